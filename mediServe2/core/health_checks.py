@@ -163,6 +163,37 @@ class HealthChecker:
                 'details': {}
             }
     
+    @staticmethod
+    def check_rag_models() -> Dict[str, Any]:
+        """Lister les modèles RAG chargés dans ce processus et leur mémoire"""
+        try:
+            from rag.model_registry import ModelRegistry
+            from rag.retriever_cache import get_retriever_cache
+            from metrics.services import MetricsService
+            
+            report = ModelRegistry.memory_report()
+            report['retriever_cache'] = get_retriever_cache().stats()
+            report['query_embedding_cache'] = MetricsService.get_cache_stats('query_embedding')
+            report['rerank'] = MetricsService.get_rerank_stats()
+            report['answer_cache'] = MetricsService.get_cache_stats('answer')
+            report['prompt_tokens'] = MetricsService.get_prompt_token_stats()
+            report['index_commits'] = MetricsService.get_index_commit_stats()
+            report['passage_embedding_cache'] = MetricsService.get_cache_stats('passage_embedding')
+            report['ocr'] = MetricsService.get_ocr_stats()
+            return {
+                'status': 'healthy',
+                'message': f"{len(report['models'])} modèle(s) RAG chargé(s)",
+                'details': report
+            }
+            
+        except Exception as e:
+            logger.error(f"RAG models health check failed: {e}")
+            return {
+                'status': 'unhealthy',
+                'message': f'RAG models check failed: {str(e)}',
+                'details': {}
+            }
+    
     @classmethod
     def run_all_checks(cls) -> Dict[str, Any]:
         """Exécuter toutes les vérifications de santé"""
@@ -173,6 +204,7 @@ class HealthChecker:
             'twilio': cls.check_twilio(),
             'pinecone': cls.check_pinecone(),
             'gemini': cls.check_gemini(),
+            'rag_models': cls.check_rag_models(),
         }
         
         # Déterminer la santé globale
@@ -0,0 +1,418 @@
+# core/stand_ins.py
+# Substituts locaux de Gemini et Twilio pour les tests de charge et de latence
+#
+# Sélection par settings.EXTERNAL_SERVICES (ou variables d'environnement hors Django) :
+#   GEMINI_BACKEND / TWILIO_BACKEND = 'live' (défaut) | 'fake' (en processus) | 'http'
+# En mode 'http', les appels partent vers scripts/stand_in_server.py (STAND_IN_URL),
+# qui expose les mêmes routes que les API réelles.
+#
+# Latences, taux d'erreur et réponses 429 sont configurés par service dans
+# STAND_IN_PROFILE ; le tirage est seedé pour des runs reproductibles.
+
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+from email.utils import formatdate
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from rag.rate_limiter import LocalBucketBackend, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+LIVE, FAKE, HTTP = 'live', 'fake', 'http'
+
+DEFAULT_PROFILE = {
+    'gemini': {'latency': 'lognormal:900:2500', 'error_rate': 0.0, 'rate_limit_rate': 0.0, 'rpm': 0},
+    'gemini_embed': {'latency': 'lognormal:80:200', 'error_rate': 0.0, 'rate_limit_rate': 0.0, 'rpm': 0},
+    'twilio': {'latency': 'lognormal:250:600', 'error_rate': 0.0, 'rate_limit_rate': 0.0, 'rpm': 0},
+}
+
+
+def external_setting(key: str, default=None):
+    """settings.EXTERNAL_SERVICES[key], ou la variable d'environnement du même nom hors Django"""
+    try:
+        from django.conf import settings
+        if settings.configured:
+            return getattr(settings, 'EXTERNAL_SERVICES', {}).get(key, default)
+    except ImportError:
+        pass
+    return os.getenv(key, default)
+
+
+# ---------------------------
+# Latences et pannes simulées
+# ---------------------------
+
+class LatencyModel:
+    """
+    Distribution de latence (ms) décrite par une chaîne :
+    'const:300', 'uniform:100:400', 'normal:300:50', 'lognormal:médiane:p95'
+    """
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        kind, *params = spec.split(':')
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        if kind not in ('const', 'uniform', 'normal', 'lognormal'):
+            raise ValueError(f"Distribution de latence inconnue: {spec}")
+
+    def sample(self, rng: random.Random) -> float:
+        p = self.params
+        if self.kind == 'const':
+            return p[0]
+        if self.kind == 'uniform':
+            return rng.uniform(p[0], p[1])
+        if self.kind == 'normal':
+            return max(0.0, rng.gauss(p[0], p[1]))
+        median, p95 = p
+        sigma = math.log(p95 / median) / 1.645 if p95 > median else 0.0
+        return rng.lognormvariate(math.log(median), sigma)
+
+
+class ServiceBehaviour:
+    """Latence, erreurs et limitation de débit simulées pour un service"""
+
+    def __init__(self, name: str, profile: Dict[str, Any], seed: int = 42, sleep: bool = True):
+        self.name = name
+        self.latency = LatencyModel(profile.get('latency', 'const:0'))
+        self.error_rate = float(profile.get('error_rate', 0.0))
+        self.rate_limit_rate = float(profile.get('rate_limit_rate', 0.0))
+        self.rpm = float(profile.get('rpm', 0) or 0)
+        self.sleep = sleep
+        self._rng = random.Random(f"{seed}:{name}")
+        self._lock = threading.Lock()
+        self._buckets = None
+        if self.rpm:
+            self._buckets = LocalBucketBackend()
+
+    def call(self) -> Optional[int]:
+        """Attend la latence tirée ; retourne le code HTTP d'échec simulé (None si succès)"""
+        with self._lock:
+            delay_ms = self.latency.sample(self._rng)
+            roll = self._rng.random()
+        status = None
+        if self._buckets is not None and self._buckets.try_acquire(
+                self.name, time.time(), (self.rpm, 1e12), 1, 0, 0.0) > 0:
+            status = 429
+        elif roll < self.rate_limit_rate:
+            status = 429
+        elif roll < self.rate_limit_rate + self.error_rate:
+            status = 503
+        if status == 429:
+            delay_ms = min(delay_ms, 50.0)  # un refus de quota est rapide
+        if self.sleep:
+            time.sleep(delay_ms / 1000)
+        get_stand_in_stats().record(self.name, delay_ms, status)
+        return status
+
+
+class StandInStats:
+    """Compteurs par service : appels, échecs simulés et latence injectée"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.services: Dict[str, Dict[str, float]] = {}
+
+    def record(self, service: str, delay_ms: float, status: Optional[int]):
+        with self._lock:
+            s = self.services.setdefault(service, {'calls': 0, 'errors': 0, 'rate_limited': 0, 'injected_ms': 0.0})
+            s['calls'] += 1
+            s['injected_ms'] += delay_ms
+            if status == 429:
+                s['rate_limited'] += 1
+            elif status:
+                s['errors'] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: dict(values) for name, values in self.services.items()}
+
+    def reset(self):
+        with self._lock:
+            self.services.clear()
+
+
+_stats = StandInStats()
+_behaviours: Dict[str, ServiceBehaviour] = {}
+_behaviours_lock = threading.Lock()
+
+
+def get_stand_in_stats() -> StandInStats:
+    return _stats
+
+
+def get_behaviour(service: str) -> ServiceBehaviour:
+    """Comportement du service configuré par STAND_IN_PROFILE (partagé par le processus)"""
+    with _behaviours_lock:
+        if service not in _behaviours:
+            profile = dict(DEFAULT_PROFILE.get(service, {}))
+            profile.update((external_setting('STAND_IN_PROFILE') or {}).get(service, {}))
+            _behaviours[service] = ServiceBehaviour(
+                service, profile,
+                seed=int(external_setting('STAND_IN_SEED', 42)),
+                sleep=str(external_setting('STAND_IN_SLEEP', True)).lower() not in ('false', '0', 'no'),
+            )
+        return _behaviours[service]
+
+
+def configure_behaviour(service: str, profile: Dict[str, Any], seed: int = 42, sleep: bool = True):
+    """Remplace le comportement d'un service (scripts de benchmark, serveur de substitution)"""
+    with _behaviours_lock:
+        _behaviours[service] = ServiceBehaviour(service, {**DEFAULT_PROFILE.get(service, {}), **profile},
+                                                seed=seed, sleep=sleep)
+
+
+# ---------------------------
+# Contenus générés
+# ---------------------------
+
+FAKE_SENTENCES = [
+    "D'après votre dossier, ces résultats sont à discuter avec votre médecin.",
+    "Pensez à bien suivre la posologie indiquée sur votre ordonnance 💊.",
+    "Votre dernier bilan ne montre pas d'anomalie urgente ✅.",
+    "Un contrôle est recommandé lors de votre prochain rendez-vous 📅.",
+    "N'oubliez pas que ceci est un conseil et ne remplace pas une consultation médicale.",
+]
+FAKE_SUGGESTIONS = [
+    "Quels sont mes derniers résultats ?",
+    "Quelle est ma posologie actuelle ?",
+    "Quand est mon prochain rendez-vous ?",
+    "Que signifie ce résultat ?",
+]
+
+
+def fake_answer(prompt: str) -> str:
+    """Réponse déterministe (fonction du prompt), au format attendu par parse_rag_output"""
+    h = zlib.crc32(prompt.encode('utf-8'))
+    sentences = [FAKE_SENTENCES[(h + i) % len(FAKE_SENTENCES)] for i in range(3)]
+    suggestions = [FAKE_SUGGESTIONS[(h + i) % len(FAKE_SUGGESTIONS)] for i in range(3)]
+    return " ".join(sentences) + "\n\n---SUGGESTIONS---\n" + "\n".join(
+        f"{i}. {s}" for i, s in enumerate(suggestions, 1))
+
+
+def fake_embedding(text: str, dim: int = 768) -> List[float]:
+    rng = random.Random(zlib.crc32(text.encode('utf-8')))
+    vec = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+def gemini_generate_payload(prompt: str) -> Dict[str, Any]:
+    """Corps JSON d'une réponse generateContent"""
+    text = fake_answer(prompt)
+    prompt_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(text)
+    return {
+        'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}, 'finishReason': 'STOP', 'index': 0}],
+        'usageMetadata': {'promptTokenCount': prompt_tokens, 'candidatesTokenCount': output_tokens,
+                          'totalTokenCount': prompt_tokens + output_tokens},
+    }
+
+
+def twilio_message_payload(account_sid: str, params: Dict[str, Any], sid: Optional[str] = None,
+                           status: str = 'queued') -> Dict[str, Any]:
+    """Corps JSON d'une ressource Message de l'API Twilio"""
+    sid = sid or f"SM{uuid.uuid4().hex}"
+    now = formatdate(usegmt=True)
+    return {
+        'sid': sid, 'account_sid': account_sid, 'status': status, 'direction': 'outbound-api',
+        'from': params.get('From') or params.get('from_'), 'to': params.get('To') or params.get('to'),
+        'body': params.get('Body') or params.get('body') or '', 'num_segments': '1',
+        'error_code': None, 'error_message': None, 'price': None, 'api_version': '2010-04-01',
+        'date_created': now, 'date_updated': now, 'date_sent': None,
+        'uri': f"/2010-04-01/Accounts/{account_sid}/Messages/{sid}.json",
+    }
+
+
+# ---------------------------
+# Gemini
+# ---------------------------
+
+def gemini_error(status: int, message: str) -> Exception:
+    """Exception levée par le SDK Gemini pour ce code HTTP (ResourceExhausted pour 429...)"""
+    try:
+        from google.api_core import exceptions as api_exceptions
+        return api_exceptions.from_http_status(status, message)
+    except ImportError:
+        return RuntimeError(f"{status} {message}")
+
+
+def _gemini_response(payload: Dict[str, Any]):
+    candidate = payload['candidates'][0]
+    parts = [SimpleNamespace(text=p.get('text', '')) for p in candidate['content']['parts']]
+    usage = payload.get('usageMetadata', {})
+    return SimpleNamespace(
+        text=''.join(p.text for p in parts),
+        parts=parts,
+        candidates=[SimpleNamespace(content=SimpleNamespace(parts=parts), finish_reason=candidate.get('finishReason'))],
+        usage_metadata=SimpleNamespace(
+            prompt_token_count=usage.get('promptTokenCount', 0),
+            candidates_token_count=usage.get('candidatesTokenCount', 0),
+            total_token_count=usage.get('totalTokenCount', 0),
+        ),
+    )
+
+
+class FakeGenerativeModel:
+    """Substitut en processus de genai.GenerativeModel (generate_content)"""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    def generate_content(self, prompt, generation_config=None, **kwargs):
+        status = get_behaviour('gemini').call()
+        if status:
+            raise gemini_error(status, f"Stand-in Gemini: HTTP {status}")
+        return _gemini_response(gemini_generate_payload(str(prompt)))
+
+
+class HttpGenerativeModel:
+    """Client REST minimal vers la route generateContent du serveur de substitution"""
+
+    def __init__(self, model_name: str, base_url: str, api_key: str = 'stand-in', timeout: float = 60.0):
+        self.model_name = model_name.split('/')[-1]
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def generate_content(self, prompt, generation_config=None, **kwargs):
+        import requests
+        body = {'contents': [{'role': 'user', 'parts': [{'text': str(prompt)}]}]}
+        if generation_config is not None:
+            body['generationConfig'] = {
+                'maxOutputTokens': getattr(generation_config, 'max_output_tokens', None),
+                'temperature': getattr(generation_config, 'temperature', None),
+            }
+        resp = requests.post(f"{self.base_url}/v1beta/models/{self.model_name}:generateContent",
+                             params={'key': self.api_key}, json=body, timeout=self.timeout)
+        if resp.status_code >= 400:
+            raise gemini_error(resp.status_code, resp.json().get('error', {}).get('message', resp.text))
+        return _gemini_response(resp.json())
+
+
+def gemini_backend() -> str:
+    return (external_setting('GEMINI_BACKEND', LIVE) or LIVE).lower()
+
+
+def make_generative_model(model_name: str):
+    """genai.GenerativeModel, ou son substitut selon GEMINI_BACKEND"""
+    backend = gemini_backend()
+    if backend == FAKE:
+        return FakeGenerativeModel(model_name)
+    if backend == HTTP:
+        return HttpGenerativeModel(model_name, external_setting('STAND_IN_URL', 'http://127.0.0.1:8765'))
+    import google.generativeai as genai
+    return genai.GenerativeModel(model_name)
+
+
+def embed_content(model: str, content: str, task_type: str = 'retrieval_document') -> Dict[str, Any]:
+    """genai.embed_content, ou son substitut selon GEMINI_BACKEND"""
+    backend = gemini_backend()
+    if backend == LIVE:
+        import google.generativeai as genai
+        return genai.embed_content(model=model, content=content, task_type=task_type)
+    if backend == FAKE:
+        status = get_behaviour('gemini_embed').call()
+        if status:
+            raise gemini_error(status, f"Stand-in Gemini embed: HTTP {status}")
+        return {'embedding': fake_embedding(content)}
+    import requests
+    base_url = external_setting('STAND_IN_URL', 'http://127.0.0.1:8765').rstrip('/')
+    resp = requests.post(f"{base_url}/v1beta/{model}:embedContent", params={'key': 'stand-in'},
+                         json={'content': {'parts': [{'text': content}]}, 'taskType': task_type.upper()},
+                         timeout=30)
+    if resp.status_code >= 400:
+        raise gemini_error(resp.status_code, resp.text)
+    return {'embedding': resp.json()['embedding']['values']}
+
+
+# ---------------------------
+# Twilio
+# ---------------------------
+
+def twilio_error(status: int, method: str, uri: str) -> Exception:
+    try:
+        from twilio.base.exceptions import TwilioRestException
+        code = 20429 if status == 429 else 20500
+        return TwilioRestException(status, uri, msg=f"Stand-in Twilio: HTTP {status}", code=code, method=method)
+    except ImportError:
+        return RuntimeError(f"Twilio {status} {method} {uri}")
+
+
+class _FakeMessageContext:
+    def __init__(self, client, sid: str):
+        self._client = client
+        self.sid = sid
+
+    def fetch(self):
+        status = get_behaviour('twilio').call()
+        uri = f"/2010-04-01/Accounts/{self._client.account_sid}/Messages/{self.sid}.json"
+        if status:
+            raise twilio_error(status, 'GET', uri)
+        payload = self._client.sent.get(self.sid) or twilio_message_payload(self._client.account_sid, {}, self.sid)
+        return SimpleNamespace(**{**payload, 'status': 'delivered'})
+
+
+class _FakeMessageList:
+    """client.messages : create(...) et client.messages(sid).fetch()"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __call__(self, sid: str):
+        return _FakeMessageContext(self._client, sid)
+
+    def create(self, **kwargs):
+        status = get_behaviour('twilio').call()
+        uri = f"/2010-04-01/Accounts/{self._client.account_sid}/Messages.json"
+        if status:
+            raise twilio_error(status, 'POST', uri)
+        payload = twilio_message_payload(self._client.account_sid, kwargs)
+        with self._client.lock:
+            self._client.sent[payload['sid']] = payload
+            if len(self._client.sent) > self._client.MAX_SENT:
+                self._client.sent.pop(next(iter(self._client.sent)))
+        return SimpleNamespace(**payload)
+
+
+class FakeTwilioClient:
+    """Substitut en processus de twilio.rest.Client (messages.create / messages(sid).fetch)"""
+
+    MAX_SENT = 10000
+
+    def __init__(self, account_sid: Optional[str] = None, auth_token: Optional[str] = None):
+        self.account_sid = account_sid or 'ACstandin'
+        self.lock = threading.Lock()
+        self.sent: Dict[str, Dict[str, Any]] = {}
+        self.messages = _FakeMessageList(self)
+
+
+def _stand_in_http_client(base_url: str):
+    """HttpClient Twilio qui redirige https://*.twilio.com vers le serveur de substitution"""
+    from twilio.http.http_client import TwilioHttpClient
+
+    class StandInTwilioHttpClient(TwilioHttpClient):
+        def request(self, method, url, *args, **kwargs):
+            url = re.sub(r'^https://[^/]+\.twilio\.com', base_url.rstrip('/'), url)
+            return super().request(method, url, *args, **kwargs)
+
+    return StandInTwilioHttpClient()
+
+
+def make_twilio_client(account_sid: Optional[str] = None, auth_token: Optional[str] = None):
+    """twilio.rest.Client, ou son substitut selon TWILIO_BACKEND"""
+    backend = (external_setting('TWILIO_BACKEND', LIVE) or LIVE).lower()
+    if backend == FAKE:
+        return FakeTwilioClient(account_sid, auth_token)
+    from twilio.rest import Client
+    if backend == HTTP:
+        return Client(account_sid or 'ACstandin', auth_token or 'stand-in',
+                      http_client=_stand_in_http_client(external_setting('STAND_IN_URL', 'http://127.0.0.1:8765')))
+    return Client(account_sid, auth_token)
@@ -1,11 +1,9 @@
 # documents/tasks.py - Version simplifiée et corrigée
 
 from celery import shared_task, current_task
-from django.utils import timezone
 from .models import DocumentUpload
 import logging
 import os
-import subprocess
 from django.conf import settings
 from kombu import Connection
 
@@ -54,88 +52,30 @@ def process_document_async(self, document_upload_id):
         doc_upload.upload_status = 'processing'
         doc_upload.save()
         
-        self.update_state(
-            state='PROGRESS',
-            meta={'current': 15, 'total': 100, 'status': 'Initialisation du traitement...'}
-        )
-        
-        # 4. Extraction du texte
-        self.update_state(
-            state='PROGRESS',
-            meta={'current': 30, 'total': 100, 'status': 'Extraction du texte...'}
-        )
-        
-        # 5. Vectorisation
-        self.update_state(
-            state='PROGRESS',
-            meta={'current': 60, 'total': 100, 'status': 'Vectorisation en cours...'}
-        )
+        # 4. Vectorisation dans le processus du worker : modèle d'embedding, données NLTK
+        # et caches restent chargés d'un document à l'autre (rag.vectorizer)
+        from rag.vectorizer import get_document_vectorizer
         
-        # 6. Exécuter le script de vectorisation
-        script_path = os.path.join(settings.BASE_DIR, 'scripts', 'vectorize_document.sh')
-        
-        if not os.path.exists(script_path):
-            logger.error(f"Script non trouvé: {script_path}")
-            doc_upload.upload_status = 'failed'
-            doc_upload.error_message = "Script de vectorisation non trouvé"
-            doc_upload.save()
-            return {"status": "error", "error": "Script non trouvé"}
-        
-        os.chmod(script_path, 0o755)
-        
-        env = os.environ.copy()
-        env['DJANGO_SETTINGS_MODULE'] = 'mediServe.settings'
-        env['PYTHONPATH'] = str(settings.BASE_DIR) + os.pathsep + env.get('PYTHONPATH', '')
-        
-        process = subprocess.Popen(
-            [script_path, str(document_upload_id)],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            env=env,
-            cwd=settings.BASE_DIR
-        )
-        
-        # Lire la sortie avec progression
-        output_lines = []
-        for line in iter(process.stdout.readline, ''):
-            line = line.strip()
-            if line:
-                logger.info(f"[SCRIPT] {line}")
-                output_lines.append(line)
-                
-                # Mettre à jour la progression selon la sortie
-                if "Extraction terminée" in line:
-                    self.update_state(
-                        state='PROGRESS',
-                        meta={'current': 70, 'total': 100, 'status': 'Indexation...'}
-                    )
-                elif "Vectorisation réussie" in line:
-                    self.update_state(
-                        state='PROGRESS',
-                        meta={'current': 90, 'total': 100, 'status': 'Finalisation...'}
-                    )
+        def progress(stage, percent, status, **details):
+            self.update_state(
+                state='PROGRESS',
+                meta={'current': percent, 'total': 100, 'status': status, 'stage': stage, **details}
+            )
         
-        process.stdout.close()
-        return_code = process.wait()
+        progress('initialization', 15, 'Initialisation du traitement...')
+        vectorizer = get_document_vectorizer()
+        success = vectorizer.process_document(document_upload_id, progress=progress)
+        report = dict(vectorizer.last_report)
         
-        # 7. Traiter le résultat
-        if return_code == 0:
+        # 5. Traiter le résultat (le statut du document est mis à jour par le vectoriseur)
+        if success:
             logger.info(f"✅ Document {document_upload_id} traité avec succès")
             
-            doc_upload.upload_status = 'indexed'
-            doc_upload.processed_at = timezone.now()
-            doc_upload.save()
-            
-            self.update_state(
-                state='SUCCESS',
-                meta={'current': 100, 'total': 100, 'status': 'Terminé avec succès!'}
-            )
-            
             # Notification WhatsApp
             try:
                 from messaging.services import WhatsAppService
                 whatsapp = WhatsAppService()
+                doc_upload.refresh_from_db()
                 patient = doc_upload.patient
                 
                 message = f"✅ {patient.first_name}, votre document '{doc_upload.original_filename}' a été indexé avec succès."
@@ -146,19 +86,16 @@ def process_document_async(self, document_upload_id):
             return {
                 "status": "success",
                 "document_id": document_upload_id,
-                "message": "Document indexé avec succès"
+                "message": "Document indexé avec succès",
+                "report": report
             }
         else:
-            logger.error(f"❌ Échec du traitement (code {return_code})")
-            doc_upload.upload_status = 'failed'
-            doc_upload.error_message = f"Échec de la vectorisation (code {return_code})"
-            doc_upload.save()
-            
+            logger.error(f"❌ Échec du traitement du document {document_upload_id}: {report.get('error')}")
             return {
                 "status": "error",
                 "document_id": document_upload_id,
-                "return_code": return_code,
-                "output": '\n'.join(output_lines[-5:])  # Dernières 5 lignes
+                "error": report.get('error', "Échec de la vectorisation"),
+                "report": report
             }
             
     except DocumentUpload.DoesNotExist:
@@ -200,4 +137,32 @@ def send_patient_activation_sms(patient_id):
         logger.exception(f"Erreur envoi SMS: {e}")
         return {"status": "error", "error": str(e)}
 
-# Les autres tâches existantes...
\ No newline at end of file
+# Les autres tâches existantes...
+
+
+@shared_task(name='documents.tasks.remove_document_from_index')
+def remove_document_from_index(patient_id, document_id):
+    """Retire un document supprimé de la recherche (tombstones, sans réindexation)"""
+    from rag.index_writer import remove_document
+    try:
+        result = remove_document(patient_id, document_id)
+        return {"status": "success", "document_id": document_id, **result}
+    except Exception as e:
+        logger.exception(f"Erreur retrait du document {document_id} (patient {patient_id}): {e}")
+        return {"status": "error", "error": str(e)}
+
+
+@shared_task(name='documents.tasks.compact_vector_store')
+def compact_vector_store(patient_id):
+    """Compacte le store d'un patient : retire les lignes supprimées, reconstruit FAISS et BM25"""
+    from rag.index_writer import PatientIndexWriter
+    from rag.answer_cache import get_answer_cache
+    try:
+        result = PatientIndexWriter(patient_id, settings.RAG_SETTINGS.get('EMBEDDING_DIM', 768)).compact()
+        answer_cache = get_answer_cache()
+        if answer_cache is not None:
+            answer_cache.invalidate(patient_id)
+        return {"status": "success", "patient_id": patient_id, **result}
+    except Exception as e:
+        logger.exception(f"Erreur compaction du store patient {patient_id}: {e}")
+        return {"status": "error", "error": str(e)}
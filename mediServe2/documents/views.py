@@ -79,33 +79,15 @@ class DocumentUploadViewSet(viewsets.ModelViewSet):
                 logger.error(f"❌ ERREUR Celery: {type(e).__name__}: {str(e)}")
                 logger.error(f"Détails: {e}", exc_info=True)
                 
-                # Essayer d'exécuter le script directement
-                logger.info("⚠️ Tentative d'exécution directe du script de vectorisation...")
+                # Celery indisponible : vectorisation directe dans ce processus
+                logger.info("⚠️ Vectorisation directe du document (sans Celery)...")
                 try:
-                    import subprocess
-                    script_path = os.path.join(settings.BASE_DIR, 'scripts', 'vectorize_document.sh')
-                    
-                    if os.path.exists(script_path):
-                        logger.info(f"Script trouvé: {script_path}")
-                        os.chmod(script_path, 0o755)  # S'assurer qu'il est exécutable
-                        
-                        process = subprocess.Popen(
-                            [script_path, str(document.id)],
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            text=True
-                        )
-                        stdout, stderr = process.communicate()
-                        
-                        logger.info(f"Script stdout: {stdout}")
-                        if stderr:
-                            logger.error(f"Script stderr: {stderr}")
-                        logger.info(f"Script return code: {process.returncode}")
-                    else:
-                        logger.error(f"❌ Script non trouvé: {script_path}")
-                        
-                except Exception as script_error:
-                    logger.error(f"❌ Erreur exécution script: {script_error}")
+                    from rag.vectorizer import get_document_vectorizer
+                    success = get_document_vectorizer().process_document(document.id)
+                    logger.info(f"Vectorisation directe {'réussie' if success else 'échouée'}")
+                    document.refresh_from_db()
+                except Exception as vectorize_error:
+                    logger.error(f"❌ Erreur de vectorisation directe: {vectorize_error}")
             
             return Response({
                 "id": document.id,
@@ -0,0 +1,23 @@
+# gunicorn.conf.py
+# Configuration gunicorn (lue automatiquement depuis le répertoire de lancement)
+#
+# Avec --preload, mediServe.wsgi charge seulement les poids des modèles RAG dans
+# le master. L'inférence de chauffe, le pré-remplissage du cache d'embeddings, les
+# threads de micro-batching et les connexions (service d'embeddings, Redis, Gemini)
+# sont créés dans chaque worker après le fork : les pools de threads OpenMP/MKL de
+# torch et les threads Python ne survivent pas à fork().
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def post_worker_init(worker):
+    """Chauffe des modèles RAG dans le worker, une fois l'application chargée"""
+    from django.conf import settings
+
+    if not settings.RAG_SETTINGS.get('PRELOAD_MODELS', False):
+        return
+    from rag.model_registry import ModelRegistry
+    logger.info(f"🔥 Chauffe des modèles RAG dans le worker (pid {worker.pid})")
+    ModelRegistry.warm_up()
@@ -1,6 +1,7 @@
 import os
 import logging
 from celery import Celery
+from celery.signals import worker_process_init
 from django.conf import settings
 
 # Configuration du logging pour Celery
@@ -50,6 +51,21 @@ def setup_periodic_tasks(sender, **kwargs):
         if not task_name.startswith('celery.'):
             logger.info(f"✅ Tâche: {task_name}")
 
+# Pré-chargement des modèles RAG dans chaque processus worker
+@worker_process_init.connect
+def preload_rag_models(**kwargs):
+    if not settings.RAG_SETTINGS.get('PRELOAD_MODELS', False):
+        return
+    from rag.model_registry import ModelRegistry
+    logger.info("Pré-chargement des modèles RAG...")
+    ModelRegistry.warm_up()
+    # Worker d'ingestion : vectoriseur prêt avant le premier document
+    try:
+        from rag.vectorizer import get_document_vectorizer
+        get_document_vectorizer().warm_up()
+    except Exception as e:
+        logger.error(f"❌ Échec du pré-chargement du vectoriseur: {e}", exc_info=True)
+
 # Test de connexion au démarrage
 @app.task(bind=True)
 def debug_task(self):
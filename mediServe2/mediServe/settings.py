@@ -39,6 +39,30 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+
+# Cache partagé par tous les processus (workers gunicorn et Celery) : compteurs de
+# MetricsService, verrous de déduplication des tâches. CACHE_REDIS_URL vide ->
+# cache mémoire local (développement sans Redis, compteurs propres à chaque processus).
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', 'redis://redis:6379/1')
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+            'KEY_PREFIX': 'mediserve',
+            # Redis injoignable : échec rapide, les appelants se replient (miss / no-op)
+            'OPTIONS': {
+                'socket_connect_timeout': float(os.getenv('CACHE_REDIS_CONNECT_TIMEOUT', 0.5)),
+                'socket_timeout': float(os.getenv('CACHE_REDIS_SOCKET_TIMEOUT', 0.5)),
+            },
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
 WHATSAPP_MODE = os.getenv('WHATSAPP_MODE', 'sandbox')
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
@@ -67,6 +91,31 @@ WHATSAPP_TEMPLATES = {
     'document_ready': os.getenv('WHATSAPP_TEMPLATE_DOCUMENT', 'document_ready_template'),
     'appointment_reminder': os.getenv('WHATSAPP_TEMPLATE_APPOINTMENT', 'appointment_template'),
 }
+# Services externes : 'live' (API réelles), 'fake' (substituts en processus)
+# ou 'http' (scripts/stand_in_server.py) pour les tests de charge et de latence
+EXTERNAL_SERVICES = {
+    'GEMINI_BACKEND': os.getenv('GEMINI_BACKEND', 'live'),
+    'TWILIO_BACKEND': os.getenv('TWILIO_BACKEND', 'live'),
+    'STAND_IN_URL': os.getenv('STAND_IN_URL', 'http://127.0.0.1:8765'),
+    'STAND_IN_SEED': int(os.getenv('STAND_IN_SEED', 42)),
+    'STAND_IN_SLEEP': os.getenv('STAND_IN_SLEEP', 'True').lower() in ('true', '1', 'yes'),
+    # Latence : 'const:ms', 'uniform:min:max', 'normal:moyenne:écart', 'lognormal:médiane:p95'
+    'STAND_IN_PROFILE': {
+        'gemini': {
+            'latency': os.getenv('STAND_IN_GEMINI_LATENCY', 'lognormal:900:2500'),
+            'error_rate': float(os.getenv('STAND_IN_GEMINI_ERROR_RATE', 0.0)),
+            'rate_limit_rate': float(os.getenv('STAND_IN_GEMINI_429_RATE', 0.0)),
+            'rpm': int(os.getenv('STAND_IN_GEMINI_RPM', 0)),  # 0 = pas de quota simulé
+        },
+        'gemini_embed': {'latency': os.getenv('STAND_IN_GEMINI_EMBED_LATENCY', 'lognormal:80:200')},
+        'twilio': {
+            'latency': os.getenv('STAND_IN_TWILIO_LATENCY', 'lognormal:250:600'),
+            'error_rate': float(os.getenv('STAND_IN_TWILIO_ERROR_RATE', 0.0)),
+            'rate_limit_rate': float(os.getenv('STAND_IN_TWILIO_429_RATE', 0.0)),
+        },
+    },
+}
+
 # Configuration Pinecone
 PINECONE_API_KEY = os.getenv('PINECONE_API_KEY')
 PINECONE_INDEX_NAME = os.getenv('PINECONE_INDEX_NAME', 'medirecord-rag')
@@ -83,6 +132,11 @@ CELERY_TASK_ROUTES = {
     # Tâches de maintenance sur une queue séparée
     'metrics.tasks.cleanup_old_metrics': {'queue': 'maintenance'},
     'sessions.tasks.cleanup_expired_sessions': {'queue': 'maintenance'},
+    # Résumés de conversation : basse priorité, jamais devant les réponses patients
+    'sessions.tasks.update_conversation_summary': {'queue': 'maintenance'},
+    # Retrait d'un document supprimé : quelques secondes, avant les autres tâches
+    'documents.tasks.remove_document_from_index': {'queue': 'high_priority'},
+    'documents.tasks.compact_vector_store': {'queue': 'maintenance'},
 }
 
 CELERY_TASK_ANNOTATIONS = {
@@ -362,6 +416,12 @@ STATIC_URL = '/static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Données NLTK (découpage en phrases) installées une fois par `manage.py download_nltk_data` :
+# aucun téléchargement pendant l'ingestion des documents
+NLTK_DATA_DIR = os.getenv('NLTK_DATA', str(BASE_DIR / 'nltk_data'))
+NLTK_RESOURCES = ['punkt', 'punkt_tab']
+os.environ.setdefault('NLTK_DATA', NLTK_DATA_DIR)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -373,25 +433,136 @@ RAG_SETTINGS = {
     # Chemin de stockage des index BM25
     'BM25_INDEX_DIR': os.path.join(MEDIA_ROOT, 'indexes'),
 
+    # Format du vector store : 'mmap' (rag.vector_format, partagé via le page cache) ou 'hdf5' (historique)
+    'VECTOR_STORE_FORMAT': os.getenv('RAG_VECTOR_STORE_FORMAT', 'mmap'),
+    'VECTOR_DTYPE': os.getenv('RAG_VECTOR_DTYPE', 'float32'),  # 'float32' ou 'float16'
+    # Codes de l'index FAISS : 'none' (float32), 'fp16', 'sq8' ou 'pq'. Hors 'none', les
+    # RESCORE_FACTOR × top_k meilleurs candidats sont re-scorés sur les vecteurs du store mmap
+    'VECTOR_COMPRESSION': os.getenv('RAG_VECTOR_COMPRESSION', 'none'),
+    'RESCORE_FACTOR': int(os.getenv('RAG_RESCORE_FACTOR', 4)),
+    # 'per_patient' : un index par patient ; 'shared' : index FAISS partagé et shardé (rag.shared_index)
+    'VECTOR_STORAGE_MODE': os.getenv('RAG_VECTOR_STORAGE_MODE', 'per_patient'),
+    'SHARED_INDEX_DIR': os.path.join(MEDIA_ROOT, 'vectors', 'shared'),
+    'SHARED_INDEX_SHARDS': int(os.getenv('RAG_SHARED_INDEX_SHARDS', 16)),
+    # Un segment par ajout de document ; fusionnés au-delà de ce nombre par shard
+    'SHARED_INDEX_MAX_SEGMENTS': int(os.getenv('RAG_SHARED_INDEX_MAX_SEGMENTS', 16)),
+    # Type d'index FAISS (rag.index_factory) : 'auto' (selon le nombre de vecteurs et le budget
+    # mémoire), ou forcé 'flat' / 'ivf_flat' / 'ivf_pq' / 'hnsw'
+    'FAISS_INDEX_TYPE': os.getenv('RAG_FAISS_INDEX_TYPE', 'auto'),
+    'FAISS_MEMORY_TARGET_MB': int(os.getenv('RAG_FAISS_MEMORY_TARGET_MB', 256)),  # Par index / shard
+    'FAISS_FLAT_MAX_VECTORS': int(os.getenv('RAG_FAISS_FLAT_MAX_VECTORS', 20000)),  # Recherche exacte en deçà
+    'FAISS_HNSW_M': 32,
+    'FAISS_EF_CONSTRUCTION': 80,
+    # Valeurs par défaut des paramètres de recherche (surchargeables à chaque requête)
+    'FAISS_NPROBE': int(os.getenv('RAG_FAISS_NPROBE', 16)),
+    'FAISS_EF_SEARCH': int(os.getenv('RAG_FAISS_EF_SEARCH', 64)),
+    # Lignes ajoutées hors de l'index FAISS (parcourues exactement) avant de l'étendre :
+    # au moins FAISS_TAIL_MIN_ROWS, puis FAISS_TAIL_RATIO × lignes indexées
+    'FAISS_TAIL_MIN_ROWS': int(os.getenv('RAG_FAISS_TAIL_MIN_ROWS', 4096)),
+    'FAISS_TAIL_RATIO': float(os.getenv('RAG_FAISS_TAIL_RATIO', 0.1)),
+    # Documents supprimés (rag.tombstones) : compaction en tâche de fond au-delà de cette part
+    # des lignes du store, et d'un minimum de lignes
+    'TOMBSTONE_COMPACTION_RATIO': float(os.getenv('RAG_TOMBSTONE_COMPACTION_RATIO', 0.2)),
+    'TOMBSTONE_COMPACTION_MIN_ROWS': 100,
+    # Documents d'un même patient terminés dans cette fenêtre : un seul commit d'index (rag.commit_queue)
+    'INDEX_COMMIT_WINDOW_MS': float(os.getenv('RAG_INDEX_COMMIT_WINDOW_MS', 200)),
+
     # Paramètres d'indexation
     'USE_BM25': True,  # Activer l'indexation BM25
+    # Moteur BM25 : 'sparse' (rag.sparse_bm25, fichier unique mappé) ou 'whoosh' (historique)
+    'BM25_ENGINE': os.getenv('RAG_BM25_ENGINE', 'sparse'),
+    # Découpage des documents à l'ingestion (rag.chunking) : 'lexical', 'sentence' ou 'semantic' ;
+    # sans valeur, 'semantic' si USE_SEMANTIC_CHUNKING, sinon 'lexical'
+    'CHUNKING_STRATEGY': os.getenv('RAG_CHUNKING_STRATEGY'),
     'USE_SEMANTIC_CHUNKING': True,  # Utiliser le chunking sémantique
     'SEMANTIC_THRESHOLD': 0.75,  # Seuil de similarité pour le chunking
+    'SEMANTIC_BATCH_SIZE': 64,  # Phrases encodées par lot pour le chunking sémantique
 
     # Paramètres de recherche
     'USE_RERANKING': True,  # Activer le reranking
     'RERANKER_MODEL': 'cross-encoder/ms-marco-MiniLM-L-6-v2',
+    'RERANK_MAX_TOKENS': 256,  # Passages tronqués avant scoring
+    # Au-delà de ce délai, la requête garde les scores hybrides (None = pas de budget)
+    'RERANK_BUDGET_MS': float(os.getenv('RAG_RERANK_BUDGET_MS', 300)),
+    'RERANK_BATCH_MAX_SIZE': 64,
+    'RERANK_BATCH_MAX_WAIT_MS': 5,
+    # Budget mémoire du cache de retrievers par patient (octets, par processus)
+    'RETRIEVER_CACHE_MAX_BYTES': int(os.getenv('RAG_RETRIEVER_CACHE_MAX_BYTES', 1024 * 1024 * 1024)),
 
     # Limite de taille des documents
     'MAX_FILE_SIZE': 50 * 1024 * 1024,  # 50MB
+    # Extraction des PDF page par page dans un pool de processus (rag.pdf_extraction)
+    # Processus d'extraction par document (0 : min(4, nombre de CPU)). Dans le worker Celery
+    # prefork, chaque processus enfant lance son propre pool (billiard) : jusqu'à
+    # concurrence × PDF_EXTRACTION_WORKERS processus pendant l'ingestion (voir README)
+    'PDF_EXTRACTION_WORKERS': int(os.getenv('RAG_PDF_EXTRACTION_WORKERS', 0)),
+    'PDF_PAGE_TIMEOUT': float(os.getenv('RAG_PDF_PAGE_TIMEOUT', 60)),  # secondes ; page ignorée au-delà
+    'PDF_MAX_PAGES_IN_FLIGHT': None,  # Pages soumises en avance (None : 2 × workers)
+    'PDF_PAGES_PER_WORKER': 50,  # Worker recyclé après ce nombre de pages (mémoire bornée)
+    # Tri des pages avant extraction (rag.page_triage) : camelot sur les pages à tableaux, OCR sur les scans
+    'PAGE_TRIAGE': os.getenv('RAG_PAGE_TRIAGE', 'True').lower() in ('true', '1', 'yes'),
+    'PAGE_TRIAGE_THRESHOLDS': {},  # Surcharge de rag.page_triage.DEFAULT_THRESHOLDS
+    'PAGE_OCR_RESOLUTION': 300,  # dpi du rendu des pages scannées pour Tesseract
+    # OCR (rag.ocr) : pool tesseract, prétraitement, cache disque par contenu d'image
+    'OCR_WORKERS': int(os.getenv('RAG_OCR_WORKERS', 0)),  # 0 : un par cœur
+    'OCR_LANG': 'fra',
+    'OCR_MAX_PIXELS': 2480 * 3508,  # Réduction au-delà (A4 à 300 dpi)
+    'OCR_BINARIZE': True,  # Seuillage d'Otsu avant Tesseract
+    'OCR_CACHE': os.getenv('RAG_OCR_CACHE', 'True').lower() in ('true', '1', 'yes'),
+    'OCR_CACHE_DIR': os.path.join(MEDIA_ROOT, 'ocr_cache'),
+    'OCR_CACHE_MAX_ENTRIES': 50_000,
+
+    # Cache sémantique des réponses par patient (invalidé à chaque nouveau document / modification du dossier)
+    'ANSWER_CACHE_ENABLED': os.getenv('RAG_ANSWER_CACHE_ENABLED', 'True').lower() in ('true', '1', 'yes'),
+    'ANSWER_CACHE_THRESHOLD': float(os.getenv('RAG_ANSWER_CACHE_THRESHOLD', 0.92)),  # Similarité cosinus minimale
+    'ANSWER_CACHE_MIN_CHUNK_OVERLAP': 0.5,  # Recouvrement (Jaccard) minimal des extraits retrouvés
+    'ANSWER_CACHE_MAX_ENTRIES': 50,  # Par patient
 
     # Modèles
     'EMBEDDING_MODEL': 'all-mpnet-base-v2',
+    'EMBEDDING_DIM': 768,
+    # Micro-batching des embeddings : 'thread' (par worker), 'service' (processus partagé,
+    # voir `manage.py run_embedding_service`) ou 'off'
+    'EMBEDDING_BATCHING': os.getenv('RAG_EMBEDDING_BATCHING', 'thread'),
+    'EMBEDDING_BATCH_MAX_SIZE': 32,
+    'EMBEDDING_BATCH_MAX_WAIT_MS': float(os.getenv('RAG_EMBEDDING_BATCH_MAX_WAIT_MS', 5)),
+    'EMBEDDING_SERVICE_ADDRESS': os.getenv('RAG_EMBEDDING_SERVICE_ADDRESS', '/tmp/mediserve_embeddings.sock'),
+    # Indexation : passages encodés par lots de cette taille, triés par longueur (moins de padding)
+    'PASSAGE_ENCODE_BATCH_SIZE': int(os.getenv('RAG_PASSAGE_ENCODE_BATCH_SIZE', 64)),
+    # Cache des embeddings de requêtes : LRU par processus + Redis partagé (None pour désactiver Redis)
+    'QUERY_EMBEDDING_CACHE': True,
+    'QUERY_EMBEDDING_CACHE_SIZE': int(os.getenv('RAG_QUERY_EMBEDDING_CACHE_SIZE', 4096)),
+    'QUERY_EMBEDDING_CACHE_REDIS_URL': os.getenv('RAG_QUERY_EMBEDDING_CACHE_REDIS_URL', CELERY_BROKER_URL),
+    # Cache disque des embeddings de passages à l'indexation (rag.passage_embedding_cache), LRU
+    'PASSAGE_EMBEDDING_CACHE': os.getenv('RAG_PASSAGE_EMBEDDING_CACHE', 'True').lower() in ('true', '1', 'yes'),
+    'PASSAGE_EMBEDDING_CACHE_DIR': os.path.join(MEDIA_ROOT, 'embedding_cache'),
+    'PASSAGE_EMBEDDING_CACHE_MAX_ENTRIES': int(os.getenv('RAG_PASSAGE_EMBEDDING_CACHE_MAX_ENTRIES', 200_000)),
     'LLM_MODEL': 'gemini-1.5-flash-latest',
-
-    # Configuration de chunking lexical
-    'CHUNK_SIZE': 1000,  # Taille des chunks lexicaux
-    'CHUNK_OVERLAP': 200,  # Chevauchement entre chunks
+    # Quotas Gemini partagés par tous les processus (rag.rate_limiter) : requêtes/min et tokens/min
+    'LLM_RATE_LIMITS': {
+        'gemini-1.5-flash-latest': {
+            'rpm': int(os.getenv('GEMINI_FLASH_RPM', 15)),
+            'tpm': int(os.getenv('GEMINI_FLASH_TPM', 1_000_000)),
+        },
+        'gemini-pro': {
+            'rpm': int(os.getenv('GEMINI_PRO_RPM', 60)),
+            'tpm': int(os.getenv('GEMINI_PRO_TPM', 120_000)),
+        },
+    },
+    # Part de la capacité réservée aux réponses patients (inaccessible aux tâches de fond)
+    'LLM_BACKGROUND_RESERVE': float(os.getenv('RAG_LLM_BACKGROUND_RESERVE', 0.2)),
+    'LLM_RATE_LIMIT_MAX_WAIT': 60,  # secondes ; au-delà RateLimitExceeded
+    'RATE_LIMIT_REDIS_URL': os.getenv('RAG_RATE_LIMIT_REDIS_URL', CELERY_BROKER_URL),
+    # Mémoire de conversation (rag.conversation_memory) : résumé glissant + derniers échanges
+    'MEMORY_RECENT_TURNS': int(os.getenv('RAG_MEMORY_RECENT_TURNS', 4)),
+    'MEMORY_TOKEN_BUDGET': int(os.getenv('RAG_MEMORY_TOKEN_BUDGET', 600)),  # Historique injecté dans le prompt
+    'MEMORY_SUMMARY_MAX_TOKENS': 200,
+    # Charger les modèles au démarrage des workers (gunicorn / Celery) plutôt qu'à la première requête
+    'PRELOAD_MODELS': os.getenv('RAG_PRELOAD_MODELS', 'False').lower() in ('true', '1', 'yes'),
+
+    # Taille des passages, en tokens du modèle d'embedding (au plus son max_seq_length)
+    'CHUNK_SIZE': int(os.getenv('RAG_CHUNK_SIZE', 256)),  # Taille maximale, toutes stratégies
+    'CHUNK_OVERLAP': 32,  # Chevauchement entre fenêtres lexicales
 }
 
 os.makedirs(RAG_SETTINGS['VECTOR_STORE_DIR'], exist_ok=True)
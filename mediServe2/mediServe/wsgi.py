@@ -14,3 +14,12 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mediServe.settings')
 
 application = get_wsgi_application()
+
+# Charger les poids des modèles RAG à l'import (gunicorn --preload : une fois dans
+# le master, puis partagés par fork). Aucune inférence ici : la chauffe se fait
+# dans chaque worker (post_worker_init de gunicorn.conf.py).
+from django.conf import settings  # noqa: E402
+
+if settings.RAG_SETTINGS.get('PRELOAD_MODELS', False):
+    from rag.model_registry import ModelRegistry
+    ModelRegistry.load_weights()
@@ -0,0 +1,8 @@
+# messaging/quick_replies.py
+# Réponses rapides WhatsApp (boutons "1", "2", "3") et questions associées
+
+QUICK_REPLY_MAP = {
+    "1": "Quels sont mes prochains rendez-vous ?",
+    "2": "Donne moi des conseils santé au vu de mes antécédents médicaux ?",
+    "3": "Quels médicaments dois-je prendre aujourd'hui ?",
+}
@@ -3,7 +3,7 @@
 import requests
 from django.conf import settings
 import logging
-from twilio.rest import Client
+from core.stand_ins import make_twilio_client
 
 logger = logging.getLogger(__name__)
 
@@ -11,7 +11,7 @@ class SMSService:
     """Service pour envoyer des SMS via Twilio"""
     
     def __init__(self):
-        self.client = Client(
+        self.client = make_twilio_client(
             settings.TWILIO_ACCOUNT_SID,
             settings.TWILIO_AUTH_TOKEN
         )
@@ -46,7 +46,7 @@ class WhatsAppService:
     """Service pour envoyer des messages WhatsApp via Twilio"""
     
     def __init__(self):
-        self.client = Client(
+        self.client = make_twilio_client(
             settings.TWILIO_ACCOUNT_SID,
             settings.TWILIO_AUTH_TOKEN
         )
@@ -5,11 +5,12 @@ import os
 import sys
 import logging
 import re
+import time
 from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from twilio.twiml.messaging_response import MessagingResponse
-from twilio.rest import Client
+from core.stand_ins import make_twilio_client
 from django.conf import settings
 from django.utils import timezone
 import json
@@ -41,12 +42,7 @@ from patients.models import Patient
 from documents.models import DocumentUpload
 from sessions.models import WhatsAppSession, ConversationLog
 from messaging.utils import normalize_phone_number, phones_match
-
-QUICK_REPLY_MAP = {
-    "1": "Quels sont mes prochains rendez-vous ?",
-    "2": "Donne moi des conseils santé au vu de mes antécédents médicaux ?",
-    "3": "Quels médicaments dois-je prendre aujourd'hui ?",
-}
+from messaging.quick_replies import QUICK_REPLY_MAP
 
 logger = logging.getLogger(__name__)
 @csrf_exempt
@@ -89,7 +85,7 @@ def whatsapp_rag_webhook(request):
         logger.info(f"📱 MessageSid: {message_sid}")
         
         # Initialize Twilio client
-        client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
+        client = make_twilio_client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
         
         # 3. Traiter le message d'activation
         if message_body.upper().startswith('ACTIVER '):
@@ -244,6 +240,13 @@ def whatsapp_rag_webhook(request):
             )
             
             logger.info(f"✅ Réponse générée en {response_time_ms:.0f}ms")
+
+            # Résumé des échanges sortis de la fenêtre récente, en tâche de fond
+            try:
+                from rag.conversation_memory import get_conversation_memory
+                get_conversation_memory().schedule_update(session)
+            except Exception as e:
+                logger.warning(f"⚠️ Mise à jour du résumé de conversation non planifiée: {e}")
             
         except Exception as e:
             logger.error(f"❌ Erreur RAG pour patient {patient.id}: {e}", exc_info=True)
@@ -414,23 +417,21 @@ def process_with_rag(patient, query, session):
         logger.info(f"🤖 Traitement RAG pour patient {patient.id} - {patient.full_name()}")
         logger.info(f"📝 Question: {query}")
 
-        # --- Ajout de la mémoire de conversation ---
-        history_logs = ConversationLog.objects.filter(session=session).order_by('-timestamp')[:20]
-        
-        conversation_history = ""
-        if history_logs:
-            history_list = []
-            # Inverser pour avoir l'ordre chronologique
-            for log in reversed(history_logs):
-                history_list.append(f"Patient: {log.user_message}")
-                history_list.append(f"Assistant: {log.ai_response}")
-            conversation_history = "\n".join(history_list)
-            logger.info(f"🧠 Historique de conversation injecté:\n{conversation_history}")
+        # --- Mémoire de conversation : résumé glissant + derniers échanges, sous budget de tokens ---
+        from rag.conversation_memory import get_conversation_memory, is_follow_up
+        memory = get_conversation_memory().build(session)
+        # Historique injecté seulement pour une question de suivi ; une question autonome
+        # est répondue sans historique, réponse alors réutilisable via le cache de réponses
+        follow_up = bool(memory['text']) and is_follow_up(query)
+        conversation_history = memory['text'] if follow_up else ''
+        if conversation_history:
+            logger.info(f"🧠 Historique injecté: {memory['turns']} échange(s) récents"
+                        f"{' + résumé' if memory['has_summary'] else ''}, ~{memory['tokens']} tokens "
+                        f"(historique complet: ~{memory['legacy_tokens']} tokens)")
 
         # Détecter si c'est le début de la conversation pour la salutation
-        is_new_conversation = not history_logs.exists()
+        is_new_conversation = memory['is_new']
         greeting = f"👋 Bonjour {patient.first_name} ! " if is_new_conversation else ""
-        # --- Fin de l'ajout de la mémoire ---
 
         # Vérifier d'abord les documents indexés
         indexed_docs = DocumentUpload.objects.filter(
@@ -439,37 +440,37 @@ def process_with_rag(patient, query, session):
         )
         logger.info(f"📚 Documents indexés pour ce patient: {indexed_docs.count()}")
         
-        # Importer les modules RAG
-        from rag.your_rag_module import (
-            VectorStoreHDF5, EmbeddingGenerator, 
-            HybridRetriever, GeminiLLM, RAG
-        )
+        # Importer les modules RAG (modèles partagés par le registre du processus)
+        from rag.your_rag_module import RAG
+        from rag.model_registry import ModelRegistry
+        from rag.retriever_cache import get_retriever_cache
+        from rag.answer_cache import get_answer_cache
         
-        # Chemins des fichiers pour ce patient
-        vector_dir = os.path.join(settings.MEDIA_ROOT, 'vectors', f'patient_{patient.id}')
-        hdf5_path = os.path.join(vector_dir, 'vector_store.h5')
-        bm25_dir = os.path.join(settings.MEDIA_ROOT, 'indexes', f'patient_{patient.id}_bm25')
+        # Retriever du patient : structures chaudes en cache, reconstruites
+        # uniquement quand un nouveau document publie une version du store
+        retriever = get_retriever_cache().get(patient.id)
         
-        if not os.path.exists(hdf5_path):
+        if retriever is None:
             logger.warning(f"⚠️ Pas de vector store pour patient {patient.id}")
             if indexed_docs.count() > 0:
                 return "⚠️ Vos documents sont en cours de traitement. Veuillez réessayer dans quelques instants."
             return fallback_response(patient, query)
         
-        # Initialisation des composants RAG
-        vector_store = VectorStoreHDF5(hdf5_path)
-        vector_store.load_store()
-        embedder = EmbeddingGenerator(settings.RAG_SETTINGS.get('EMBEDDING_MODEL', 'all-mpnet-base-v2'))
+        # Recherche sur la question brute : les extraits servent au cache de réponses et au prompt
+        contexts = retriever.retrieve(query, 3)
+        chunk_ids = [ctx.get('id') for ctx in contexts]
+        # Les questions de suivi dépendent de l'historique : jamais servies depuis le cache
+        answer_cache = get_answer_cache() if not follow_up else None
+        if answer_cache is not None:
+            cached = answer_cache.lookup(patient, query, chunk_ids)
+            if cached is not None:
+                structured_response = dict(cached['answer'])
+                structured_response['answer'] = post_process_response(
+                    f"{greeting}{structured_response['answer']}", patient
+                )
+                return structured_response
         
-        if os.path.exists(bm25_dir) and settings.RAG_SETTINGS.get('USE_BM25', True):
-            retriever = HybridRetriever(vector_store, embedder, bm25_dir)
-            if settings.RAG_SETTINGS.get('USE_RERANKING', False):
-                reranker_model = settings.RAG_SETTINGS.get('RERANKER_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
-                retriever.enable_reranking(reranker_model)
-        else:
-            retriever = HybridRetriever(vector_store, embedder)
-            
-        llm = GeminiLLM(model_name=settings.RAG_SETTINGS.get('LLM_MODEL', 'gemini-1.5-flash-latest'))
+        llm = ModelRegistry.get_llm()
         rag = RAG(retriever, llm)
         
         # Personnaliser le prompt pour WhatsApp avec mémoire
@@ -529,10 +530,28 @@ def process_with_rag(patient, query, session):
             Assistant: {greeting}"""
         
         logger.info(f"💭 Génération de la réponse RAG avec mémoire")
-        response = rag.answer(enhanced_query, top_k=3)
+        # La recherche utilise la question brute (cache d'embeddings, pertinence), le LLM le prompt enrichi
+        start = time.time()
+        response = rag.answer(enhanced_query, top_k=3, retrieval_query=query, contexts=contexts)
+        generation_ms = (time.time() - start) * 1000
+        try:
+            from metrics.services import MetricsService
+            MetricsService.record_prompt_tokens(rag.last_prompt_tokens, memory['tokens'] if follow_up else 0,
+                                                memory['legacy_tokens'], turns=memory['turns'] if follow_up else 0,
+                                                has_summary=memory['has_summary'] and follow_up)
+        except Exception as e:  # les métriques ne doivent jamais bloquer une réponse
+            logger.debug(f"Métrique de prompt non enregistrée: {e}")
 
         structured_response = parse_rag_output(response)
 
+        # Réponse générée sans historique : réutilisable d'une conversation à l'autre ;
+        # la salutation d'ouverture est retirée (remise à la lecture du cache)
+        if answer_cache is not None:
+            cached_response = dict(structured_response)
+            if greeting and cached_response['answer'].startswith(greeting.strip()):
+                cached_response['answer'] = cached_response['answer'][len(greeting.strip()):].lstrip()
+            answer_cache.store(patient, query, chunk_ids, cached_response, generation_ms)
+
         structured_response['answer'] = post_process_response(structured_response['answer'], patient)
         
         # response = post_process_response(response, patient)
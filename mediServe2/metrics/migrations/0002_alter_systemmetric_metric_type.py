@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='systemmetric',
+            name='metric_type',
+            field=models.CharField(choices=[('response_time', 'Temps de réponse'), ('rag_accuracy', 'Précision RAG'), ('user_satisfaction', 'Satisfaction utilisateur'), ('message_delivery', 'Livraison message'), ('document_indexing', 'Indexation document'), ('cache_hit_rate', 'Taux de hit cache')], max_length=30),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0004_alter_systemmetric_metric_type'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='systemmetric',
+            name='metric_type',
+            field=models.CharField(choices=[('response_time', 'Temps de réponse'), ('rag_accuracy', 'Précision RAG'), ('user_satisfaction', 'Satisfaction utilisateur'), ('message_delivery', 'Livraison message'), ('document_indexing', 'Indexation document'), ('cache_hit_rate', 'Taux de hit cache'), ('rerank_time', 'Temps de reranking'), ('prompt_tokens', 'Tokens du prompt'), ('index_commit', "Commit d'index")], max_length=30),
+        ),
+    ]
@@ -7,6 +7,11 @@ class SystemMetric(models.Model):
         ('user_satisfaction', 'Satisfaction utilisateur'),
         ('message_delivery', 'Livraison message'),
         ('document_indexing', 'Indexation document'),
+        ('cache_hit_rate', 'Taux de hit cache'),
+        ('rerank_time', 'Temps de reranking'),
+        ('prompt_tokens', 'Tokens du prompt'),
+        ('index_commit', "Commit d'index"),
+        ('ocr_time', "Temps d'OCR"),
     ]
     
     metric_type = models.CharField(max_length=30, choices=METRIC_TYPES)
@@ -1,6 +1,8 @@
 import time
+from datetime import timedelta
 from typing import Dict, Any
 from .models import SystemMetric, PerformanceAlert
+from django.core.cache import cache
 from django.utils import timezone
 import logging
 
@@ -63,6 +65,187 @@ class MetricsService:
             }
         )
     
+    @staticmethod
+    def increment_counter(name: str, amount: int = 1) -> int:
+        """
+        Compteur léger dans le cache Django partagé (settings.CACHES, Redis) :
+        agrégé sur tous les workers, sans écriture en base par événement
+        """
+        key = f"metrics:counter:{name}"
+        try:
+            try:
+                return cache.incr(key, amount)
+            except ValueError:
+                # Clé absente : l'initialiser (add est atomique si un autre worker l'a créée entre-temps)
+                if cache.add(key, amount, timeout=None):
+                    return amount
+                return cache.incr(key, amount)
+        except Exception as e:
+            # Une métrique ne doit jamais faire échouer la requête (cache indisponible)
+            logger.warning(f"⚠️ Compteur {name} non incrémenté: {e}")
+            return 0
+
+    @staticmethod
+    def get_counter(name: str) -> int:
+        try:
+            return cache.get(f"metrics:counter:{name}", 0)
+        except Exception as e:
+            logger.warning(f"⚠️ Compteur {name} illisible: {e}")
+            return 0
+
+    @staticmethod
+    def record_cache_lookup(cache_name: str, hit: bool):
+        """Compte un accès (hit ou miss) à un cache applicatif"""
+        MetricsService.increment_counter(f"{cache_name}.{'hits' if hit else 'misses'}")
+
+    @staticmethod
+    def record_cache_lookups(cache_name: str, hits: int, misses: int):
+        """Compte un lot d'accès à un cache (ex: tous les passages d'un document)"""
+        if hits:
+            MetricsService.increment_counter(f"{cache_name}.hits", hits)
+        if misses:
+            MetricsService.increment_counter(f"{cache_name}.misses", misses)
+
+    @staticmethod
+    def get_cache_stats(cache_name: str) -> Dict[str, Any]:
+        hits = MetricsService.get_counter(f"{cache_name}.hits")
+        misses = MetricsService.get_counter(f"{cache_name}.misses")
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 4) if total else 0.0,
+            # Temps épargné par les hits (caches qui le mesurent, ex: réponses RAG)
+            'latency_saved_ms': MetricsService.get_counter(f"{cache_name}.latency_saved_ms"),
+        }
+
+    @staticmethod
+    def snapshot_cache_stats(cache_name: str):
+        """Enregistre le taux de hit courant d'un cache comme SystemMetric"""
+        stats = MetricsService.get_cache_stats(cache_name)
+        SystemMetric.objects.create(
+            metric_type='cache_hit_rate',
+            value=stats['hit_rate'],
+            metadata={'cache': cache_name, **stats}
+        )
+        return stats
+
+    @staticmethod
+    def record_rerank(rerank_time_ms: float, degraded: bool, pairs: int = 0):
+        """Enregistre la durée d'un reranking et s'il a dépassé son budget de latence"""
+        SystemMetric.objects.create(
+            metric_type='rerank_time',
+            value=rerank_time_ms,
+            metadata={'degraded': degraded, 'pairs': pairs}
+        )
+        MetricsService.increment_counter('rerank.requests')
+        if degraded:
+            MetricsService.increment_counter('rerank.degraded')
+
+    @staticmethod
+    def get_rerank_stats() -> Dict[str, Any]:
+        requests = MetricsService.get_counter('rerank.requests')
+        degraded = MetricsService.get_counter('rerank.degraded')
+        return {
+            'requests': requests,
+            'degraded': degraded,
+            'degradation_rate': round(degraded / requests, 4) if requests else 0.0,
+        }
+
+    @staticmethod
+    def record_prompt_tokens(prompt_tokens: int, history_tokens: int, legacy_history_tokens: int,
+                             turns: int = 0, has_summary: bool = False):
+        """
+        Enregistre la taille estimée du prompt envoyé au LLM et celle qu'il
+        aurait eue avec l'historique complet (20 derniers échanges).
+        """
+        legacy_prompt_tokens = prompt_tokens - history_tokens + legacy_history_tokens
+        SystemMetric.objects.create(
+            metric_type='prompt_tokens',
+            value=prompt_tokens,
+            metadata={
+                'history_tokens': history_tokens,
+                'legacy_prompt_tokens': legacy_prompt_tokens,
+                'turns': turns,
+                'has_summary': has_summary,
+            }
+        )
+        MetricsService.increment_counter('llm.prompts')
+        MetricsService.increment_counter('llm.prompt_tokens', int(prompt_tokens))
+        MetricsService.increment_counter('llm.legacy_prompt_tokens', int(legacy_prompt_tokens))
+
+    @staticmethod
+    def get_prompt_token_stats() -> Dict[str, Any]:
+        prompts = MetricsService.get_counter('llm.prompts')
+        tokens = MetricsService.get_counter('llm.prompt_tokens')
+        legacy = MetricsService.get_counter('llm.legacy_prompt_tokens')
+        return {
+            'prompts': prompts,
+            'avg_prompt_tokens': round(tokens / prompts, 1) if prompts else 0.0,
+            'avg_legacy_prompt_tokens': round(legacy / prompts, 1) if prompts else 0.0,
+            'reduction': round(1 - tokens / legacy, 4) if legacy else 0.0,
+        }
+
+    @staticmethod
+    def record_index_commit(documents: int, chunks: int, commit_ms: float, waited_ms: float = 0.0):
+        """Enregistre un commit d'index patient (rag.commit_queue) et le nombre de documents regroupés"""
+        SystemMetric.objects.create(
+            metric_type='index_commit',
+            value=documents,
+            metadata={'chunks': chunks, 'commit_ms': commit_ms, 'waited_ms': waited_ms}
+        )
+        MetricsService.increment_counter('index.commits')
+        MetricsService.increment_counter('index.documents', int(documents))
+
+    @staticmethod
+    def get_index_commit_stats(window_minutes: int = 60) -> Dict[str, Any]:
+        """Commits par seconde et documents par commit sur la fenêtre récente"""
+        from django.db.models import Avg, Count, Max, Min, Sum
+        since = timezone.now() - timedelta(minutes=window_minutes)
+        agg = SystemMetric.objects.filter(metric_type='index_commit', timestamp__gte=since).aggregate(
+            commits=Count('id'), documents=Sum('value'), first=Min('timestamp'), last=Max('timestamp'),
+            avg_documents=Avg('value'),
+        )
+        commits = agg['commits'] or 0
+        # Débit mesuré sur la période d'activité (au moins une seconde)
+        span = (agg['last'] - agg['first']).total_seconds() if commits > 1 else 0.0
+        commits_total = MetricsService.get_counter('index.commits')
+        documents_total = MetricsService.get_counter('index.documents')
+        return {
+            'window_minutes': window_minutes,
+            'commits': commits,
+            'documents': int(agg['documents'] or 0),
+            'commits_per_sec': round(commits / max(span, 1.0), 4) if commits else 0.0,
+            'documents_per_commit': round(agg['avg_documents'] or 0.0, 2),
+            'total_commits': commits_total,
+            'total_documents_per_commit': round(documents_total / commits_total, 2) if commits_total else 0.0,
+        }
+
+    @staticmethod
+    def record_ocr(ocr_time_ms: float, pixels: int = 0, ocr_pixels: int = 0):
+        """Enregistre la durée de reconnaissance d'une image (hors cache) et sa réduction éventuelle"""
+        SystemMetric.objects.create(
+            metric_type='ocr_time',
+            value=ocr_time_ms,
+            metadata={'pixels': pixels, 'ocr_pixels': ocr_pixels}
+        )
+
+    @staticmethod
+    def get_ocr_stats(window_minutes: int = 60) -> Dict[str, Any]:
+        """Latence OCR par image sur la fenêtre récente et taux de hit du cache OCR"""
+        from django.db.models import Avg, Count, Max
+        since = timezone.now() - timedelta(minutes=window_minutes)
+        agg = SystemMetric.objects.filter(metric_type='ocr_time', timestamp__gte=since).aggregate(
+            images=Count('id'), avg_ms=Avg('value'), max_ms=Max('value'),
+        )
+        return {
+            'window_minutes': window_minutes,
+            'images': agg['images'] or 0,
+            'avg_ms': round(agg['avg_ms'] or 0.0, 1),
+            'max_ms': round(agg['max_ms'] or 0.0, 1),
+            'cache': MetricsService.get_cache_stats('ocr'),
+        }
+
     @staticmethod
     def _create_alert(metric_type: str, severity: str, message: str, 
                      threshold: float, actual_value: float):
@@ -167,28 +167,9 @@ class PatientCreateAPIView(views.APIView):
     def _process_document_sync(self, document_id):
         """Traiter un document de manière synchrone"""
         try:
-            # Importer le script de vectorisation
-            import subprocess
-            script_path = os.path.join(settings.BASE_DIR, 'scripts', 'vectorize_single_document.py')
-
-            if not os.path.exists(script_path):
-                # Essayer l'import direct
-                logger.info("Import direct du module de vectorisation")
-                import sys
-                sys.path.insert(0, os.path.join(settings.BASE_DIR, 'scripts'))
-                from vectorize_single_document import DocumentVectorizer
-
-                vectorizer = DocumentVectorizer()
-                return vectorizer.process_document(document_id)
-            else:
-                # Exécuter via subprocess
-                logger.info(f"Exécution du script: {script_path}")
-                result = subprocess.run(
-                    ['python', script_path, str(document_id)],
-                    capture_output=True,
-                    text=True
-                )
-                return result.returncode == 0
+            # Vectorisation dans ce processus (modèle conservé entre les documents)
+            from rag.vectorizer import get_document_vectorizer
+            return get_document_vectorizer().process_document(document_id)
 
         except Exception as e:
             logger.error(f"Erreur traitement synchrone: {e}")
@@ -437,6 +418,7 @@ class PatientIndexingStatusView(views.APIView):
                         if result.state == 'PROGRESS' and isinstance(result.info, dict):
                             doc_data['progress'] = result.info.get('current', 0)
                             doc_data['task_status'] = result.info.get('status', '')
+                            doc_data['task_stage'] = result.info.get('stage', '')
                         elif result.state in ['SUCCESS', 'FAILURE']:
                             doc_data['task_status'] = result.state
                             
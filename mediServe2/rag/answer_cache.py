@@ -0,0 +1,167 @@
+# rag/answer_cache.py
+# Cache sémantique des réponses RAG par patient
+
+import time
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from rag.storage import StoreVersion
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FIELDS = ('medical_history', 'allergies', 'current_medications')
+CACHE_NAME = 'answer'
+
+
+def profile_fingerprint(patient) -> str:
+    """Empreinte des champs du dossier injectés dans le prompt"""
+    raw = '\x1f'.join(str(getattr(patient, field, '') or '') for field in PROFILE_FIELDS)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class SemanticAnswerCache:
+    """
+    Réponses déjà générées pour un patient, retrouvées par similarité cosinus
+    de la question.
+
+    Une entrée n'est valable que pour la version courante du store du patient
+    (StoreVersion) et l'état courant de ses champs médicaux : si l'un des deux
+    change, toutes les entrées du patient sont supprimées. Seules les réponses
+    générées sans historique de conversation (questions autonomes, voir
+    rag.conversation_memory.is_follow_up) y sont stockées : elles restent
+    valables d'une conversation à l'autre. Les entrées sont stockées dans le
+    cache Django (partagé entre workers si Redis est configuré).
+    """
+
+    def __init__(self, threshold: float = 0.92, min_chunk_overlap: float = 0.5,
+                 max_entries: int = 50, ttl: int = 7 * 24 * 3600):
+        self.threshold = threshold
+        self.min_chunk_overlap = min_chunk_overlap
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    @staticmethod
+    def key(patient_id) -> str:
+        return f"rag:answers:{patient_id}"
+
+    @staticmethod
+    def scope(patient) -> str:
+        version = StoreVersion.current(patient.id)
+        return hashlib.sha1(f"{version}|{profile_fingerprint(patient)}".encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _embed(question: str) -> np.ndarray:
+        from rag.model_registry import ModelRegistry
+        vec = np.asarray(ModelRegistry.get_embedder().embed_text(question), dtype='float32').reshape(-1)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _load(self, patient) -> Optional[Dict[str, Any]]:
+        try:
+            data = cache.get(self.key(patient.id))
+        except Exception as e:
+            # Cache indisponible (Redis) : simple miss, la réponse est générée normalement
+            logger.warning(f"⚠️ Cache de réponses illisible pour patient {patient.id}: {e}")
+            return None
+        if data is None:
+            return None
+        if data.get('scope') != self.scope(patient):
+            logger.info(f"♻️ Cache de réponses du patient {patient.id} invalidé (document ou dossier modifié)")
+            self.invalidate(patient.id)
+            return None
+        return data
+
+    def lookup(self, patient, question: str, chunk_ids: List[str]) -> Optional[Dict[str, Any]]:
+        """Entrée la plus proche au-dessus du seuil, dont les extraits recoupent ceux retrouvés"""
+        data = self._load(patient)
+        entries = data['entries'] if data else []
+        if entries:
+            query = self._embed(question)
+            matrix = np.frombuffer(b''.join(e['embedding'] for e in entries), dtype='float32').reshape(len(entries), -1)
+            scores = matrix @ query
+            for i in np.argsort(-scores):
+                if scores[i] < self.threshold:
+                    break
+                entry = entries[i]
+                if self._chunk_overlap(entry['chunk_ids'], chunk_ids) >= self.min_chunk_overlap:
+                    self._record(hit=True, saved_ms=entry.get('latency_ms', 0))
+                    logger.info(f"🎯 Réponse en cache pour patient {patient.id} "
+                                f"(similarité {scores[i]:.3f}, question d'origine: {entry['question'][:60]})")
+                    return entry
+        self._record(hit=False)
+        return None
+
+    def store(self, patient, question: str, chunk_ids: List[str], answer: Any, latency_ms: float):
+        data = self._load(patient) or {'scope': self.scope(patient), 'entries': []}
+        data['entries'].append({
+            'question': question,
+            'embedding': self._embed(question).astype('float32').tobytes(),
+            'chunk_ids': list(chunk_ids),
+            'answer': answer,
+            'latency_ms': float(latency_ms),
+            'created_at': time.time(),
+        })
+        data['entries'] = data['entries'][-self.max_entries:]
+        try:
+            cache.set(self.key(patient.id), data, timeout=self.ttl)
+        except Exception as e:
+            logger.warning(f"⚠️ Réponse non mise en cache pour patient {patient.id}: {e}")
+
+    def invalidate(self, patient_id):
+        # Une invalidation perdue (cache indisponible) reste sans effet : _load compare
+        # la portée de chaque entrée à la version du store et au dossier courants
+        try:
+            cache.delete(self.key(patient_id))
+        except Exception as e:
+            logger.warning(f"⚠️ Cache de réponses du patient {patient_id} non invalidé: {e}")
+
+    def invalidate_if_profile_changed(self, patient):
+        try:
+            data = cache.get(self.key(patient.id))
+        except Exception as e:
+            logger.warning(f"⚠️ Cache de réponses du patient {patient.id} illisible: {e}")
+            return
+        if data is not None and data.get('scope') != self.scope(patient):
+            self.invalidate(patient.id)
+            logger.info(f"♻️ Cache de réponses du patient {patient.id} supprimé (dossier médical modifié)")
+
+    @staticmethod
+    def _chunk_overlap(cached_ids: List[str], current_ids: List[str]) -> float:
+        if not cached_ids and not current_ids:
+            return 1.0
+        cached, current = set(cached_ids), set(current_ids)
+        return len(cached & current) / max(len(cached | current), 1)
+
+    @staticmethod
+    def _record(hit: bool, saved_ms: float = 0.0):
+        try:
+            from metrics.services import MetricsService
+            MetricsService.record_cache_lookup(CACHE_NAME, hit)
+            if hit and saved_ms:
+                MetricsService.increment_counter(f"{CACHE_NAME}.latency_saved_ms", int(saved_ms))
+        except Exception as e:  # les métriques ne doivent jamais bloquer une requête
+            logger.debug(f"Métrique du cache de réponses non enregistrée: {e}")
+
+
+_answer_cache: Optional[SemanticAnswerCache] = None
+
+
+def get_answer_cache() -> Optional[SemanticAnswerCache]:
+    """Cache configuré par RAG_SETTINGS (None si désactivé)"""
+    global _answer_cache
+    rag_settings = settings.RAG_SETTINGS
+    if not rag_settings.get('ANSWER_CACHE_ENABLED', True):
+        return None
+    if _answer_cache is None:
+        _answer_cache = SemanticAnswerCache(
+            threshold=rag_settings.get('ANSWER_CACHE_THRESHOLD', 0.92),
+            min_chunk_overlap=rag_settings.get('ANSWER_CACHE_MIN_CHUNK_OVERLAP', 0.5),
+            max_entries=rag_settings.get('ANSWER_CACHE_MAX_ENTRIES', 50),
+            ttl=rag_settings.get('ANSWER_CACHE_TTL', 7 * 24 * 3600),
+        )
+    return _answer_cache
@@ -0,0 +1,154 @@
+# rag/batching.py
+# Micro-batching dynamique : regroupe les appels concurrents en un seul lot
+
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    File de requêtes traitée par un thread dédié.
+
+    Chaque appel à submit() retourne un Future. Le thread de traitement
+    prend la première requête en attente puis attend au plus `max_wait_ms`
+    que d'autres arrivent (jusqu'à `max_batch_size`), et appelle
+    `process_batch` une seule fois pour tout le lot. Sous charge, les lots
+    se forment naturellement pendant que le lot précédent est calculé.
+
+    Une requête soumise avec une échéance (`deadline`, horloge
+    time.monotonic) encore en file à cette échéance est retirée du lot
+    avant le calcul : son Future échoue avec TimeoutError.
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], Sequence[Any]],
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0, name: str = 'batcher'):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stopped = False
+        self.batches = 0
+        self.items = 0
+        self.max_seen_batch = 0
+        self.expired = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f"{self.name}-worker", daemon=True)
+                self._thread.start()
+
+    def submit(self, item: Any, deadline: Optional[float] = None) -> Future:
+        if self._stopped:
+            raise RuntimeError(f"{self.name} arrêté")
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((item, future, deadline))
+        return future
+
+    def __call__(self, item: Any, timeout: Optional[float] = None) -> Any:
+        return self.submit(item).result(timeout=timeout)
+
+    def _collect(self) -> List[tuple]:
+        batch = [self._queue.get()]
+        if batch[0] is None:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                return
+            # Les Futures annulés par l'appelant ne sont pas calculés
+            batch = [(item, fut, deadline) for item, fut, deadline in batch if fut.set_running_or_notify_cancel()]
+            # Ni ceux dont l'échéance est passée : l'appelant a déjà abandonné
+            now = time.monotonic()
+            live = []
+            for item, fut, deadline in batch:
+                if deadline is not None and deadline <= now:
+                    fut.set_exception(TimeoutError(f"{self.name}: échéance dépassée avant le calcul"))
+                    self.expired += 1
+                else:
+                    live.append((item, fut))
+            batch = live
+            if not batch:
+                continue
+            try:
+                results = self.process_batch([item for item, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{len(results)} résultats pour un lot de {len(batch)}")
+                for (_, fut), result in zip(batch, results):
+                    fut.set_result(result)
+            except Exception as e:
+                logger.error(f"❌ {self.name}: échec du lot de {len(batch)}: {e}")
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+            self.batches += 1
+            self.items += len(batch)
+            self.max_seen_batch = max(self.max_seen_batch, len(batch))
+
+    def stop(self):
+        self._stopped = True
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'batches': self.batches,
+            'items': self.items,
+            'avg_batch_size': round(self.items / self.batches, 2) if self.batches else 0.0,
+            'max_batch_size_seen': self.max_seen_batch,
+            'queued': self._queue.qsize(),
+            'expired': self.expired,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+        }
+
+
+def encode_length_sorted(encode: Callable[[List[str]], Any], texts: Sequence[str],
+                         batch_size: int = 64) -> np.ndarray:
+    """
+    Encode des textes par lots de `batch_size`, triés par longueur : chaque
+    lot regroupe des textes de tailles voisines (peu de padding). Les
+    vecteurs sont rendus dans l'ordre d'origine, dans un seul tableau.
+    """
+    if not len(texts):
+        return np.zeros((0, 0), dtype='float32')
+    batch_size = max(1, int(batch_size))
+    order = np.argsort([len(text) for text in texts], kind='stable')[::-1]
+    out = None
+    for start in range(0, len(order), batch_size):
+        idx = order[start:start + batch_size]
+        vectors = np.asarray(encode([texts[i] for i in idx]), dtype='float32').reshape(len(idx), -1)
+        if out is None:
+            out = np.empty((len(texts), vectors.shape[1]), dtype='float32')
+        out[idx] = vectors
+    return out
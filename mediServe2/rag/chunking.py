@@ -0,0 +1,224 @@
+# rag/chunking.py
+# Découpage des documents en passages : un seul moteur pour l'ingestion
+# (DocumentVectorizer), RAGService, rag.tasks et scripts/generate_embeddings.py
+#
+# Les stratégies sont des générateurs sur un flux de pages
+# ({'page': ..., 'text': ..., 'source': ...}) et produisent des passages du
+# même format, page par page, sans charger tout le document :
+#   lexical  : fenêtres glissantes de mots, avec chevauchement ;
+#   sentence : phrases regroupées jusqu'à la taille maximale ;
+#   semantic : phrases regroupées tant qu'elles restent proches (cosinus) du
+#              centroïde du passage en cours. Le centroïde est une somme
+#              courante (O(dim) par phrase) et les phrases sont encodées par
+#              lots de plusieurs pages.
+#
+# Les tailles sont en tokens du modèle d'embedding (au-delà de son
+# max_seq_length, la fin du passage serait ignorée à l'encodage) : compte
+# exact avec un tokenizer (tokenizer_token_counter) ou estimation
+# (approx_token_count), utilisée par défaut car elle ne demande pas de
+# charger le modèle et donne un découpage stable d'une indexation à l'autre.
+
+import re
+import logging
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ('lexical', 'sentence', 'semantic')
+DEFAULT_MAX_TOKENS = 256
+DEFAULT_OVERLAP = 32
+DEFAULT_THRESHOLD = 0.75
+DEFAULT_BATCH_SIZE = 64  # Phrases par appel à encode (chunking sémantique)
+
+# Estimation : mots et signes de ponctuation, ~1,3 token WordPiece par mot en français
+_PIECES = re.compile(r"\w+|[^\w\s]")
+TOKENS_PER_PIECE = 1.3
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+(?=[A-ZÀ-ÖØ-Þ0-9«\"(])")
+
+TokenCounter = Callable[[str], float]
+Encoder = Callable[[List[str]], np.ndarray]
+
+
+def approx_token_count(text: str) -> float:
+    """Nombre de tokens estimé, sans tokenizer"""
+    return len(_PIECES.findall(text)) * TOKENS_PER_PIECE
+
+
+def tokenizer_token_counter(tokenizer) -> TokenCounter:
+    """Compte exact avec le tokenizer du modèle (ex: SentenceTransformer.tokenizer)"""
+    def count(text: str) -> float:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    return count
+
+
+def split_sentences(text: str, language: str = 'french') -> List[str]:
+    """Phrases du texte (NLTK Punkt si disponible, sinon ponctuation finale)"""
+    text = text.strip()
+    if not text:
+        return []
+    try:
+        from nltk.tokenize import sent_tokenize
+        return [s for s in sent_tokenize(text, language=language) if s.strip()]
+    except (ImportError, LookupError):
+        return [s for s in _SENTENCE_END.split(text) if s.strip()]
+
+
+def _windows(words: List[str], counts: List[float], max_tokens: float, overlap: float) -> Iterator[str]:
+    """Fenêtres de mots d'au plus max_tokens, la suivante reprenant ~overlap tokens"""
+    start, n = 0, len(words)
+    while start < n:
+        end, total = start, 0.0
+        while end < n and (end == start or total + counts[end] <= max_tokens):
+            total += counts[end]
+            end += 1
+        yield ' '.join(words[start:end])
+        if end >= n:
+            return
+        back, tail = end, 0.0
+        while back > start + 1 and tail + counts[back - 1] <= overlap:
+            back -= 1
+            tail += counts[back]
+        start = back
+
+
+def _bounded_sentences(text: str, max_tokens: float, count_tokens: TokenCounter,
+                       language: str) -> List[Tuple[str, float]]:
+    """Phrases et leur taille ; une phrase trop longue est coupée en fenêtres de mots"""
+    sentences = []
+    for sentence in split_sentences(text, language):
+        tokens = count_tokens(sentence)
+        if tokens <= max_tokens:
+            sentences.append((sentence, tokens))
+            continue
+        words = sentence.split()
+        for piece in _windows(words, [count_tokens(w) for w in words], max_tokens, 0):
+            sentences.append((piece, count_tokens(piece)))
+    return sentences
+
+
+def _passage(page: Dict, text: str) -> Dict:
+    return {**{k: v for k, v in page.items() if k != 'text'}, 'text': text}
+
+
+def lexical_chunks(pages: Iterable[Dict], max_tokens: float = DEFAULT_MAX_TOKENS,
+                   overlap: float = DEFAULT_OVERLAP,
+                   count_tokens: TokenCounter = approx_token_count) -> Iterator[Dict]:
+    """Fenêtres glissantes de mots sur chaque page"""
+    overlap = min(overlap, max_tokens / 2)
+    for page in pages:
+        words = (page.get('text') or '').split()
+        if words:
+            for window in _windows(words, [count_tokens(w) for w in words], max_tokens, overlap):
+                yield _passage(page, window)
+
+
+def sentence_chunks(pages: Iterable[Dict], max_tokens: float = DEFAULT_MAX_TOKENS,
+                    count_tokens: TokenCounter = approx_token_count,
+                    language: str = 'french') -> Iterator[Dict]:
+    """Phrases consécutives d'une page regroupées jusqu'à max_tokens"""
+    for page in pages:
+        current, total = [], 0.0
+        for sentence, tokens in _bounded_sentences(page.get('text') or '', max_tokens, count_tokens, language):
+            if current and total + tokens > max_tokens:
+                yield _passage(page, ' '.join(current))
+                current, total = [], 0.0
+            current.append(sentence)
+            total += tokens
+        if current:
+            yield _passage(page, ' '.join(current))
+
+
+def semantic_chunks(pages: Iterable[Dict], encode: Encoder, threshold: float = DEFAULT_THRESHOLD,
+                    max_tokens: float = DEFAULT_MAX_TOKENS,
+                    count_tokens: TokenCounter = approx_token_count,
+                    batch_size: int = DEFAULT_BATCH_SIZE, language: str = 'french') -> Iterator[Dict]:
+    """
+    Une phrase rejoint le passage en cours si sa similarité cosinus avec le
+    centroïde (moyenne normalisée des phrases du passage) atteint `threshold`
+    et que max_tokens n'est pas dépassé ; sinon elle en ouvre un nouveau.
+    Les passages ne franchissent pas les limites de page.
+    """
+    buffered: List[Tuple[Dict, List[Tuple[str, float]]]] = []
+    pending = 0
+    for page in pages:
+        sentences = _bounded_sentences(page.get('text') or '', max_tokens, count_tokens, language)
+        if not sentences:
+            continue
+        buffered.append((page, sentences))
+        pending += len(sentences)
+        if pending >= batch_size:
+            yield from _segment(buffered, encode, threshold, max_tokens)
+            buffered, pending = [], 0
+    if buffered:
+        yield from _segment(buffered, encode, threshold, max_tokens)
+
+
+def _segment(buffered: List[Tuple[Dict, List[Tuple[str, float]]]], encode: Encoder,
+             threshold: float, max_tokens: float) -> Iterator[Dict]:
+    texts = [sentence for _, sentences in buffered for sentence, _ in sentences]
+    vectors = np.asarray(encode(texts), dtype='float32').reshape(len(texts), -1)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    offset = 0
+    for page, sentences in buffered:
+        current, total, centroid = [], 0.0, None
+        for (sentence, tokens), vec in zip(sentences, vectors[offset:offset + len(sentences)]):
+            if current:
+                norm = float(np.linalg.norm(centroid))
+                similarity = float(vec @ centroid) / norm if norm else 0.0
+                if similarity < threshold or total + tokens > max_tokens:
+                    yield _passage(page, ' '.join(current))
+                    current, total, centroid = [], 0.0, None
+            current.append(sentence)
+            total += tokens
+            # Somme courante : même direction que la moyenne, sans la recalculer
+            centroid = vec.copy() if centroid is None else centroid + vec
+        if current:
+            yield _passage(page, ' '.join(current))
+        offset += len(sentences)
+
+
+def chunk_pages(pages: Iterable[Dict], strategy: str = 'lexical', encode: Optional[Encoder] = None,
+                max_tokens: float = DEFAULT_MAX_TOKENS, overlap: float = DEFAULT_OVERLAP,
+                threshold: float = DEFAULT_THRESHOLD, count_tokens: TokenCounter = approx_token_count,
+                batch_size: int = DEFAULT_BATCH_SIZE, language: str = 'french') -> Iterator[Dict]:
+    """Découpe un flux de pages selon la stratégie demandée"""
+    if strategy == 'lexical':
+        return lexical_chunks(pages, max_tokens, overlap, count_tokens)
+    if strategy == 'sentence':
+        return sentence_chunks(pages, max_tokens, count_tokens, language)
+    if strategy == 'semantic':
+        if encode is None:
+            raise ValueError("Le chunking sémantique nécessite une fonction d'encodage")
+        return semantic_chunks(pages, encode, threshold, max_tokens, count_tokens, batch_size, language)
+    raise ValueError(f"Stratégie de chunking inconnue: {strategy} (attendu: {', '.join(STRATEGIES)})")
+
+
+def chunk_text(text: str, strategy: str = 'lexical', **options) -> List[str]:
+    """Découpe un texte seul (sans notion de page)"""
+    return [chunk['text'] for chunk in chunk_pages([{'page': 0, 'text': text}], strategy, **options)]
+
+
+def settings_strategy() -> str:
+    """Stratégie d'ingestion : CHUNKING_STRATEGY, sinon selon USE_SEMANTIC_CHUNKING"""
+    from django.conf import settings
+    rag_settings = settings.RAG_SETTINGS
+    return rag_settings.get('CHUNKING_STRATEGY') or (
+        'semantic' if rag_settings.get('USE_SEMANTIC_CHUNKING', True) else 'lexical')
+
+
+def chunk_pages_from_settings(pages: Iterable[Dict], encode: Optional[Encoder] = None,
+                              count_tokens: TokenCounter = approx_token_count) -> Iterator[Dict]:
+    """Découpage configuré par RAG_SETTINGS (chemin d'ingestion des documents)"""
+    from django.conf import settings
+    rag_settings = settings.RAG_SETTINGS
+    return chunk_pages(
+        pages, settings_strategy(), encode=encode,
+        max_tokens=rag_settings.get('CHUNK_SIZE', DEFAULT_MAX_TOKENS),
+        overlap=rag_settings.get('CHUNK_OVERLAP', DEFAULT_OVERLAP),
+        threshold=rag_settings.get('SEMANTIC_THRESHOLD', DEFAULT_THRESHOLD),
+        count_tokens=count_tokens,
+        batch_size=rag_settings.get('SEMANTIC_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+    )
@@ -0,0 +1,198 @@
+# rag/commit_queue.py
+# File de commits par patient : plusieurs documents, un seul commit d'index
+#
+# Chaque processus de vectorisation dépose ses chunks (vecteurs + métadonnées)
+# dans la file du patient (vector_dir/pending/, un fichier .npz par document,
+# déposé atomiquement) puis demande un commit. Le premier qui obtient le
+# verrou du patient (PatientIndexWriter.locked) attend INDEX_COMMIT_WINDOW_MS
+# que les documents terminés en même temps rejoignent la file, puis les
+# écrit tous d'un coup : un ajout au store et à FAISS, une mise à jour BM25,
+# une publication. Les processus suivants trouvent leur document déjà commis
+# (fichier .result.json) et repartent sans rien réécrire.
+#
+# Les patients différents ont chacun leur verrou et indexent en parallèle.
+
+import os
+import json
+import time
+import uuid
+import glob
+import logging
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+
+from rag.index_writer import PatientIndexWriter, schedule_compaction
+from rag.storage import StoreVersion
+
+logger = logging.getLogger(__name__)
+
+PENDING_DIRNAME = 'pending'
+RESULT_SUFFIX = '.result.json'
+
+
+class PatientCommitQueue:
+    """File de chunks en attente d'indexation pour un patient"""
+
+    def __init__(self, patient_id, dim: int, window_ms: Optional[float] = None):
+        self.patient_id = patient_id
+        self.writer = PatientIndexWriter(patient_id, dim)
+        self.directory = os.path.join(self.writer.paths['vector_dir'], PENDING_DIRNAME)
+        if window_ms is None:
+            window_ms = settings.RAG_SETTINGS.get('INDEX_COMMIT_WINDOW_MS', 200)
+        self.window = max(float(window_ms), 0.0) / 1000
+
+    def submit(self, vectors: np.ndarray, metadata: List[Dict], document_id=None,
+               replace: bool = False) -> str:
+        """
+        Dépose les chunks d'un document (sans verrou). Avec `replace`, les
+        lignes déjà indexées de `document_id` seront masquées au commit.
+        Retourne l'identifiant de l'entrée.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        entry_id = f"{time.time_ns():020d}_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        header = {'document_id': None if document_id is None else str(document_id),
+                  'replace': bool(replace), 'submitted_at': time.time()}
+        tmp_path = os.path.join(self.directory, f".{entry_id}.tmp")
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, vectors=np.asarray(vectors, dtype='float32').reshape(-1, self.writer.dim),
+                     metadata=np.frombuffer(json.dumps(metadata).encode('utf-8'), dtype='uint8'),
+                     header=np.frombuffer(json.dumps(header).encode('utf-8'), dtype='uint8'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._entry_path(entry_id))
+        return entry_id
+
+    def commit(self, entry_id: str, update_bm25: Optional[Callable] = None) -> Dict:
+        """
+        Attend que l'entrée soit commise, en la commettant si besoin avec
+        toutes les entrées en attente. Retourne le résultat du commit qui l'a
+        incluse (n_vectors, documents, chunks, compaction_recommended, ...).
+
+        update_bm25(writer, new_metadata, n_vectors) met à jour les index BM25
+        avant la publication.
+        """
+        waited_start = time.perf_counter()
+        with self.writer.locked():
+            waited_ms = (time.perf_counter() - waited_start) * 1000
+            result = self._pop_result(entry_id)
+            if result is None:
+                if self.window:
+                    # Laisser les documents terminés en même temps rejoindre ce commit
+                    time.sleep(self.window)
+                result = self._commit_pending(entry_id, update_bm25, waited_ms)
+        if result.get('status') == 'error':
+            raise RuntimeError(f"Commit de l'index du patient {self.patient_id} échoué: {result.get('error')}")
+        return result
+
+    def submit_and_commit(self, vectors: np.ndarray, metadata: List[Dict], document_id=None,
+                          replace: bool = False, update_bm25: Optional[Callable] = None) -> Dict:
+        entry_id = self.submit(vectors, metadata, document_id=document_id, replace=replace)
+        return self.commit(entry_id, update_bm25=update_bm25)
+
+    def pending(self) -> List[str]:
+        """Entrées en attente, dans l'ordre de dépôt"""
+        return sorted(os.path.basename(p)[:-4] for p in glob.glob(os.path.join(self.directory, '*.npz')))
+
+    # ------------------------------------------------------------------
+    def _entry_path(self, entry_id: str) -> str:
+        return os.path.join(self.directory, f"{entry_id}.npz")
+
+    def _result_path(self, entry_id: str) -> str:
+        return os.path.join(self.directory, f"{entry_id}{RESULT_SUFFIX}")
+
+    def _pop_result(self, entry_id: str) -> Optional[Dict]:
+        """Résultat laissé par l'écrivain qui a commis cette entrée (None si toujours en attente)"""
+        path = self._result_path(entry_id)
+        try:
+            with open(path) as f:
+                result = json.load(f)
+        except FileNotFoundError:
+            return None
+        os.remove(path)
+        return result
+
+    def _load(self, entry_id: str) -> Dict:
+        with np.load(self._entry_path(entry_id)) as data:
+            entry = json.loads(data['header'].tobytes().decode('utf-8'))
+            entry['vectors'] = data['vectors']
+            entry['metadata'] = json.loads(data['metadata'].tobytes().decode('utf-8'))
+        entry['id'] = entry_id
+        return entry
+
+    def _commit_pending(self, own_entry: str, update_bm25: Optional[Callable], waited_ms: float) -> Dict:
+        entries, results = [], {}
+        for entry_id in self.pending():
+            try:
+                entries.append(self._load(entry_id))
+            except Exception as e:
+                # Entrée illisible : écartée pour ne pas bloquer la file du patient
+                logger.error(f"❌ Entrée {entry_id} du patient {self.patient_id} illisible: {e}")
+                results[entry_id] = {'status': 'error', 'error': f"entrée illisible: {e}"}
+
+        # Un document déposé deux fois dans la même fenêtre : seule la dernière version compte
+        latest = {}
+        for entry in entries:
+            if entry['document_id'] is not None:
+                latest[entry['document_id']] = entry['id']
+        batch = [e for e in entries if e['document_id'] is None or latest[e['document_id']] == e['id']]
+        batch_ids = {e['id'] for e in batch}
+
+        start = time.perf_counter()
+        try:
+            result = self._write(batch, update_bm25)
+            result.update(status='committed', commit_ms=round((time.perf_counter() - start) * 1000, 2),
+                          waited_ms=round(waited_ms, 2))
+        except Exception as e:
+            logger.error(f"❌ Commit de l'index du patient {self.patient_id} échoué: {e}", exc_info=True)
+            result = {'status': 'error', 'error': str(e)}
+
+        for entry in entries:
+            results[entry['id']] = result if entry['id'] in batch_ids else {**result, 'superseded': True}
+        for entry_id, entry_result in results.items():
+            if entry_id != own_entry:
+                with open(self._result_path(entry_id), 'w') as f:
+                    json.dump(entry_result, f)
+            os.remove(self._entry_path(entry_id))
+
+        if result['status'] == 'committed':
+            self._record(result)
+        return results.get(own_entry, result)
+
+    def _write(self, batch: List[Dict], update_bm25: Optional[Callable]) -> Dict:
+        writer = self.writer
+        replaced = 0
+        for entry in batch:
+            if entry['replace'] and entry['document_id'] is not None:
+                replaced += writer.delete_document(entry['document_id'])['deleted_rows']
+        vectors = np.vstack([entry['vectors'] for entry in batch]) if batch \
+            else np.zeros((0, writer.dim), dtype='float32')
+        metadata = [meta for entry in batch for meta in entry['metadata']]
+        result = writer.append(vectors, metadata)
+        result['replaced_rows'] = replaced
+        if update_bm25 is not None and metadata:
+            update_bm25(writer, metadata, result['n_vectors'])
+        commits = StoreVersion.read_manifest(self.patient_id).get('commits', 0) + 1
+        writer.publish(result['n_vectors'], compaction_recommended=result['compaction_recommended'],
+                       commits=commits)
+
+        from rag.answer_cache import get_answer_cache
+        answer_cache = get_answer_cache()
+        if answer_cache is not None:
+            answer_cache.invalidate(self.patient_id)
+        if result['compaction_recommended'] and writer.tombstone_count(result['n_vectors']):
+            schedule_compaction(self.patient_id)
+
+        logger.info(f"📥 Store patient {self.patient_id}: {len(batch)} document(s), {len(metadata)} chunks "
+                    f"en un commit ({result['n_vectors']} vecteurs, {replaced} lignes remplacées)")
+        return {**result, 'documents': len(batch), 'chunks': len(metadata)}
+
+    @staticmethod
+    def _record(result: Dict):
+        try:
+            from metrics.services import MetricsService
+            MetricsService.record_index_commit(result['documents'], result['chunks'],
+                                               result['commit_ms'], result['waited_ms'])
+        except Exception as e:  # les métriques ne doivent jamais bloquer l'indexation
+            logger.debug(f"Métrique de commit d'index non enregistrée: {e}")
@@ -0,0 +1,222 @@
+# rag/conversation_memory.py
+# Mémoire de conversation à budget de tokens : résumé glissant + derniers échanges
+
+import re
+import logging
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from rag.rate_limiter import BACKGROUND, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_KEY = 'conversation_summary'
+# Bloc ajouté par le webhook après la réponse (suggestions de questions) : inutile au LLM
+SUGGESTIONS_MARKER = "\n\nVous pourriez aussi demander :"
+# Nombre d'échanges pris en compte par l'ancien historique (pour mesurer le gain)
+LEGACY_HISTORY_TURNS = 20
+
+# Détection des questions de suivi (qui ne se comprennent qu'avec l'historique)
+FOLLOW_UP_STARTS = ('et ', 'mais ', 'donc ', 'alors ', 'aussi ', 'ok ', "d'accord")
+FOLLOW_UP_WORDS = {
+    'ça', 'cela', 'ceci', 'celui', 'celle', 'ceux', 'celles', 'cet', 'cette', 'ces',
+    'il', 'elle', 'ils', 'elles', 'lui', 'précédent', 'précédente', 'ci-dessus',
+}
+FOLLOW_UP_PHRASES = (
+    'vous avez dit', 'tu as dit', 'vous venez de', 'tu viens de', 'plus de détails',
+    'le même', 'la même', 'les mêmes', 'dernière réponse',
+)
+INTERROGATIVES = {'pourquoi', 'comment', 'combien', 'quand', 'où', 'lequel', 'laquelle', 'quoi'}
+# Tournures impersonnelles : « il » n'y renvoie à rien de l'historique
+IMPERSONAL = re.compile(r"\b(il y a|y a-t-il|il faut|faut-il|il est (important|possible|normal|nécessaire))\b")
+WORD_RE = re.compile(r"[\w'-]+", re.UNICODE)
+
+
+def is_follow_up(question: str) -> bool:
+    """
+    Vrai si la question renvoie aux échanges précédents (pronom ou démonstratif
+    sans antécédent, « et … ? », question très courte) : elle doit être posée
+    au LLM avec l'historique. Les autres questions sont autonomes : la réponse
+    ne dépend pas de la conversation (cache de réponses réutilisable).
+    """
+    text = ' '.join((question or '').lower().split())
+    if not text:
+        return False
+    if text.startswith(FOLLOW_UP_STARTS) or any(phrase in text for phrase in FOLLOW_UP_PHRASES):
+        return True
+    words = WORD_RE.findall(IMPERSONAL.sub(' ', text))
+    if len(words) <= 2 or (len(words) <= 3 and words[0] in INTERROGATIVES):
+        return True
+    return any(word in FOLLOW_UP_WORDS for word in words)
+
+
+class ConversationMemory:
+    """
+    Historique injecté dans le prompt : résumé des échanges anciens (stocké
+    dans WhatsAppSession.metadata, mis à jour en tâche de fond) + les
+    `recent_turns` derniers échanges, le tout sous `token_budget` tokens.
+
+    metadata['conversation_summary'] = {'text', 'last_log_id', 'turns', 'updated_at'}
+    """
+
+    def __init__(self, recent_turns: int = 4, token_budget: int = 600,
+                 summary_max_tokens: int = 200, max_turn_chars: int = 600):
+        self.recent_turns = recent_turns
+        self.token_budget = token_budget
+        self.summary_max_tokens = summary_max_tokens
+        self.max_turn_chars = max_turn_chars
+
+    @staticmethod
+    def summary_state(session) -> Dict[str, Any]:
+        return (session.metadata or {}).get(SUMMARY_KEY) or {}
+
+    @classmethod
+    def _clean_response(cls, text: str) -> str:
+        return (text or '').split(SUGGESTIONS_MARKER, 1)[0].strip()
+
+    def _format_turn(self, log) -> str:
+        user = (log.user_message or '')[:self.max_turn_chars]
+        assistant = self._clean_response(log.ai_response)[:self.max_turn_chars]
+        return f"Patient: {user}\nAssistant: {assistant}"
+
+    def build(self, session) -> Dict[str, Any]:
+        """
+        Historique à injecter pour le prochain tour.
+        Retourne {'text', 'tokens', 'turns', 'has_summary', 'is_new', 'legacy_tokens'}.
+        """
+        from sessions.models import ConversationLog
+
+        state = self.summary_state(session)
+        summary = (state.get('text') or '').strip()
+        last_log_id = state.get('last_log_id') or 0
+
+        logs = list(
+            ConversationLog.objects.filter(session=session, id__gt=last_log_id)
+            .order_by('-timestamp')[:self.recent_turns]
+        )
+
+        parts: List[str] = []
+        used = 0
+        if summary:
+            summary = summary[:self.summary_max_tokens * 4]
+            parts.append(f"Résumé des échanges précédents : {summary}")
+            used = estimate_tokens(parts[0])
+
+        # Tours les plus récents d'abord, jusqu'à épuisement du budget
+        turns: List[str] = []
+        for log in logs:
+            turn = self._format_turn(log)
+            cost = estimate_tokens(turn)
+            if used + cost > self.token_budget:
+                break
+            turns.append(turn)
+            used += cost
+        parts.extend(reversed(turns))
+
+        return {
+            'text': "\n".join(parts),
+            'tokens': used,
+            'turns': len(turns),
+            'has_summary': bool(summary),
+            'is_new': not logs and not summary,
+            'legacy_tokens': self.legacy_history_tokens(session),
+        }
+
+    @staticmethod
+    def legacy_history_tokens(session) -> int:
+        """Taille qu'aurait eue l'historique complet des 20 derniers échanges (référence « avant »)"""
+        from sessions.models import ConversationLog
+        lengths = ConversationLog.objects.filter(session=session).order_by('-timestamp') \
+            .values_list('message_length', 'response_length')[:LEGACY_HISTORY_TURNS]
+        chars = sum(m + r + len("Patient: \nAssistant: \n") for m, r in lengths)
+        return chars // 4
+
+    # ---------------------------
+    # Résumé incrémental (tâche de fond)
+    # ---------------------------
+
+    def pending_logs(self, session) -> list:
+        """Échanges sortis de la fenêtre récente et pas encore intégrés au résumé"""
+        from sessions.models import ConversationLog
+        last_log_id = self.summary_state(session).get('last_log_id') or 0
+        logs = list(ConversationLog.objects.filter(session=session, id__gt=last_log_id).order_by('timestamp'))
+        return logs[:-self.recent_turns] if self.recent_turns else logs
+
+    def schedule_update(self, session):
+        """Planifie la mise à jour du résumé si des échanges sortent de la fenêtre récente"""
+        from sessions.models import ConversationLog
+        last_log_id = self.summary_state(session).get('last_log_id') or 0
+        if ConversationLog.objects.filter(session=session, id__gt=last_log_id).count() <= self.recent_turns:
+            return False
+        # Une seule mise à jour en file par session
+        if not cache.add(f"rag:memory:summarizing:{session.id}", 1, timeout=300):
+            return False
+        from sessions.tasks import update_conversation_summary
+        update_conversation_summary.delay(session.id)
+        return True
+
+    def summarize(self, session, llm=None) -> Optional[Dict[str, Any]]:
+        """Intègre les échanges en attente au résumé de la session (appel LLM basse priorité)"""
+        from sessions.models import WhatsAppSession
+
+        pending = self.pending_logs(session)
+        if not pending:
+            return None
+        state = self.summary_state(session)
+        previous = state.get('text') or ''
+
+        exchanges = "\n".join(self._format_turn(log) for log in pending)
+        prompt = (
+            "Tu mets à jour le résumé d'une conversation entre un patient et son assistant médical.\n"
+            f"Rédige en français un résumé factuel de {self.summary_max_tokens // 2} mots maximum : "
+            "symptômes et questions du patient, informations médicales données, rappels ou "
+            "engagements en cours. N'invente rien, n'ajoute aucune salutation.\n\n"
+            f"Résumé actuel :\n{previous or '(aucun)'}\n\n"
+            f"Nouveaux échanges :\n{exchanges}\n\n"
+            "Résumé mis à jour :"
+        )
+        if llm is None:
+            from rag.model_registry import ModelRegistry
+            llm = ModelRegistry.get_llm()
+        text = llm.generate(prompt, priority=BACKGROUND).strip()
+        if not text:
+            return None
+
+        new_state = {
+            'text': text[:self.summary_max_tokens * 4],
+            'last_log_id': pending[-1].id,
+            'turns': (state.get('turns') or 0) + len(pending),
+            'updated_at': timezone.now().isoformat(),
+        }
+        # Écriture ciblée : ne pas écraser les autres clés de metadata modifiées entre-temps
+        with transaction.atomic():
+            locked = WhatsAppSession.objects.select_for_update().get(pk=session.pk)
+            metadata = dict(locked.metadata or {})
+            if (metadata.get(SUMMARY_KEY) or {}).get('last_log_id', 0) > new_state['last_log_id']:
+                return None  # une mise à jour plus récente est déjà passée
+            metadata[SUMMARY_KEY] = new_state
+            locked.metadata = metadata
+            locked.save(update_fields=['metadata'])
+        logger.info(f"🧠 Résumé de la session {session.session_id} mis à jour "
+                    f"({len(pending)} échange(s) intégrés, {estimate_tokens(new_state['text'])} tokens)")
+        return new_state
+
+
+_memory: Optional[ConversationMemory] = None
+
+
+def get_conversation_memory() -> ConversationMemory:
+    """Mémoire configurée par RAG_SETTINGS"""
+    global _memory
+    if _memory is None:
+        rag_settings = settings.RAG_SETTINGS
+        _memory = ConversationMemory(
+            recent_turns=rag_settings.get('MEMORY_RECENT_TURNS', 4),
+            token_budget=rag_settings.get('MEMORY_TOKEN_BUDGET', 600),
+            summary_max_tokens=rag_settings.get('MEMORY_SUMMARY_MAX_TOKENS', 200),
+        )
+    return _memory
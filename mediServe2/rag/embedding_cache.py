@@ -0,0 +1,195 @@
+# rag/embedding_cache.py
+# Cache des embeddings de requêtes : LRU en mémoire + niveau Redis partagé entre workers
+
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_TTL = 7 * 24 * 3600
+REDIS_RETRY_DELAY = 30  # secondes avant de retenter Redis après une erreur
+
+
+def normalize_query_text(text: str) -> str:
+    """Normalisation de la clé (et du texte encodé) : NFC, espaces compactés"""
+    return ' '.join(unicodedata.normalize('NFC', text or '').split())
+
+
+class QueryEmbeddingCache:
+    """
+    Cache à deux niveaux des embeddings de requêtes.
+
+    Niveau 1 : LRU du processus (tableaux numpy). Niveau 2 : Redis, valeurs
+    stockées en octets float32 bruts, partagées par tous les workers
+    gunicorn / Celery. Les clés combinent le nom du modèle et le texte
+    normalisé. Redis est optionnel : en cas d'erreur, le cache continue en
+    mémoire seule et Redis est retenté après REDIS_RETRY_DELAY secondes.
+    """
+
+    def __init__(self, model_name: str, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 redis_url: Optional[str] = None, ttl: int = DEFAULT_TTL,
+                 metrics_name: str = 'query_embedding'):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.metrics_name = metrics_name
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_url = redis_url
+        self._redis_down_until = 0.0
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def key(self, text: str) -> str:
+        digest = hashlib.sha1(normalize_query_text(text).encode('utf-8')).hexdigest()
+        return f"qemb:{self.model_name}:{digest}"
+
+    # --- Redis -------------------------------------------------------------
+
+    def _client(self):
+        if not self._redis_url or time.time() < self._redis_down_until:
+            return None
+        if self._redis is None:
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(self._redis_url, socket_timeout=0.2,
+                                                   socket_connect_timeout=0.2)
+            except Exception as e:
+                self._redis_failed(e)
+                return None
+        return self._redis
+
+    def _redis_failed(self, error):
+        logger.warning(f"⚠️ Cache d'embeddings Redis indisponible ({error}), mémoire seule pendant "
+                       f"{REDIS_RETRY_DELAY}s")
+        self._redis_down_until = time.time() + REDIS_RETRY_DELAY
+
+    def _redis_get(self, key: str) -> Optional[np.ndarray]:
+        client = self._client()
+        if client is None:
+            return None
+        try:
+            raw = client.get(key)
+        except Exception as e:
+            self._redis_failed(e)
+            return None
+        if not raw or len(raw) % 4:
+            return None
+        return np.frombuffer(raw, dtype='<f4').astype('float32')
+
+    def _redis_set(self, key: str, vec: np.ndarray):
+        client = self._client()
+        if client is None:
+            return
+        try:
+            client.set(key, np.asarray(vec, dtype='<f4').tobytes(), ex=self.ttl)
+        except Exception as e:
+            self._redis_failed(e)
+
+    # --- LRU ---------------------------------------------------------------
+
+    def _local_get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vec = self._entries.get(key)
+            if vec is not None:
+                self._entries.move_to_end(key)
+            return vec
+
+    def _local_put(self, key: str, vec: np.ndarray):
+        with self._lock:
+            self._entries[key] = vec
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _record(self, hit: bool):
+        try:
+            from metrics.services import MetricsService
+            MetricsService.record_cache_lookup(self.metrics_name, hit)
+        except Exception as e:  # les métriques ne doivent jamais bloquer une requête
+            logger.debug(f"Métrique de cache non enregistrée: {e}")
+
+    # --- API ---------------------------------------------------------------
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = self.key(text)
+        vec = self._local_get(key)
+        if vec is not None:
+            self.hits += 1
+            self._record(True)
+            return vec.copy()
+
+        vec = self._redis_get(key)
+        if vec is not None:
+            self._local_put(key, vec)
+            self.hits += 1
+            self.redis_hits += 1
+            self._record(True)
+            return vec.copy()
+
+        self.misses += 1
+        self._record(False)
+        return None
+
+    def put(self, text: str, vec: np.ndarray):
+        key = self.key(text)
+        vec = np.array(vec, dtype='float32').reshape(-1)
+        vec.setflags(write=False)
+        self._local_put(key, vec)
+        self._redis_set(key, vec)
+
+    def get_or_compute(self, text: str, encode: Callable[[str], np.ndarray]) -> np.ndarray:
+        """
+        Retourne une copie de l'embedding (les stores normalisent le vecteur
+        de requête sur place, l'entrée en cache ne doit pas être modifiée).
+        """
+        vec = self.get(text)
+        if vec is not None:
+            return vec
+        vec = encode(normalize_query_text(text))
+        self.put(text, vec)
+        return np.array(vec, dtype='float32').reshape(-1)
+
+    def prewarm(self, texts: Iterable[str], encode: Callable[[str], np.ndarray]) -> int:
+        """Pré-calcule les requêtes connues d'avance (réponses rapides...)"""
+        count = 0
+        for text in texts:
+            key = self.key(text)
+            if self._local_get(key) is not None:
+                continue
+            vec = self._redis_get(key)
+            if vec is None:
+                vec = encode(normalize_query_text(text))
+                self._redis_set(key, np.asarray(vec, dtype='float32').reshape(-1))
+            vec = np.array(vec, dtype='float32').reshape(-1)
+            vec.setflags(write=False)
+            self._local_put(key, vec)
+            count += 1
+        return count
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'model': self.model_name,
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'redis': bool(self._redis_url),
+        }
@@ -0,0 +1,137 @@
+# rag/embedding_service.py
+# Service d'embeddings local : un seul processus détient le modèle, les workers
+# gunicorn / Celery lui envoient leurs requêtes via une socket Unix.
+#
+#   python manage.py run_embedding_service
+#
+# Les requêtes reçues de toutes les connexions passent par un MicroBatcher :
+# les appels concurrents des différents workers sont encodés en un seul lot.
+
+import os
+import logging
+import threading
+from multiprocessing.connection import Client, Listener
+from typing import List, Optional
+
+import numpy as np
+
+from rag.batching import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = '/tmp/mediserve_embeddings.sock'
+
+
+def _authkey() -> bytes:
+    return os.getenv('RAG_EMBEDDING_SERVICE_KEY', 'mediserve-embeddings').encode('utf-8')
+
+
+class EmbeddingServer:
+    """Serveur d'embeddings : une connexion = un thread, un batcher commun"""
+
+    def __init__(self, embedder, address: str = DEFAULT_ADDRESS,
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.embedder = embedder
+        self.address = address
+        self.batcher = MicroBatcher(embedder.encode_batch, max_batch_size=max_batch_size,
+                                    max_wait_ms=max_wait_ms, name='embedding-service')
+
+    def _handle(self, conn):
+        try:
+            while True:
+                try:
+                    op, payload = conn.recv()
+                except EOFError:
+                    return
+                try:
+                    if op == 'embed':
+                        futures = [self.batcher.submit(text) for text in payload]
+                        vectors = np.vstack([f.result() for f in futures]).astype('float32')
+                        conn.send(('ok', vectors))
+                    elif op == 'info':
+                        conn.send(('ok', {'model_name': self.embedder.model_name,
+                                          'dim': self.embedder.dim,
+                                          'stats': self.batcher.stats()}))
+                    else:
+                        conn.send(('error', f"Opération inconnue: {op}"))
+                except Exception as e:
+                    conn.send(('error', str(e)))
+        finally:
+            conn.close()
+
+    def serve_forever(self):
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        with Listener(self.address, family='AF_UNIX', authkey=_authkey()) as listener:
+            logger.info(f"🚀 Service d'embeddings '{self.embedder.model_name}' à l'écoute sur {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    logger.warning(f"⚠️ Connexion refusée: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+
+class RemoteEmbeddingGenerator:
+    """
+    Remplaçant d'EmbeddingGenerator qui délègue l'encodage au service
+    (mêmes attributs model_name / dim / query_cache, même embed_text).
+    Les poids du modèle ne sont pas chargés dans le worker.
+    """
+
+    def __init__(self, model_name: str, address: str = DEFAULT_ADDRESS, query_cache=None, timeout: float = 10.0):
+        self.model_name = model_name
+        self.address = address
+        self.query_cache = query_cache
+        self.timeout = timeout
+        self.model = None
+        self.batcher = None
+        self._local = threading.local()
+        info = self._call('info', None)
+        if info['model_name'] != model_name:
+            raise ValueError(f"Le service encode avec '{info['model_name']}', '{model_name}' attendu")
+        self.dim = info['dim']
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = Client(self.address, family='AF_UNIX', authkey=_authkey())
+            self._local.conn = conn
+        return conn
+
+    def _call(self, op: str, payload):
+        # Une reconnexion en cas de redémarrage du service
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.send((op, payload))
+                if not conn.poll(self.timeout):
+                    # La réponse en retard arriverait sur la requête suivante : abandonner la connexion
+                    self._local.conn = None
+                    conn.close()
+                    raise RuntimeError(f"Service d'embeddings sans réponse après {self.timeout}s")
+                status, result = conn.recv()
+                break
+            except (EOFError, ConnectionError, OSError):
+                self._local.conn = None
+                conn.close()
+                if attempt:
+                    raise
+        if status != 'ok':
+            raise RuntimeError(f"Service d'embeddings: {result}")
+        return result
+
+    def encode_batch(self, texts: List[str]) -> np.ndarray:
+        return self._call('embed', list(texts))
+
+    def _encode(self, text: str) -> np.ndarray:
+        return self.encode_batch([text])[0]
+
+    def embed_text(self, text: str) -> np.ndarray:
+        if self.query_cache is not None:
+            return self.query_cache.get_or_compute(text, self._encode)
+        return self._encode(text)
+
+    def stats(self) -> Optional[dict]:
+        return self._call('info', None)['stats']
@@ -0,0 +1,438 @@
+# rag/index_factory.py
+# Choix automatique du type d'index FAISS selon la taille du corpus
+#
+#   flat      : recherche exacte, jusqu'à FAISS_FLAT_MAX_VECTORS vecteurs
+#   hnsw      : graphe HNSW, le plus rapide si la mémoire le permet
+#   ivf_flat  : listes inversées sur vecteurs complets (≈ mémoire d'un Flat)
+#   ivf_pq    : listes inversées + product quantization quand le budget
+#               mémoire (FAISS_MEMORY_TARGET_MB) est dépassé
+#
+# Le type retenu et ses paramètres sont enregistrés dans index_params.json
+# à côté du store du patient. nprobe (IVF) et efSearch (HNSW) ont une
+# valeur par défaut par index mais peuvent être passés à chaque requête.
+#
+# Avec VECTOR_COMPRESSION, l'index ne garde que des codes (float16, SQ8 ou
+# PQ) : il sert à présélectionner rescore_factor × top_k candidats, dont les
+# scores sont recalculés sur les vecteurs pleine précision du store mmap.
+#
+# L'index peut couvrir moins de lignes que le store : les dernières lignes
+# ajoutées (la « queue ») sont parcourues exactement sur les vecteurs du
+# store (search_with_tail), et l'index n'est réécrit que lorsque la queue
+# dépasse tail_limit() — un ajout de document ne relit ni ne réécrit tout
+# l'index FAISS.
+
+import os
+import json
+import math
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import faiss
+
+from rag.vector_format import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+INDEX_PARAMS_FILENAME = 'index_params.json'
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw')
+
+# k-means de FAISS : au moins 39 points d'apprentissage par centroïde
+MIN_POINTS_PER_CENTROID = 39
+MAX_POINTS_PER_CENTROID = 256
+PQ_NBITS = 8
+PQ_M_CANDIDATES = (96, 64, 48, 32, 24, 16, 8)
+TRAINING_SEED = 1234
+# Réentraînement des centroïdes IVF quand l'index a grossi de ce facteur depuis son apprentissage
+RETRAIN_GROWTH = 2.0
+
+# Codecs des vecteurs dans l'index : float32, float16, 8 bits par dimension, product quantization
+COMPRESSIONS = ('none', 'fp16', 'sq8', 'pq')
+CODEC_STORAGE = {'none': 'Flat', 'fp16': 'SQfp16', 'sq8': 'SQ8'}
+CODEC_BYTES_PER_DIM = {'none': 4, 'fp16': 2, 'sq8': 1}
+# Échantillon d'apprentissage minimal (bornes min/max du SQ8, livres de codes PQ)
+CODEC_TRAINING_POINTS = {'sq8': 65536, 'pq': 65536}
+
+DEFAULT_CONFIG = {
+    'type': 'auto',
+    'memory_target_mb': 256,
+    'flat_max_vectors': 20000,
+    'hnsw_m': 32,
+    'ef_construction': 80,
+    'ef_search': 64,
+    'nprobe': 16,
+    'compression': 'none',
+    'rescore_factor': 4,
+    'tail_min_rows': 4096,
+    'tail_ratio': 0.1,
+}
+
+# Clé de configuration -> clé de RAG_SETTINGS
+_SETTINGS_KEYS = {
+    'type': 'FAISS_INDEX_TYPE',
+    'memory_target_mb': 'FAISS_MEMORY_TARGET_MB',
+    'flat_max_vectors': 'FAISS_FLAT_MAX_VECTORS',
+    'hnsw_m': 'FAISS_HNSW_M',
+    'ef_construction': 'FAISS_EF_CONSTRUCTION',
+    'ef_search': 'FAISS_EF_SEARCH',
+    'nprobe': 'FAISS_NPROBE',
+    'compression': 'VECTOR_COMPRESSION',
+    'rescore_factor': 'RESCORE_FACTOR',
+    'tail_min_rows': 'FAISS_TAIL_MIN_ROWS',
+    'tail_ratio': 'FAISS_TAIL_RATIO',
+}
+
+
+def index_config(**overrides) -> Dict:
+    """Configuration effective : valeurs par défaut < RAG_SETTINGS < arguments"""
+    config = dict(DEFAULT_CONFIG)
+    try:
+        from django.conf import settings
+        from django.core.exceptions import ImproperlyConfigured
+        try:
+            rag_settings = settings.RAG_SETTINGS
+        except ImproperlyConfigured:
+            rag_settings = {}
+    except ImportError:
+        rag_settings = {}
+    config.update({key: rag_settings[name] for key, name in _SETTINGS_KEYS.items() if name in rag_settings})
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    return config
+
+
+def code_bytes(codec: str, dim: int, pq_m: Optional[int] = None) -> int:
+    """Octets par vecteur stockés dans l'index selon le codec"""
+    if codec == 'pq':
+        return pq_m or max(1, dim // 8)
+    return CODEC_BYTES_PER_DIM[codec] * dim
+
+
+def flat_bytes(n_vectors: int, dim: int, codec: str = 'none', pq_m: Optional[int] = None) -> int:
+    return n_vectors * code_bytes(codec, dim, pq_m)
+
+
+def hnsw_bytes(n_vectors: int, dim: int, hnsw_m: int, codec: str = 'none') -> int:
+    # Codes + ~2·M voisins int32 au niveau 0 (les niveaux supérieurs sont négligeables)
+    return n_vectors * (code_bytes(codec, dim) + hnsw_m * 2 * 4)
+
+
+def ivf_bytes(n_vectors: int, dim: int, nlist: int, codec: str = 'none', pq_m: Optional[int] = None) -> int:
+    # Codes + identifiants int64 + centroïdes grossiers (+ livres de codes PQ)
+    total = n_vectors * (code_bytes(codec, dim, pq_m) + 8) + nlist * dim * 4
+    if codec == 'pq':
+        total += (1 << PQ_NBITS) * dim * 4
+    return total
+
+
+def default_nlist(n_vectors: int) -> int:
+    """nlist ≈ 4·√n, limité pour garder MIN_POINTS_PER_CENTROID points par liste"""
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // MIN_POINTS_PER_CENTROID))
+
+
+def _pq_m(n_vectors: int, dim: int, nlist: int, budget: int) -> int:
+    """Plus grand nombre de sous-quantifieurs (diviseur de dim) tenant dans le budget"""
+    candidates = [m for m in PQ_M_CANDIDATES if m <= dim and dim % m == 0] or [1]
+    for m in candidates:
+        if ivf_bytes(n_vectors, dim, nlist, 'pq', m) <= budget:
+            return m
+    return candidates[-1]
+
+
+def choose_index_spec(n_vectors: int, dim: int, allowed: Tuple[str, ...] = INDEX_TYPES,
+                      allow_compression: bool = True, **overrides) -> Dict:
+    """
+    Choisit le type d'index, son codec et leurs paramètres.
+
+    FAISS_INDEX_TYPE='auto' : Flat pour les petits corpus, puis HNSW si sa
+    mémoire tient dans le budget, IVF-Flat si les vecteurs (ou leurs codes)
+    y tiennent, IVF-PQ sinon. Un type forcé retombe sur le plus proche
+    réalisable quand il n'y a pas assez de données pour l'entraînement.
+
+    VECTOR_COMPRESSION ('fp16', 'sq8', 'pq') remplace les vecteurs float32
+    de l'index par des codes ; les meilleurs candidats sont alors re-scorés
+    exactement depuis le store (voir rescore).
+    """
+    config = index_config(**overrides)
+    budget = int(float(config['memory_target_mb']) * 1024 * 1024)
+    requested = config['type']
+    if requested != 'auto' and requested not in INDEX_TYPES:
+        raise ValueError(f"Type d'index FAISS inconnu: {requested}")
+    codec = config['compression'] if allow_compression else 'none'
+    if codec not in COMPRESSIONS:
+        raise ValueError(f"Compression de vecteurs inconnue: {codec}")
+
+    nlist = default_nlist(n_vectors)
+    if requested == 'auto':
+        if n_vectors < int(config['flat_max_vectors']):
+            index_type = 'flat'
+        elif 'hnsw' in allowed and codec != 'pq' \
+                and hnsw_bytes(n_vectors, dim, int(config['hnsw_m']), codec) <= budget:
+            index_type = 'hnsw'
+        elif codec != 'pq' and (ivf_bytes(n_vectors, dim, nlist, codec) <= budget or 'ivf_pq' not in allowed):
+            index_type = 'ivf_flat'
+        else:
+            index_type = 'ivf_pq'
+    else:
+        index_type = requested
+    # Codes PQ : portés par IVF-PQ (pas de HNSW sur codes PQ)
+    if codec == 'pq' and index_type in ('ivf_flat', 'hnsw') and 'ivf_pq' in allowed:
+        index_type = 'ivf_pq'
+    if index_type not in allowed:
+        index_type = 'ivf_flat' if 'ivf_flat' in allowed and index_type.startswith('ivf') else 'flat'
+
+    # Pas assez de points pour apprendre les livres de codes PQ (2^nbits centroïdes)
+    enough_for_pq = n_vectors >= MIN_POINTS_PER_CENTROID * (1 << PQ_NBITS)
+    if index_type == 'ivf_pq' and not enough_for_pq:
+        index_type = 'ivf_flat'
+    # Ni pour les centroïdes IVF : la recherche exacte reste la meilleure option
+    if index_type.startswith('ivf') and nlist < 2:
+        index_type = 'flat'
+    if index_type == 'ivf_pq':
+        codec = 'pq'
+    elif codec == 'pq' and (index_type == 'hnsw' or not enough_for_pq):
+        codec = 'sq8'
+
+    spec = {'type': index_type, 'codec': codec, 'n_vectors': int(n_vectors), 'dim': int(dim),
+            'metric': 'inner_product', 'rescore': codec != 'none',
+            'rescore_factor': int(config['rescore_factor'])}
+    if codec == 'pq':
+        spec.update(pq_m=_pq_m(n_vectors, dim, nlist if index_type == 'ivf_pq' else 0, budget), pq_nbits=PQ_NBITS)
+        storage = f"PQ{spec['pq_m']}x{PQ_NBITS}"
+    else:
+        storage = CODEC_STORAGE[codec]
+
+    if index_type == 'flat':
+        spec['factory'] = storage
+        spec['estimated_bytes'] = flat_bytes(n_vectors, dim, codec, spec.get('pq_m'))
+    elif index_type == 'hnsw':
+        spec.update(hnsw_m=int(config['hnsw_m']), ef_construction=int(config['ef_construction']),
+                    ef_search=int(config['ef_search']))
+        spec['factory'] = f"HNSW{spec['hnsw_m']},{storage}"
+        spec['estimated_bytes'] = hnsw_bytes(n_vectors, dim, spec['hnsw_m'], codec)
+    else:
+        spec.update(nlist=nlist, nprobe=min(int(config['nprobe']), nlist))
+        spec['factory'] = f"IVF{nlist},{storage}"
+        spec['estimated_bytes'] = ivf_bytes(n_vectors, dim, nlist, codec, spec.get('pq_m'))
+    return spec
+
+
+def training_sample(vectors: np.ndarray, nlist: int, min_points: int = 0) -> np.ndarray:
+    """Échantillon aléatoire (reproductible) pour l'apprentissage des centroïdes"""
+    size = max(nlist * MAX_POINTS_PER_CENTROID, min_points)
+    if len(vectors) <= size:
+        return vectors
+    rng = np.random.default_rng(TRAINING_SEED)
+    return vectors[np.sort(rng.choice(len(vectors), size, replace=False))]
+
+
+def new_index(spec: Dict) -> faiss.Index:
+    """Index vide (non entraîné) correspondant à la spécification"""
+    index = faiss.index_factory(spec['dim'], spec['factory'], faiss.METRIC_INNER_PRODUCT)
+    if spec['type'] == 'hnsw':
+        index.hnsw.efConstruction = spec['ef_construction']
+        index.hnsw.efSearch = spec['ef_search']
+    elif spec['type'].startswith('ivf'):
+        faiss.extract_index_ivf(index).nprobe = spec['nprobe']
+    if spec.get('codec') == 'pq':
+        # Activé par index_factory mais inutile ici (pas de filtrage polysémique) et très lent
+        index.do_polysemous_training = False
+    return index
+
+
+def train_index(index: faiss.Index, vectors: np.ndarray, spec: Dict) -> float:
+    """Entraîne les centroïdes IVF et les codecs PQ / SQ8, retourne la durée en secondes"""
+    if index.is_trained:
+        return 0.0
+    start = time.perf_counter()
+    min_points = CODEC_TRAINING_POINTS.get(spec.get('codec'), 0)
+    index.train(np.ascontiguousarray(training_sample(vectors, spec.get('nlist', 1), min_points)))
+    return time.perf_counter() - start
+
+
+def build_index(vectors: np.ndarray, spec: Optional[Dict] = None, ids: Optional[np.ndarray] = None) -> faiss.Index:
+    """
+    Construit et remplit l'index (vecteurs déjà normalisés L2).
+
+    Le temps d'entraînement et de construction est ajouté à la spécification
+    ('train_seconds', 'build_seconds') pour index_params.json.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    if spec is None:
+        spec = choose_index_spec(len(vectors), vectors.shape[1])
+    start = time.perf_counter()
+    index = new_index(spec)
+    spec['train_seconds'] = round(train_index(index, vectors, spec), 3)
+    if ids is not None:
+        index.add_with_ids(vectors, np.asarray(ids, dtype='int64'))
+    else:
+        index.add(vectors)
+    spec['build_seconds'] = round(time.perf_counter() - start, 3)
+    spec['trained_on'] = int(len(vectors))
+    logger.info(
+        f"🧭 Index FAISS {spec['factory']} construit: {index.ntotal} vecteurs "
+        f"en {spec['build_seconds']}s (entraînement {spec['train_seconds']}s)"
+    )
+    return index
+
+
+def needs_rebuild(params: Dict, n_vectors: int, dim: int, **overrides) -> bool:
+    """
+    Vrai si un index construit avec `params` n'est plus adapté à n_vectors
+    (autre type choisi, ou centroïdes IVF appris sur trop peu de données) :
+    les ajouts incrémentaux le gardent tel quel jusqu'à la compaction.
+    """
+    expected = choose_index_spec(n_vectors, dim, **overrides)
+    if expected['factory'] != params.get('factory', 'Flat'):
+        return not (expected['type'] == params.get('type') and expected['type'].startswith('ivf')
+                    and n_vectors <= RETRAIN_GROWTH * params.get('trained_on', 0))
+    return params.get('type', 'flat').startswith('ivf') and n_vectors > RETRAIN_GROWTH * params.get('trained_on', 0)
+
+
+def exact_scan(params: Dict) -> bool:
+    """Index Flat non compressé : un store mmap est parcouru directement, sans fichier FAISS"""
+    return params.get('type', 'flat') == 'flat' and params.get('codec', 'none') == 'none'
+
+
+def tail_limit(indexed_rows: int, **overrides) -> int:
+    """
+    Lignes non indexées tolérées avant d'ajouter la queue à l'index : au
+    moins tail_min_rows, puis une fraction de l'index (réécritures de
+    l'index espacées géométriquement, coût amorti constant par ligne).
+    """
+    config = index_config(**overrides)
+    return max(int(config['tail_min_rows']), int(float(config['tail_ratio']) * indexed_rows))
+
+
+def search_with_tail(index: faiss.Index, vectors: np.ndarray, query: np.ndarray, top_k: int, params: Dict,
+                     nprobe: Optional[int] = None, ef_search: Optional[int] = None, sel=None,
+                     deleted: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+    """
+    Recherche sur l'index (lignes [0, index.ntotal)) complétée par un
+    parcours exact des lignes suivantes du store (`vectors`), hors lignes
+    supprimées (`deleted`, masque booléen). Retourne [(ligne, score)].
+    """
+    q = normalize_rows(query)
+    indexed = index.ntotal
+    hits = []
+    if indexed:
+        scores, ids = search_index(index, q, candidate_count(params, top_k, indexed),
+                                   nprobe=nprobe, ef_search=ef_search, sel=sel)
+        if params.get('rescore'):
+            rows, exact = rescore(vectors, q, ids[0], top_k)
+            hits = [(int(i), float(s)) for i, s in zip(rows, exact)]
+        else:
+            # Les index IVF / HNSW peuvent rendre moins de top_k résultats (id -1)
+            hits = [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i >= 0]
+    if len(vectors) > indexed:
+        tail = normalize_rows(vectors[indexed:]) @ q[0]
+        if deleted is not None:
+            tail[deleted[indexed:len(vectors)]] = -np.inf
+        k = min(top_k, len(tail))
+        top = np.argpartition(-tail, k - 1)[:k]
+        hits += [(indexed + int(i), float(tail[i])) for i in top if np.isfinite(tail[i])]
+        hits = sorted(hits, key=lambda hit: hit[1], reverse=True)[:top_k]
+    return hits
+
+
+def write_index_atomic(index: faiss.Index, path: str):
+    """faiss.write_index via un fichier temporaire (les lecteurs ne voient jamais un index partiel)"""
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def search_parameters(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                      sel=None) -> Optional[faiss.SearchParameters]:
+    """
+    Paramètres de recherche par requête (n'altèrent pas l'index partagé
+    entre threads). Retourne None si rien n'est à surcharger.
+    """
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    ivf = faiss.try_extract_index_ivf(base)
+    # Les index IVF / HNSW refusent des paramètres d'un autre type, même pour un simple sélecteur
+    if ivf is not None and (nprobe is not None or sel is not None):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = int(nprobe if nprobe is not None else ivf.nprobe)
+    elif isinstance(base, faiss.IndexHNSW) and (ef_search is not None or sel is not None):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = int(ef_search if ef_search is not None else base.hnsw.efSearch)
+    elif sel is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if sel is not None:
+        params.sel = sel
+    return params
+
+
+def search_index(index: faiss.Index, queries: np.ndarray, top_k: int,
+                 nprobe: Optional[int] = None, ef_search: Optional[int] = None, sel=None):
+    """index.search avec nprobe / efSearch / sélecteur propres à cette requête"""
+    params = search_parameters(index, nprobe, ef_search, sel)
+    if params is None:
+        return index.search(queries, top_k)
+    return index.search(queries, top_k, params=params)
+
+
+def candidate_count(spec: Dict, top_k: int, ntotal: int) -> int:
+    """Nombre de candidats à demander à l'index (davantage si leurs scores sont recalculés)"""
+    factor = max(int(spec.get('rescore_factor', 1)), 1) if spec.get('rescore') else 1
+    return min(top_k * factor, ntotal)
+
+
+def rescore(vectors: np.ndarray, query: np.ndarray, candidates: np.ndarray,
+            top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Recalcule exactement les scores des candidats depuis les vecteurs
+    pleine précision (sur un numpy.memmap, seules ces lignes sont lues).
+    Retourne (lignes, scores) triés par score décroissant.
+    """
+    rows = np.unique(candidates[candidates >= 0])  # triées : accès mmap dans l'ordre du fichier
+    if not len(rows):
+        return rows, np.zeros(0, dtype='float32')
+    exact = normalize_rows(vectors[rows]) @ normalize_rows(query)[0]
+    top = np.argsort(-exact)[:top_k]
+    return rows[top], exact[top]
+
+
+def index_contents(index: faiss.Index) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (identifiants, vecteurs) d'un index IndexIDMap2(Flat) ou IVF-Flat,
+    lus directement dans le stockage (exacts, sans direct map).
+    """
+    if isinstance(index, faiss.IndexIDMap):
+        if index.ntotal == 0:
+            return np.zeros(0, dtype='int64'), np.zeros((0, index.d), dtype='float32')
+        return faiss.vector_to_array(index.id_map).astype('int64'), index.index.reconstruct_n(0, index.ntotal)
+    ivf = faiss.downcast_index(faiss.extract_index_ivf(index))
+    if not isinstance(ivf, faiss.IndexIVFFlat):
+        raise ValueError(f"Vecteurs non reconstructibles exactement depuis {type(ivf).__name__}")
+    invlists = ivf.invlists
+    ids, vectors = [np.zeros(0, dtype='int64')], [np.zeros((0, ivf.d), dtype='float32')]
+    for list_no in range(ivf.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            ids.append(faiss.rev_swig_ptr(invlists.get_ids(list_no), size).copy())
+            codes = faiss.rev_swig_ptr(invlists.get_codes(list_no), size * ivf.code_size)
+            vectors.append(codes.copy().view('float32').reshape(size, ivf.d))
+    return np.concatenate(ids), np.vstack(vectors)
+
+
+def index_params_path(directory: str, filename: str = INDEX_PARAMS_FILENAME) -> str:
+    return os.path.join(directory, filename)
+
+
+def write_index_params(directory: str, spec: Dict, filename: str = INDEX_PARAMS_FILENAME):
+    """Enregistre le type d'index et ses paramètres à côté du store"""
+    from rag.storage import write_json_atomic
+    write_json_atomic(index_params_path(directory, filename), {**spec, 'written_at': time.time()})
+
+
+def read_index_params(directory: str, filename: str = INDEX_PARAMS_FILENAME) -> Dict:
+    """Paramètres enregistrés ({} pour les stores antérieurs : index Flat)"""
+    try:
+        with open(index_params_path(directory, filename)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
@@ -0,0 +1,462 @@
+# rag/index_writer.py
+# Écriture incrémentale du store d'un patient
+#
+# Chaque document ajoute seulement ses lignes : fin des fichiers mmap
+# (rag.vector_format.append_store), datasets HDF5 redimensionnables ou
+# lignes du patient dans l'index partagé, et index.add sur l'index FAISS
+# existant. Rien n'est visible avant StoreVersion.publish(n_vectors=...) :
+# le manifeste est le point de commit.
+#
+# La suppression ou le remplacement d'un document marque ses lignes dans
+# tombstones.bin (rag.tombstones) sans toucher aux fichiers.
+#
+# La reconstruction complète (réécriture contiguë, réentraînement IVF,
+# changement de type d'index, retrait des lignes supprimées) n'a lieu qu'à
+# la compaction (`manage.py compact_vector_stores`, ou tâche Celery
+# documents.tasks.compact_vector_store quand les tombstones dépassent
+# TOMBSTONE_COMPACTION_RATIO).
+#
+# Un seul écrivain par patient à la fois : verrou fcntl (PatientIndexWriter.locked),
+# pris par la file de commits (rag.commit_queue), la suppression et la compaction.
+
+import os
+import json
+import time
+import fcntl
+import logging
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import h5py
+import numpy as np
+import faiss
+from django.conf import settings
+
+from rag.index_factory import (
+    build_index, choose_index_spec, exact_scan, needs_rebuild, read_index_params, tail_limit, write_index_atomic,
+    write_index_params,
+)
+from rag.shared_index import get_shared_index, uses_shared_index
+from rag.sparse_bm25 import SparseBM25Index
+from rag.storage import StoreVersion, patient_store_paths
+from rag.tombstones import live_deleted_ids, mark_rows, read_tombstone_mask, tombstones_path
+from rag.vector_format import (
+    LazyMetadata, append_metadata, append_store, committed_rows, normalize_rows, open_vectors, read_header,
+    read_store, write_metadata, write_store,
+)
+
+logger = logging.getLogger(__name__)
+
+HDF5_CHUNK_ROWS = 1024
+
+
+class PatientIndexWriter:
+    """
+    Écrivain du store d'un patient (vecteurs, métadonnées, index FAISS).
+
+    Le format cible suit RAG_SETTINGS (VECTOR_STORAGE_MODE, VECTOR_STORE_FORMAT) ;
+    un store existant dans un autre format est converti une fois, au premier ajout.
+    """
+
+    def __init__(self, patient_id, dim: int):
+        self.patient_id = patient_id
+        self.dim = dim
+        self.paths = patient_store_paths(patient_id)
+        rag_settings = settings.RAG_SETTINGS
+        self.dtype = rag_settings.get('VECTOR_DTYPE', 'float32')
+        self.compaction_ratio = float(rag_settings.get('TOMBSTONE_COMPACTION_RATIO', 0.2))
+        self.compaction_min_rows = int(rag_settings.get('TOMBSTONE_COMPACTION_MIN_ROWS', 100))
+        if uses_shared_index():
+            self.target = 'shared'
+        else:
+            self.target = 'hdf5' if rag_settings.get('VECTOR_STORE_FORMAT', 'mmap') == 'hdf5' else 'mmap'
+
+    @contextmanager
+    def locked(self):
+        """Verrou exclusif du store du patient (entre processus ; les autres patients ne sont pas bloqués)"""
+        lock_path = f"{self.paths['vector_dir'].rstrip(os.sep)}.lock"
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        with open(lock_path, 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield self
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # ------------------------------------------------------------------
+    # État du store
+    # ------------------------------------------------------------------
+    def layout(self) -> Optional[str]:
+        """Format du store existant : 'shared', 'mmap', 'hdf5' ou None"""
+        paths = self.paths
+        if self.target == 'shared' and os.path.exists(paths['metadata']) and not os.path.exists(paths['vectors']):
+            return 'shared'
+        if os.path.exists(paths['vectors']):
+            return 'mmap'
+        if os.path.exists(paths['hdf5']):
+            return 'hdf5'
+        return None
+
+    def committed_rows(self, layout: str) -> int:
+        """Lignes publiées du store (celles que voient les lecteurs)"""
+        if layout == 'hdf5':
+            with h5py.File(self.paths['hdf5'], 'r') as hf:
+                return min(len(hf['vectors']), len(hf['metadata'])) if 'vectors' in hf and 'metadata' in hf else 0
+        rows = committed_rows(self.paths['vector_dir'])
+        if layout == 'mmap':
+            header_rows = read_header(self.paths['vectors'])[0]
+            return header_rows if rows is None else min(rows, header_rows)
+        meta = LazyMetadata(self.paths['vector_dir'], rows)
+        try:
+            return len(meta)
+        finally:
+            meta.close()
+
+    def read_all(self, layout: str) -> Tuple[np.ndarray, List[Dict]]:
+        """Vecteurs et métadonnées publiés (conversion de format et compaction uniquement)"""
+        vector_dir = self.paths['vector_dir']
+        if layout == 'mmap':
+            return read_store(vector_dir)
+        if layout == 'shared':
+            meta = LazyMetadata(vector_dir, committed_rows(vector_dir))
+            try:
+                metadata = [meta[i] for i in range(len(meta))]
+            finally:
+                meta.close()
+            return get_shared_index().patient_vectors(self.patient_id, len(metadata)), metadata
+        vectors, metadata = np.zeros((0, self.dim), dtype='float32'), []
+        with h5py.File(self.paths['hdf5'], 'r') as hf:
+            if 'vectors' in hf:
+                vectors = np.asarray(hf['vectors'][:], dtype='float32')
+            for raw in hf['metadata'][:] if 'metadata' in hf else []:
+                meta = json.loads(raw.decode('utf-8') if isinstance(raw, bytes) else raw)
+                meta.setdefault('id', str(len(metadata)))
+                metadata.append(meta)
+        rows = min(len(vectors), len(metadata))
+        return vectors[:rows], metadata[:rows]
+
+    def read_live(self, layout: str) -> Tuple[np.ndarray, List[Dict]]:
+        """Comme read_all, sans les lignes des documents supprimés"""
+        vectors, metadata = self.read_all(layout)
+        mask = read_tombstone_mask(self.paths['vector_dir'], len(metadata))
+        if not mask.any():
+            return vectors, metadata
+        keep = np.flatnonzero(~mask)
+        return vectors[keep], [metadata[i] for i in keep]
+
+    def metadata(self, rows: int):
+        """Métadonnées des `rows` premières lignes (séquence paresseuse hors HDF5)"""
+        if os.path.exists(self.paths['metadata']):
+            return LazyMetadata(self.paths['vector_dir'], rows)
+        return self.read_all('hdf5')[1][:rows] if os.path.exists(self.paths['hdf5']) else []
+
+    # ------------------------------------------------------------------
+    # Suppression (tombstones)
+    # ------------------------------------------------------------------
+    def document_rows(self, document_id, rows: int) -> np.ndarray:
+        """Lignes d'un document parmi les `rows` premières"""
+        document_id = str(document_id)
+        meta = self.metadata(rows)
+        try:
+            return np.array([i for i in range(len(meta)) if str(meta[i].get('document_id')) == document_id],
+                            dtype='int64')
+        finally:
+            if hasattr(meta, 'close'):
+                meta.close()
+
+    def delete_document(self, document_id) -> Dict:
+        """
+        Masque les lignes d'un document (non publié : appeler publish()).
+        Retourne n_vectors, deleted_rows, tombstones et compaction_recommended.
+        """
+        layout = self.layout()
+        if layout is None:
+            return {'n_vectors': 0, 'deleted_rows': 0, 'tombstones': 0, 'compaction_recommended': False}
+        total = self.committed_rows(layout)
+        rows = self.document_rows(document_id, total)
+        tombstones = mark_rows(self.paths['vector_dir'], total, rows) if len(rows) else self.tombstone_count(total)
+        if len(rows):
+            logger.info(f"🪦 Store patient {self.patient_id}: document {document_id} masqué "
+                        f"({len(rows)} lignes, {tombstones}/{total} supprimées)")
+        return {'n_vectors': total, 'deleted_rows': len(rows), 'tombstones': tombstones,
+                'compaction_recommended': self.compaction_due(tombstones, total)}
+
+    def tombstone_count(self, rows: int) -> int:
+        return int(read_tombstone_mask(self.paths['vector_dir'], rows).sum())
+
+    def compaction_due(self, tombstones: int, rows: int) -> bool:
+        """Assez de lignes supprimées pour justifier une compaction en tâche de fond"""
+        return tombstones >= self.compaction_min_rows and tombstones >= self.compaction_ratio * max(rows, 1)
+
+    # ------------------------------------------------------------------
+    # Ajout incrémental
+    # ------------------------------------------------------------------
+    def append(self, vectors: np.ndarray, metadata: List[Dict], replace_document=None) -> Dict:
+        """
+        Ajoute les lignes d'un document (non publiées : appeler publish()
+        une fois les index BM25 à jour). Avec `replace_document`, les lignes
+        précédentes de ce document sont d'abord masquées (document corrigé ou
+        retraité). Retourne previous_rows, n_vectors, replaced_rows et
+        compaction_recommended.
+        """
+        vectors = normalize_rows(vectors) if len(vectors) else np.zeros((0, self.dim), dtype='float32')
+        os.makedirs(self.paths['vector_dir'], exist_ok=True)
+        replaced = self.delete_document(replace_document)['deleted_rows'] if replace_document is not None else 0
+        layout = self.layout()
+
+        if layout is None or layout != self.target:
+            # Nouveau store, ou changement de format (ex: HDF5 historique -> mmap) : écriture complète
+            old_vectors, old_metadata = self.read_live(layout) if layout else (np.zeros((0, self.dim), 'float32'), [])
+            if layout:
+                logger.info(f"🔁 Conversion du store patient {self.patient_id}: {layout} -> {self.target}")
+            total = self.rewrite(np.vstack([old_vectors, vectors]), old_metadata + list(metadata))
+            return {'previous_rows': len(old_metadata), 'n_vectors': total, 'replaced_rows': replaced,
+                    'compaction_recommended': False}
+
+        previous = self.committed_rows(layout)
+        if layout == 'shared':
+            # Vecteurs d'abord : les lignes sans métadonnées sont ignorées à la recherche
+            get_shared_index().append_patient(self.patient_id, vectors, start_row=previous)
+            total = append_metadata(self.paths['vector_dir'], metadata, committed=previous)
+            return {'previous_rows': previous, 'n_vectors': total, 'replaced_rows': replaced,
+                    'compaction_recommended': self.compaction_due(self.tombstone_count(total), total)}
+
+        if layout == 'mmap':
+            total = append_store(self.paths['vector_dir'], vectors, metadata, committed=previous)
+        else:
+            total = self._append_hdf5(vectors, metadata, previous)
+            if total is None:
+                # Datasets HDF5 de taille fixe (anciens stores) : réécriture redimensionnable, une seule fois
+                old_vectors, old_metadata = self.read_live(layout)
+                total = self.rewrite(np.vstack([old_vectors, vectors]), old_metadata + list(metadata))
+                return {'previous_rows': previous, 'n_vectors': total, 'replaced_rows': replaced,
+                        'compaction_recommended': False}
+
+        recommended = self._append_faiss(previous, total) \
+            or self.compaction_due(self.tombstone_count(total), total)
+        logger.info(f"➕ Store patient {self.patient_id}: {len(vectors)} lignes ajoutées ({total} au total)")
+        return {'previous_rows': previous, 'n_vectors': total, 'replaced_rows': replaced,
+                'compaction_recommended': recommended}
+
+    def _append_hdf5(self, vectors: np.ndarray, metadata: List[Dict], previous: int) -> Optional[int]:
+        """Ajout dans des datasets redimensionnables ; None si le fichier doit d'abord être réécrit"""
+        with h5py.File(self.paths['hdf5'], 'a') as hf:
+            ds_vectors, ds_meta = hf.get('vectors'), hf.get('metadata')
+            if ds_vectors is None or ds_meta is None \
+                    or ds_vectors.maxshape[0] is not None or ds_meta.maxshape[0] is not None:
+                return None
+            total = previous + len(vectors)
+            ds_vectors.resize(total, axis=0)
+            ds_vectors[previous:total] = vectors
+            ds_meta.resize(total, axis=0)
+            ds_meta[previous:total] = self._encode_metadata(metadata)
+        return total
+
+    def _append_faiss(self, previous: int, total: int) -> bool:
+        """
+        Tient l'index FAISS à jour sans le relire ni le réécrire à chaque
+        document ; retourne True si une compaction est recommandée.
+
+        Store mmap en Flat non compressé : MmapVectorStore parcourt la matrice
+        mappée, aucun index n'est écrit. Sinon, les lignes ajoutées restent
+        hors de l'index (parcourues exactement à la recherche,
+        index_factory.search_with_tail) jusqu'à dépasser tail_limit() : elles
+        y sont alors ajoutées en une fois (index.add de la queue seulement).
+        """
+        vector_dir = self.paths['vector_dir']
+        faiss_path = self.paths['faiss']
+        params = read_index_params(vector_dir)
+        if self.target == 'mmap' and exact_scan(params):
+            self._drop_faiss()
+            return needs_rebuild(params, total, self.dim)
+
+        indexed = params.get('n_vectors') if os.path.exists(faiss_path) else None
+        if indexed is None or indexed > previous:
+            # Index absent, antérieur à index_params.json ou en avance sur le store : on le relit
+            index = faiss.read_index(faiss_path) if os.path.exists(faiss_path) else None
+            if index is None or index.ntotal > previous:
+                logger.warning(f"⚠️ Index FAISS du patient {self.patient_id} à reconstruire "
+                               f"({index.ntotal if index is not None else 'absent'} / {previous} vecteurs)")
+                self.rebuild_faiss(self._stored_vectors(total))
+                return False
+            indexed = index.ntotal
+        if total - indexed < tail_limit(indexed):
+            return needs_rebuild(params, total, self.dim)
+
+        index = faiss.read_index(faiss_path)
+        if index.ntotal != indexed:
+            # index_params.json non mis à jour après la dernière écriture de l'index
+            logger.warning(f"⚠️ Index FAISS du patient {self.patient_id} désynchronisé "
+                           f"({index.ntotal} / {indexed} vecteurs) : reconstruction")
+            self.rebuild_faiss(self._stored_vectors(total))
+            return False
+        index.add(np.ascontiguousarray(self._stored_vectors(total, start=indexed), dtype='float32'))
+        write_index_atomic(index, faiss_path)
+        params['n_vectors'] = int(index.ntotal)
+        write_index_params(vector_dir, params)
+        logger.info(f"🧭 Index FAISS du patient {self.patient_id}: {total - indexed} lignes de la queue indexées "
+                    f"({index.ntotal} vecteurs)")
+        return needs_rebuild(params, index.ntotal, self.dim)
+
+    def _drop_faiss(self):
+        """Supprime un fichier FAISS que plus aucun lecteur n'ouvre (il deviendrait obsolète)"""
+        if os.path.exists(self.paths['faiss']):
+            os.remove(self.paths['faiss'])
+
+    def _stored_vectors(self, rows: int, start: int = 0) -> np.ndarray:
+        if os.path.exists(self.paths['vectors']):
+            return np.asarray(open_vectors(self.paths['vectors'], rows)[start:], dtype='float32')
+        with h5py.File(self.paths['hdf5'], 'r') as hf:
+            return normalize_rows(hf['vectors'][start:rows])
+
+    # ------------------------------------------------------------------
+    # Réécriture complète (conversion, compaction)
+    # ------------------------------------------------------------------
+    def rewrite(self, vectors: np.ndarray, metadata: List[Dict]) -> int:
+        """
+        Réécrit tout le store au format cible et reconstruit l'index FAISS.
+        Les lignes fournies sont toutes vivantes : les tombstones sont effacées.
+        """
+        vectors = normalize_rows(vectors) if len(vectors) else np.zeros((0, self.dim), dtype='float32')
+        vector_dir = self.paths['vector_dir']
+        os.makedirs(vector_dir, exist_ok=True)
+        if os.path.exists(tombstones_path(vector_dir)):
+            os.remove(tombstones_path(vector_dir))
+        if self.target == 'shared':
+            get_shared_index().replace_patient(self.patient_id, vectors)
+            write_metadata(vector_dir, metadata)
+            for stale in (self.paths['vectors'], self.paths['faiss']):
+                if os.path.exists(stale):
+                    os.remove(stale)
+            return len(metadata)
+
+        if self.target == 'mmap':
+            write_store(vector_dir, vectors, metadata, dtype=self.dtype)
+        else:
+            self._write_hdf5(vectors, metadata)
+        self.rebuild_faiss(vectors)
+        return len(metadata)
+
+    def _write_hdf5(self, vectors: np.ndarray, metadata: List[Dict]):
+        """Datasets redimensionnables (les ajouts suivants n'écrivent que les nouvelles lignes)"""
+        path = self.paths['hdf5']
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with h5py.File(tmp_path, 'w') as hf:
+            hf.create_dataset('vectors', data=vectors, maxshape=(None, self.dim),
+                              chunks=(HDF5_CHUNK_ROWS, self.dim))
+            hf.create_dataset('metadata', data=self._encode_metadata(metadata), maxshape=(None,),
+                              chunks=(HDF5_CHUNK_ROWS,), dtype=h5py.special_dtype(vlen=bytes))
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _encode_metadata(metadata: List[Dict]) -> np.ndarray:
+        return np.array([json.dumps(meta).encode('utf-8') for meta in metadata], dtype=object)
+
+    def rebuild_faiss(self, vectors: np.ndarray):
+        """Index FAISS complet, type choisi selon la taille actuelle (rag.index_factory)"""
+        faiss_path = self.paths['faiss']
+        if not len(vectors):
+            if os.path.exists(faiss_path):
+                os.remove(faiss_path)
+            return
+        spec = choose_index_spec(len(vectors), self.dim)
+        if self.target == 'mmap' and exact_scan(spec):
+            # Recherche exacte sur la matrice mappée : seul index_params.json est utile
+            self._drop_faiss()
+            write_index_params(self.paths['vector_dir'], spec)
+            logger.info(f"Store patient {self.patient_id}: recherche exacte sur {len(vectors)} vecteurs, "
+                        f"pas d'index FAISS")
+            return
+        index = build_index(np.ascontiguousarray(vectors, dtype='float32'), spec)
+        write_index_atomic(index, faiss_path)
+        write_index_params(self.paths['vector_dir'], spec)
+        logger.info(f"Index FAISS mis à jour/créé: {faiss_path} avec {index.ntotal} vecteurs ({spec['factory']})")
+
+    def compact(self) -> Dict:
+        """
+        Compaction explicite : réécriture contiguë au format cible sans les
+        lignes supprimées, index FAISS reconstruit (réentraîné), index BM25
+        purgé, nouvelle version publiée.
+        """
+        with self.locked():
+            return self._compact()
+
+    def _compact(self) -> Dict:
+        layout = self.layout()
+        if layout is None:
+            return {'n_vectors': 0, 'compacted': False}
+        start = time.perf_counter()
+        vectors, metadata = self.read_all(layout)
+        mask = read_tombstone_mask(self.paths['vector_dir'], len(metadata))
+        removed = int(mask.sum())
+        deleted_ids = live_deleted_ids([meta['id'] for meta in metadata], mask)
+        keep = np.flatnonzero(~mask)
+        metadata = [metadata[i] for i in keep]
+        total = self.rewrite(vectors[keep], metadata)
+        if removed:
+            self._purge_bm25(metadata, deleted_ids)
+        self.publish(total, compaction_recommended=False, tombstones=0, compacted_at=time.time())
+        elapsed = time.perf_counter() - start
+        logger.info(f"🧹 Store patient {self.patient_id} compacté: {total} vecteurs "
+                    f"({removed} lignes supprimées retirées) en {elapsed:.2f}s")
+        return {'n_vectors': total, 'compacted': True, 'removed_rows': removed,
+                'seconds': round(elapsed, 3), 'from': layout}
+
+    def _purge_bm25(self, live_metadata: List[Dict], deleted_ids: set):
+        """
+        Retire des index BM25 les chunks supprimés (jusqu'ici filtrés à la
+        recherche). `deleted_ids` exclut les identifiants repris par une ligne
+        vivante : leur entrée Whoosh est celle du chunk actuel.
+        """
+        sparse_path = self.paths['bm25_sparse']
+        if os.path.exists(sparse_path):
+            # Index compact en ajout seul : reconstruit depuis les lignes vivantes
+            SparseBM25Index.build([(meta['id'], meta.get('text', '')) for meta in live_metadata]).save(sparse_path)
+        if os.path.isdir(self.paths['bm25']):
+            from whoosh import index as whoosh_index
+            try:
+                idx = whoosh_index.open_dir(self.paths['bm25'])
+            except whoosh_index.EmptyIndexError:
+                return
+            writer = idx.writer()
+            for mid in deleted_ids:
+                writer.delete_by_term('id', mid)
+            writer.commit()
+
+    def publish(self, n_vectors: int, **extra) -> str:
+        """Point de commit : les lecteurs voient les n_vectors premières lignes"""
+        return StoreVersion.publish(self.patient_id, n_vectors=n_vectors, **extra)
+
+
+def remove_document(patient_id, document_id) -> Dict:
+    """
+    Masque les chunks d'un document supprimé et publie la nouvelle version
+    (visible à la requête suivante). Planifie une compaction si les
+    tombstones dépassent TOMBSTONE_COMPACTION_RATIO.
+    """
+    writer = PatientIndexWriter(patient_id, settings.RAG_SETTINGS.get('EMBEDDING_DIM', 768))
+    with writer.locked():
+        result = writer.delete_document(document_id)
+        if result['deleted_rows']:
+            writer.publish(result['n_vectors'], tombstones=result['tombstones'],
+                           compaction_recommended=result['compaction_recommended'])
+    if result['deleted_rows']:
+        from rag.answer_cache import get_answer_cache
+        answer_cache = get_answer_cache()
+        if answer_cache is not None:
+            answer_cache.invalidate(patient_id)
+    if result['compaction_recommended']:
+        schedule_compaction(patient_id)
+    return result
+
+
+def schedule_compaction(patient_id) -> bool:
+    """Compaction en tâche de fond (queue 'maintenance') ; False si Celery est indisponible"""
+    try:
+        from documents.tasks import compact_vector_store
+        compact_vector_store.delay(patient_id)
+        return True
+    except Exception as e:
+        logger.warning(f"⚠️ Compaction du patient {patient_id} non planifiée ({e}) : "
+                       f"manage.py compact_vector_stores --only-recommended")
+        return False
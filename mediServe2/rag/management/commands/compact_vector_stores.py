@@ -0,0 +1,61 @@
+import os
+import glob
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rag.answer_cache import get_answer_cache
+from rag.index_writer import PatientIndexWriter
+from rag.storage import StoreVersion
+
+
+class Command(BaseCommand):
+    help = ("Compacte les stores patients écrits par ajouts successifs : réécriture contiguë, "
+            "index FAISS reconstruit (type réévalué, IVF réentraîné)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patient', type=int, help="Compacter uniquement ce patient")
+        parser.add_argument('--only-recommended', action='store_true',
+                            help="Uniquement les stores marqués compaction_recommended dans leur manifeste")
+        parser.add_argument('--dry-run', action='store_true', help="Lister les stores sans rien écrire")
+
+    def handle(self, *args, **options):
+        vector_root = settings.RAG_SETTINGS['VECTOR_STORE_DIR']
+        pattern = f"patient_{options['patient']}" if options['patient'] else 'patient_*'
+        patient_dirs = sorted(d for d in glob.glob(os.path.join(vector_root, pattern)) if os.path.isdir(d))
+
+        if not patient_dirs:
+            raise CommandError(f"Aucun store patient trouvé dans {vector_root}")
+
+        dim = settings.RAG_SETTINGS.get('EMBEDDING_DIM', 768)
+        answer_cache = get_answer_cache()
+        compacted = skipped = failed = 0
+        for patient_dir in patient_dirs:
+            patient_id = os.path.basename(patient_dir).split('_', 1)[1]
+            manifest = StoreVersion.read_manifest(patient_id)
+            if options['only_recommended'] and not manifest.get('compaction_recommended'):
+                skipped += 1
+                continue
+
+            if options['dry_run']:
+                self.stdout.write(f"🔎 {patient_dir} serait compacté ({manifest.get('n_vectors', '?')} vecteurs)")
+                continue
+
+            try:
+                result = PatientIndexWriter(patient_id, dim).compact()
+                if not result['compacted']:
+                    self.stdout.write(f"⏭️  {patient_dir}: store vide")
+                    skipped += 1
+                    continue
+                if answer_cache is not None:
+                    answer_cache.invalidate(patient_id)
+                compacted += 1
+                self.stdout.write(self.style.SUCCESS(
+                    f"✅ {patient_dir}: {result['n_vectors']} vecteurs ({result['from']}), "
+                    f"{result['removed_rows']} lignes supprimées retirées en {result['seconds']}s"
+                ))
+            except Exception as e:
+                failed += 1
+                self.stderr.write(self.style.ERROR(f"❌ {patient_dir}: {e}"))
+
+        self.stdout.write(f"\nCompactés: {compacted}, ignorés: {skipped}, échecs: {failed}")
@@ -0,0 +1,87 @@
+import os
+import glob
+import json
+import time
+
+import h5py
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rag.storage import StoreVersion
+from rag.vector_format import VECTORS_FILENAME, DTYPE_CODES, write_store, read_header
+
+
+class Command(BaseCommand):
+    help = "Convertit les vector stores HDF5 (media/vectors/patient_*/vector_store.h5) au format mmap"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patient', type=int, help="Convertir uniquement ce patient")
+        parser.add_argument(
+            '--dtype', choices=sorted(DTYPE_CODES),
+            default=settings.RAG_SETTINGS.get('VECTOR_DTYPE', 'float32'),
+            help="Type des vecteurs stockés"
+        )
+        parser.add_argument('--force', action='store_true', help="Reconvertir même si un store mmap existe")
+        parser.add_argument('--delete-hdf5', action='store_true', help="Supprimer le fichier HDF5 après conversion")
+        parser.add_argument('--dry-run', action='store_true', help="Lister les stores sans rien écrire")
+
+    def handle(self, *args, **options):
+        vector_root = settings.RAG_SETTINGS['VECTOR_STORE_DIR']
+        pattern = f"patient_{options['patient']}" if options['patient'] else 'patient_*'
+        h5_files = sorted(glob.glob(os.path.join(vector_root, pattern, 'vector_store.h5')))
+
+        if not h5_files:
+            raise CommandError(f"Aucun store HDF5 trouvé dans {vector_root}")
+
+        converted = skipped = failed = 0
+        for h5_path in h5_files:
+            patient_dir = os.path.dirname(h5_path)
+            mmap_path = os.path.join(patient_dir, VECTORS_FILENAME)
+
+            if os.path.exists(mmap_path) and not options['force']:
+                self.stdout.write(f"⏭️  {patient_dir}: déjà converti")
+                skipped += 1
+                continue
+
+            if options['dry_run']:
+                self.stdout.write(f"🔎 {h5_path} serait converti")
+                continue
+
+            try:
+                start = time.time()
+                vectors, metadata = self._read_hdf5(h5_path)
+                write_store(patient_dir, vectors, metadata, dtype=options['dtype'])
+
+                rows, dim, dtype = read_header(mmap_path)
+                if rows != len(metadata):
+                    raise CommandError(f"Vérification échouée: {rows} lignes écrites pour {len(metadata)} attendues")
+
+                patient_id = os.path.basename(patient_dir).split('_', 1)[1]
+                StoreVersion.publish(patient_id, n_vectors=rows, converted_from='hdf5')
+
+                if options['delete_hdf5']:
+                    os.remove(h5_path)
+
+                converted += 1
+                self.stdout.write(self.style.SUCCESS(
+                    f"✅ {patient_dir}: {rows} vecteurs ({dim}d, {dtype}) en {(time.time() - start) * 1000:.0f}ms"
+                ))
+            except Exception as e:
+                failed += 1
+                self.stderr.write(self.style.ERROR(f"❌ {h5_path}: {e}"))
+
+        self.stdout.write(f"\nConvertis: {converted}, ignorés: {skipped}, échecs: {failed}")
+
+    @staticmethod
+    def _read_hdf5(h5_path):
+        """Lit vecteurs et métadonnées comme VectorStoreHDF5.load_store"""
+        with h5py.File(h5_path, 'r') as hf:
+            vectors = np.asarray(hf['vectors'][:], dtype='float32')
+            metadata = []
+            for raw in hf['metadata'][:]:
+                meta = json.loads(raw.decode('utf-8') if isinstance(raw, bytes) else raw)
+                if 'id' not in meta:
+                    meta['id'] = str(len(metadata))
+                metadata.append(meta)
+        return vectors, metadata
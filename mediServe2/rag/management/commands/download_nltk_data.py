@@ -0,0 +1,21 @@
+import nltk
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Installe les données NLTK (Punkt) dans NLTK_DATA_DIR, pour une ingestion sans accès réseau"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help="Répertoire cible (défaut : settings.NLTK_DATA_DIR)")
+
+    def handle(self, *args, **options):
+        target = options['dir'] or settings.NLTK_DATA_DIR
+        failed = []
+        for resource in settings.NLTK_RESOURCES:
+            if nltk.download(resource, download_dir=target, quiet=True, raise_on_error=False):
+                self.stdout.write(self.style.SUCCESS(f"✅ {resource} -> {target}"))
+            else:
+                failed.append(resource)
+        if failed:
+            raise CommandError(f"Téléchargement impossible: {', '.join(failed)}")
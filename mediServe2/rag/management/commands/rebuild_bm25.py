@@ -0,0 +1,56 @@
+import os
+import glob
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rag.sparse_bm25 import SparseBM25Index
+from rag.storage import StoreVersion, patient_store_paths
+from rag.vector_format import open_patient_store
+
+
+class Command(BaseCommand):
+    help = "Construit l'index BM25 compact (rag.sparse_bm25) des patients depuis leurs vector stores"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patient', type=int, help="Reconstruire uniquement ce patient")
+        parser.add_argument('--force', action='store_true', help="Reconstruire même si l'index compact existe")
+
+    def handle(self, *args, **options):
+        vector_root = settings.RAG_SETTINGS['VECTOR_STORE_DIR']
+        pattern = f"patient_{options['patient']}" if options['patient'] else 'patient_*'
+        patient_ids = sorted(
+            os.path.basename(d).split('_', 1)[1]
+            for d in glob.glob(os.path.join(vector_root, pattern)) if os.path.isdir(d)
+        )
+        if not patient_ids:
+            raise CommandError(f"Aucun vector store trouvé dans {vector_root}")
+
+        built = skipped = failed = 0
+        for patient_id in patient_ids:
+            path = patient_store_paths(patient_id)['bm25_sparse']
+            if os.path.exists(path) and not options['force']:
+                self.stdout.write(f"⏭️  Patient {patient_id}: index compact déjà présent")
+                skipped += 1
+                continue
+            try:
+                start = time.time()
+                store = open_patient_store(patient_id)
+                if store is None:
+                    skipped += 1
+                    continue
+                docs = [(meta['id'], meta.get('text', '')) for meta in store.meta]
+                index = SparseBM25Index.build(docs)
+                index.save(path)
+                StoreVersion.publish(patient_id, bm25_engine='sparse')
+                built += 1
+                self.stdout.write(self.style.SUCCESS(
+                    f"✅ Patient {patient_id}: {index.n_docs} documents, {index.n_terms} termes "
+                    f"en {(time.time() - start) * 1000:.0f}ms"
+                ))
+            except Exception as e:
+                failed += 1
+                self.stderr.write(self.style.ERROR(f"❌ Patient {patient_id}: {e}"))
+
+        self.stdout.write(f"\nConstruits: {built}, ignorés: {skipped}, échecs: {failed}")
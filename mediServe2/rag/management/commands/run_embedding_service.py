@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rag.embedding_service import EmbeddingServer, DEFAULT_ADDRESS
+from rag.your_rag_module import EmbeddingGenerator
+
+
+class Command(BaseCommand):
+    help = "Lance le service d'embeddings partagé (RAG_SETTINGS['EMBEDDING_BATCHING'] = 'service')"
+
+    def add_arguments(self, parser):
+        rag_settings = settings.RAG_SETTINGS
+        parser.add_argument('--address', default=rag_settings.get('EMBEDDING_SERVICE_ADDRESS', DEFAULT_ADDRESS),
+                            help="Chemin de la socket Unix")
+        parser.add_argument('--model', default=rag_settings.get('EMBEDDING_MODEL', 'all-mpnet-base-v2'))
+        parser.add_argument('--max-batch-size', type=int, default=rag_settings.get('EMBEDDING_BATCH_MAX_SIZE', 32))
+        parser.add_argument('--max-wait-ms', type=float, default=rag_settings.get('EMBEDDING_BATCH_MAX_WAIT_MS', 5))
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"⏳ Chargement du modèle {options['model']}...")
+        embedder = EmbeddingGenerator(options['model'])
+        server = EmbeddingServer(
+            embedder,
+            address=options['address'],
+            max_batch_size=options['max_batch_size'],
+            max_wait_ms=options['max_wait_ms'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"✅ Service d'embeddings prêt sur {options['address']}"))
+        server.serve_forever()
@@ -0,0 +1,320 @@
+# rag/model_registry.py
+# Registre des modèles partagés par processus (embedder, cross-encoder, LLM)
+
+import os
+import time
+import logging
+import threading
+from typing import Dict, Optional, Any, Callable, Tuple
+
+from django.conf import settings
+
+from rag.your_rag_module import EmbeddingGenerator, GeminiLLM, HybridRetriever
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = 'all-mpnet-base-v2'
+DEFAULT_RERANKER_MODEL = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+DEFAULT_LLM_MODEL = 'gemini-1.5-flash-latest'
+
+
+def _module_memory_bytes(module) -> int:
+    """Estime la mémoire occupée par les poids d'un modèle torch (0 si inconnu)"""
+    if module is None or not hasattr(module, 'parameters'):
+        return 0
+    try:
+        total = 0
+        for param in module.parameters():
+            total += param.numel() * param.element_size()
+        for buf in module.buffers():
+            total += buf.numel() * buf.element_size()
+        return total
+    except Exception:  # noqa
+        return 0
+
+
+def process_rss_bytes() -> int:
+    """RSS courant du processus (Linux), sinon pic RSS via resource"""
+    try:
+        with open('/proc/self/statm') as f:
+            rss_pages = int(f.read().split()[1])
+        return rss_pages * os.sysconf('SC_PAGE_SIZE')
+    except Exception:  # noqa
+        try:
+            import resource
+            # ru_maxrss est en kilo-octets sous Linux
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except Exception:  # noqa
+            return 0
+
+
+class ModelRegistry:
+    """
+    Charge chaque modèle configuré une seule fois par processus worker.
+
+    Les instances sont partagées entre threads : le chargement est protégé
+    par un verrou par modèle, l'inférence (SentenceTransformer, CrossEncoder,
+    appels Gemini) est sans état et peut se faire en parallèle.
+    """
+
+    _models: Dict[Tuple[str, str], Any] = {}
+    _stats: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    _lock = threading.Lock()
+    _key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+    @classmethod
+    def _get_or_load(cls, kind: str, name: str, loader: Callable[[], Any]) -> Any:
+        key = (kind, name)
+        model = cls._models.get(key)
+        if model is not None:
+            return model
+
+        with cls._lock:
+            key_lock = cls._key_locks.setdefault(key, threading.Lock())
+
+        # Double vérification : un autre thread a pu charger le modèle entre-temps
+        with key_lock:
+            model = cls._models.get(key)
+            if model is not None:
+                return model
+
+            logger.info(f"⏳ Chargement du modèle {kind} '{name}' (pid {os.getpid()})")
+            rss_before = process_rss_bytes()
+            start = time.time()
+            model = loader()
+            load_ms = (time.time() - start) * 1000
+
+            cls._stats[key] = {
+                'kind': kind,
+                'name': name,
+                'load_time_ms': round(load_ms, 1),
+                'loaded_at': time.time(),
+                'rss_delta_bytes': max(process_rss_bytes() - rss_before, 0),
+            }
+            cls._models[key] = model
+            logger.info(f"✅ Modèle {kind} '{name}' chargé en {load_ms:.0f}ms")
+            return model
+
+    @classmethod
+    def get_embedder(cls, model_name: Optional[str] = None) -> EmbeddingGenerator:
+        """EmbeddingGenerator partagé pour RAG_SETTINGS['EMBEDDING_MODEL']"""
+        name = model_name or settings.RAG_SETTINGS.get('EMBEDDING_MODEL', DEFAULT_EMBEDDING_MODEL)
+        return cls._get_or_load('embedding', name, lambda: _load_embedder(name))
+
+    @classmethod
+    def get_sentence_transformer(cls, model_name: Optional[str] = None):
+        """
+        SentenceTransformer local pour l'indexation des documents : celui de
+        l'embedder de requêtes s'il est déjà chargé dans le processus, sinon
+        une instance dédiée (mode 'service', où l'embedder est distant)
+        """
+        name = model_name or settings.RAG_SETTINGS.get('EMBEDDING_MODEL', DEFAULT_EMBEDDING_MODEL)
+        embedder = cls._models.get(('embedding', name))
+        if getattr(embedder, 'model', None) is not None:
+            return embedder.model
+
+        def _load():
+            from sentence_transformers import SentenceTransformer
+            return SentenceTransformer(name)
+
+        return cls._get_or_load('sentence_transformer', name, _load)
+
+    @classmethod
+    def get_cross_encoder(cls, model_name: Optional[str] = None):
+        """CrossEncoder partagé pour RAG_SETTINGS['RERANKER_MODEL']"""
+        name = model_name or settings.RAG_SETTINGS.get('RERANKER_MODEL', DEFAULT_RERANKER_MODEL)
+
+        def _load():
+            from sentence_transformers import CrossEncoder
+            return CrossEncoder(name)
+
+        return cls._get_or_load('reranker', name, _load)
+
+    @classmethod
+    def get_rerank_engine(cls, model_name: Optional[str] = None):
+        """RerankEngine partagé (lots inter-requêtes, troncature, budget de latence)"""
+        name = model_name or settings.RAG_SETTINGS.get('RERANKER_MODEL', DEFAULT_RERANKER_MODEL)
+
+        def _load():
+            from rag.reranker import RerankEngine
+            rag_settings = settings.RAG_SETTINGS
+            return RerankEngine(
+                cls.get_cross_encoder(name),
+                max_tokens=rag_settings.get('RERANK_MAX_TOKENS', 256),
+                max_batch_size=rag_settings.get('RERANK_BATCH_MAX_SIZE', 64),
+                max_wait_ms=rag_settings.get('RERANK_BATCH_MAX_WAIT_MS', 5),
+                default_budget_ms=rag_settings.get('RERANK_BUDGET_MS'),
+            )
+
+        return cls._get_or_load('rerank_engine', name, _load)
+
+    @classmethod
+    def get_llm(cls, model_name: Optional[str] = None) -> GeminiLLM:
+        """Client GeminiLLM partagé pour RAG_SETTINGS['LLM_MODEL']"""
+        name = model_name or settings.RAG_SETTINGS.get('LLM_MODEL', DEFAULT_LLM_MODEL)
+        from rag.rate_limiter import get_rate_limiter
+        return cls._get_or_load('llm', name, lambda: GeminiLLM(model_name=name, rate_limiter=get_rate_limiter()))
+
+    @classmethod
+    def load_weights(cls) -> Dict[str, Any]:
+        """
+        Charge uniquement les poids des modèles locaux, sans aucune inférence.
+
+        Destiné au master gunicorn (--preload) : les poids sont ensuite
+        partagés par fork (copy-on-write). Rien ici ne démarre de thread
+        (MicroBatcher), n'ouvre de connexion (service d'embeddings, Redis,
+        Gemini) ni n'exécute de calcul torch, qui ne survivent pas au fork
+        (threads OpenMP/MKL). L'inférence de chauffe et le pré-remplissage
+        du cache se font dans chaque worker via warm_up().
+        """
+        loaded = {}
+        try:
+            if settings.RAG_SETTINGS.get('EMBEDDING_BATCHING', 'thread') != 'service':
+                loaded['sentence_transformer'] = cls.get_sentence_transformer()
+            if settings.RAG_SETTINGS.get('USE_RERANKING', False):
+                loaded['reranker'] = cls.get_cross_encoder()
+        except Exception as e:
+            logger.error(f"❌ Échec du chargement des poids RAG: {e}", exc_info=True)
+        return loaded
+
+    @classmethod
+    def warm_up(cls, include_llm: bool = True) -> Dict[str, Any]:
+        """
+        Pré-charge les modèles configurés et les chauffe (inférence, cache).
+
+        À appeler dans chaque processus worker après le fork (post_worker_init
+        gunicorn, worker_process_init Celery), jamais dans un master qui forke.
+        """
+        loaded = {}
+        try:
+            loaded['embedding'] = cls.get_embedder()
+            prewarm_query_embeddings(loaded['embedding'])
+            if settings.RAG_SETTINGS.get('USE_RERANKING', False):
+                loaded['reranker'] = cls.get_rerank_engine()
+            if include_llm:
+                loaded['llm'] = cls.get_llm()
+        except Exception as e:
+            # Le worker doit pouvoir démarrer même si un modèle est indisponible :
+            # il sera rechargé paresseusement à la première requête.
+            logger.error(f"❌ Échec du pré-chargement des modèles RAG: {e}", exc_info=True)
+        return loaded
+
+    @classmethod
+    def is_loaded(cls, kind: str, model_name: str) -> bool:
+        return (kind, model_name) in cls._models
+
+    @classmethod
+    def loaded_models(cls) -> list:
+        """Liste des modèles chargés avec leur empreinte mémoire estimée"""
+        result = []
+        for key, model in list(cls._models.items()):
+            stats = dict(cls._stats.get(key, {}))
+            if key[0] in ('embedding', 'reranker'):
+                # EmbeddingGenerator.model / CrossEncoder.model sont des modules torch
+                stats['memory_bytes'] = _module_memory_bytes(getattr(model, 'model', None))
+            elif key[0] == 'sentence_transformer':
+                stats['memory_bytes'] = _module_memory_bytes(model)
+            else:
+                # Le LLM est distant : seul le client vit dans le processus ;
+                # le RerankEngine réutilise le CrossEncoder déjà compté
+                stats['memory_bytes'] = 0
+            if key[0] == 'rerank_engine':
+                stats['rerank'] = model.stats()
+            result.append(stats)
+        return result
+
+    @classmethod
+    def memory_report(cls) -> Dict[str, Any]:
+        """Résumé pour les health checks / le monitoring"""
+        models = cls.loaded_models()
+        return {
+            'pid': os.getpid(),
+            'process_rss_bytes': process_rss_bytes(),
+            'models_memory_bytes': sum(m.get('memory_bytes', 0) for m in models),
+            'models': models,
+        }
+
+    @classmethod
+    def clear(cls):
+        """Décharge tous les modèles (tests, rechargement de configuration)"""
+        with cls._lock:
+            cls._models.clear()
+            cls._stats.clear()
+            cls._key_locks.clear()
+
+
+def _load_embedder(model_name: str):
+    """
+    Embedder selon RAG_SETTINGS['EMBEDDING_BATCHING'] :
+    'service' -> client du service d'embeddings (rag.embedding_service),
+    'thread'  -> modèle local avec micro-batching des appels concurrents,
+    'off'     -> modèle local, un encode par appel.
+    """
+    rag_settings = settings.RAG_SETTINGS
+    mode = rag_settings.get('EMBEDDING_BATCHING', 'thread')
+    if mode == 'service':
+        from rag.embedding_service import RemoteEmbeddingGenerator, DEFAULT_ADDRESS
+        return RemoteEmbeddingGenerator(
+            model_name,
+            address=rag_settings.get('EMBEDDING_SERVICE_ADDRESS', DEFAULT_ADDRESS),
+            query_cache=_query_cache(model_name),
+        )
+    # Poids chargés avant le fork par ModelRegistry.load_weights() : réutilisés
+    preloaded = ModelRegistry._models.get(('sentence_transformer', model_name))
+    embedder = EmbeddingGenerator(model_name, query_cache=_query_cache(model_name), model=preloaded)
+    if mode == 'thread':
+        embedder.enable_batching(
+            max_batch_size=rag_settings.get('EMBEDDING_BATCH_MAX_SIZE', 32),
+            max_wait_ms=rag_settings.get('EMBEDDING_BATCH_MAX_WAIT_MS', 5),
+        )
+    return embedder
+
+
+def _query_cache(model_name: str):
+    """Cache des embeddings de requêtes (None si désactivé dans RAG_SETTINGS)"""
+    if not settings.RAG_SETTINGS.get('QUERY_EMBEDDING_CACHE', True):
+        return None
+    from rag.embedding_cache import QueryEmbeddingCache
+    return QueryEmbeddingCache(
+        model_name,
+        max_entries=settings.RAG_SETTINGS.get('QUERY_EMBEDDING_CACHE_SIZE', 4096),
+        redis_url=settings.RAG_SETTINGS.get('QUERY_EMBEDDING_CACHE_REDIS_URL'),
+    )
+
+
+def prewarm_query_embeddings(embedder: EmbeddingGenerator) -> int:
+    """Pré-remplit le cache avec les questions des réponses rapides WhatsApp"""
+    if embedder.query_cache is None:
+        return 0
+    from messaging.quick_replies import QUICK_REPLY_MAP
+    count = embedder.query_cache.prewarm(QUICK_REPLY_MAP.values(), embedder._encode)
+    logger.info(f"🔥 {count} embeddings de réponses rapides pré-calculés")
+    return count
+
+
+def build_hybrid_retriever(vector_store, bm25_dir: Optional[str] = None, bm25_index=None) -> HybridRetriever:
+    """
+    Construit un HybridRetriever sur les modèles partagés du registre.
+
+    Point d'entrée unique pour toutes les constructions de retriever
+    (webhook WhatsApp, API RAG, cache de retrievers, scripts de diagnostic).
+    """
+    embedder = ModelRegistry.get_embedder()
+    if bm25_index is None and bm25_dir is not None:
+        from rag.sparse_bm25 import open_sparse_bm25, sparse_engine_enabled, sparse_path_for
+        if sparse_engine_enabled():
+            bm25_index = open_sparse_bm25(sparse_path_for(bm25_dir))
+    use_bm25 = settings.RAG_SETTINGS.get('USE_BM25', True) and (
+        bm25_index is not None
+        or (bm25_dir is not None and os.path.exists(bm25_dir))
+    )
+    retriever = HybridRetriever(
+        vector_store, embedder,
+        bm25_dir if use_bm25 else None,
+        bm25_index=bm25_index if use_bm25 else None,
+    )
+
+    if use_bm25 and settings.RAG_SETTINGS.get('USE_RERANKING', False):
+        reranker_name = settings.RAG_SETTINGS.get('RERANKER_MODEL', DEFAULT_RERANKER_MODEL)
+        retriever.enable_reranking(reranker_name, engine=ModelRegistry.get_rerank_engine(reranker_name))
+    return retriever
@@ -0,0 +1,298 @@
+# rag/ocr.py
+# OCR des images (photos d'ordonnances, pages scannées, images des PDF)
+#
+# Toutes les reconnaissances passent par un OcrEngine :
+#   - prétraitement avant Tesseract : orientation EXIF, niveaux de gris,
+#     réduction adaptative au-delà de OCR_MAX_PIXELS (une photo de téléphone
+#     de 12 à 48 Mpx n'apporte rien de plus qu'une page A4 à 300 dpi) et
+#     binarisation d'Otsu (image 1 bit : fichier temporaire transmis à
+#     Tesseract bien plus petit, seuillage déterministe) ;
+#   - pool de OCR_WORKERS threads (par défaut un par cœur) pilotant chacun un
+#     processus tesseract : le travail se fait hors du GIL, y compris depuis
+#     un worker Celery prefork (processus démon, qui ne peut pas créer de
+#     processus enfants multiprocessing) ; OMP_THREAD_LIMIT=1 évite que chaque
+#     tesseract lance en plus ses propres threads ;
+#   - cache disque (SQLite) des textes, clé = empreinte du contenu de l'image
+#     et des paramètres de reconnaissance : une image déjà lue (ré-upload,
+#     réindexation, logo ou en-tête répété sur chaque page) n'est jamais
+#     repassée à Tesseract ; les doublons d'un même lot ne sont lus qu'une fois.
+#
+# Ce module n'importe pas Django : seul get_ocr_engine() lit RAG_SETTINGS.
+
+import io
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PREPROCESS_VERSION = 1  # À incrémenter si le prétraitement change (invalide le cache)
+DEFAULT_MAX_PIXELS = 2480 * 3508  # Page A4 à 300 dpi
+DEFAULT_MAX_ENTRIES = 50_000
+DEFAULT_LANG = 'fra'
+CACHE_FILENAME = 'ocr.sqlite'
+
+ImageSource = Union[str, bytes, Any]  # Chemin, contenu du fichier ou PIL.Image déjà décodée
+
+
+def otsu_threshold(gray: np.ndarray) -> int:
+    """Seuil d'Otsu d'une image en niveaux de gris (uint8)"""
+    hist = np.bincount(gray.ravel(), minlength=256).astype('float64')
+    total = hist.sum()
+    if not total:
+        return 128
+    levels = np.arange(256)
+    weight_bg = np.cumsum(hist)
+    weight_fg = total - weight_bg
+    sum_bg = np.cumsum(hist * levels)
+    mean_bg = np.divide(sum_bg, weight_bg, out=np.zeros(256), where=weight_bg > 0)
+    mean_fg = np.divide(sum_bg[-1] - sum_bg, weight_fg, out=np.zeros(256), where=weight_fg > 0)
+    variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(variance))
+
+
+def preprocess_image(image, max_pixels: Optional[int] = DEFAULT_MAX_PIXELS, binarize: bool = True):
+    """Orientation EXIF, niveaux de gris, réduction au budget de pixels, binarisation"""
+    from PIL import Image, ImageOps
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'L':
+        image = image.convert('L')
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        scale = (max_pixels / (width * height)) ** 0.5
+        image = image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+    if binarize:
+        threshold = otsu_threshold(np.asarray(image))
+        image = image.point(lambda value: 255 if value > threshold else 0, mode='1')
+    return image
+
+
+def _image_digest(image) -> str:
+    digest = hashlib.sha256(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class OcrResultCache:
+    """Textes OCR persistants, clé = empreinte du contenu, éviction LRU au-delà de max_entries"""
+
+    def __init__(self, directory: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max(1, int(max_entries))
+        os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._transaction(write=True) as db:
+            db.execute("CREATE TABLE IF NOT EXISTS results ("
+                       "key TEXT PRIMARY KEY, text TEXT NOT NULL, last_used REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+
+    def _db(self) -> sqlite3.Connection:
+        # Une connexion par thread et par processus (jamais héritée d'un fork)
+        cached = getattr(self._local, 'db', None)
+        if cached is None or cached[0] != os.getpid():
+            db = sqlite3.connect(os.path.join(self.directory, CACHE_FILENAME), timeout=30,
+                                 isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            cached = self._local.db = (os.getpid(), db)
+        return cached[1]
+
+    @contextmanager
+    def _transaction(self, write: bool = False):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, str]:
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        with self._transaction() as db:
+            found = dict(db.execute(f"SELECT key, text FROM results WHERE key IN ({','.join('?' * len(keys))})",
+                                    keys).fetchall())
+        if found:
+            try:
+                with self._transaction(write=True) as db:
+                    db.executemany("UPDATE results SET last_used = ? WHERE key = ?",
+                                   [(time.time(), key) for key in found])
+            except sqlite3.OperationalError as e:
+                logger.debug(f"Dates d'accès du cache OCR non mises à jour: {e}")
+        return found
+
+    def put_many(self, results: Dict[str, str]):
+        if not results:
+            return
+        now = time.time()
+        with self._transaction(write=True) as db:
+            db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                           [(key, text, now) for key, text in results.items()])
+            excess = db.execute("SELECT COUNT(*) FROM results").fetchone()[0] - self.max_entries
+            if excess > 0:
+                db.execute("DELETE FROM results WHERE key IN "
+                           "(SELECT key FROM results ORDER BY last_used LIMIT ?)", (excess,))
+                logger.info(f"🧹 Cache OCR: {excess} entrée(s) évincée(s)")
+
+    def __len__(self) -> int:
+        with self._transaction() as db:
+            return db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+
+class OcrEngine:
+    """Reconnaissance de texte : prétraitement, pool de processus tesseract, cache par contenu"""
+
+    def __init__(self, workers: Optional[int] = None, lang: str = DEFAULT_LANG,
+                 max_pixels: Optional[int] = DEFAULT_MAX_PIXELS, binarize: bool = True,
+                 cache: Optional[OcrResultCache] = None, metrics_name: str = 'ocr'):
+        self.workers = max(1, int(workers or os.cpu_count() or 1))
+        self.lang = lang
+        self.max_pixels = max_pixels
+        self.binarize = binarize
+        self.cache = cache
+        self.metrics_name = metrics_name
+        self._executor = None  # (pid, ThreadPoolExecutor)
+        self._executor_lock = threading.Lock()
+        # Chaque tesseract reste sur un cœur : le parallélisme vient du pool
+        os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+    @property
+    def signature(self) -> str:
+        """Paramètres qui influencent le texte reconnu (partie de la clé de cache)"""
+        return f"v{PREPROCESS_VERSION}:{self.lang}:{self.max_pixels or 0}:{int(self.binarize)}"
+
+    def key(self, source: ImageSource) -> str:
+        """Empreinte du contenu : octets du fichier, ou pixels pour une image déjà décodée"""
+        if isinstance(source, (str, os.PathLike)):
+            digest = hashlib.sha256()
+            with open(source, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            content = digest.hexdigest()
+        elif isinstance(source, bytes):
+            content = hashlib.sha256(source).hexdigest()
+        else:
+            content = _image_digest(source)
+        return hashlib.sha256(f"{self.signature}\x00{content}".encode()).hexdigest()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # Recréé après un fork (les threads du parent n'existent pas dans l'enfant)
+        with self._executor_lock:
+            if self._executor is None or self._executor[0] != os.getpid():
+                self._executor = (os.getpid(), ThreadPoolExecutor(self.workers, thread_name_prefix='ocr'))
+            return self._executor[1]
+
+    def _recognize_one(self, source: ImageSource) -> Dict:
+        import pytesseract
+        from PIL import Image
+        start = time.perf_counter()
+        if isinstance(source, (str, os.PathLike)):
+            image = Image.open(source)
+        elif isinstance(source, bytes):
+            image = Image.open(io.BytesIO(source))
+        else:
+            image = source
+        pixels = image.size[0] * image.size[1]
+        prepared = preprocess_image(image, self.max_pixels, self.binarize)
+        text = pytesseract.image_to_string(prepared, lang=self.lang).strip()
+        return {'text': text, 'ms': (time.perf_counter() - start) * 1000, 'cached': False,
+                'pixels': pixels, 'ocr_pixels': prepared.size[0] * prepared.size[1]}
+
+    def recognize(self, sources: Sequence[ImageSource], record: bool = True) -> List[Dict]:
+        """
+        Résultats ({'text', 'ms', 'cached', ...}) dans l'ordre de `sources`.
+        Les images en cache ou en double dans le lot ne passent pas par Tesseract.
+        Avec record=False, l'appelant enregistre lui-même les métriques
+        (record_ocr_metrics), par exemple depuis le processus parent.
+        """
+        keys = [self.key(source) for source in sources]
+        cached = self.cache.get_many(keys) if self.cache is not None else {}
+        pending = {}
+        for key, source in zip(keys, sources):
+            if key not in cached and key not in pending:
+                pending[key] = source
+        futures = {key: self._pool().submit(self._recognize_one, source) for key, source in pending.items()}
+
+        computed = {}
+        for key, future in futures.items():
+            computed[key] = future.result()
+        if self.cache is not None and computed:
+            try:
+                self.cache.put_many({key: result['text'] for key, result in computed.items()})
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Résultats OCR non mis en cache: {e}")
+
+        results, seen = [], set()
+        for key in keys:
+            if key in computed and key not in seen:
+                results.append({**computed[key], 'key': key})
+            else:
+                # Déjà en cache, ou doublon d'une image du même lot
+                text = cached[key] if key in cached else computed[key]['text']
+                results.append({'text': text, 'ms': 0.0, 'cached': True, 'key': key})
+            seen.add(key)
+        if record:
+            record_ocr_metrics(results, self.metrics_name)
+        return results
+
+    def ocr_many(self, sources: Sequence[ImageSource], record: bool = True) -> List[str]:
+        return [result['text'] for result in self.recognize(sources, record=record)]
+
+    def ocr(self, source: ImageSource, record: bool = True) -> str:
+        return self.recognize([source], record=record)[0]['text']
+
+
+def record_ocr_metrics(results: Sequence[Dict], metrics_name: str = 'ocr'):
+    """Latence par image reconnue et accès au cache (les métriques ne bloquent jamais l'OCR)"""
+    if not results:
+        return
+    try:
+        from metrics.services import MetricsService
+        hits = sum(1 for result in results if result['cached'])
+        MetricsService.record_cache_lookups(metrics_name, hits, len(results) - hits)
+        for result in results:
+            if not result['cached']:
+                MetricsService.record_ocr(result['ms'], result.get('pixels', 0), result.get('ocr_pixels', 0))
+    except Exception as e:
+        logger.debug(f"Métriques OCR non enregistrées: {e}")
+
+
+_engine: Optional[OcrEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_ocr_engine() -> OcrEngine:
+    """OcrEngine configuré par RAG_SETTINGS (un par processus)"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            from django.conf import settings
+            rag_settings = settings.RAG_SETTINGS
+            cache = None
+            if rag_settings.get('OCR_CACHE', True):
+                try:
+                    cache = OcrResultCache(
+                        rag_settings.get('OCR_CACHE_DIR', os.path.join(settings.MEDIA_ROOT, 'ocr_cache')),
+                        max_entries=rag_settings.get('OCR_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES),
+                    )
+                except (OSError, sqlite3.Error) as e:
+                    logger.warning(f"⚠️ Cache OCR indisponible: {e}")
+            _engine = OcrEngine(
+                workers=rag_settings.get('OCR_WORKERS') or None,
+                lang=rag_settings.get('OCR_LANG', DEFAULT_LANG),
+                max_pixels=rag_settings.get('OCR_MAX_PIXELS', DEFAULT_MAX_PIXELS),
+                binarize=rag_settings.get('OCR_BINARIZE', True),
+                cache=cache,
+            )
+        return _engine
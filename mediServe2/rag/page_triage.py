@@ -0,0 +1,112 @@
+# rag/page_triage.py
+# Tri des pages d'un PDF avant extraction : texte seul, tableau ou OCR
+#
+# Le coût de l'extraction est dominé par camelot (qui relit le PDF pour
+# chaque page demandée) et par Tesseract. Un classifieur peu coûteux,
+# calculé sur les objets déjà analysés par pdfplumber, décide pour chaque
+# page :
+#   'ocr'   : pas de couche texte exploitable et une image couvrant l'essentiel
+#             de la page (scan) -> rendu de la page puis Tesseract ;
+#   'table' : filets horizontaux / verticaux ou lignes de texte en colonnes
+#             -> couche texte + camelot sur cette page seulement ;
+#   'text'  : couche texte seule ;
+#   'empty' : ni texte ni image exploitable.
+#
+# Ce module n'importe pas Django (utilisable par les scripts autonomes) :
+# les seuils viennent de DEFAULT_THRESHOLDS ou de settings_thresholds().
+
+import logging
+from collections import defaultdict
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+ROUTES = ('text', 'table', 'ocr', 'empty')
+
+DEFAULT_THRESHOLDS = {
+    'min_text_chars': 50,          # En deçà, pas de couche texte exploitable
+    'scanned_image_coverage': 0.5,  # Part de la page couverte par des images pour un scan
+    'min_rulings': 6,              # Filets (traits / bords de rectangles) suggérant un tableau
+    'min_ruling_length': 20.0,     # Longueur minimale d'un filet (points)
+    'column_gap': 15.0,            # Écart entre mots délimitant une colonne (points)
+    'min_columnar_rows': 3,        # Lignes de texte à 3 colonnes ou plus suggérant un tableau
+}
+
+
+def settings_thresholds() -> Dict:
+    """Seuils de RAG_SETTINGS['PAGE_TRIAGE_THRESHOLDS'] complétés par les valeurs par défaut"""
+    from django.conf import settings
+    return {**DEFAULT_THRESHOLDS, **settings.RAG_SETTINGS.get('PAGE_TRIAGE_THRESHOLDS', {})}
+
+
+def _columnar_rows(words: List[Dict], column_gap: float) -> int:
+    """Lignes de texte comportant au moins trois colonnes séparées par de larges écarts"""
+    rows = defaultdict(list)
+    for word in words:
+        rows[round(word['top'] / 3)].append(word)
+    count = 0
+    for row in rows.values():
+        row.sort(key=lambda w: w['x0'])
+        gaps = sum(1 for a, b in zip(row, row[1:]) if b['x0'] - a['x1'] >= column_gap)
+        if gaps >= 2:
+            count += 1
+    return count
+
+
+def page_features(page, thresholds: Dict = None) -> Dict:
+    """Indicateurs d'une page pdfplumber : densité de texte, couverture d'images, filets, colonnes"""
+    thresholds = thresholds or DEFAULT_THRESHOLDS
+    area = float(page.width * page.height) or 1.0
+    chars = len(page.chars)
+
+    covered = 0.0
+    for image in page.images:
+        width = max(0.0, min(image['x1'], page.width) - max(image['x0'], 0))
+        height = max(0.0, min(image['bottom'], page.height) - max(image['top'], 0))
+        covered += width * height
+
+    min_length = thresholds['min_ruling_length']
+    rulings = 0
+    for edge in page.edges:
+        horizontal = abs(edge['top'] - edge['bottom']) < 1 and abs(edge['x1'] - edge['x0']) >= min_length
+        vertical = abs(edge['x1'] - edge['x0']) < 1 and abs(edge['bottom'] - edge['top']) >= min_length
+        if horizontal or vertical:
+            rulings += 1
+
+    return {
+        'chars': chars,
+        'text_density': round(chars / area * 1000, 3),  # caractères pour 1000 pt²
+        'image_coverage': round(min(covered / area, 1.0), 3),
+        'rulings': rulings,
+        'columnar_rows': _columnar_rows(page.extract_words(), thresholds['column_gap']) if chars else 0,
+    }
+
+
+def classify_page(features: Dict, thresholds: Dict = None) -> str:
+    """Voie d'extraction d'une page : 'text', 'table', 'ocr' ou 'empty'"""
+    thresholds = thresholds or DEFAULT_THRESHOLDS
+    has_text = features['chars'] >= thresholds['min_text_chars']
+    if not has_text and features['image_coverage'] >= thresholds['scanned_image_coverage']:
+        return 'ocr'
+    if not features['chars']:
+        return 'empty'
+    if (features['rulings'] >= thresholds['min_rulings']
+            or features['columnar_rows'] >= thresholds['min_columnar_rows']):
+        return 'table'
+    return 'text'
+
+
+def triage_page(page, thresholds: Dict = None) -> Dict:
+    features = page_features(page, thresholds)
+    return {'route': classify_page(features, thresholds), 'features': features}
+
+
+def triage_pdf(pdf_path: str, thresholds: Dict = None) -> List[Dict]:
+    """Voie de chaque page d'un PDF (page 1-indexée), sans rien extraire"""
+    import pdfplumber
+    decisions = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for page_no, page in enumerate(pdf.pages, start=1):
+            decisions.append({'page': page_no, **triage_page(page, thresholds)})
+            page.flush_cache()
+    return decisions
@@ -0,0 +1,314 @@
+# rag/passage_embedding_cache.py
+# Cache disque des embeddings de passages (indexation des documents)
+#
+# Réindexer un patient, changer les réglages de chunking ou ré-uploader le
+# même PDF produit les mêmes textes de passages : leurs embeddings sont
+# relus ici au lieu d'être recalculés par SentenceTransformer.encode.
+#
+# Un répertoire par modèle (PASSAGE_EMBEDDING_CACHE_DIR/<modèle>/) :
+#   vectors.<génération>.f32 : vecteurs float32 bruts, en ajout seul, lus par memmap
+#   index.sqlite             : clé sha256(modèle + texte) -> ligne, date du dernier accès
+#
+# Les lectures ne prennent aucun verrou (SQLite + page cache partagés entre
+# processus). Les ajouts, l'éviction LRU et la compaction sont sérialisés
+# par un verrou fcntl (.lock). Au-delà de MAX_ENTRIES, les entrées les moins
+# récemment utilisées sont retirées de l'index ; quand les lignes mortes
+# dépassent les lignes vivantes, le fichier de vecteurs est réécrit dans une
+# nouvelle génération (les lecteurs qui ont mappé l'ancienne la gardent).
+
+import os
+import re
+import time
+import fcntl
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = 'index.sqlite'
+DEFAULT_MAX_ENTRIES = 200_000
+COMPACTION_MIN_ROWS = 1024  # Pas de compaction pour quelques lignes mortes
+SQLITE_MAX_VARIABLES = 500
+
+
+def passage_key(model_name: str, text: str) -> str:
+    """Clé de contenu : même modèle et même texte -> même embedding"""
+    return hashlib.sha256(f"{model_name}\x00{text}".encode('utf-8')).hexdigest()
+
+
+def _chunks(items: Sequence, size: int = SQLITE_MAX_VARIABLES):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class PassageEmbeddingCache:
+    """Cache persistant des embeddings de passages pour un modèle"""
+
+    def __init__(self, model_name: str, directory: str, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 metrics_name: str = 'passage_embedding'):
+        self.model_name = model_name
+        self.directory = os.path.join(directory, re.sub(r'[^A-Za-z0-9._-]+', '_', model_name))
+        self.max_entries = max(1, int(max_entries))
+        self.metrics_name = metrics_name
+        os.makedirs(self.directory, exist_ok=True)
+        self._local = threading.local()
+        self._vectors = None  # (génération, memmap)
+        self._vectors_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        with self._locked(), self._transaction(write=True) as db:
+            db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                       "key TEXT PRIMARY KEY, row INTEGER NOT NULL, last_used REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+            db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            db.execute("INSERT OR IGNORE INTO meta VALUES ('generation', 0), ('rows', 0), ('dim', 0)")
+
+    # --- Stockage -----------------------------------------------------------
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(os.path.join(self.directory, INDEX_FILENAME), timeout=30,
+                                 isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self, write: bool = False):
+        db = self._db()
+        # IMMEDIATE : le verrou d'écriture est pris (ou attendu) dès le début, jamais
+        # en cours de transaction, où SQLite échoue sans attendre
+        db.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    @contextmanager
+    def _locked(self):
+        """Un seul processus écrit à la fois (ajouts, éviction, compaction)"""
+        with open(os.path.join(self.directory, '.lock'), 'a+') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _meta(db) -> Dict[str, int]:
+        return dict(db.execute("SELECT name, value FROM meta").fetchall())
+
+    def _vectors_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"vectors.{generation}.f32")
+
+    def _mapped(self, generation: int, rows: int, dim: int) -> Optional[np.ndarray]:
+        """Vecteurs de la génération donnée, remappés si le fichier a grandi"""
+        with self._vectors_lock:
+            if self._vectors is not None:
+                mapped_generation, mapped = self._vectors
+                if mapped_generation == generation and len(mapped) >= rows:
+                    return mapped
+            try:
+                mapped = np.memmap(self._vectors_path(generation), dtype='<f4', mode='r', shape=(rows, dim))
+            except (FileNotFoundError, ValueError):
+                # Génération remplacée par une compaction entre-temps : traité comme des miss
+                return None
+            self._vectors = (generation, mapped)
+            return mapped
+
+    @property
+    def dim(self) -> int:
+        with self._transaction() as db:
+            return self._meta(db)['dim']
+
+    # --- API ----------------------------------------------------------------
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Embeddings en cache (None pour les textes absents), dans l'ordre de `texts`"""
+        keys = [passage_key(self.model_name, text) for text in texts]
+        unique = list(dict.fromkeys(keys))
+        with self._transaction() as db:
+            meta = self._meta(db)
+            rows = {}
+            for chunk in _chunks(unique):
+                rows.update(db.execute(f"SELECT key, row FROM entries WHERE key IN "
+                                       f"({','.join('?' * len(chunk))})", chunk).fetchall())
+
+        found = {}
+        if rows:
+            vectors = self._mapped(meta['generation'], meta['rows'], meta['dim'])
+            if vectors is not None:
+                order = list(rows)
+                block = np.array(vectors[np.fromiter((rows[k] for k in order), dtype='int64')], dtype='float32')
+                found = dict(zip(order, block))
+                self._touch(order)
+
+        results = [found.get(key) for key in keys]
+        hits = sum(vec is not None for vec in results)
+        self._record(hits, len(results) - hits)
+        return results
+
+    def put_many(self, texts: Sequence[str], vectors: np.ndarray):
+        """Ajoute des embeddings (les textes déjà en cache sont ignorés)"""
+        if not len(texts):
+            return
+        vectors = np.ascontiguousarray(vectors, dtype='<f4').reshape(len(texts), -1)
+        keys = [passage_key(self.model_name, text) for text in texts]
+        with self._locked():
+            with self._transaction(write=True) as db:
+                meta = self._meta(db)
+                dim = meta['dim'] or vectors.shape[1]
+                if vectors.shape[1] != dim:
+                    raise ValueError(f"Dimension {vectors.shape[1]} pour un cache de dimension {dim} "
+                                     f"({self.model_name})")
+                known = set()
+                for chunk in _chunks(list(dict.fromkeys(keys))):
+                    known.update(k for (k,) in db.execute(f"SELECT key FROM entries WHERE key IN "
+                                                          f"({','.join('?' * len(chunk))})", chunk))
+                new = {}
+                for key, vec in zip(keys, vectors):
+                    if key not in known and key not in new:
+                        new[key] = vec
+                if not new:
+                    return
+                # Les vecteurs sont écrits avant l'index : une entrée ne pointe jamais hors du fichier
+                with open(self._vectors_path(meta['generation']), 'ab') as f:
+                    f.write(np.stack(list(new.values())).astype('<f4').tobytes())
+                now = time.time()
+                db.executemany("INSERT INTO entries VALUES (?, ?, ?)",
+                               [(key, meta['rows'] + i, now) for i, key in enumerate(new)])
+                db.executemany("UPDATE meta SET value = ? WHERE name = ?",
+                               [(meta['rows'] + len(new), 'rows'), (dim, 'dim')])
+            self._evict()
+
+    def encode_many(self, texts: Sequence[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Embeddings de tous les textes : ceux en cache sont relus, les autres
+        (dédoublonnés) sont encodés en un appel à `encode` puis ajoutés.
+        """
+        cached = self.get_many(texts)
+        missing = list(dict.fromkeys(text for text, vec in zip(texts, cached) if vec is None))
+        computed = {}
+        if missing:
+            encoded = np.asarray(encode(missing), dtype='float32').reshape(len(missing), -1)
+            try:
+                self.put_many(missing, encoded)
+            except Exception as e:  # le cache ne doit jamais bloquer l'indexation
+                logger.warning(f"⚠️ Embeddings de passages non mis en cache: {e}")
+            computed = dict(zip(missing, encoded))
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype='float32')
+        return np.vstack([vec if vec is not None else computed[text] for text, vec in zip(texts, cached)])
+
+    # --- LRU / compaction ---------------------------------------------------
+
+    def _touch(self, keys: List[str]):
+        now = time.time()
+        try:
+            with self._transaction(write=True) as db:
+                db.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in keys])
+        except sqlite3.OperationalError as e:
+            # Base occupée : l'ordre LRU est approximatif, la lecture reste valide
+            logger.debug(f"Dates d'accès du cache d'embeddings non mises à jour: {e}")
+
+    def _evict(self):
+        """Retire les entrées les moins récemment utilisées au-delà de max_entries (verrou pris)"""
+        with self._transaction(write=True) as db:
+            entries = db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            excess = entries - self.max_entries
+            if excess > 0:
+                db.execute("DELETE FROM entries WHERE key IN "
+                           "(SELECT key FROM entries ORDER BY last_used LIMIT ?)", (excess,))
+                entries -= excess
+                logger.info(f"🧹 Cache d'embeddings {self.model_name}: {excess} entrée(s) évincée(s)")
+            rows = self._meta(db)['rows']
+        if rows - entries > max(entries, COMPACTION_MIN_ROWS):
+            self._compact()
+
+    def _compact(self):
+        """Réécrit les lignes vivantes dans une nouvelle génération (verrou pris)"""
+        with self._transaction() as db:
+            meta = self._meta(db)
+            entries = db.execute("SELECT key, row FROM entries ORDER BY row").fetchall()
+        old_path = self._vectors_path(meta['generation'])
+        vectors = np.memmap(old_path, dtype='<f4', mode='r', shape=(meta['rows'], meta['dim']))
+        generation = meta['generation'] + 1
+        new_path = self._vectors_path(generation)
+        live = np.fromiter((row for _, row in entries), dtype='int64', count=len(entries))
+        with open(new_path, 'wb') as f:
+            for chunk in _chunks(live, 65536):
+                f.write(np.asarray(vectors[chunk], dtype='<f4').tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        del vectors
+        with self._transaction(write=True) as db:
+            db.executemany("UPDATE entries SET row = ? WHERE key = ?",
+                           [(i, key) for i, (key, _) in enumerate(entries)])
+            db.executemany("UPDATE meta SET value = ? WHERE name = ?",
+                           [(generation, 'generation'), (len(entries), 'rows')])
+        # Les lecteurs qui ont déjà mappé l'ancien fichier le conservent jusqu'à leur prochain remap
+        os.remove(old_path)
+        logger.info(f"🗜️ Cache d'embeddings {self.model_name} compacté: {meta['rows']} -> {len(entries)} lignes")
+
+    # --- Statistiques -------------------------------------------------------
+
+    def _record(self, hits: int, misses: int):
+        self.hits += hits
+        self.misses += misses
+        try:
+            from metrics.services import MetricsService
+            MetricsService.record_cache_lookups(self.metrics_name, hits, misses)
+        except Exception as e:  # les métriques ne doivent jamais bloquer l'indexation
+            logger.debug(f"Métrique de cache non enregistrée: {e}")
+
+    def stats(self) -> Dict:
+        with self._transaction() as db:
+            meta = self._meta(db)
+            entries = db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'model': self.model_name,
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'rows': meta['rows'],
+            'dim': meta['dim'],
+            'size_bytes': meta['rows'] * meta['dim'] * 4,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_caches: Dict[str, PassageEmbeddingCache] = {}
+
+
+def get_passage_embedding_cache(model_name: str) -> Optional[PassageEmbeddingCache]:
+    """Cache configuré par RAG_SETTINGS pour ce modèle (None si désactivé ou indisponible)"""
+    rag_settings = settings.RAG_SETTINGS
+    if not rag_settings.get('PASSAGE_EMBEDDING_CACHE', True):
+        return None
+    cache = _caches.get(model_name)
+    if cache is None:
+        try:
+            cache = PassageEmbeddingCache(
+                model_name,
+                rag_settings.get('PASSAGE_EMBEDDING_CACHE_DIR',
+                                 os.path.join(settings.MEDIA_ROOT, 'embedding_cache')),
+                max_entries=rag_settings.get('PASSAGE_EMBEDDING_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES),
+            )
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"⚠️ Cache d'embeddings de passages indisponible: {e}")
+            return None
+        _caches[model_name] = cache
+    return cache
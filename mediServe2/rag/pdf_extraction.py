@@ -0,0 +1,309 @@
+# rag/pdf_extraction.py
+# Extraction des PDF page par page dans un pool de processus
+#
+# Chaque page (texte pdfplumber + tableaux camelot de cette page) est une
+# tâche du pool ; les passages sortent dans l'ordre des pages, au fil de
+# l'eau, pendant que les pages suivantes sont extraites. La mémoire reste
+# bornée : au plus PDF_MAX_PAGES_IN_FLIGHT pages en cours, et chaque worker
+# est recyclé après PDF_PAGES_PER_WORKER pages (pdfplumber garde en cache
+# les objets des pages lues). Une page qui dépasse PDF_PAGE_TIMEOUT est
+# ignorée (avertissement) : le pool est alors détruit en fin de document
+# pour ne pas laisser un worker bloqué.
+#
+# Dans un processus démon (processus enfant d'un worker Celery prefork, où
+# tourne process_document_async), multiprocessing refuse de créer des enfants :
+# le pool vient alors de billiard (dépendance de Celery), qui l'autorise. Sans
+# billiard, ou avec un seul worker, l'extraction se fait séquentiellement dans
+# le processus (délai par page via SIGALRM). Chaque processus Celery peut donc
+# lancer PDF_EXTRACTION_WORKERS processus d'extraction : à dimensionner avec
+# la concurrence du worker d'ingestion (README).
+#
+# Avec PAGE_TRIAGE, chaque page est d'abord classée (rag.page_triage) : camelot
+# ne voit que les pages susceptibles de contenir un tableau, et seules les pages
+# scannées (sans couche texte) sont rendues pour Tesseract. Les voies choisies
+# et le temps camelot évité sont journalisés pour chaque document.
+
+import os
+import time
+import signal
+import logging
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+from .ocr import get_ocr_engine, record_ocr_metrics
+from .page_triage import ROUTES, settings_thresholds, triage_page
+
+logger = logging.getLogger(__name__)
+
+# PDF ouvert par chaque worker (un document à la fois)
+_worker_pdf = {}
+
+# Coût camelot observé par page (ms cumulées, pages) dans ce processus, pour
+# estimer le temps évité par le tri des pages
+_table_cost = [0.0, 0]
+
+
+class PageTimeout(Exception):
+    pass
+
+
+@contextmanager
+def _page_alarm(timeout: Optional[float]):
+    """Délai maximal d'une page en extraction séquentielle (SIGALRM, thread principal seulement)"""
+    if not timeout or not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def expired(signum, frame):
+        raise PageTimeout(f"extraction > {timeout}s")
+
+    previous = signal.signal(signal.SIGALRM, expired)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _open_pdf(pdf_path: str):
+    import pdfplumber
+    pdf = _worker_pdf.get(pdf_path)
+    if pdf is None:
+        for other in _worker_pdf.values():
+            other.close()
+        _worker_pdf.clear()
+        pdf = _worker_pdf[pdf_path] = pdfplumber.open(pdf_path)
+    return pdf
+
+
+def _ocr_page(page, resolution: int) -> Dict:
+    """Rendu de la page entière puis OCR (pages scannées) ; métriques enregistrées par le parent"""
+    image = page.to_image(resolution=resolution).original
+    return get_ocr_engine().recognize([image], record=False)[0]
+
+
+def _extract_tables(pdf_path: str, page_no: int) -> List[Dict]:
+    passages = []
+    try:
+        import camelot
+        for tbl in camelot.read_pdf(pdf_path, pages=str(page_no), flavor='stream', suppress_stdout=True):
+            table_text = tbl.df.to_string(index=False)
+            if table_text.strip():
+                passages.append({'source': 'pdf_table', 'page': page_no, 'text': table_text})
+    except Exception as e:
+        logger.debug(f"Pas de tableau extrait page {page_no}: {e}")
+    return passages
+
+
+def extract_page(pdf_path: str, page_no: int, tables: bool = True, thresholds: Optional[Dict] = None,
+                 ocr_resolution: int = 300) -> Tuple[List[Dict], Dict]:
+    """
+    Passages d'une page (1-indexée) : son texte (ou son OCR) puis ses tableaux,
+    et le compte rendu de la page (voie, indicateurs, temps par étape en ms).
+    Avec `thresholds` (seuils de rag.page_triage), la page est triée avant
+    extraction ; sans, camelot est appelé sur chaque page (si `tables`).
+    """
+    passages = []
+    report = {'page': page_no, 'route': 'text', 'features': None, 'ms': {}}
+    pdf = _open_pdf(pdf_path)
+    page = pdf.pages[page_no - 1]
+    try:
+        start = time.perf_counter()
+        if thresholds is not None:
+            report.update(triage_page(page, thresholds))
+            report['ms']['triage'] = (time.perf_counter() - start) * 1000
+
+        if report['route'] == 'ocr':
+            start = time.perf_counter()
+            try:
+                result = _ocr_page(page, ocr_resolution)
+                text = result.pop('text')
+                report['ocr'] = result
+            except Exception as e:
+                logger.warning(f"⚠️ OCR de la page {page_no} impossible: {e}")
+                text = ''
+            report['ms']['ocr'] = (time.perf_counter() - start) * 1000
+            if text:
+                passages.append({'source': 'pdf_ocr', 'page': page_no, 'text': text})
+        elif report['route'] != 'empty':
+            start = time.perf_counter()
+            text = (page.extract_text() or '').strip()
+            report['ms']['text'] = (time.perf_counter() - start) * 1000
+            if text:
+                passages.append({'source': 'pdf_page', 'page': page_no, 'text': text})
+    finally:
+        if hasattr(page, 'close'):
+            page.close()
+        else:
+            page.flush_cache()
+
+    run_tables = tables and (thresholds is None or report['route'] == 'table')
+    if run_tables:
+        start = time.perf_counter()
+        passages.extend(_extract_tables(pdf_path, page_no))
+        report['ms']['tables'] = (time.perf_counter() - start) * 1000
+    return passages, report
+
+
+def count_pages(pdf_path: str) -> int:
+    import pdfplumber
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+
+class PdfExtractor:
+    """Extraction parallèle des pages d'un PDF, passages rendus dans l'ordre des pages"""
+
+    def __init__(self, workers: Optional[int] = None, page_timeout: Optional[float] = None,
+                 max_in_flight: Optional[int] = None, pages_per_worker: Optional[int] = None,
+                 triage: Optional[bool] = None):
+        rag_settings = settings.RAG_SETTINGS
+        if workers is None:
+            workers = rag_settings.get('PDF_EXTRACTION_WORKERS') or min(4, os.cpu_count() or 1)
+        self.workers = max(1, int(workers))
+        self.page_timeout = page_timeout if page_timeout is not None else rag_settings.get('PDF_PAGE_TIMEOUT', 60)
+        self.max_in_flight = max(1, int(max_in_flight or rag_settings.get('PDF_MAX_PAGES_IN_FLIGHT')
+                                         or 2 * self.workers))
+        self.pages_per_worker = pages_per_worker or rag_settings.get('PDF_PAGES_PER_WORKER', 50)
+        if triage is None:
+            triage = rag_settings.get('PAGE_TRIAGE', True)
+        self.thresholds = settings_thresholds() if triage else None
+        self.ocr_resolution = rag_settings.get('PAGE_OCR_RESOLUTION', 300)
+        self.stats: Dict = {}
+
+    @staticmethod
+    def _pool_module():
+        """
+        Module fournissant le pool : multiprocessing, ou billiard dans un processus
+        démon (Celery prefork), None si aucun ne peut créer de processus enfants
+        """
+        if not multiprocessing.current_process().daemon:
+            return multiprocessing
+        try:
+            import billiard
+            return billiard
+        except ImportError:
+            logger.warning("⚠️ Processus démon sans billiard : extraction PDF séquentielle")
+            return None
+
+    def _parallel(self) -> bool:
+        return self.workers > 1 and self._pool_module() is not None
+
+    def iter_passages(self, pdf_path: str, tables: bool = True) -> Iterator[Dict]:
+        """Générateur des passages du PDF, page après page"""
+        start = time.perf_counter()
+        pages = count_pages(pdf_path)
+        self.stats = {'pages': pages, 'timeouts': [], 'errors': [], 'workers': 1, 'pool': 'sequential',
+                      'routes': dict.fromkeys(ROUTES, 0), 'ms': {}, 'tables_skipped': 0}
+        if pages == 0:
+            return
+        if self._parallel() and pages > 1:
+            yield from self._iter_parallel(pdf_path, pages, tables)
+        else:
+            yield from self._iter_sequential(pdf_path, pages, tables)
+        self.stats['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        logger.info(f"📄 {os.path.basename(pdf_path)}: {pages} pages extraites en {self.stats['elapsed_ms']:.0f} ms "
+                    f"({self.stats['workers']} processus {self.stats['pool']}, {len(self.stats['timeouts'])} page(s) expirée(s), "
+                    f"{len(self.stats['errors'])} en erreur)")
+        if self.thresholds is not None:
+            self._log_routing(pdf_path, tables)
+
+    def _record(self, report: Dict, tables: bool):
+        """Cumule le compte rendu d'une page (voie, temps par étape)"""
+        self.stats['routes'][report['route']] += 1
+        if 'ocr' in report:
+            record_ocr_metrics([report['ocr']])
+        for step, ms in report['ms'].items():
+            self.stats['ms'][step] = self.stats['ms'].get(step, 0.0) + ms
+        if 'tables' in report['ms']:
+            _table_cost[0] += report['ms']['tables']
+            _table_cost[1] += 1
+        elif tables:
+            self.stats['tables_skipped'] += 1
+        logger.debug(f"Page {report['page']} -> {report['route']} {report['features']}")
+
+    def _log_routing(self, pdf_path: str, tables: bool):
+        routes, timings = self.stats['routes'], self.stats['ms']
+        summary = ', '.join(f"{route} {count}" for route, count in routes.items() if count)
+        saved = ''
+        if tables and self.stats['tables_skipped']:
+            saved = f"camelot évité sur {self.stats['tables_skipped']} page(s)"
+            if _table_cost[1]:
+                estimate = self.stats['tables_skipped'] * _table_cost[0] / _table_cost[1]
+                self.stats['saved_ms'] = round(estimate, 1)
+                saved += f" (~{estimate / 1000:.1f} s économisées)"
+        logger.info(f"🧭 {os.path.basename(pdf_path)}: voies {summary or '-'} ; tri {timings.get('triage', 0):.0f} ms, "
+                    f"camelot {timings.get('tables', 0):.0f} ms, OCR {timings.get('ocr', 0):.0f} ms"
+                    f"{' ; ' + saved if saved else ''}")
+
+    def _iter_sequential(self, pdf_path: str, pages: int, tables: bool) -> Iterator[Dict]:
+        try:
+            for page_no in range(1, pages + 1):
+                try:
+                    with _page_alarm(self.page_timeout):
+                        passages, report = extract_page(pdf_path, page_no, tables, self.thresholds,
+                                                        self.ocr_resolution)
+                except PageTimeout as e:
+                    logger.warning(f"⏱️ Page {page_no} de {os.path.basename(pdf_path)} ignorée: {e}")
+                    self.stats['timeouts'].append(page_no)
+                    continue
+                except Exception as e:
+                    logger.warning(f"⚠️ Page {page_no} de {os.path.basename(pdf_path)} ignorée: {e}")
+                    self.stats['errors'].append(page_no)
+                    continue
+                self._record(report, tables)
+                yield from passages
+        finally:
+            pdf = _worker_pdf.pop(pdf_path, None)
+            if pdf is not None:
+                pdf.close()
+
+    def _iter_parallel(self, pdf_path: str, pages: int, tables: bool) -> Iterator[Dict]:
+        workers = min(self.workers, pages)
+        pool_module = self._pool_module()
+        self.stats['workers'] = workers
+        self.stats['pool'] = pool_module.__name__
+        pool = pool_module.Pool(workers, maxtasksperchild=self.pages_per_worker)
+        stuck, completed = False, False
+        try:
+            in_flight = {}
+            next_page = 1
+            for page_no in range(1, pages + 1):
+                # Fenêtre bornée de pages soumises en avance
+                while next_page <= pages and len(in_flight) < self.max_in_flight:
+                    in_flight[next_page] = pool.apply_async(
+                        extract_page, (pdf_path, next_page, tables, self.thresholds, self.ocr_resolution))
+                    next_page += 1
+                result = in_flight.pop(page_no)
+                try:
+                    passages, report = result.get(timeout=self.page_timeout)
+                except multiprocessing.TimeoutError:  # billiard.exceptions.TimeoutError en hérite
+                    logger.warning(f"⏱️ Page {page_no} de {os.path.basename(pdf_path)} ignorée: "
+                                   f"extraction > {self.page_timeout}s")
+                    self.stats['timeouts'].append(page_no)
+                    stuck = True
+                    continue
+                except Exception as e:
+                    logger.warning(f"⚠️ Page {page_no} de {os.path.basename(pdf_path)} ignorée: {e}")
+                    self.stats['errors'].append(page_no)
+                    continue
+                self._record(report, tables)
+                yield from passages
+            completed = True
+        finally:
+            if stuck or not completed:
+                # Worker encore bloqué sur une page expirée, ou lecture interrompue par l'appelant
+                pool.terminate()
+            else:
+                pool.close()
+            pool.join()
+
+
+def iter_pdf_passages(pdf_path: str, tables: bool = True, **options) -> Iterator[Dict]:
+    """Raccourci : passages d'un PDF avec l'extracteur configuré par RAG_SETTINGS"""
+    return PdfExtractor(**options).iter_passages(pdf_path, tables=tables)
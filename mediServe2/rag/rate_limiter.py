@@ -0,0 +1,289 @@
+# rag/rate_limiter.py
+# Limiteur de débit token-bucket partagé pour les appels LLM (Gemini)
+#
+# Deux seaux par modèle : requêtes/minute et tokens/minute. L'état est dans
+# Redis (script Lua atomique, partagé par tous les workers gunicorn/Celery),
+# avec repli en mémoire si Redis est indisponible. Un appelant n'attend que
+# si un seau est réellement vide.
+#
+# Priorités : les appels 'background' (résumés, suggestions...) ne peuvent
+# pas descendre sous une réserve de capacité, laissée aux appels
+# 'interactive' (réponses aux patients), qui passent donc en premier.
+
+import time
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+UNLIMITED = 1e12  # capacité d'un axe sans limite configurée
+REDIS_RETRY_DELAY = 30  # secondes avant de retenter Redis après une erreur
+
+
+class RateLimitExceeded(Exception):
+    """L'attente nécessaire dépasse le délai maximal accepté par l'appelant"""
+
+
+class SystemClock:
+    """Horloge murale (partagée entre processus pour l'état Redis)"""
+
+    def now(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+
+class FakeClock:
+    """Horloge manuelle pour les tests : sleep() avance le temps sans attendre"""
+
+    def __init__(self, start: float = 0.0):
+        self.current = start
+        self.slept = 0.0
+
+    def now(self) -> float:
+        return self.current
+
+    def sleep(self, seconds: float):
+        self.current += seconds
+        self.slept += seconds
+
+    def advance(self, seconds: float):
+        self.current += seconds
+
+
+def token_bucket_step(state: Dict[str, float], now: float, capacity: float, rate: float,
+                      amount: float, floor: float) -> Tuple[float, float]:
+    """
+    Recharge le seau puis calcule l'attente nécessaire pour prélever `amount`
+    sans descendre sous `floor`. Retourne (niveau rechargé, attente en secondes).
+    Même logique que TOKEN_BUCKET_LUA.
+    """
+    level = state.get('level', capacity)
+    last = state.get('ts', now)
+    level = min(capacity, level + max(0.0, now - last) * rate)
+    missing = amount + floor - level
+    wait = 0.0 if missing <= 0 else (missing / rate if rate > 0 else float('inf'))
+    return level, wait
+
+
+def try_acquire_buckets(buckets, now: float, requests: float, tokens: float, reserve: float):
+    """
+    buckets : [(state, capacity, rate)] pour (requêtes, tokens).
+    Prélève sur les deux seaux si possible ; retourne l'attente (0 si accordé).
+    """
+    amounts = (requests, tokens)
+    levels, wait = [], 0.0
+    for (state, capacity, rate), amount in zip(buckets, amounts):
+        amount = min(amount, capacity * (1 - reserve))  # sinon jamais satisfiable
+        level, w = token_bucket_step(state, now, capacity, rate, amount, reserve * capacity)
+        levels.append((level, amount))
+        wait = max(wait, w)
+    for (state, _, _), (level, amount) in zip(buckets, levels):
+        state['level'] = level - amount if wait == 0 else level
+        state['ts'] = now
+    return wait
+
+
+# KEYS[1] : seau requêtes, KEYS[2] : seau tokens
+# ARGV : now, req_capacity, req_rate, tok_capacity, tok_rate, requests, tokens, reserve, ttl
+TOKEN_BUCKET_LUA = """
+local now = tonumber(ARGV[1])
+local reserve = tonumber(ARGV[8])
+local ttl = tonumber(ARGV[9])
+local wait = 0
+local levels = {}
+local amounts = {}
+for i = 1, 2 do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = tonumber(ARGV[2 * i + 1])
+    local amount = math.min(tonumber(ARGV[5 + i]), capacity * (1 - reserve))
+    local state = redis.call('HMGET', KEYS[i], 'level', 'ts')
+    local level = tonumber(state[1]) or capacity
+    local last = tonumber(state[2]) or now
+    level = math.min(capacity, level + math.max(0, now - last) * rate)
+    local missing = amount + reserve * capacity - level
+    if missing > 0 then
+        if rate > 0 then wait = math.max(wait, missing / rate) else wait = math.huge end
+    end
+    levels[i] = level
+    amounts[i] = amount
+end
+for i = 1, 2 do
+    local level = levels[i]
+    if wait == 0 then level = level - amounts[i] end
+    redis.call('HSET', KEYS[i], 'level', tostring(level), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[i], ttl)
+end
+return tostring(wait)
+"""
+
+# Correction du seau tokens après l'appel (estimation -> consommation réelle)
+# KEYS[1] : seau tokens ; ARGV : capacity, delta, ttl
+ADJUST_LUA = """
+local capacity = tonumber(ARGV[1])
+local level = tonumber(redis.call('HGET', KEYS[1], 'level')) or capacity
+level = math.min(capacity, level - tonumber(ARGV[2]))
+redis.call('HSET', KEYS[1], 'level', tostring(level))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+return tostring(level)
+"""
+
+
+class LocalBucketBackend:
+    """Seaux en mémoire du processus (repli, ou mode sans Redis)"""
+
+    def __init__(self):
+        self._states: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def try_acquire(self, model: str, now: float, limits: Tuple[float, float],
+                    requests: float, tokens: float, reserve: float) -> float:
+        rpm, tpm = limits
+        with self._lock:
+            buckets = [
+                (self._states.setdefault(f"{model}:requests", {}), rpm, rpm / 60.0),
+                (self._states.setdefault(f"{model}:tokens", {}), tpm, tpm / 60.0),
+            ]
+            return try_acquire_buckets(buckets, now, requests, tokens, reserve)
+
+    def adjust(self, model: str, capacity: float, delta: float):
+        with self._lock:
+            state = self._states.setdefault(f"{model}:tokens", {})
+            state['level'] = min(capacity, state.get('level', capacity) - delta)
+
+
+class RedisBucketBackend:
+    """Seaux partagés dans Redis ; repli sur LocalBucketBackend en cas d'erreur"""
+
+    def __init__(self, client, prefix: str = 'ratelimit', fallback: Optional[LocalBucketBackend] = None):
+        self.client = client
+        self.prefix = prefix
+        self.fallback = fallback or LocalBucketBackend()
+        self._script = client.register_script(TOKEN_BUCKET_LUA)
+        self._adjust = client.register_script(ADJUST_LUA)
+        self._down_until = 0.0
+
+    def try_acquire(self, model: str, now: float, limits: Tuple[float, float],
+                    requests: float, tokens: float, reserve: float) -> float:
+        if time.time() >= self._down_until:
+            rpm, tpm = limits
+            try:
+                wait = self._script(
+                    keys=[f"{self.prefix}:{model}:requests", f"{self.prefix}:{model}:tokens"],
+                    args=[now, rpm, rpm / 60.0, tpm, tpm / 60.0, requests, tokens, reserve, 120],
+                )
+                return float(wait)
+            except Exception as e:
+                logger.warning(f"⚠️ Limiteur Redis indisponible ({e}), repli en mémoire pendant {REDIS_RETRY_DELAY}s")
+                self._down_until = time.time() + REDIS_RETRY_DELAY
+        return self.fallback.try_acquire(model, now, limits, requests, tokens, reserve)
+
+    def adjust(self, model: str, capacity: float, delta: float):
+        if time.time() >= self._down_until:
+            try:
+                self._adjust(keys=[f"{self.prefix}:{model}:tokens"], args=[capacity, delta, 120])
+                return
+            except Exception as e:
+                logger.warning(f"⚠️ Limiteur Redis indisponible ({e}), repli en mémoire pendant {REDIS_RETRY_DELAY}s")
+                self._down_until = time.time() + REDIS_RETRY_DELAY
+        self.fallback.adjust(model, capacity, delta)
+
+
+class RateLimiter:
+    """
+    Limiteur requêtes/min + tokens/min par modèle.
+
+    acquire() retourne immédiatement si les deux seaux ont la capacité
+    demandée, sinon attend exactement le temps de recharge nécessaire.
+    """
+
+    def __init__(self, limits: Dict[str, Dict[str, float]], backend=None, clock=None,
+                 background_reserve: float = 0.2, max_wait: float = 60.0,
+                 default_limits: Optional[Dict[str, float]] = None):
+        self.limits = limits
+        self.default_limits = default_limits
+        self.backend = backend or LocalBucketBackend()
+        self.clock = clock or SystemClock()
+        self.background_reserve = background_reserve
+        self.max_wait = max_wait
+
+    def _limits_for(self, model: str) -> Optional[Tuple[float, float]]:
+        """(rpm, tpm) du modèle ; None si aucune limite. Un axe à 0 est illimité."""
+        conf = self.limits.get(model) or self.default_limits
+        if not conf or not (conf.get('rpm') or conf.get('tpm')):
+            return None
+        return float(conf.get('rpm') or UNLIMITED), float(conf.get('tpm') or UNLIMITED)
+
+    def acquire(self, model: str, tokens: int = 0, priority: str = INTERACTIVE,
+                max_wait: Optional[float] = None) -> float:
+        """Réserve une requête et `tokens` tokens ; retourne le temps attendu (s)"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Priorité inconnue: {priority}")
+        limits = self._limits_for(model)
+        if limits is None:
+            return 0.0
+        reserve = self.background_reserve if priority == BACKGROUND else 0.0
+        max_wait = self.max_wait if max_wait is None else max_wait
+
+        waited = 0.0
+        while True:
+            wait = self.backend.try_acquire(model, self.clock.now(), limits, 1, tokens, reserve)
+            if wait <= 0:
+                if waited:
+                    logger.info(f"⏳ {model}: {waited * 1000:.0f}ms d'attente (limite de débit, {priority})")
+                return waited
+            if waited + wait > max_wait:
+                raise RateLimitExceeded(f"{model}: attente de {wait:.1f}s au-delà de {max_wait}s ({priority})")
+            self.clock.sleep(wait)
+            waited += wait
+
+    def settle(self, model: str, estimated_tokens: int, actual_tokens: int):
+        """Corrige le seau tokens avec la consommation réelle retournée par l'API"""
+        limits = self._limits_for(model)
+        if limits is None or actual_tokens is None:
+            return
+        delta = actual_tokens - min(estimated_tokens, limits[1])
+        if delta:
+            self.backend.adjust(model, limits[1], delta)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimation grossière (≈ 4 caractères par token) faute de comptage exact avant l'appel"""
+    return max(1, len(text or '') // 4)
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Limiteur du processus, configuré par RAG_SETTINGS['LLM_RATE_LIMITS']"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                from django.conf import settings
+                rag_settings = settings.RAG_SETTINGS
+                backend = LocalBucketBackend()
+                redis_url = rag_settings.get('RATE_LIMIT_REDIS_URL')
+                if redis_url:
+                    try:
+                        import redis
+                        client = redis.Redis.from_url(redis_url, socket_timeout=0.2, socket_connect_timeout=0.2)
+                        backend = RedisBucketBackend(client, fallback=backend)
+                    except Exception as e:
+                        logger.warning(f"⚠️ Limiteur Redis non configuré ({e}), limites par processus")
+                _limiter = RateLimiter(
+                    rag_settings.get('LLM_RATE_LIMITS', {}),
+                    backend=backend,
+                    background_reserve=rag_settings.get('LLM_BACKGROUND_RESERVE', 0.2),
+                    max_wait=rag_settings.get('LLM_RATE_LIMIT_MAX_WAIT', 60),
+                    default_limits=rag_settings.get('LLM_DEFAULT_RATE_LIMITS'),
+                )
+    return _limiter
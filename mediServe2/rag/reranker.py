@@ -0,0 +1,94 @@
+# rag/reranker.py
+# Reranking cross-encoder en lots partagés entre requêtes, avec budget de latence
+
+import time
+import logging
+from concurrent.futures import wait
+from typing import List, Optional, Sequence
+
+from rag.batching import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+
+class RerankEngine:
+    """
+    Moteur de reranking partagé par les retrievers d'un processus.
+
+    Les paires (question, passage) de toutes les requêtes concurrentes sont
+    regroupées par un MicroBatcher et scorées en un seul appel à
+    CrossEncoder.predict. Les passages sont tronqués à `max_tokens` tokens
+    avant le scoring. Si le budget de latence d'une requête est dépassé,
+    rerank() retourne None : l'appelant garde les scores hybrides fusionnés,
+    et ses paires encore en file sont retirées du lot sans être scorées.
+    """
+
+    def __init__(self, cross_encoder, max_tokens: int = 256, max_batch_size: int = 64,
+                 max_wait_ms: float = 5.0, default_budget_ms: Optional[float] = None):
+        self.cross_encoder = cross_encoder
+        self.max_tokens = max_tokens
+        self.default_budget_ms = default_budget_ms
+        self.tokenizer = getattr(cross_encoder, 'tokenizer', None)
+        self.batcher = MicroBatcher(self._score_batch, max_batch_size=max_batch_size,
+                                    max_wait_ms=max_wait_ms, name='rerank-batcher')
+        self.requests = 0
+        self.degraded = 0
+
+    def _score_batch(self, pairs: List[tuple]) -> Sequence[float]:
+        return self.cross_encoder.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+
+    def truncate(self, text: str) -> str:
+        if not text or not self.max_tokens:
+            return text or ''
+        if self.tokenizer is None:
+            words = text.split()
+            return text if len(words) <= self.max_tokens else ' '.join(words[:self.max_tokens])
+        ids = self.tokenizer.encode(text, add_special_tokens=False, truncation=True, max_length=self.max_tokens)
+        if len(ids) < self.max_tokens:
+            return text
+        return self.tokenizer.decode(ids, skip_special_tokens=True)
+
+    def rerank(self, question: str, passages: List[str], budget_ms: Optional[float] = None) -> Optional[List[float]]:
+        """Scores des passages, ou None si le budget de latence est dépassé"""
+        if not passages:
+            return []
+        budget_ms = self.default_budget_ms if budget_ms is None else budget_ms
+        start = time.perf_counter()
+        # Échéance transmise au batcher : si le budget expire avant le calcul du
+        # lot, les paires de cette requête en sont retirées au lieu d'être scorées
+        deadline = time.monotonic() + budget_ms / 1000 if budget_ms else None
+        futures = [self.batcher.submit((question, self.truncate(p)), deadline=deadline) for p in passages]
+
+        timeout = None if not budget_ms else max(budget_ms / 1000 - (time.perf_counter() - start), 0)
+        done, pending = wait(futures, timeout=timeout)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        degraded = bool(pending) or any(f.exception() for f in done)
+        for f in pending:
+            f.cancel()
+
+        self.requests += 1
+        if degraded:
+            self.degraded += 1
+            logger.warning(f"⏱️ Reranking abandonné après {elapsed_ms:.0f}ms (budget {budget_ms}ms), "
+                           f"scores hybrides conservés")
+        self._record(elapsed_ms, degraded, len(passages))
+        if degraded:
+            return None
+        return [float(f.result()) for f in futures]
+
+    @staticmethod
+    def _record(elapsed_ms: float, degraded: bool, pairs: int):
+        try:
+            from metrics.services import MetricsService
+            MetricsService.record_rerank(elapsed_ms, degraded, pairs)
+        except Exception as e:  # les métriques ne doivent jamais bloquer une requête
+            logger.debug(f"Métrique de reranking non enregistrée: {e}")
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'degraded': self.degraded,
+            'degradation_rate': round(self.degraded / self.requests, 4) if self.requests else 0.0,
+            'max_tokens': self.max_tokens,
+            'batcher': self.batcher.stats(),
+        }
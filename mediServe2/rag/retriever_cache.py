@@ -0,0 +1,213 @@
+# rag/retriever_cache.py
+# Cache LRU en mémoire des retrievers par patient (store + FAISS + BM25)
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Any
+
+import numpy as np
+
+from django.conf import settings
+
+from rag.your_rag_module import HybridRetriever
+from rag.storage import StoreVersion, patient_store_paths
+from rag.vector_format import open_patient_store
+from rag.sparse_bm25 import SparseBM25Index, sparse_engine_enabled
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024  # 1 Go
+
+
+def load_bm25_in_ram(bm25_dir: str):
+    """Ouvre un index Whoosh copié en RAM (plus aucune lecture disque à la recherche)"""
+    from whoosh.filedb.filestore import FileStorage, copy_to_ram
+    storage = copy_to_ram(FileStorage(bm25_dir))
+    return storage.open_index(), sum(storage.file_length(name) for name in storage.list())
+
+
+def estimate_store_bytes(store) -> int:
+    """Taille approximative d'un store chargé (vecteurs, index FAISS, métadonnées)"""
+    total = 0
+    vectors = getattr(store, 'vectors', None)
+    compressed = (getattr(store, 'index_params', None) or {}).get('rescore')
+    # Index compressé sur store mmap : seules les lignes candidates sont lues à chaque recherche
+    if vectors is not None and not (compressed and isinstance(vectors, np.memmap)):
+        total += vectors.nbytes
+    index = getattr(store, 'index', None)
+    if index is not None:
+        # Index IVF / HNSW : estimation enregistrée à la construction (rag.index_factory)
+        estimated = (getattr(store, 'index_params', None) or {}).get('estimated_bytes')
+        total += estimated or getattr(index, 'code_size', index.d * 4) * index.ntotal
+    meta = getattr(store, 'meta', [])
+    if hasattr(meta, 'nbytes'):
+        # Métadonnées mappées (rag.vector_format) : taille du fichier JSONL
+        total += meta.nbytes
+    else:
+        for m in meta:
+            # texte + surcoût d'un dict Python
+            total += len(m.get('text', '')) + 512
+    return total
+
+
+class _CacheEntry:
+    __slots__ = ('retriever', 'version', 'size_bytes', 'built_at', 'hits')
+
+    def __init__(self, retriever, version, size_bytes):
+        self.retriever = retriever
+        self.version = version
+        self.size_bytes = size_bytes
+        self.built_at = time.time()
+        self.hits = 0
+
+
+class RetrieverCache:
+    """
+    Cache LRU des HybridRetriever complets, indexé par patient.
+
+    Une entrée est reconstruite dès que le store du patient publie une
+    nouvelle version (voir rag.storage.StoreVersion). Les entrées les moins
+    récemment utilisées sont évincées quand le budget mémoire est dépassé.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Any, _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks: Dict[Any, threading.Lock] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, patient_id) -> Optional[HybridRetriever]:
+        """Retourne le retriever du patient (None si aucun store n'existe)"""
+        version = StoreVersion.current(patient_id)
+        if version is None:
+            self.invalidate(patient_id)
+            return None
+
+        entry = self._lookup(patient_id, version)
+        if entry is not None:
+            return entry.retriever
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault(patient_id, threading.Lock())
+
+        # Un seul thread construit le retriever d'un patient donné
+        with build_lock:
+            entry = self._lookup(patient_id, version, count=False)
+            if entry is not None:
+                return entry.retriever
+
+            with self._lock:
+                self.misses += 1
+            start = time.time()
+            retriever, size_bytes = self._build(patient_id)
+            logger.info(
+                f"🧠 Retriever patient {patient_id} construit en {(time.time() - start) * 1000:.0f}ms "
+                f"({size_bytes / 1024 / 1024:.1f} Mo)"
+            )
+            self._insert(patient_id, _CacheEntry(retriever, version, size_bytes))
+            return retriever
+
+    def _lookup(self, patient_id, version, count: bool = True) -> Optional[_CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(patient_id)
+            if entry is None:
+                return None
+            if entry.version != version:
+                logger.info(f"♻️ Store patient {patient_id} republié, invalidation du retriever")
+                self._remove(patient_id)
+                return None
+            self._entries.move_to_end(patient_id)
+            if count:
+                entry.hits += 1
+                self.hits += 1
+            return entry
+
+    def _build(self, patient_id):
+        # Import local : le registre charge les modèles à la première utilisation
+        from rag.model_registry import build_hybrid_retriever
+
+        paths = patient_store_paths(patient_id)
+        store = open_patient_store(patient_id)
+        if store is None:
+            raise FileNotFoundError(f"Aucun vector store pour le patient {patient_id}")
+        size_bytes = estimate_store_bytes(store)
+
+        bm25_index = None
+        use_bm25 = settings.RAG_SETTINGS.get('USE_BM25', True)
+        if use_bm25 and sparse_engine_enabled() and os.path.exists(paths['bm25_sparse']):
+            bm25_index = SparseBM25Index.open(paths['bm25_sparse'])
+            size_bytes += bm25_index.nbytes
+        elif use_bm25 and os.path.exists(paths['bm25']):
+            try:
+                bm25_index, bm25_bytes = load_bm25_in_ram(paths['bm25'])
+                size_bytes += bm25_bytes
+            except Exception as e:
+                logger.warning(f"⚠️ Index BM25 illisible pour patient {patient_id}: {e}")
+
+        retriever = build_hybrid_retriever(store, paths['bm25'], bm25_index=bm25_index)
+        return retriever, size_bytes
+
+    def _insert(self, patient_id, entry: _CacheEntry):
+        with self._lock:
+            self._remove(patient_id)
+            self._entries[patient_id] = entry
+            self.total_bytes += entry.size_bytes
+            # Évincer les moins récents, en gardant au moins l'entrée courante
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_id, _ = next(iter(self._entries.items()))
+                self._remove(old_id)
+                self.evictions += 1
+                logger.info(f"🗑️ Retriever patient {old_id} évincé du cache (budget mémoire)")
+
+    def _remove(self, patient_id):
+        entry = self._entries.pop(patient_id, None)
+        if entry is not None:
+            self.total_bytes -= entry.size_bytes
+
+    def invalidate(self, patient_id):
+        with self._lock:
+            self._remove(patient_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'total_bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'patients': {
+                    str(pid): {'size_bytes': e.size_bytes, 'hits': e.hits, 'built_at': e.built_at}
+                    for pid, e in self._entries.items()
+                },
+            }
+
+
+_default_cache: Optional[RetrieverCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_retriever_cache() -> RetrieverCache:
+    """Cache partagé du processus, dimensionné par RAG_SETTINGS['RETRIEVER_CACHE_MAX_BYTES']"""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                max_bytes = settings.RAG_SETTINGS.get('RETRIEVER_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+                _default_cache = RetrieverCache(max_bytes=max_bytes)
+    return _default_cache
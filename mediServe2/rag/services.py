@@ -8,9 +8,10 @@ import pinecone
 import google.generativeai as genai
 from pinecone import Pinecone
 import PyPDF2
-from PIL import Image
-import pytesseract
 from django.conf import settings
+from core.stand_ins import embed_content, make_generative_model
+from .chunking import DEFAULT_MAX_TOKENS, chunk_text
+from .ocr import get_ocr_engine
 from .models import Document, ConversationSession, Message
 
 logger = logging.getLogger(__name__)
@@ -24,10 +25,7 @@ class DocumentProcessor:
         try:
             with open(file_path, 'rb') as file:
                 pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                return text.strip()
+                return "\n".join((page.extract_text() or "") for page in pdf_reader.pages).strip()
         except Exception as e:
             logger.error(f"Erreur extraction PDF {file_path}: {e}")
             return ""
@@ -36,9 +34,7 @@ class DocumentProcessor:
     def extract_text_from_image(file_path: str) -> str:
         """Extrait le texte d'une image via OCR"""
         try:
-            image = Image.open(file_path)
-            text = pytesseract.image_to_string(image, lang='fra')
-            return text.strip()
+            return get_ocr_engine().ocr(file_path)
         except Exception as e:
             logger.error(f"Erreur OCR image {file_path}: {e}")
             return ""
@@ -52,7 +48,7 @@ class EmbeddingService:
     def generate_embedding(self, text: str) -> List[float]:
         """Génère un embedding pour un texte donné"""
         try:
-            response = genai.embed_content(
+            response = embed_content(
                 model="models/embedding-001",
                 content=text,
                 task_type="retrieval_document"
@@ -104,7 +100,8 @@ class GeminiService:
     
     def __init__(self):
         genai.configure(api_key=settings.GEMINI_API_KEY)
-        self.model = genai.GenerativeModel('gemini-pro')
+        self.model_name = 'gemini-pro'
+        self.model = make_generative_model(self.model_name)
         
     def generate_response(self, query: str, context: str, 
                          patient_info: str) -> str:
@@ -134,6 +131,8 @@ class GeminiService:
         """
         
         try:
+            from rag.rate_limiter import get_rate_limiter, estimate_tokens
+            get_rate_limiter().acquire(self.model_name, estimate_tokens(prompt) + 400)
             response = self.model.generate_content(prompt)
             return response.text
         except Exception as e:
@@ -199,24 +198,11 @@ class RAGService:
             logger.error(f"Erreur indexation document {document.id}: {e}")
             return False
     
-    def _chunk_text(self, text: str, max_chars: int = 1000) -> List[str]:
-        """Divise le texte en chunks plus petits"""
-        paragraphs = text.split('\n\n')
-        chunks = []
-        current_chunk = ""
-        
-        for paragraph in paragraphs:
-            if len(current_chunk + paragraph) < max_chars:
-                current_chunk += paragraph + "\n\n"
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = paragraph + "\n\n"
-        
-        if current_chunk:
-            chunks.append(current_chunk.strip())
-        
-        return chunks
+    def _chunk_text(self, text: str, max_tokens: int = None) -> List[str]:
+        """Divise le texte en chunks plus petits (phrases regroupées, rag.chunking)"""
+        if max_tokens is None:
+            max_tokens = settings.RAG_SETTINGS.get('CHUNK_SIZE', DEFAULT_MAX_TOKENS)
+        return chunk_text(text, strategy='sentence', max_tokens=max_tokens)
     
     def query(self, patient_id: str, query: str, session_id: str) -> str:
         """Traite une requête patient et retourne une réponse"""
@@ -0,0 +1,422 @@
+# rag/shared_index.py
+# Index FAISS partagé entre patients (mode VECTOR_STORAGE_MODE = 'shared')
+#
+# Tous les chunks sont rangés dans quelques shards faiss.IndexIDMap2 au lieu
+# d'un fichier vector_store.faiss par patient. L'identifiant FAISS d'un chunk
+# encode son patient et sa ligne dans le store du patient :
+#
+#     faiss_id = (patient_id << 32) | row
+#
+# La recherche d'un patient est restreinte à sa plage d'identifiants avec
+# un faiss.IDSelectorRange. Les métadonnées restent par patient
+# (metadata.jsonl, voir rag.vector_format) : le HybridRetriever fonctionne
+# sans modification sur SharedIndexStore.
+#
+# Les shards restent Flat quelle que soit leur taille : la recherche d'un
+# patient doit être exacte. Sur un IVF, le sélecteur de plage n'est appliqué
+# qu'aux nprobe listes visitées, où les quelques vecteurs du patient sont
+# rarement (~2 résultats sur 10 au nprobe par défaut). Sur un Flat, FAISS
+# teste le sélecteur pour chaque vecteur et ne calcule que les produits
+# scalaires des lignes du patient. Les shards IVF-Flat écrits avant sont
+# reconvertis en Flat à leur prochaine écriture.
+#
+# Un ajout de document n'écrit que ses vecteurs (un segment) et le
+# manifeste du shard, pas le shard entier (voir SharedFaissIndex).
+
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import faiss
+
+from rag.index_factory import index_contents, search_index, tail_limit, write_index_atomic, write_index_params
+from rag.tombstones import load_tombstones
+from rag.vector_format import LazyMetadata, LazyIdMap, METADATA_FILENAME, committed_rows, normalize_rows
+
+logger = logging.getLogger(__name__)
+
+ROW_BITS = 32
+MAX_ROWS_PER_PATIENT = 1 << ROW_BITS
+
+# Type des shards (voir plus haut) ; 'ivf_flat' reste lisible (shards antérieurs)
+SHARD_INDEX_TYPE = 'flat'
+MANIFEST_SUFFIX = '.segments.json'
+# Lecture en mmap : les shards sont partagés via le page cache entre processus
+_READ_FLAGS = getattr(faiss, 'IO_FLAG_MMAP_IFC', getattr(faiss, 'IO_FLAG_MMAP', 0))
+
+
+def patient_id_range(patient_id) -> Tuple[int, int]:
+    """Plage [début, fin) des identifiants FAISS d'un patient"""
+    start = int(patient_id) << ROW_BITS
+    return start, start + MAX_ROWS_PER_PATIENT
+
+
+def encode_ids(patient_id, rows: np.ndarray) -> np.ndarray:
+    return (np.int64(int(patient_id)) << np.int64(ROW_BITS)) | np.asarray(rows, dtype='int64')
+
+
+def decode_rows(ids: np.ndarray) -> np.ndarray:
+    return np.asarray(ids, dtype='int64') & np.int64(MAX_ROWS_PER_PATIENT - 1)
+
+
+class SharedFaissIndex:
+    """
+    Ensemble de shards FAISS partagés par tous les patients.
+
+    Le shard d'un patient est patient_id % n_shards. Un shard est une base
+    (IndexIDMap2 Flat) et des segments, un petit fichier par écriture ; son
+    manifeste (shard_NNN.segments.json, remplacé atomiquement) liste les
+    fichiers en vigueur et le nombre de lignes écrites par patient. Un ajout
+    n'écrit que son segment et le manifeste ; les segments sont fusionnés
+    au-delà de SHARED_INDEX_MAX_SEGMENTS, puis reversés dans la base quand
+    ils dépassent index_factory.tail_limit() de la base (réécritures de la
+    base espacées géométriquement). Remplacer des lignes déjà écrites
+    (compaction, reprise d'un ajout interrompu) refond le shard en une base.
+
+    Les écritures sont sérialisées par un verrou fcntl par shard ; les
+    lecteurs détectent un nouveau manifeste par stat() et rouvrent le shard
+    à la recherche suivante. Les shards antérieurs (shard_NNN.faiss seul,
+    sans manifeste) restent lisibles et sont repris à la première écriture.
+    """
+
+    def __init__(self, directory: str, dim: int, n_shards: int = 1, max_segments: int = 16):
+        self.directory = directory
+        self.dim = dim
+        self.n_shards = max(1, int(n_shards))
+        self.max_segments = max(1, int(max_segments))
+        self._shards: Dict[int, Tuple[Tuple, List[faiss.Index]]] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def shard_of(self, patient_id) -> int:
+        return int(patient_id) % self.n_shards
+
+    def shard_path(self, shard: int) -> str:
+        """Base d'un shard sans manifeste (format antérieur aux segments)"""
+        return os.path.join(self.directory, f'shard_{shard:03d}.faiss')
+
+    def manifest_path(self, shard: int) -> str:
+        return os.path.join(self.directory, f'shard_{shard:03d}{MANIFEST_SUFFIX}')
+
+    def params_filename(self, shard: int) -> str:
+        return f'shard_{shard:03d}.params.json'
+
+    def _part_path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _new_index(self) -> faiss.Index:
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(self.dim))
+
+    @staticmethod
+    def _stat_token(path: str) -> Optional[Tuple]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _shard_token(self, shard: int) -> Optional[Tuple]:
+        return self._stat_token(self.manifest_path(shard)) or self._stat_token(self.shard_path(shard))
+
+    def _read_manifest(self, shard: int) -> Dict:
+        """Manifeste du shard ; pour un shard antérieur, sa base seule (lignes par patient inconnues)"""
+        try:
+            with open(self.manifest_path(shard)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            legacy = os.path.basename(self.shard_path(shard))
+            base = [legacy, None] if os.path.exists(self.shard_path(shard)) else None
+            return {'generation': 0, 'base': base, 'segments': [], 'rows': None}
+
+    @staticmethod
+    def _parts(manifest: Dict) -> List[List]:
+        """[nom, lignes] de la base puis des segments, dans l'ordre d'écriture"""
+        return ([manifest['base']] if manifest['base'] else []) + manifest['segments']
+
+    def _shard(self, shard: int) -> List[faiss.Index]:
+        """Base et segments du shard en lecture, rouverts si le manifeste a été republié"""
+        for _ in range(3):
+            token = self._shard_token(shard)
+            with self._lock:
+                cached = self._shards.get(shard)
+                if cached is not None and cached[0] == token:
+                    return cached[1]
+            manifest = self._read_manifest(shard)
+            try:
+                indexes = [faiss.read_index(self._part_path(name), _READ_FLAGS) for name, _ in self._parts(manifest)]
+            except RuntimeError:
+                # Fusion concurrente : fichiers retirés entre la lecture du manifeste et leur ouverture
+                continue
+            with self._lock:
+                self._shards[shard] = (token, indexes)
+            return indexes
+        raise RuntimeError(f"Shard {shard} illisible ({self.directory}) : manifeste instable")
+
+    def patient_selector(self, patient_id, tombstones=None):
+        """Sélecteur des identifiants du patient, hors lignes supprimées (rag.tombstones)"""
+        start, end = patient_id_range(patient_id)
+        selector = faiss.IDSelectorRange(start, end)
+        if tombstones is None:
+            return selector
+        return tombstones.selector(encode=lambda rows: encode_ids(patient_id, rows), base=selector)
+
+    def search(self, patient_id, query_vec: np.ndarray, top_k: int = 5,
+               nprobe: Optional[int] = None, selector=None) -> List[Tuple[int, float]]:
+        """
+        Recherche exacte restreinte au patient, sur la base et les segments :
+        [(ligne, score)]. `nprobe` ne sert qu'aux bases IVF-Flat antérieures,
+        pas encore reconverties : toutes leurs listes sont alors visitées.
+        """
+        q = normalize_rows(query_vec)
+        selector = selector if selector is not None else self.patient_selector(patient_id)
+        hits = []
+        for index in self._shard(self.shard_of(patient_id)):
+            if index.ntotal == 0:
+                continue
+            probe = faiss.extract_index_ivf(index).nlist if not isinstance(index, faiss.IndexIDMap) else nprobe
+            D, I = search_index(index, q, min(top_k, index.ntotal), nprobe=probe, sel=selector)
+            hits += [(int(row), float(score)) for row, score, fid in zip(decode_rows(I[0]), D[0], I[0]) if fid >= 0]
+        return sorted(hits, key=lambda hit: hit[1], reverse=True)[:top_k]
+
+    def patient_vectors(self, patient_id, n_rows: int) -> np.ndarray:
+        """Vecteurs (normalisés) d'un patient, dans l'ordre de ses lignes"""
+        out = np.zeros((n_rows, self.dim), dtype='float32')
+        if n_rows == 0:
+            return out
+        start, end = patient_id_range(patient_id)
+        # Une ligne réécrite dans un segment plus récent remplace la précédente
+        for index in self._shard(self.shard_of(patient_id)):
+            if isinstance(index, faiss.IndexIDMap):
+                ids = faiss.vector_to_array(index.id_map).astype('int64')
+                mask = (ids >= start) & (ids < end)
+                vectors = np.vstack([index.reconstruct(int(i)) for i in ids[mask]]) if mask.any() else None
+            else:
+                # Base IVF-Flat antérieure : lecture des listes inversées
+                ids, vectors = index_contents(index)
+                mask = (ids >= start) & (ids < end)
+                vectors = vectors[mask]
+            rows = decode_rows(ids[mask])
+            keep = rows < n_rows
+            if keep.any():
+                out[rows[keep]] = vectors[keep]
+        return out
+
+    def replace_patient(self, patient_id, vectors: np.ndarray):
+        """Remplace tous les vecteurs d'un patient"""
+        self._write_rows(patient_id, vectors, start_row=0)
+
+    def append_patient(self, patient_id, vectors: np.ndarray, start_row: int):
+        """
+        Ajoute les vecteurs d'un patient à partir de la ligne `start_row`
+        (les lignes suivantes, restes d'un ajout interrompu, sont remplacées).
+        """
+        self._write_rows(patient_id, vectors, start_row=start_row)
+
+    def _write_rows(self, patient_id, vectors: np.ndarray, start_row: int):
+        vectors = normalize_rows(vectors) if len(vectors) else np.zeros((0, self.dim), dtype='float32')
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Dimension {vectors.shape[1]} incompatible avec l'index partagé ({self.dim})")
+        if start_row + len(vectors) >= MAX_ROWS_PER_PATIENT:
+            raise ValueError(f"Trop de vecteurs pour le patient {patient_id}")
+
+        shard = self.shard_of(patient_id)
+        ids = encode_ids(patient_id, np.arange(start_row, start_row + len(vectors)))
+        with open(f"{self.shard_path(shard)}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            manifest = self._writable_manifest(shard)
+            obsolete = []
+            key = str(int(patient_id))
+            removed = max(manifest['rows'].get(key, 0) - start_row, 0)
+            if removed:
+                # Lignes déjà écrites à remplacer : le shard est refondu en une base
+                start, _ = patient_id_range(patient_id)
+                obsolete = self._merge(shard, manifest, self._parts(manifest), into_base=True,
+                                       drop=(start + start_row, start + MAX_ROWS_PER_PATIENT), extra=(ids, vectors))
+            elif len(vectors):
+                part = self._new_index()
+                part.add_with_ids(vectors, ids)
+                manifest['segments'].append(self._write_part(shard, manifest, part))
+            obsolete += self._maybe_merge(shard, manifest)
+
+            rows = start_row + len(vectors)
+            if rows:
+                manifest['rows'][key] = rows
+            else:
+                manifest['rows'].pop(key, None)
+            self._publish(shard, manifest, obsolete)
+
+        logger.info(
+            f"🗂️ Shard {shard}: patient {patient_id} -> {len(vectors)} vecteurs à partir de la ligne {start_row} "
+            f"({removed} remplacés, {len(manifest['segments'])} segment(s))"
+        )
+
+    def _writable_manifest(self, shard: int) -> Dict:
+        """
+        Manifeste à modifier (sous verrou). Un shard antérieur est repris une
+        fois : lignes par patient relevées dans sa base, base IVF-Flat
+        reconvertie en Flat.
+        """
+        manifest = self._read_manifest(shard)
+        if manifest['rows'] is not None:
+            return manifest
+        manifest['rows'] = {}
+        if manifest['base'] is None:
+            return manifest
+        index = faiss.read_index(self._part_path(manifest['base'][0]))
+        ids, vectors = index_contents(index)
+        patients, rows = ids >> np.int64(ROW_BITS), decode_rows(ids)
+        for pid in np.unique(patients):
+            manifest['rows'][str(int(pid))] = int(rows[patients == pid].max()) + 1
+        if isinstance(index, faiss.IndexIDMap):
+            manifest['base'][1] = int(index.ntotal)
+        else:
+            # Base IVF-Flat : la recherche restreinte à un patient n'y est pas exacte
+            flat = self._new_index()
+            flat.add_with_ids(vectors, ids)
+            manifest['base'] = self._write_part(shard, manifest, flat)
+            write_index_params(self.directory, {'type': SHARD_INDEX_TYPE, 'factory': 'IDMap2,Flat',
+                                                'n_vectors': int(flat.ntotal)}, self.params_filename(shard))
+            logger.info(f"🧭 Shard {shard}: index IVF-Flat -> Flat ({flat.ntotal} vecteurs, recherche exacte)")
+        return manifest
+
+    def _maybe_merge(self, shard: int, manifest: Dict) -> List[str]:
+        """Fusion des segments au-delà de max_segments ; dans la base quand ils en dépassent tail_limit()"""
+        if len(manifest['segments']) <= self.max_segments:
+            return []
+        base_rows = manifest['base'][1] if manifest['base'] else 0
+        segment_rows = sum(rows for _, rows in manifest['segments'])
+        if segment_rows >= tail_limit(base_rows):
+            return self._merge(shard, manifest, self._parts(manifest), into_base=True)
+        return self._merge(shard, manifest, manifest['segments'], into_base=False)
+
+    def _merge(self, shard: int, manifest: Dict, parts: List[List], into_base: bool,
+               drop: Optional[Tuple[int, int]] = None, extra: Optional[Tuple] = None) -> List[str]:
+        """
+        Réunit `parts` (et `extra` = (ids, vecteurs)) en un fichier, sans les
+        identifiants de `drop` = [début, fin). Le résultat devient la base
+        (into_base) ou l'unique segment. Retourne les fichiers remplacés.
+        """
+        start = time.perf_counter()
+        merged = self._new_index()
+        for name, _ in parts:
+            ids, vectors = index_contents(faiss.read_index(self._part_path(name), _READ_FLAGS))
+            if drop is not None:
+                keep = (ids < drop[0]) | (ids >= drop[1])
+                ids, vectors = ids[keep], vectors[keep]
+            if len(ids):
+                # Un identifiant réécrit dans un segment plus récent remplace le précédent
+                merged.remove_ids(faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids)))
+                merged.add_with_ids(vectors, ids)
+        if extra is not None and len(extra[0]):
+            merged.add_with_ids(extra[1], extra[0])
+        part = self._write_part(shard, manifest, merged)
+        if into_base:
+            manifest['base'], manifest['segments'] = part, []
+        else:
+            manifest['segments'] = [part]
+        logger.info(f"🗂️ Shard {shard}: {len(parts)} fichier(s) fusionné(s) en "
+                    f"{'base' if into_base else 'segment'} ({merged.ntotal} vecteurs, "
+                    f"{time.perf_counter() - start:.2f}s)")
+        return [name for name, _ in parts]
+
+    def _write_part(self, shard: int, manifest: Dict, index: faiss.Index) -> List:
+        """Écrit un nouveau fichier du shard (invisible tant que le manifeste ne le cite pas)"""
+        manifest['generation'] += 1
+        name = f"shard_{shard:03d}.{manifest['generation']:08d}.faiss"
+        write_index_atomic(index, self._part_path(name))
+        return [name, int(index.ntotal)]
+
+    def _publish(self, shard: int, manifest: Dict, obsolete: List[str]):
+        """Remplace le manifeste (point de commit) puis supprime les fichiers qu'il ne cite plus"""
+        from rag.storage import write_json_atomic
+        write_json_atomic(self.manifest_path(shard), manifest)
+        current = {name for name, _ in self._parts(manifest)}
+        # Base d'un shard antérieur aux segments, reprise puis fusionnée ou reconvertie
+        obsolete = obsolete + [os.path.basename(self.shard_path(shard))]
+        for name in obsolete:
+            if name not in current and os.path.exists(self._part_path(name)):
+                # Les lecteurs qui l'ont déjà ouvert (mmap) gardent leur copie jusqu'à la réouverture
+                os.remove(self._part_path(name))
+
+    def remove_patient(self, patient_id):
+        self.replace_patient(patient_id, np.zeros((0, self.dim), dtype='float32'))
+
+    def stats(self) -> Dict:
+        return {
+            'shards': self.n_shards,
+            'loaded_shards': len(self._shards),
+            'segments': sum(max(len(indexes) - 1, 0) for _, indexes in self._shards.values()),
+            'ntotal': sum(index.ntotal for _, indexes in self._shards.values() for index in indexes),
+        }
+
+
+class SharedIndexStore:
+    """
+    Vue d'un patient sur l'index partagé, compatible avec VectorStoreHDF5 /
+    MmapVectorStore (meta, id_map, search, get_metadata).
+    """
+
+    def __init__(self, shared_index: SharedFaissIndex, patient_id, directory: str):
+        self.shared_index = shared_index
+        self.patient_id = patient_id
+        self.directory = directory
+        self.index = None
+        self.vectors = None
+        self.meta = []
+        self.id_map = {}
+        self.tombstones = None
+        self._selector = None
+
+    def load_store(self):
+        if not os.path.exists(os.path.join(self.directory, METADATA_FILENAME)):
+            raise FileNotFoundError(f"Métadonnées introuvables: {self.directory}")
+        self.meta = LazyMetadata(self.directory, committed_rows(self.directory))
+        self.id_map = LazyIdMap(self.meta, self.directory)
+        self.tombstones = load_tombstones(self.directory, self.meta)
+        self._selector = self.shared_index.patient_selector(self.patient_id, self.tombstones)
+
+    @property
+    def ntotal(self) -> int:
+        return len(self.meta)
+
+    def search(self, query_vec: np.ndarray, top_k: int = 5,
+               nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[Tuple[int, float]]:
+        # ef_search est accepté pour l'interface commune : les shards ne sont jamais HNSW
+        hits = self.shared_index.search(self.patient_id, query_vec, top_k, nprobe=nprobe, selector=self._selector)
+        # Une ligne absente des métadonnées signifie une écriture en cours : on l'ignore
+        return [(row, score) for row, score in hits if row < len(self.meta)]
+
+    def get_metadata(self, indices: List[int]) -> List[Dict]:
+        return [self.meta[i] for i in indices]
+
+
+_shared_index: Optional[SharedFaissIndex] = None
+_shared_index_lock = threading.Lock()
+
+
+def get_shared_index() -> SharedFaissIndex:
+    """Index partagé du processus (RAG_SETTINGS['SHARED_INDEX_DIR'] / ['SHARED_INDEX_SHARDS'])"""
+    global _shared_index
+    if _shared_index is None:
+        with _shared_index_lock:
+            if _shared_index is None:
+                from django.conf import settings
+                rag_settings = settings.RAG_SETTINGS
+                _shared_index = SharedFaissIndex(
+                    rag_settings.get('SHARED_INDEX_DIR',
+                                     os.path.join(rag_settings['VECTOR_STORE_DIR'], 'shared')),
+                    dim=rag_settings.get('EMBEDDING_DIM', 768),
+                    n_shards=rag_settings.get('SHARED_INDEX_SHARDS', 16),
+                    max_segments=rag_settings.get('SHARED_INDEX_MAX_SEGMENTS', 16),
+                )
+    return _shared_index
+
+
+def uses_shared_index() -> bool:
+    from django.conf import settings
+    return settings.RAG_SETTINGS.get('VECTOR_STORAGE_MODE', 'per_patient') == 'shared'
@@ -0,0 +1,42 @@
+# rag/signals.py
+# Invalidation des caches RAG quand le dossier d'un patient change
+
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from documents.models import DocumentUpload
+from patients.models import Patient
+from rag.answer_cache import get_answer_cache
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Patient)
+def invalidate_answer_cache_on_profile_change(sender, instance, created, **kwargs):
+    """Les réponses en cache dépendent des antécédents, allergies et traitements"""
+    if created:
+        return
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        answer_cache.invalidate_if_profile_changed(instance)
+
+
+@receiver(post_delete, sender=DocumentUpload)
+def remove_deleted_document_from_index(sender, instance, **kwargs):
+    """Un document supprimé disparaît des réponses dès la publication de ses tombstones"""
+    patient_id, document_id = instance.patient_id, instance.id
+
+    def _remove():
+        try:
+            from documents.tasks import remove_document_from_index
+            remove_document_from_index.delay(patient_id, document_id)
+        except Exception as e:
+            # Celery indisponible : le marquage est rapide, on le fait dans la requête
+            logger.warning(f"⚠️ Celery indisponible ({e}), retrait synchrone du document {document_id}")
+            from rag.index_writer import remove_document
+            remove_document(patient_id, document_id)
+
+    transaction.on_commit(_remove)
@@ -0,0 +1,340 @@
+# rag/sparse_bm25.py
+# Index BM25 compact en mémoire : postings CSR + scoring NumPy
+#
+# Remplace l'index Whoosh d'un patient par un fichier unique mappable :
+#
+#   en-tête (24 octets) : magic, version, longueur de l'en-tête JSON
+#   en-tête JSON        : statistiques (n_docs, longueur totale, B, K1) et
+#                         position / dtype / forme de chaque tableau
+#   tableaux alignés    : term_ptr (V+1), post_docs, post_tf (postings triés
+#                         par terme puis document), idf (V), doc_len (N),
+#                         doc_len_exact (N), vocabulaire et ids des chunks
+#
+# Le scoring reproduit scoring.BM25F de Whoosh (B=0.75, K1=1.2,
+# idf = log(N / (df + 1)) + 1, longueurs de champ quantifiées sur un octet)
+# et la requête ET implicite du QueryParser utilisé par HybridRetriever :
+# les (id, score) retournés sont interchangeables avec ceux de Whoosh.
+
+import os
+import re
+import json
+import struct
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MDBM25\0\0'
+FORMAT_VERSION = 1
+_PREFIX = struct.Struct('<8sIIQ')
+ALIGN = 64
+
+DEFAULT_B = 0.75
+DEFAULT_K1 = 1.2
+
+# Même découpage que FR_ANALYZER (RegexTokenizer | LowercaseFilter)
+TOKEN_PATTERN = re.compile(r"[0-9A-Za-zÀ-ÖØ-öø-ÿ]+")
+
+try:
+    # Quantification des longueurs de champ de Whoosh (un octet par document)
+    from whoosh.util.numeric import length_to_byte as _length_to_byte, byte_to_length as _byte_to_length
+
+    def quantize_length(length: int) -> float:
+        lbyte = _length_to_byte(length)
+        return float(_byte_to_length(lbyte)) if lbyte else 0.0
+except ImportError:  # Whoosh absent : longueurs exactes
+    def quantize_length(length: int) -> float:
+        return float(length)
+
+
+def tokenize(text: str) -> List[str]:
+    return [tok.lower() for tok in TOKEN_PATTERN.findall(text or '')]
+
+
+class SparseBM25Index:
+    """
+    Index BM25 d'un patient, ouvert en mmap (lecture) ou construit en mémoire.
+
+    search() retourne [(chunk_id, score)] comme la recherche Whoosh de
+    HybridRetriever. append() ajoute (ou remplace, même id) des documents
+    sans retokeniser les documents existants.
+    """
+
+    ARRAYS = ('term_ptr', 'post_docs', 'post_tf', 'idf', 'doc_len', 'doc_len_exact', 'terms_blob', 'ids_blob')
+
+    def __init__(self, arrays: Dict[str, np.ndarray], total_length: int,
+                 B: float = DEFAULT_B, K1: float = DEFAULT_K1, path: Optional[str] = None):
+        self.term_ptr = arrays['term_ptr']
+        self.post_docs = arrays['post_docs']
+        self.post_tf = arrays['post_tf']
+        self.idf = arrays['idf']
+        self.doc_len = arrays['doc_len']
+        self.doc_len_exact = arrays['doc_len_exact']
+        self._terms_blob = arrays['terms_blob']
+        self._ids_blob = arrays['ids_blob']
+        self.total_length = int(total_length)
+        self.B = B
+        self.K1 = K1
+        self.path = path
+        self._vocab: Optional[Dict[str, int]] = None
+        self._ids: Optional[List[str]] = None
+
+    # --- Propriétés ----------------------------------------------------------
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.doc_len)
+
+    @property
+    def n_terms(self) -> int:
+        return len(self.term_ptr) - 1
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name if not name.endswith('_blob') else f'_{name}').nbytes for name in self.ARRAYS)
+
+    @property
+    def vocab(self) -> Dict[str, int]:
+        if self._vocab is None:
+            terms = bytes(self._terms_blob).decode('utf-8').split('\n') if self.n_terms else []
+            self._vocab = {t: i for i, t in enumerate(terms)}
+        return self._vocab
+
+    @property
+    def ids(self) -> List[str]:
+        if self._ids is None:
+            self._ids = bytes(self._ids_blob).decode('utf-8').split('\n') if self.n_docs else []
+        return self._ids
+
+    # --- Recherche -----------------------------------------------------------
+
+    def _term_scores(self, tid: int, docs: np.ndarray, tf: np.ndarray, avgfl: float) -> np.ndarray:
+        dl = self.doc_len[docs].astype('float64')
+        tf = tf.astype('float64')
+        return self.idf[tid] * ((tf * (self.K1 + 1)) / (tf + self.K1 * ((1 - self.B) + self.B * dl / avgfl)))
+
+    def search(self, question: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """Requête ET sur les tokens de la question (comme QueryParser), meilleurs scores d'abord"""
+        tokens = list(dict.fromkeys(tokenize(question)))
+        if not tokens or self.n_docs == 0:
+            return []
+        vocab = self.vocab
+        tids = [vocab.get(t) for t in tokens]
+        if any(t is None for t in tids):
+            return []  # un terme absent : aucun document ne contient tous les termes
+
+        avgfl = (self.total_length / self.n_docs) or 1.0
+        # Intersection en partant du terme le plus rare
+        tids.sort(key=lambda t: self.term_ptr[t + 1] - self.term_ptr[t])
+        first = tids[0]
+        s, e = self.term_ptr[first], self.term_ptr[first + 1]
+        cand = np.asarray(self.post_docs[s:e])
+        acc = self._term_scores(first, cand, np.asarray(self.post_tf[s:e]), avgfl)
+
+        for tid in tids[1:]:
+            if not len(cand):
+                return []
+            s, e = self.term_ptr[tid], self.term_ptr[tid + 1]
+            docs = np.asarray(self.post_docs[s:e])
+            pos = np.searchsorted(docs, cand)
+            found = pos < len(docs)
+            found[found] = docs[pos[found]] == cand[found]
+            cand, acc, pos = cand[found], acc[found], pos[found]
+            acc = acc + self._term_scores(tid, cand, np.asarray(self.post_tf[s:e])[pos], avgfl)
+
+        if not len(cand):
+            return []
+        k = min(limit, len(cand))
+        if k < len(cand):
+            top = np.argpartition(-acc, k - 1)[:k]
+            cand, acc = cand[top], acc[top]
+        # Score décroissant, puis numéro de document croissant (ordre de Whoosh)
+        order = np.lexsort((cand, -acc))
+        ids = self.ids
+        return [(ids[int(cand[i])], float(acc[i])) for i in order]
+
+    # --- Construction / ajouts -----------------------------------------------
+
+    @classmethod
+    def build(cls, documents: Iterable[Tuple[str, str]], B: float = DEFAULT_B, K1: float = DEFAULT_K1):
+        return cls.empty(B=B, K1=K1).append(documents)
+
+    @classmethod
+    def empty(cls, B: float = DEFAULT_B, K1: float = DEFAULT_K1):
+        arrays = {
+            'term_ptr': np.zeros(1, dtype='int64'),
+            'post_docs': np.zeros(0, dtype='int32'),
+            'post_tf': np.zeros(0, dtype='float32'),
+            'idf': np.zeros(0, dtype='float64'),
+            'doc_len': np.zeros(0, dtype='float32'),
+            'doc_len_exact': np.zeros(0, dtype='int32'),
+            'terms_blob': np.zeros(0, dtype='uint8'),
+            'ids_blob': np.zeros(0, dtype='uint8'),
+        }
+        return cls(arrays, 0, B=B, K1=K1)
+
+    def append(self, documents: Iterable[Tuple[str, str]]) -> 'SparseBM25Index':
+        """
+        Nouvel index contenant les documents existants plus `documents`
+        [(chunk_id, texte)]. Un id déjà présent est remplacé (comme
+        update_document de Whoosh). Seuls les nouveaux textes sont tokenisés.
+        """
+        documents = list(documents)
+        # Dernière version de chaque id dans le lot
+        latest = {doc_id: text for doc_id, text in documents}
+        replaced = set(latest)
+
+        old_ids = self.ids
+        keep_docs = np.array([i for i, doc_id in enumerate(old_ids) if doc_id not in replaced], dtype='int64')
+        vocab = dict(self.vocab)
+        terms = list(vocab)
+
+        # Postings existants en COO (terme, doc, tf), documents supprimés filtrés
+        old_terms = np.repeat(np.arange(self.n_terms, dtype='int64'), np.diff(self.term_ptr))
+        old_docs = np.asarray(self.post_docs, dtype='int64')
+        remap = np.full(self.n_docs, -1, dtype='int64')
+        remap[keep_docs] = np.arange(len(keep_docs))
+        mask = remap[old_docs] >= 0 if len(old_docs) else np.zeros(0, dtype=bool)
+        coo_terms = [old_terms[mask]]
+        coo_docs = [remap[old_docs[mask]]]
+        coo_tf = [np.asarray(self.post_tf, dtype='float32')[mask]]
+
+        ids = [old_ids[i] for i in keep_docs]
+        lengths = [np.asarray(self.doc_len_exact, dtype='int32')[keep_docs]]
+        new_lengths = []
+        new_terms, new_docs, new_tf = [], [], []
+        for doc_id, text in latest.items():
+            docnum = len(ids)
+            ids.append(doc_id)
+            tokens = tokenize(text)
+            new_lengths.append(len(tokens))
+            counts: Dict[str, int] = {}
+            for tok in tokens:
+                counts[tok] = counts.get(tok, 0) + 1
+            for tok, tf in counts.items():
+                tid = vocab.get(tok)
+                if tid is None:
+                    tid = vocab[tok] = len(terms)
+                    terms.append(tok)
+                new_terms.append(tid)
+                new_docs.append(docnum)
+                new_tf.append(tf)
+        coo_terms.append(np.asarray(new_terms, dtype='int64'))
+        coo_docs.append(np.asarray(new_docs, dtype='int64'))
+        coo_tf.append(np.asarray(new_tf, dtype='float32'))
+        lengths.append(np.asarray(new_lengths, dtype='int32'))
+
+        all_terms = np.concatenate(coo_terms)
+        all_docs = np.concatenate(coo_docs)
+        all_tf = np.concatenate(coo_tf)
+        doc_len_exact = np.concatenate(lengths)
+
+        # Vocabulaire compacté : termes sans posting retirés
+        df = np.bincount(all_terms, minlength=len(terms))
+        live = np.nonzero(df)[0]
+        term_remap = np.full(len(terms), -1, dtype='int64')
+        term_remap[live] = np.arange(len(live))
+        all_terms = term_remap[all_terms]
+        df = df[live]
+        terms = [terms[i] for i in live]
+
+        order = np.lexsort((all_docs, all_terms))
+        term_ptr = np.zeros(len(terms) + 1, dtype='int64')
+        np.cumsum(df, out=term_ptr[1:])
+
+        n_docs = len(ids)
+        arrays = {
+            'term_ptr': term_ptr,
+            'post_docs': all_docs[order].astype('int32'),
+            'post_tf': all_tf[order],
+            'idf': (np.log(n_docs / (df + 1.0)) + 1.0) if n_docs else np.zeros(0, dtype='float64'),
+            'doc_len': np.array([quantize_length(int(n)) for n in doc_len_exact], dtype='float32'),
+            'doc_len_exact': doc_len_exact,
+            'terms_blob': np.frombuffer('\n'.join(terms).encode('utf-8'), dtype='uint8'),
+            'ids_blob': np.frombuffer('\n'.join(ids).encode('utf-8'), dtype='uint8'),
+        }
+        index = SparseBM25Index(arrays, int(doc_len_exact.sum()), B=self.B, K1=self.K1)
+        index._vocab = {t: i for i, t in enumerate(terms)}
+        index._ids = ids
+        return index
+
+    # --- Persistance ---------------------------------------------------------
+
+    def save(self, path: str):
+        """Écrit l'index dans un fichier unique (remplacement atomique)"""
+        arrays = {name: np.ascontiguousarray(getattr(self, name if not name.endswith('_blob') else f'_{name}'))
+                  for name in self.ARRAYS}
+        header = {'n_docs': self.n_docs, 'n_terms': self.n_terms, 'total_length': self.total_length,
+                  'B': self.B, 'K1': self.K1, 'arrays': {}}
+
+        # La taille de l'en-tête JSON détermine les offsets : itérer jusqu'à stabilité
+        data_start = 0
+        while True:
+            offset = data_start
+            layout = {}
+            for name, arr in arrays.items():
+                layout[name] = [offset, arr.dtype.str, list(arr.shape)]
+                offset = _align(offset + arr.nbytes)
+            header['arrays'] = layout
+            header_bytes = json.dumps(header).encode('utf-8')
+            needed = _align(_PREFIX.size + len(header_bytes))
+            if needed <= data_start:
+                break
+            data_start = needed
+
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, 0, len(header_bytes)))
+            f.write(header_bytes)
+            for name, arr in arrays.items():
+                f.seek(header['arrays'][name][0])
+                f.write(arr.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self.path = path
+
+    @classmethod
+    def open(cls, path: str) -> 'SparseBM25Index':
+        """Ouvre l'index en mmap (les postings restent dans le page cache)"""
+        with open(path, 'rb') as f:
+            magic, version, _, header_len = _PREFIX.unpack(f.read(_PREFIX.size))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"Index BM25 non reconnu: {path}")
+            header = json.loads(f.read(header_len).decode('utf-8'))
+        arrays = {}
+        for name, (offset, dtype, shape) in header['arrays'].items():
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=tuple(shape))
+        return cls(arrays, header['total_length'], B=header['B'], K1=header['K1'], path=path)
+
+    @classmethod
+    def append_to_file(cls, path: str, documents: Iterable[Tuple[str, str]]) -> 'SparseBM25Index':
+        base = cls.open(path) if os.path.exists(path) else cls.empty()
+        index = base.append(documents)
+        index.save(path)
+        return index
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def sparse_path_for(bm25_dir: str) -> str:
+    """Fichier de l'index compact, à côté du dossier Whoosh du patient"""
+    return f"{bm25_dir.rstrip(os.sep)}.sbm25"
+
+
+def open_sparse_bm25(path: str) -> Optional[SparseBM25Index]:
+    if not os.path.exists(path):
+        return None
+    return SparseBM25Index.open(path)
+
+
+def sparse_engine_enabled() -> bool:
+    from django.conf import settings
+    return settings.RAG_SETTINGS.get('BM25_ENGINE', 'sparse') == 'sparse'
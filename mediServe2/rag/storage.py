@@ -0,0 +1,92 @@
+# rag/storage.py
+# Emplacements des stores par patient et publication de leur version
+
+import os
+import json
+import time
+import uuid
+import logging
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = 'manifest.json'
+
+
+def patient_vector_dir(patient_id) -> str:
+    return os.path.join(settings.RAG_SETTINGS['VECTOR_STORE_DIR'], f'patient_{patient_id}')
+
+
+def patient_bm25_dir(patient_id) -> str:
+    return os.path.join(settings.RAG_SETTINGS['BM25_INDEX_DIR'], f'patient_{patient_id}_bm25')
+
+
+def patient_store_paths(patient_id) -> Dict[str, str]:
+    """Chemins des fichiers du store d'un patient"""
+    vector_dir = patient_vector_dir(patient_id)
+    return {
+        'vector_dir': vector_dir,
+        'vectors': os.path.join(vector_dir, 'vectors.mvec'),
+        'metadata': os.path.join(vector_dir, 'metadata.jsonl'),
+        'hdf5': os.path.join(vector_dir, 'vector_store.h5'),
+        'faiss': os.path.join(vector_dir, 'vector_store.faiss'),
+        'manifest': os.path.join(vector_dir, MANIFEST_FILENAME),
+        'bm25': patient_bm25_dir(patient_id),
+        'bm25_sparse': f"{patient_bm25_dir(patient_id)}.sbm25",
+    }
+
+
+def write_json_atomic(path: str, data: Dict):
+    """Écrit un fichier JSON de manière atomique (fichier temporaire + rename)"""
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class StoreVersion:
+    """
+    Version publiée du store d'un patient.
+
+    Chaque publication remplace atomiquement manifest.json (nouvel inode),
+    le jeton de version est donc lisible avec un simple stat() sans lire
+    le contenu du fichier. Les stores antérieurs sans manifeste sont
+    versionnés par le stat du fichier HDF5.
+    """
+
+    @staticmethod
+    def current(patient_id) -> Optional[Tuple]:
+        paths = patient_store_paths(patient_id)
+        for key in ('manifest', 'hdf5'):
+            try:
+                st = os.stat(paths[key])
+            except FileNotFoundError:
+                continue
+            return (key, st.st_ino, st.st_mtime_ns, st.st_size)
+        return None
+
+    @staticmethod
+    def read_manifest(patient_id) -> Dict:
+        path = patient_store_paths(patient_id)['manifest']
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    @staticmethod
+    def publish(patient_id, **extra) -> str:
+        """Publie une nouvelle version du store (à appeler après chaque écriture)"""
+        paths = patient_store_paths(patient_id)
+        os.makedirs(paths['vector_dir'], exist_ok=True)
+        manifest = StoreVersion.read_manifest(patient_id)
+        manifest.update(extra)
+        manifest['version'] = uuid.uuid4().hex
+        manifest['published_at'] = time.time()
+        write_json_atomic(paths['manifest'], manifest)
+        logger.info(f"📦 Store patient {patient_id} publié (version {manifest['version'][:8]})")
+        return manifest['version']
@@ -0,0 +1,146 @@
+# rag/tombstones.py
+# Suppression logique des lignes d'un store patient (documents supprimés ou remplacés)
+#
+# Les lignes d'un document supprimé restent dans vectors.mvec / metadata.jsonl
+# / l'index FAISS : un bitmap (tombstones.bin, 1 bit par ligne) les masque à
+# la recherche, via un sélecteur FAISS (IDSelectorNot) côté dense et un
+# filtre sur les identifiants côté BM25. La compaction
+# (PatientIndexWriter.compact) les retire physiquement.
+#
+# Les chunks d'un document retraité reçoivent de nouveaux identifiants
+# (rag.vectorizer, suffixe propre à chaque indexation) ; pour les stores
+# indexés avant, un identifiant porté aussi par une ligne vivante n'est
+# jamais considéré comme supprimé (live_deleted_ids).
+#
+# Le fichier est relu au chargement du store, donc à chaque nouvelle version
+# publiée (StoreVersion) : une suppression est visible dès la publication.
+
+import os
+import logging
+from typing import Callable, Iterable, List, Optional, Sequence, Set
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOMBSTONES_FILENAME = 'tombstones.bin'
+
+
+def tombstones_path(directory: str) -> str:
+    return os.path.join(directory, TOMBSTONES_FILENAME)
+
+
+def read_tombstone_mask(directory: str, rows: int) -> np.ndarray:
+    """Masque booléen des lignes supprimées (False partout si aucun fichier)"""
+    mask = np.zeros(rows, dtype=bool)
+    try:
+        with open(tombstones_path(directory), 'rb') as f:
+            bits = np.unpackbits(np.frombuffer(f.read(), dtype=np.uint8), bitorder='little').astype(bool)
+    except FileNotFoundError:
+        return mask
+    n = min(rows, len(bits))
+    mask[:n] = bits[:n]
+    return mask
+
+
+def write_tombstone_mask(directory: str, mask: np.ndarray):
+    """Écriture atomique du bitmap ; supprime le fichier s'il n'y a plus de ligne supprimée"""
+    path = tombstones_path(directory)
+    if not mask.any():
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(np.packbits(mask, bitorder='little').tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Tombstones:
+    """
+    Lignes supprimées d'un store chargé : masque, identifiants de chunks
+    (filtre BM25) et sélecteur FAISS excluant ces lignes.
+    """
+
+    def __init__(self, mask: np.ndarray, deleted_ids: Set[str]):
+        self.mask = mask
+        self.deleted_ids = deleted_ids
+        self._rows = np.flatnonzero(mask).astype('int64')
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def rows(self) -> np.ndarray:
+        return self._rows
+
+    def is_deleted(self, row: int) -> bool:
+        return bool(row < len(self.mask) and self.mask[row])
+
+    def selector(self, encode: Optional[Callable[[np.ndarray], np.ndarray]] = None, base=None):
+        """
+        Sélecteur FAISS des lignes vivantes (à construire une fois par store
+        chargé). `encode` convertit les lignes en identifiants FAISS (index
+        partagé) ; `base` est combiné en ET (plage du patient).
+        """
+        import faiss
+        if encode is None:
+            bitmap = np.packbits(self.mask, bitorder='little')
+            deleted = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+            refs = [bitmap, deleted]
+        else:
+            ids = np.ascontiguousarray(encode(self._rows), dtype='int64')
+            deleted = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+            refs = [ids, deleted]
+        selector = faiss.IDSelectorNot(deleted)
+        if base is not None:
+            refs.append(selector)
+            selector = faiss.IDSelectorAnd(base, selector)
+            refs.append(base)
+        # Les sélecteurs FAISS ne gardent que des pointeurs : on conserve leurs dépendances
+        selector.referenced_objects = refs
+        return selector
+
+
+def row_ids(directory: str, meta: Sequence) -> List[str]:
+    """Identifiant de chaque ligne (metadata.ids s'il existe, sans décoder les métadonnées)"""
+    from rag.vector_format import LazyMetadata, read_ids
+    if isinstance(meta, LazyMetadata):
+        try:
+            return read_ids(directory)[:len(meta)]
+        except FileNotFoundError:
+            pass
+    return [meta[i]['id'] for i in range(len(meta))]
+
+
+def live_deleted_ids(ids: Sequence[str], mask: np.ndarray) -> Set[str]:
+    """
+    Identifiants des seules lignes supprimées : un identifiant repris par une
+    ligne vivante (document retraité avant les identifiants par indexation)
+    désigne le chunk actuel dans les index BM25 et ne doit être ni filtré ni purgé.
+    """
+    deleted = {ids[int(row)] for row in np.flatnonzero(mask)}
+    if not deleted:
+        return deleted
+    return deleted - {ids[int(row)] for row in np.flatnonzero(~mask)}
+
+
+def load_tombstones(directory: str, meta: Sequence) -> Optional[Tombstones]:
+    """Tombstones du store chargé (None s'il n'y en a pas : aucun surcoût à la recherche)"""
+    if not os.path.exists(tombstones_path(directory)):
+        return None
+    mask = read_tombstone_mask(directory, len(meta))
+    if not mask.any():
+        return None
+    return Tombstones(mask, live_deleted_ids(row_ids(directory, meta), mask))
+
+
+def mark_rows(directory: str, rows: int, deleted: Iterable[int]) -> int:
+    """Ajoute des lignes au bitmap ; retourne le nombre total de lignes supprimées"""
+    mask = read_tombstone_mask(directory, rows)
+    deleted = np.asarray(list(deleted), dtype='int64')
+    mask[deleted[(deleted >= 0) & (deleted < rows)]] = True
+    write_tombstone_mask(directory, mask)
+    return int(mask.sum())
@@ -0,0 +1,444 @@
+# rag/vector_format.py
+# Format de stockage des vecteurs mappé en mémoire (numpy.memmap)
+#
+# Fichier vectors.mvec :
+#   en-tête de 64 octets  : magic, version, dtype, nombre de lignes, dimension
+#   corps                 : matrice contiguë (rows x dim) float32 ou float16
+# Fichiers associés :
+#   metadata.jsonl        : une ligne JSON par vecteur
+#   metadata.idx          : offsets (uint64, rows + 1) des lignes de metadata.jsonl
+#   metadata.ids          : identifiants des chunks, un par ligne (sans JSON)
+#
+# L'ouverture est O(1) : seul l'en-tête est lu, les pages de la matrice sont
+# chargées à la demande et partagées via le page cache entre tous les
+# processus gunicorn / Celery qui ouvrent le même store.
+#
+# Les nouveaux documents sont ajoutés en fin de fichiers (append_store).
+# Le nombre de lignes publié dans manifest.json (n_vectors) fait foi : les
+# lignes ajoutées au-delà ne sont visibles qu'après la publication du
+# manifeste, et une écriture interrompue est tronquée à l'ajout suivant.
+
+import os
+import json
+import mmap
+import struct
+import logging
+from collections.abc import Mapping, Sequence
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MDVSTORE'
+FORMAT_VERSION = 1
+HEADER_SIZE = 64
+_HEADER_STRUCT = struct.Struct('<8sIIQI')
+
+DTYPE_CODES = {'float32': 1, 'float16': 2}
+CODE_DTYPES = {v: k for k, v in DTYPE_CODES.items()}
+
+VECTORS_FILENAME = 'vectors.mvec'
+METADATA_FILENAME = 'metadata.jsonl'
+METADATA_INDEX_FILENAME = 'metadata.idx'
+METADATA_IDS_FILENAME = 'metadata.ids'
+
+
+class VectorFormatError(ValueError):
+    """Fichier de vecteurs invalide ou incompatible"""
+
+
+def _pack_header(rows: int, dim: int, dtype: str) -> bytes:
+    header = _HEADER_STRUCT.pack(MAGIC, FORMAT_VERSION, DTYPE_CODES[dtype], rows, dim)
+    return header.ljust(HEADER_SIZE, b'\0')
+
+
+def read_header(path: str) -> Tuple[int, int, str]:
+    """Retourne (rows, dim, dtype) sans lire la matrice"""
+    with open(path, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+    if len(raw) < HEADER_SIZE:
+        raise VectorFormatError(f"En-tête tronqué: {path}")
+    magic, version, dtype_code, rows, dim = _HEADER_STRUCT.unpack_from(raw)
+    if magic != MAGIC:
+        raise VectorFormatError(f"Fichier non reconnu (magic {magic!r}): {path}")
+    if version != FORMAT_VERSION:
+        raise VectorFormatError(f"Version de format non supportée ({version}): {path}")
+    if dtype_code not in CODE_DTYPES:
+        raise VectorFormatError(f"Type de données inconnu ({dtype_code}): {path}")
+    return rows, dim, CODE_DTYPES[dtype_code]
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Normalisation L2 vectorisée (copie float32)"""
+    vectors = np.asarray(vectors, dtype='float32')
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def write_vectors(path: str, vectors: np.ndarray, dtype: str = 'float32'):
+    """Écrit la matrice complète de manière atomique"""
+    if dtype not in DTYPE_CODES:
+        raise VectorFormatError(f"dtype non supporté: {dtype}")
+    matrix = np.ascontiguousarray(vectors, dtype=dtype)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(_pack_header(matrix.shape[0], matrix.shape[1], dtype))
+        f.write(matrix.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def open_vectors(path: str, rows: Optional[int] = None) -> np.memmap:
+    """Ouvre la matrice (limitée à `rows` lignes) en lecture seule via numpy.memmap (O(1))"""
+    header_rows, dim, dtype = read_header(path)
+    rows = header_rows if rows is None else min(rows, header_rows)
+    if rows == 0:
+        return np.zeros((0, dim), dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(rows, dim))
+
+
+def write_metadata(directory: str, metadata: Iterable[Dict]):
+    """Écrit metadata.jsonl, son index d'offsets et la liste des ids de manière atomique"""
+    jsonl_path = os.path.join(directory, METADATA_FILENAME)
+    idx_path = os.path.join(directory, METADATA_INDEX_FILENAME)
+    ids_path = os.path.join(directory, METADATA_IDS_FILENAME)
+    tmp_jsonl = f"{jsonl_path}.tmp.{os.getpid()}"
+    tmp_idx = f"{idx_path}.tmp.{os.getpid()}"
+    tmp_ids = f"{ids_path}.tmp.{os.getpid()}"
+
+    offsets = [0]
+    with open(tmp_jsonl, 'wb') as f, open(tmp_ids, 'w', encoding='utf-8') as ids_file:
+        for i, meta in enumerate(metadata):
+            line = json.dumps(meta, ensure_ascii=False).encode('utf-8') + b'\n'
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+            ids_file.write(f"{meta.get('id', i)}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    np.asarray(offsets, dtype='<u8').tofile(tmp_idx)
+
+    os.replace(tmp_ids, ids_path)
+    os.replace(tmp_jsonl, jsonl_path)
+    os.replace(tmp_idx, idx_path)
+
+
+def committed_rows(directory: str) -> Optional[int]:
+    """Nombre de lignes publié dans manifest.json (None pour un store sans manifeste)"""
+    from rag.storage import MANIFEST_FILENAME
+    try:
+        with open(os.path.join(directory, MANIFEST_FILENAME)) as f:
+            rows = json.load(f).get('n_vectors')
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return None if rows is None else int(rows)
+
+
+def _truncate_and_append(path: str, size: int, data: bytes):
+    """Coupe le fichier à `size` octets (écriture interrompue) puis ajoute `data`"""
+    with open(path, 'r+b') as f:
+        f.truncate(size)
+        f.seek(size)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _metadata_state(directory: str) -> Tuple[np.ndarray, bytes, int]:
+    """Offsets, contenu de metadata.ids et nombre de lignes complètes des métadonnées"""
+    offsets = np.fromfile(os.path.join(directory, METADATA_INDEX_FILENAME), dtype='<u8')
+    with open(os.path.join(directory, METADATA_IDS_FILENAME), 'rb') as f:
+        ids_raw = f.read()
+    return offsets, ids_raw, min(len(offsets) - 1, ids_raw.count(b'\n'))
+
+
+def _append_metadata_at(directory: str, metadata: List[Dict], base: int, offsets: np.ndarray, ids_raw: bytes):
+    """Écrit les métadonnées à partir de la ligne `base` (les lignes suivantes sont écrasées)"""
+    lines = [json.dumps(meta, ensure_ascii=False).encode('utf-8') + b'\n' for meta in metadata]
+    new_offsets = int(offsets[base]) + np.cumsum([len(line) for line in lines], dtype='<u8')
+    newlines = np.flatnonzero(np.frombuffer(ids_raw, dtype=np.uint8) == ord('\n'))
+    ids_size = int(newlines[base - 1]) + 1 if base else 0
+    _truncate_and_append(os.path.join(directory, METADATA_FILENAME), int(offsets[base]), b''.join(lines))
+    _truncate_and_append(os.path.join(directory, METADATA_INDEX_FILENAME), (base + 1) * 8,
+                         new_offsets.astype('<u8').tobytes())
+    _truncate_and_append(os.path.join(directory, METADATA_IDS_FILENAME), ids_size, ''.join(
+        f"{meta.get('id', base + i)}\n" for i, meta in enumerate(metadata)).encode('utf-8'))
+
+
+def append_metadata(directory: str, metadata: List[Dict], committed: Optional[int] = None) -> int:
+    """Ajoute des métadonnées seules (index partagé), retourne le nouveau nombre de lignes"""
+    offsets, ids_raw, base = _metadata_state(directory)
+    if committed is not None:
+        base = min(base, committed)
+    if metadata:
+        _append_metadata_at(directory, metadata, base, offsets, ids_raw)
+    return base + len(metadata)
+
+
+def append_store(directory: str, vectors: np.ndarray, metadata: List[Dict],
+                 committed: Optional[int] = None) -> int:
+    """
+    Ajoute des lignes en fin de store sans réécrire l'existant.
+
+    `committed` est le nombre de lignes publiées (manifeste) : tout ce qui
+    le dépasse provient d'un ajout interrompu et est écrasé. Les lecteurs
+    ne voient les nouvelles lignes qu'après StoreVersion.publish(n_vectors=...).
+    Retourne le nouveau nombre de lignes.
+    """
+    if len(vectors) != len(metadata):
+        raise VectorFormatError(f"{len(vectors)} vecteurs pour {len(metadata)} métadonnées")
+    vectors_path = os.path.join(directory, VECTORS_FILENAME)
+    rows, dim, dtype = read_header(vectors_path)
+    offsets, ids_raw, meta_rows = _metadata_state(directory)
+    base = min(rows, meta_rows) if committed is None else min(rows, meta_rows, committed)
+    if not len(vectors):
+        return base
+
+    matrix = np.ascontiguousarray(normalize_rows(vectors), dtype=dtype)
+    if matrix.shape[1] != dim:
+        raise VectorFormatError(f"Dimension {matrix.shape[1]} incompatible avec le store ({dim})")
+    _append_metadata_at(directory, metadata, base, offsets, ids_raw)
+
+    # Vecteurs, puis en-tête : un lecteur ne mappe jamais plus que les lignes publiées
+    total = base + len(matrix)
+    _truncate_and_append(vectors_path, HEADER_SIZE + base * dim * matrix.itemsize, matrix.tobytes())
+    with open(vectors_path, 'r+b') as f:
+        f.write(_pack_header(total, dim, dtype))
+        f.flush()
+        os.fsync(f.fileno())
+    return total
+
+
+def read_ids(directory: str) -> List[str]:
+    """Identifiants des chunks dans l'ordre des lignes du store"""
+    with open(os.path.join(directory, METADATA_IDS_FILENAME), encoding='utf-8') as f:
+        return f.read().splitlines()
+
+
+class LazyMetadata(Sequence):
+    """
+    Liste de métadonnées décodées à la demande depuis metadata.jsonl (mmap).
+
+    Seules les lignes réellement consultées (résultats de recherche) sont
+    décodées ; les entrées décodées sont gardées en mémoire.
+    """
+
+    def __init__(self, directory: str, rows: Optional[int] = None):
+        jsonl_path = os.path.join(directory, METADATA_FILENAME)
+        idx_path = os.path.join(directory, METADATA_INDEX_FILENAME)
+        self._offsets = np.fromfile(idx_path, dtype='<u8')
+        self._size = max(len(self._offsets) - 1, 0)
+        if rows is not None:
+            self._size = min(self._size, rows)
+        self._file = open(jsonl_path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._size else None
+        self._decoded: Dict[int, Dict] = {}
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        return int(self._offsets[self._size]) + (self._size + 1) * 8 if self._size else 0
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._size))]
+        if i < 0:
+            i += self._size
+        if not 0 <= i < self._size:
+            raise IndexError(i)
+        meta = self._decoded.get(i)
+        if meta is None:
+            raw = self._mm[int(self._offsets[i]):int(self._offsets[i + 1])]
+            meta = json.loads(raw.decode('utf-8'))
+            if 'id' not in meta:
+                meta['id'] = str(i)
+            self._decoded[i] = meta
+        return meta
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._file.close()
+
+
+class LazyIdMap(Mapping):
+    """Dictionnaire id -> métadonnées, construit depuis metadata.ids à la première consultation"""
+
+    def __init__(self, meta: Sequence, directory: str):
+        self._meta = meta
+        self._directory = directory
+        self._rows: Optional[Dict[str, int]] = None
+
+    def _ensure(self):
+        if self._rows is None:
+            self._rows = {mid: i for i, mid in enumerate(read_ids(self._directory)[:len(self._meta)])}
+        return self._rows
+
+    def row_of(self, key) -> int:
+        return self._ensure()[key]
+
+    def __getitem__(self, key):
+        return self._meta[self._ensure()[key]]
+
+    def __contains__(self, key):
+        return key in self._ensure()
+
+    def __iter__(self):
+        return iter(self._ensure())
+
+    def __len__(self):
+        return len(self._meta)
+
+
+class MmapVectorStore:
+    """
+    Store de vecteurs mappé en mémoire, compatible avec VectorStoreHDF5
+    (attributs vectors / meta / id_map / index, méthodes search / get_metadata).
+
+    Les vecteurs étant normalisés à l'écriture, la recherche exacte par
+    produit scalaire se fait directement sur la matrice mappée, sans
+    charger d'index FAISS en mémoire. Pour les gros stores, un index
+    approché (IVF / HNSW, voir rag.index_factory) est chargé si
+    index_params.json en déclare un. S'il est compressé (float16, SQ8, PQ),
+    ses candidats sont re-scorés sur la matrice mappée : seul l'index
+    compressé réside en mémoire.
+    """
+
+    SEARCH_CHUNK_ROWS = 65536
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, VECTORS_FILENAME)
+        self.faiss_path = os.path.join(directory, 'vector_store.faiss')
+        self.index = None
+        self.index_params: Dict = {}
+        self.vectors: Optional[np.ndarray] = None
+        self.meta: Sequence = []
+        self.id_map: Mapping = {}
+        # Lignes des documents supprimés (rag.tombstones), masquées à la recherche
+        self.tombstones = None
+        self._live_selector = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def load_store(self):
+        from rag.tombstones import load_tombstones
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Vector store introuvable: {self.path}")
+        # Seules les lignes publiées (manifest.json) sont visibles
+        rows = committed_rows(self.directory)
+        self.vectors = open_vectors(self.path, rows)
+        self.meta = LazyMetadata(self.directory, rows)
+        self.id_map = LazyIdMap(self.meta, self.directory)
+        if len(self.meta) != self.vectors.shape[0]:
+            raise VectorFormatError(
+                f"Incohérence store {self.directory}: {self.vectors.shape[0]} vecteurs, {len(self.meta)} métadonnées"
+            )
+        self.tombstones = load_tombstones(self.directory, self.meta)
+        self._load_ann_index()
+        if self.index is not None and self.tombstones is not None:
+            self._live_selector = self.tombstones.selector()
+
+    def _load_ann_index(self):
+        """Charge l'index déclaré dans index_params.json (les stores Flat non compressés restent en numpy)"""
+        from rag.index_factory import read_index_params
+        self.index_params = read_index_params(self.directory)
+        exact_scan = self.index_params.get('type', 'flat') == 'flat' and self.index_params.get('codec', 'none') == 'none'
+        if exact_scan or not os.path.exists(self.faiss_path):
+            return
+        import faiss
+        index = faiss.read_index(self.faiss_path)
+        if index.ntotal > self.ntotal:
+            # Index d'une version plus récente que les lignes publiées : la recherche exacte reste correcte
+            self.logger.warning(
+                f"⚠️ Index {self.index_params['type']} en avance ({index.ntotal} vecteurs pour {self.ntotal}), "
+                f"recherche exacte sur {self.directory}"
+            )
+            return
+        # Lignes ajoutées depuis la dernière écriture de l'index : parcourues exactement (search_with_tail)
+        self.index = index
+
+    @property
+    def ntotal(self) -> int:
+        return 0 if self.vectors is None else self.vectors.shape[0]
+
+    def search(self, query_vec: np.ndarray, top_k: int = 5,
+               nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[Tuple[int, float]]:
+        if self.vectors is None:
+            raise RuntimeError("Vector store non chargé")
+        if self.ntotal == 0:
+            return []
+        if self.index is not None:
+            from rag.index_factory import search_with_tail
+            return search_with_tail(self.index, self.vectors, query_vec, top_k, self.index_params,
+                                    nprobe=nprobe, ef_search=ef_search, sel=self._live_selector,
+                                    deleted=self.tombstones.mask if self.tombstones is not None else None)
+        q = normalize_rows(query_vec)[0]
+        k = min(top_k, self.ntotal - (len(self.tombstones) if self.tombstones is not None else 0))
+        if k <= 0:
+            return []
+
+        # Produit scalaire par blocs (les blocs float16 sont convertis à la volée)
+        scores = np.empty(self.ntotal, dtype='float32')
+        for start in range(0, self.ntotal, self.SEARCH_CHUNK_ROWS):
+            block = self.vectors[start:start + self.SEARCH_CHUNK_ROWS]
+            scores[start:start + block.shape[0]] = block.astype('float32', copy=False) @ q
+        if self.tombstones is not None:
+            scores[self.tombstones.mask] = -np.inf
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def get_metadata(self, indices: List[int]) -> List[Dict]:
+        return [self.meta[i] for i in indices]
+
+
+def write_store(directory: str, vectors: np.ndarray, metadata: List[Dict], dtype: str = 'float32'):
+    """Écrit un store complet (vecteurs normalisés + métadonnées)"""
+    if len(vectors) != len(metadata):
+        raise VectorFormatError(f"{len(vectors)} vecteurs pour {len(metadata)} métadonnées")
+    os.makedirs(directory, exist_ok=True)
+    write_metadata(directory, metadata)
+    write_vectors(os.path.join(directory, VECTORS_FILENAME), normalize_rows(vectors), dtype=dtype)
+
+
+def read_store(directory: str) -> Tuple[np.ndarray, List[Dict]]:
+    """Relit un store complet publié (vecteurs float32 en mémoire + métadonnées décodées)"""
+    rows = committed_rows(directory)
+    vectors = np.array(open_vectors(os.path.join(directory, VECTORS_FILENAME), rows), dtype='float32')
+    meta = LazyMetadata(directory, rows)
+    try:
+        return vectors, [meta[i] for i in range(len(meta))]
+    finally:
+        meta.close()
+
+
+def open_patient_store(patient_id):
+    """
+    Ouvre le store d'un patient : vue sur l'index partagé en mode 'shared',
+    sinon format mmap s'il existe, sinon HDF5 historique.
+    Retourne None si le patient n'a aucun store.
+    """
+    from rag.storage import patient_store_paths
+    from rag.shared_index import SharedIndexStore, get_shared_index, uses_shared_index
+    from rag.your_rag_module import VectorStoreHDF5
+
+    paths = patient_store_paths(patient_id)
+    if uses_shared_index() and os.path.exists(paths['metadata']) and not os.path.exists(paths['vectors']):
+        store = SharedIndexStore(get_shared_index(), patient_id, paths['vector_dir'])
+    elif os.path.exists(paths['vectors']):
+        store = MmapVectorStore(paths['vector_dir'])
+    elif os.path.exists(paths['hdf5']):
+        store = VectorStoreHDF5(paths['hdf5'])
+    else:
+        return None
+    store.load_store()
+    return store
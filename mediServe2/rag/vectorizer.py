@@ -0,0 +1,377 @@
+# rag/vectorizer.py
+# Vectorisation d'un document uploadé : extraction, chunking, embeddings, index du patient
+#
+# Importé directement par le worker d'ingestion (documents.tasks) : un
+# DocumentVectorizer par processus (get_document_vectorizer), dont le modèle
+# d'embedding (ModelRegistry, partagé avec la recherche) et les données NLTK
+# restent en mémoire d'un document à l'autre. Aucun effet de bord à l'import :
+# ni django.setup(), ni téléchargement NLTK (données installées par
+# `manage.py download_nltk_data` dans NLTK_DATA_DIR).
+# scripts/vectorize_single_document.py reste le point d'entrée en ligne de commande.
+
+import os
+import time
+import uuid
+import logging
+import threading
+from typing import Callable, Iterator, Optional
+
+import numpy as np
+import faiss
+from django.conf import settings
+from django.utils import timezone
+from whoosh import index as whoosh_index
+from whoosh.fields import Schema, TEXT, ID
+from whoosh.analysis import RegexTokenizer, LowercaseFilter
+
+from documents.models import DocumentUpload
+from .batching import encode_length_sorted
+from .chunking import chunk_pages_from_settings, settings_strategy, split_sentences
+from .commit_queue import PatientCommitQueue
+from .model_registry import ModelRegistry
+from .ocr import get_ocr_engine
+from .passage_embedding_cache import get_passage_embedding_cache
+from .pdf_extraction import PdfExtractor
+from .sparse_bm25 import SparseBM25Index, sparse_engine_enabled, sparse_path_for
+
+logger = logging.getLogger(__name__)
+
+# Analyseur pour le français
+FR_ANALYZER = RegexTokenizer(r"[0-9A-Za-zÀ-ÖØ-öø-ÿ]+") | LowercaseFilter()
+
+# Passages découpés par rag.chunking (les tableaux restent entiers)
+TEXT_SOURCES = ('pdf_page', 'pdf_ocr', 'image_ocr')
+
+# Rapport de progression : progress(stage, percent, status, **détails)
+ProgressCallback = Callable[..., None]
+
+class DocumentVectorizer:
+    # Rapports de progression par page au plus une fois par intervalle (secondes)
+    PAGE_PROGRESS_INTERVAL = 1.0
+
+    def __init__(self, embedder_name=None):
+        if embedder_name is None:
+            embedder_name = settings.RAG_SETTINGS.get('EMBEDDING_MODEL', 'all-mpnet-base-v2')
+        logger.info(f"Initialisation de DocumentVectorizer avec le modèle: {embedder_name}")
+        self.embedder_name = embedder_name # Sauvegarder pour les métadonnées
+        # Durées et volumes du dernier document traité (rapport de la tâche d'ingestion)
+        self.last_report = {}
+        # Embeddings déjà calculés pour ces textes (réindexation, ré-upload) : relus sur disque
+        self.embedding_cache = get_passage_embedding_cache(embedder_name)
+        cached_dim = self.embedding_cache.dim if self.embedding_cache is not None else 0
+        # Le modèle n'est chargé qu'au premier passage absent du cache
+        self.dim = cached_dim or self.embedder.get_sentence_embedding_dimension()
+
+    @property
+    def embedder(self):
+        # Chargé une fois par processus, partagé avec la recherche (ModelRegistry)
+        return ModelRegistry.get_sentence_transformer(self.embedder_name)
+
+    def warm_up(self):
+        """Charge le modèle et les données NLTK avant le premier document"""
+        self.embedder
+        try:
+            import nltk
+            nltk.data.find('tokenizers/punkt_tab/french/')
+        except (ImportError, LookupError):
+            logger.warning("⚠️ Données NLTK absentes (manage.py download_nltk_data) : "
+                           "découpage en phrases par ponctuation")
+        split_sentences("Initialisation. Données de découpage chargées.")
+
+    @staticmethod
+    def _report(progress: Optional[ProgressCallback], stage: str, percent: int, status: str, **details):
+        if progress is None:
+            return
+        try:
+            progress(stage, percent, status, **details)
+        except Exception as e:  # la progression ne doit jamais faire échouer l'indexation
+            logger.debug(f"Progression non transmise ({stage}): {e}")
+
+    def encode_passages(self, texts: list) -> np.ndarray:
+        """Embeddings des passages ou phrases (non normalisés), via le cache disque si activé"""
+        batch_size = settings.RAG_SETTINGS.get('PASSAGE_ENCODE_BATCH_SIZE', 64)
+
+        def encode_batch(batch):
+            return self.embedder.encode(batch, batch_size=len(batch), convert_to_numpy=True)
+
+        def encode(to_encode):
+            # Lots de taille fixe, textes de longueurs voisines (rag.batching)
+            return encode_length_sorted(encode_batch, to_encode, batch_size)
+
+        if self.embedding_cache is None:
+            return encode(texts)
+        hits_before = self.embedding_cache.hits
+        vectors = self.embedding_cache.encode_many(texts, encode)
+        hits = self.embedding_cache.hits - hits_before
+        logger.info(f"🧠 Embeddings: {hits}/{len(texts)} textes relus du cache, {len(texts) - hits} encodés")
+        return vectors
+
+    def chunk_passages(self, passages) -> list:
+        """
+        Découpe les pages de texte selon RAG_SETTINGS (rag.chunking) ; les
+        tableaux restent entiers. `passages` peut être un générateur (PDF
+        extrait en parallèle) : le chunking avance au rythme de l'extraction.
+        Le chunking sémantique encode les phrases via encode_passages (et donc
+        le cache d'embeddings).
+        """
+        others = []
+
+        def text_pages():
+            for passage in passages:
+                if passage['source'] in TEXT_SOURCES:
+                    yield passage
+                else:
+                    others.append(passage)
+
+        return list(chunk_pages_from_settings(text_pages(), encode=self.encode_passages)) + others
+        
+    def process_document(self, document_upload_id: int, progress: Optional[ProgressCallback] = None):
+        """
+        Traite et vectorise un document. `progress(stage, percent, status, **détails)`
+        est appelé à chaque étape (extraction page par page, vectorisation,
+        indexation) ; les durées sont dans self.last_report.
+        """
+        doc_upload = None # Définir au cas où le premier try échoue
+        self.last_report = report = {'document_id': document_upload_id}
+        started = time.perf_counter()
+        try:
+            # 1. Récupérer le document
+            doc_upload = DocumentUpload.objects.get(id=document_upload_id)
+            patient = doc_upload.patient
+            
+            logger.info(f"Traitement du document {doc_upload.original_filename} pour {patient.full_name()}")
+            
+            # 2. Vérifier que le fichier existe
+            if not doc_upload.file or not os.path.exists(doc_upload.file.path):
+                raise FileNotFoundError(f"Fichier physique introuvable: {doc_upload.file.path}")
+            
+            # 3. Extraire le texte selon le type
+            file_path = doc_upload.file.path
+            file_ext = doc_upload.file_type.lower()
+            
+            self._report(progress, 'extraction', 10, "Extraction du texte...")
+            if file_ext == 'pdf':
+                extracted = self.extract_text_from_pdf(file_path, progress=progress)
+            elif file_ext in ['jpg', 'jpeg', 'png', 'tiff', 'bmp']:
+                extracted = self.extract_text_from_image(file_path)
+            else:
+                raise ValueError(f"Type de fichier non supporté: {file_ext}")
+            
+            # Les pages sont découpées au fur et à mesure de leur extraction
+            passages = self.chunk_passages(extracted)
+            if not passages:
+                raise ValueError("Aucun texte extrait du document")
+            report['passages'] = len(passages)
+            report['extraction_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            
+            logger.info(f"Extrait {len(passages)} passages du document (chunking {settings_strategy()})")
+            self._report(progress, 'encoding', 65, f"Vectorisation de {len(passages)} passages...",
+                         passages=len(passages))
+            
+            # 4. Préparer les chemins de stockage pour ce patient
+            # Utiliser RAG_SETTINGS pour la robustesse
+            vector_dir = settings.RAG_SETTINGS['VECTOR_STORE_DIR']
+            index_dir = settings.RAG_SETTINGS['BM25_INDEX_DIR']
+            
+            # Créer les dossiers de base s'ils n'existent pas (déjà fait dans settings.py mais redondance ok)
+            os.makedirs(vector_dir, exist_ok=True)
+            os.makedirs(index_dir, exist_ok=True)
+            
+            patient_bm25_dir = os.path.join(index_dir, f'patient_{patient.id}_bm25')
+            os.makedirs(patient_bm25_dir, exist_ok=True)
+
+            # 5. File de commits du patient : un seul écrivain à la fois, les documents
+            # terminés dans la même fenêtre sont indexés en un commit (rag.commit_queue)
+            commit_queue = PatientCommitQueue(patient.id, self.dim)
+            # Document déjà indexé (retraitement, version corrigée) : ses anciennes lignes sont masquées
+            reprocessed = doc_upload.processed_at is not None
+            # Suffixe propre à cette indexation : les chunks de la nouvelle version ne reprennent
+            # pas les identifiants des lignes masquées (filtre BM25 et purge à la compaction)
+            index_pass = uuid.uuid4().hex[:8]
+            
+            # 6. Vectoriser les nouveaux passages : encodage par lots, normalisation en un appel
+            step = time.perf_counter()
+            new_vectors = np.ascontiguousarray(self.encode_passages([p['text'] for p in passages]),
+                                               dtype='float32')
+            faiss.normalize_L2(new_vectors)
+            report['encoding_ms'] = round((time.perf_counter() - step) * 1000, 1)
+            self._report(progress, 'indexing', 85, "Indexation...")
+            
+            new_metadata = []
+            for i, passage in enumerate(passages):
+                # Créer les métadonnées
+                meta = {
+                    'id': f"doc{doc_upload.id}_patient{patient.id}_{passage['source']}_p{passage['page']}_c{i}_{index_pass}",
+                    'patient_id': str(patient.id),
+                    'document_id': str(doc_upload.id),
+                    'source': passage['source'],
+                    'type': passage['source'], # 'type' est souvent utilisé, 'source' peut être plus spécifique
+                    'page': passage['page'],
+                    'text': passage['text'],
+                    'file_name': doc_upload.original_filename,
+                    'embedder': self.embedder_name # Utiliser la variable d'instance
+                }
+                new_metadata.append(meta)
+            
+            # 7-10. Ajouter au store (index partagé, mmap ou HDF5), à l'index FAISS et à l'index
+            # BM25 du patient, sans relire ni réécrire les documents précédents ; la publication
+            # invalide les retrievers et réponses en cache de ce patient
+            def update_bm25(writer, committed_metadata, n_vectors):
+                if not settings.RAG_SETTINGS.get('USE_BM25', True):
+                    return
+                all_metadata = None
+                if sparse_engine_enabled() and not os.path.exists(sparse_path_for(patient_bm25_dir)):
+                    # Première écriture de l'index compact : il faut tout le store
+                    all_metadata = writer.metadata(n_vectors)
+                self.update_bm25_index(patient_bm25_dir, committed_metadata, all_metadata)
+
+            step = time.perf_counter()
+            result = commit_queue.submit_and_commit(
+                new_vectors.reshape(-1, self.dim), new_metadata,
+                document_id=doc_upload.id, replace=reprocessed, update_bm25=update_bm25,
+            )
+            report['indexing_ms'] = round((time.perf_counter() - step) * 1000, 1)
+            report['replaced_rows'] = result.get('replaced_rows', 0)
+            logger.info(f"Document indexé dans un commit de {result['documents']} document(s) "
+                        f"({result['n_vectors']} vecteurs pour le patient {patient.id})")
+            if result['compaction_recommended']:
+                logger.info(f"🧹 Compaction recommandée pour le patient {patient.id} (manage.py compact_vector_stores)")
+            
+            # 11. Mettre à jour le statut du document
+            doc_upload.upload_status = 'indexed'
+            doc_upload.processed_at = timezone.now()
+            doc_upload.error_message = '' # Effacer les erreurs précédentes
+            doc_upload.save()
+            
+            report['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            logger.info(f"✅ Document {document_upload_id} vectorisé avec succès pour patient {patient.id} "
+                        f"en {report['total_ms']:.0f} ms")
+            self._report(progress, 'indexed', 100, "Terminé avec succès!", **report)
+            return True
+            
+        except Exception as e:
+            logger.error(f"❌ Erreur lors de la vectorisation du document {document_upload_id}: {str(e)}", exc_info=True)
+            
+            if doc_upload:
+                doc_upload.upload_status = 'failed'
+                doc_upload.error_message = str(e)
+                doc_upload.save()
+            report['error'] = str(e)
+            
+            return False
+    
+    def extract_text_from_pdf(self, pdf_path: str, progress: Optional[ProgressCallback] = None) -> Iterator[dict]:
+        """
+        Passages d'un PDF (texte ou OCR, puis tableaux de chaque page selon
+        le tri des pages), rendus page après page par un pool de processus
+        (rag.pdf_extraction). Avec `progress`, l'avancement est signalé par
+        page extraite (de 10 à 60 %, au plus une fois par seconde).
+        """
+        extractor = PdfExtractor()
+        passages = extractor.iter_passages(pdf_path)
+        if progress is None:
+            return passages
+        return self._page_progress(passages, extractor, progress)
+
+    def _page_progress(self, passages: Iterator[dict], extractor: PdfExtractor,
+                       progress: ProgressCallback) -> Iterator[dict]:
+        last_page, last_report = 0, 0.0
+        for passage in passages:
+            if passage['page'] != last_page:
+                last_page = passage['page']
+                total = extractor.stats.get('pages') or last_page
+                now = time.monotonic()
+                if now - last_report >= self.PAGE_PROGRESS_INTERVAL or last_page == total:
+                    last_report = now
+                    self._report(progress, 'extraction', 10 + int(50 * last_page / total),
+                                 f"Extraction du texte (page {last_page}/{total})...",
+                                 page=last_page, pages=total)
+            yield passage
+        self.last_report['pages'] = extractor.stats.get('pages', 0)
+    
+    def extract_text_from_image(self, image_path: str) -> list:
+        """Extrait le texte d'une image via OCR"""
+        passages = []
+        
+        try:
+            # Prétraitement, pool tesseract et cache par contenu (rag.ocr)
+            text = get_ocr_engine().ocr(image_path)
+            
+            if text:
+                passages.append({
+                    'source': 'image_ocr', # Plus spécifique
+                    'page': 0, # Pas de notion de page pour une image simple
+                    'text': text
+                })
+        except Exception as e:
+            logger.error(f"Erreur OCR: {e}", exc_info=True)
+        
+        return passages
+    
+    def update_bm25_index(self, bm25_dir: str, new_metadata: list, all_metadata: list = None):
+        """Met à jour l'index BM25. Ajoute seulement les nouveaux documents."""
+        if not new_metadata: # Seulement traiter s'il y a de nouvelles métadonnées à ajouter
+            logger.info("Aucune nouvelle métadonnée pour l'index BM25.")
+            return
+
+        if sparse_engine_enabled():
+            self.update_sparse_bm25_index(sparse_path_for(bm25_dir), new_metadata, all_metadata)
+            return
+
+        try:
+            if not os.path.exists(bm25_dir):
+                os.makedirs(bm25_dir)
+                schema = Schema(id=ID(stored=True, unique=True), content=TEXT(analyzer=FR_ANALYZER))
+                idx = whoosh_index.create_in(bm25_dir, schema)
+                logger.info(f"Index BM25 créé: {bm25_dir}")
+            else:
+                try:
+                    idx = whoosh_index.open_dir(bm25_dir)
+                    logger.info(f"Index BM25 ouvert: {bm25_dir}")
+                except whoosh_index.EmptyIndexError: # Si le dossier existe mais est vide/corrompu
+                    logger.warning(f"Index BM25 existant à {bm25_dir} est vide ou corrompu. Recréation.")
+                    schema = Schema(id=ID(stored=True, unique=True), content=TEXT(analyzer=FR_ANALYZER))
+                    idx = whoosh_index.create_in(bm25_dir, schema)
+
+
+            # Utiliser un writer avec modification pour ajouter ou mettre à jour
+            writer = idx.writer()
+            for meta in new_metadata:
+                # id est unique, donc update=True va remplacer si l'id existe déjà.
+                # C'est utile si on re-vectorise un document.
+                writer.update_document(
+                    id=meta['id'], 
+                    content=meta['text']
+                )
+            writer.commit()
+            
+            logger.info(f"Index BM25 mis à jour: {len(new_metadata)} documents traités dans {bm25_dir}")
+            
+        except Exception as e:
+            logger.warning(f"Erreur mise à jour BM25 ({bm25_dir}): {e}", exc_info=True)
+
+    def update_sparse_bm25_index(self, path: str, new_metadata: list, all_metadata: list = None):
+        """Index BM25 compact (rag.sparse_bm25) : ajout incrémental dans un fichier unique"""
+        try:
+            if not os.path.exists(path) and all_metadata:
+                # Première écriture (ou migration depuis Whoosh) : indexer tout le store
+                docs = all_metadata
+            else:
+                docs = new_metadata
+            index = SparseBM25Index.append_to_file(path, [(meta['id'], meta['text']) for meta in docs])
+            logger.info(f"Index BM25 compact mis à jour: {len(docs)} documents traités, {index.n_docs} au total ({path})")
+        except Exception as e:
+            logger.warning(f"Erreur mise à jour BM25 compact ({path}): {e}", exc_info=True)
+
+
+_vectorizer: Optional[DocumentVectorizer] = None
+_vectorizer_lock = threading.Lock()
+
+
+def get_document_vectorizer() -> DocumentVectorizer:
+    """DocumentVectorizer du processus (modèle et caches conservés entre les documents)"""
+    global _vectorizer
+    with _vectorizer_lock:
+        if _vectorizer is None:
+            _vectorizer = DocumentVectorizer()
+        return _vectorizer
@@ -10,7 +10,9 @@ import os
 from django.conf import settings
 import sys
 sys.path.append(os.path.join(settings.BASE_DIR, 'scripts'))
-from rag.your_rag_module import VectorStoreHDF5, EmbeddingGenerator, HybridRetriever, GeminiLLM, RAG
+from rag.your_rag_module import RAG
+from rag.model_registry import ModelRegistry
+from rag.retriever_cache import get_retriever_cache
 
 logger = logging.getLogger(__name__)
 
@@ -39,41 +41,23 @@ class RAGQueryView(views.APIView):
             # Trouver le patient
             patient = Patient.objects.get(phone=patient_phone, is_active=True)
             
-            # Chemins des fichiers vector store pour ce patient
-            hdf5_path = os.path.join(settings.MEDIA_ROOT, 'vectors', f'patient_{patient.id}.h5')
+            # 1. Retriever du patient (vector store + FAISS + BM25 en cache)
+            retriever = get_retriever_cache().get(patient.id)
             
             # Vérifier l'existence des fichiers
-            if not os.path.exists(hdf5_path):
+            if retriever is None:
                 return Response(
                     {"error": "Aucun document indexé trouvé pour ce patient"},
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            # 1. Charger le vector store
-            vector_store = VectorStoreHDF5(hdf5_path)
-            vector_store.load_store()
+            # 2. LLM partagé du processus
+            llm = ModelRegistry.get_llm()
             
-            # 2. Initialiser le générateur d'embeddings
-            embedder = EmbeddingGenerator()
-            
-            # 3. Construire le retriever (hybride si BM25 disponible)
-            bm25_index_dir = os.path.join(settings.MEDIA_ROOT, 'indexes', f'patient_{patient.id}_bm25')
-            if os.path.exists(bm25_index_dir):
-                retriever = HybridRetriever(vector_store, embedder, bm25_index_dir)
-                # Activer le reranking si configuré
-                if getattr(settings, 'USE_RERANKING', True):
-                    retriever.enable_reranking('cross-encoder/ms-marco-MiniLM-L-6-v2')
-            else:
-                # Retriever dense seulement
-                retriever = HybridRetriever(vector_store, embedder)
-            
-            # 4. Initialiser le LLM
-            llm = GeminiLLM()
-            
-            # 5. Créer le pipeline RAG
+            # 3. Créer le pipeline RAG
             rag = RAG(retriever, llm)
             
-            # 6. Générer la réponse
+            # 4. Générer la réponse
             response_text = rag.answer(query, top_k=5)
             
             # Calculer le temps de réponse
@@ -2,9 +2,9 @@
 import os
 import json
 import logging
+import time
 from typing import List, Dict, Optional, Tuple
 
-import time
 import numpy as np
 import faiss
 import h5py
@@ -18,6 +18,11 @@ from whoosh.fields import Schema, TEXT, ID
 from whoosh.analysis import StandardAnalyzer
 from whoosh.qparser import QueryParser
 
+from rag.index_factory import (
+    build_index, choose_index_spec, read_index_params, search_with_tail, write_index_params,
+)
+from rag.tombstones import load_tombstones
+
 FR_ANALYZER = RegexTokenizer(r"[0-9A-Za-zÀ-ÖØ-öø-ÿ]+") \
               | LowercaseFilter()
 load_dotenv()
@@ -35,6 +40,11 @@ class VectorStoreHDF5:
         self.vectors: Optional[np.ndarray] = None
         self.meta: List[Dict] = []
         self.id_map: Dict[str, Dict] = {}
+        # Type et paramètres de l'index FAISS (index_params.json, {} pour un index Flat historique)
+        self.index_params: Dict = {}
+        # Lignes des documents supprimés (rag.tombstones), masquées à la recherche
+        self.tombstones = None
+        self._live_selector = None
         self.logger = logging.getLogger(self.__class__.__name__)
 
     def load_store(self):
@@ -65,23 +75,29 @@ class VectorStoreHDF5:
             # Si le fichier FAISS n'existe pas, le créer à partir des vecteurs HDF5
             self.logger.warning(f"FAISS index not found at {self.faiss_path}, creating from HDF5 vectors...")
             if self.vectors is not None and len(self.vectors) > 0:
-                dim = self.vectors.shape[1]
-                self.index = faiss.IndexFlatIP(dim)
-                vectors_copy = self.vectors.copy()
+                vectors_copy = self.vectors.astype('float32')
                 faiss.normalize_L2(vectors_copy)
-                self.index.add(vectors_copy)
+                # Type d'index choisi selon le nombre de vecteurs (rag.index_factory)
+                spec = choose_index_spec(len(vectors_copy), vectors_copy.shape[1])
+                self.index = build_index(vectors_copy, spec)
                 faiss.write_index(self.index, self.faiss_path)
-                self.logger.info(f"Created and saved FAISS index with {self.index.ntotal} vectors")
+                write_index_params(os.path.dirname(self.path), spec)
+                self.logger.info(f"Created and saved FAISS index ({spec['type']}) with {self.index.ntotal} vectors")
             else:
                 raise ValueError("No vectors found in HDF5 file to create FAISS index")
+        self.index_params = read_index_params(os.path.dirname(self.path))
+        self.tombstones = load_tombstones(os.path.dirname(self.path), self.meta)
+        self._live_selector = self.tombstones.selector() if self.tombstones is not None else None
 
-    def search(self, query_vec: np.ndarray, top_k: int = 5) -> List[Tuple[int, float]]:
+    def search(self, query_vec: np.ndarray, top_k: int = 5,
+               nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> List[Tuple[int, float]]:
         if self.index is None:
             raise RuntimeError("FAISS index not loaded")
-        vec = query_vec.reshape(1, -1) if query_vec.ndim == 1 else query_vec
-        faiss.normalize_L2(vec)
-        scores, ids = self.index.search(vec, top_k)
-        return list(zip(ids[0].tolist(), scores[0].tolist()))
+        # Index compressé (float16 / SQ8 / PQ) : scores exacts sur les vecteurs HDF5 ; les lignes
+        # ajoutées depuis la dernière écriture de l'index sont parcourues exactement
+        return search_with_tail(self.index, self.vectors, query_vec, top_k, self.index_params,
+                                nprobe=nprobe, ef_search=ef_search, sel=self._live_selector,
+                                deleted=self.tombstones.mask if self.tombstones is not None else None)
 
     def get_metadata(self, indices: List[int]) -> List[Dict]:
         return [self.meta[i] for i in indices]
@@ -90,13 +106,34 @@ class VectorStoreHDF5:
 # 🤖 Embedding Generator
 # ---------------------------
 class EmbeddingGenerator:
-    def __init__(self, model_name: str = 'all-mpnet-base-v2'):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name: str = 'all-mpnet-base-v2', query_cache=None, model=None):
+        self.model_name = model_name
+        # Poids déjà chargés (ex. dans le master gunicorn avant le fork) réutilisés tels quels
+        self.model = model if model is not None else SentenceTransformer(model_name)
         self.dim = self.model.get_sentence_embedding_dimension()
+        # Cache optionnel des requêtes (rag.embedding_cache.QueryEmbeddingCache)
+        self.query_cache = query_cache
+        # Micro-batching optionnel des appels concurrents (rag.batching.MicroBatcher)
+        self.batcher = None
 
-    def embed_text(self, text: str) -> np.ndarray:
+    def enable_batching(self, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        from rag.batching import MicroBatcher
+        self.batcher = MicroBatcher(self.encode_batch, max_batch_size=max_batch_size,
+                                    max_wait_ms=max_wait_ms, name='embedding-batcher')
+
+    def encode_batch(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(list(texts), batch_size=max(len(texts), 1), convert_to_numpy=True)
+
+    def _encode(self, text: str) -> np.ndarray:
+        if self.batcher is not None:
+            return self.batcher(text)
         return self.model.encode(text, convert_to_numpy=True)
 
+    def embed_text(self, text: str) -> np.ndarray:
+        if self.query_cache is not None:
+            return self.query_cache.get_or_compute(text, self._encode)
+        return self._encode(text)
+
 # ---------------------------
 # 🗃️ BM25 Initialization
 # ---------------------------
@@ -114,6 +151,21 @@ def init_bm25_index(index_dir: str):
         idx = whoosh_index.open_dir(index_dir)
     return idx
 
+# ---------------------------
+# ⏱️ Durées par étape (benchmarks, métriques)
+# ---------------------------
+class StageTimer:
+    """Durées successives des étapes d'une recherche, en ms ({'embed_ms': ..., ...})"""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        self.timings[f"{stage}_ms"] = (now - self._last) * 1000
+        self._last = now
+
 # ---------------------------
 # 🔎 Simple Retriever (dense-only)
 # ---------------------------
@@ -121,10 +173,15 @@ class Retriever:
     def __init__(self, store: VectorStoreHDF5, embedder: EmbeddingGenerator):
         self.store = store
         self.embedder = embedder
+        self.last_timings: Dict[str, float] = {}
 
-    def retrieve(self, question: str, top_k: int = 5) -> List[Dict]:
+    def retrieve(self, question: str, top_k: int = 5, **search_params) -> List[Dict]:
+        timer = StageTimer()
         q_vec = self.embedder.embed_text(question)
-        hits = self.store.search(q_vec, top_k)
+        timer.lap('embed')
+        hits = self.store.search(q_vec, top_k, **search_params)
+        timer.lap('faiss')
+        self.last_timings = timer.timings
         results = []
         for idx, score in hits:
             meta = self.store.meta[idx].copy()
@@ -140,20 +197,43 @@ class HybridRetriever:
         self,
         store: VectorStoreHDF5,
         embedder: EmbeddingGenerator,
-        bm25_index_dir: Optional[str] = None
+        bm25_index_dir: Optional[str] = None,
+        bm25_index=None
     ):
         self.store = store
         self.embedder = embedder
-        self.bm25_idx = init_bm25_index(bm25_index_dir) if bm25_index_dir else None
+        # Index BM25 compact (rag.sparse_bm25.SparseBM25Index) : pas de QueryParser ni de searcher
+        self.sparse_bm25 = None
+        if bm25_index is not None and not hasattr(bm25_index, 'searcher'):
+            self.sparse_bm25 = bm25_index
+            self.bm25_idx = None
+        # Un index déjà ouvert (ex: copie en RAM du cache de retrievers) évite de rouvrir le dossier
+        elif bm25_index is not None:
+            self.bm25_idx = bm25_index
+        else:
+            self.bm25_idx = init_bm25_index(bm25_index_dir) if bm25_index_dir else None
         if self.bm25_idx:
             self.qp = QueryParser("content", schema=self.bm25_idx.schema)
         self.cross_encoder: Optional[CrossEncoder] = None
+        # Moteur de reranking partagé (rag.reranker.RerankEngine) : lots + budget de latence
+        self.rerank_engine = None
+        self.last_rerank_degraded = False
+        # Durée (ms) de chaque étape du dernier retrieve() : embed, faiss, bm25, fusion, rerank
+        self.last_timings: Dict[str, float] = {}
 
     def _build_query(self, question: str):
         toks = [t.text for t in FR_ANALYZER(question)]
         return None if not toks else self.qp.parse(" ".join(toks))
 
-    def enable_reranking(self, model_name: str):
+    def enable_reranking(self, model_name: str, cross_encoder: Optional[CrossEncoder] = None, engine=None):
+        # Réutiliser une instance partagée (rag.model_registry) si elle est fournie
+        if engine is not None:
+            self.rerank_engine = engine
+            self.cross_encoder = engine.cross_encoder
+            return
+        if cross_encoder is not None:
+            self.cross_encoder = cross_encoder
+            return
         self.cross_encoder = CrossEncoder(model_name)
         logging.getLogger(self.__class__.__name__).info(f"Loaded CrossEncoder '{model_name}' for reranking")
 
@@ -162,19 +242,38 @@ class HybridRetriever:
                  top_k: int = 5,
                  alpha: float = 0.5,
                  dense_k: int = 10,
-                 bm25_k: int = 10) -> List[Dict]:
+                 bm25_k: int = 10,
+                 rerank_budget_ms: Optional[float] = None,
+                 nprobe: Optional[int] = None,
+                 ef_search: Optional[int] = None) -> List[Dict]:
+        timer = StageTimer()
+        self.last_timings = timer.timings
+
         # ↓ Dense retrieval first (works even when bm25 disabled)
         q_vec = self.embedder.embed_text(question)
-        dense_hits = self.store.search(q_vec, dense_k)
+        timer.lap('embed')
+        # nprobe / ef_search : compromis rappel / latence des index IVF / HNSW, ignorés par un index Flat
+        dense_hits = self.store.search(q_vec, dense_k, nprobe=nprobe, ef_search=ef_search)
+        timer.lap('faiss')
 
         # BM-25 retrieval (optional)
+        # Les chunks des documents supprimés restent dans l'index BM25 jusqu'à la compaction :
+        # on demande quelques résultats de plus et on les filtre
+        tombstones = getattr(self.store, 'tombstones', None)
+        deleted_ids = tombstones.deleted_ids if tombstones is not None else ()
+        bm25_limit = bm25_k + min(len(deleted_ids), bm25_k)
         bm25_hits = []
-        if self.bm25_idx:
+        if self.sparse_bm25 is not None:
+            bm25_hits = self.sparse_bm25.search(question, limit=bm25_limit)
+        elif self.bm25_idx:
             query = self._build_query(question)
             if query is not None:
                 with self.bm25_idx.searcher(weighting=scoring.BM25F()) as searcher:
-                    res = searcher.search(query, limit=bm25_k)
+                    res = searcher.search(query, limit=bm25_limit)
                     bm25_hits = [(hit["id"], hit.score) for hit in res]
+        if deleted_ids:
+            bm25_hits = [(mid, score) for mid, score in bm25_hits if mid not in deleted_ids][:bm25_k]
+        timer.lap('bm25')
                     
         # Combine
         combined = {}
@@ -202,14 +301,27 @@ class HybridRetriever:
             v['score'] = alpha*(v['dense']/max_d) + (1-alpha)*(v['bm25']/max_b)
             
         items = sorted(combined.values(), key=lambda x: x['score'], reverse=True)
+        timer.lap('fusion')
         
         # Rerank
-        if self.cross_encoder:
+        self.last_rerank_degraded = False
+        if self.rerank_engine:
+            passages = [item['meta'].get('text','') for item in items[:top_k*2]]
+            rerank_scores = self.rerank_engine.rerank(question, passages, budget_ms=rerank_budget_ms)
+            if rerank_scores is None:
+                # Budget dépassé : on garde l'ordre des scores hybrides
+                self.last_rerank_degraded = True
+            else:
+                for item, rs in zip(items[:top_k*2], rerank_scores):
+                    item['score'] = float(rs)
+                items = sorted(items, key=lambda x: x['score'], reverse=True)
+        elif self.cross_encoder:
             pairs = [(question, item['meta'].get('text','')) for item in items[:top_k*2]]
             rerank_scores = self.cross_encoder.predict(pairs)
             for item, rs in zip(items[:top_k*2], rerank_scores):
                 item['score'] = float(rs)
             items = sorted(items, key=lambda x: x['score'], reverse=True)
+        timer.lap('rerank')
             
         # Top-k
         results = []
@@ -225,12 +337,18 @@ class HybridRetriever:
 # ✨ Gemini LLM
 # ---------------------------
 class GeminiLLM:
-    def __init__(self, model_name: str = 'gemini-1.5-flash-latest'):
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise EnvironmentError("GEMINI_API_KEY non défini")
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel(model_name)
+    def __init__(self, model_name: str = 'gemini-1.5-flash-latest', rate_limiter=None):
+        from core.stand_ins import LIVE, gemini_backend, make_generative_model
+        # Substituts locaux (GEMINI_BACKEND=fake|http) : pas de clé API nécessaire
+        if gemini_backend() == LIVE:
+            api_key = os.getenv("GEMINI_API_KEY")
+            if not api_key:
+                raise EnvironmentError("GEMINI_API_KEY non défini")
+            genai.configure(api_key=api_key)
+        self.model = make_generative_model(model_name)
+        self.model_name = model_name
+        # Limiteur partagé (rag.rate_limiter) ; None = aucune limitation côté client
+        self.rate_limiter = rate_limiter
         # Configuration pour des réponses médicales plus naturelles
         self.config = genai.types.GenerationConfig(
             temperature=0.3,  # Un peu plus de variabilité pour des réponses naturelles
@@ -239,10 +357,18 @@ class GeminiLLM:
             max_output_tokens=500,  # Limiter la longueur pour WhatsApp
         )
 
-    def generate(self, prompt: str) -> str:
-        # Respect API rate limits
-        time.sleep(1)
+    def generate(self, prompt: str, priority: str = 'interactive') -> str:
+        # Attente uniquement si le quota (requêtes/min, tokens/min) est épuisé
+        estimated = 0
+        if self.rate_limiter is not None:
+            from rag.rate_limiter import estimate_tokens
+            estimated = estimate_tokens(prompt) + self.config.max_output_tokens
+            self.rate_limiter.acquire(self.model_name, estimated, priority=priority)
         resp = self.model.generate_content(prompt, generation_config=self.config)
+        if self.rate_limiter is not None:
+            usage = getattr(resp, 'usage_metadata', None)
+            if usage is not None and getattr(usage, 'total_token_count', None):
+                self.rate_limiter.settle(self.model_name, estimated, usage.total_token_count)
         return resp.text if resp.parts else ''
 
 # ---------------------------
@@ -252,9 +378,17 @@ class RAG:
     def __init__(self, retriever, llm):
         self.retriever = retriever
         self.llm = llm
+        self.last_contexts: List[Dict] = []
+        # Taille estimée (≈ 4 caractères/token) du dernier prompt envoyé au LLM
+        self.last_prompt_tokens = 0
 
-    def answer(self, question: str, top_k: int = 3) -> str:
-        contexts = self.retriever.retrieve(question, top_k)
+    def answer(self, question: str, top_k: int = 3, retrieval_query: Optional[str] = None,
+               contexts: Optional[List[Dict]] = None) -> str:
+        # retrieval_query : question brute du patient quand `question` est un prompt enrichi
+        # contexts : extraits déjà retrouvés par l'appelant (évite une seconde recherche)
+        if contexts is None:
+            contexts = self.retriever.retrieve(retrieval_query or question, top_k)
+        self.last_contexts = contexts
         prompt = (
             "Tu es un assistant médical intelligent qui aide les patients à comprendre leurs documents médicaux. "
             "Utilise les extraits suivants pour répondre à la question de manière claire et empathique.\n"
@@ -278,6 +412,5 @@ class RAG:
         prompt += "Si nécessaire, suggère de consulter le médecin pour plus de précisions.\n"
         prompt += "\nRéponse :"
         
-        # Respect API rate limits
-        time.sleep(0.5)
+        self.last_prompt_tokens = len(prompt) // 4
         return self.llm.generate(prompt)
\ No newline at end of file
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Benchmark du cache de réponses RAG sur une conversation WhatsApp rejouée sur plusieurs jours.
+
+Usage:
+    python scripts/bench_answer_cache.py --patient-id 1
+    python scripts/bench_answer_cache.py --patient-id 1 --days 10 --no-sleep --json bench_answer_cache.json
+
+Le patient (--patient-id) doit avoir des documents indexés. Gemini est simulé
+(GEMINI_BACKEND=fake, latences seedées). Chaque tour passe par
+process_with_rag avec une session WhatsApp dédiée (supprimée à la fin) et
+est journalisé comme dans le webhook : à partir du deuxième message, la
+mémoire de conversation n'est jamais vide, comme en production.
+
+Chaque jour mélange des questions autonomes (souvent reposées, parfois
+reformulées) et des questions de suivi (« Et le soir ? »). Le rapport donne
+le taux de hit (sur tous les tours et sur les questions autonomes), la
+latence médiane des hits et des misses et le temps de génération épargné.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+# Questions autonomes et leurs reformulations
+STANDALONE = [
+    ["Quelle est ma posologie actuelle ?", "Quelle est ma posologie actuelle", "C'est quoi ma posologie actuelle ?"],
+    ["Quels sont mes derniers résultats ?", "Quels sont mes derniers résultats d'analyse ?"],
+    ["Quand est mon prochain rendez-vous ?", "Mon prochain rendez-vous est quand ?"],
+    ["Est-ce que mon cholestérol est trop élevé ?", "Mon cholestérol est-il trop élevé ?"],
+    ["Résume mon dernier rapport médical", "Peux-tu résumer mon dernier rapport médical ?"],
+    ["Quels médicaments je prends ?", "Quels médicaments dois-je prendre ?"],
+]
+FOLLOW_UPS = ["Et le soir ?", "Pourquoi ?", "Je dois le prendre avec ça ?", "Et pour le matin ?",
+              "Cette dose est normale ?", "Vous avez dit combien de fois par jour ?"]
+
+
+def conversation(days, turns_per_day, seed):
+    """Tours rejoués : une question autonome, parfois suivie d'une question de suivi"""
+    rng = random.Random(seed)
+    script = []
+    for day in range(days):
+        turns = []
+        while len(turns) < turns_per_day:
+            variants = STANDALONE[rng.randrange(len(STANDALONE))]
+            # La formulation habituelle domine, les reformulations restent fréquentes
+            turns.append(variants[0] if rng.random() < 0.6 else rng.choice(variants[1:]))
+            if len(turns) < turns_per_day and rng.random() < 0.4:
+                turns.append(rng.choice(FOLLOW_UPS))
+        script.append(turns)
+    return script
+
+
+def median_ms(samples):
+    return round(statistics.median(samples), 1) if samples else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Taux de hit du cache de réponses sur une conversation rejouée")
+    parser.add_argument('--patient-id', type=int, required=True)
+    parser.add_argument('--days', type=int, default=5)
+    parser.add_argument('--turns-per-day', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-sleep', action='store_true', help="Gemini simulé sans latence")
+    parser.add_argument('--json', help="Écrire les résultats dans ce fichier JSON")
+    args = parser.parse_args()
+
+    os.environ['GEMINI_BACKEND'] = 'fake'
+    os.environ['STAND_IN_SEED'] = str(args.seed)
+    os.environ['STAND_IN_SLEEP'] = 'False' if args.no_sleep else 'True'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mediServe.settings')
+    import django
+    django.setup()
+    from patients.models import Patient
+    from sessions.models import WhatsAppSession, ConversationLog
+    from messaging.whatsapp_rag_webhook import process_with_rag
+    from metrics.services import MetricsService
+    from rag.answer_cache import CACHE_NAME, get_answer_cache
+    from rag.conversation_memory import get_conversation_memory, is_follow_up
+
+    patient = Patient.objects.get(id=args.patient_id)
+    answer_cache = get_answer_cache()
+    if answer_cache is None:
+        print("❌ Cache de réponses désactivé (RAG_ANSWER_CACHE_ENABLED)")
+        sys.exit(1)
+    answer_cache.invalidate(patient.id)
+
+    session = WhatsAppSession.objects.create(patient=patient, phone_number='bench',
+                                             session_id=f'bench_answer_cache_{int(time.time())}')
+    turns = []
+    try:
+        for day, questions in enumerate(conversation(args.days, args.turns_per_day, args.seed)):
+            for question in questions:
+                with_history = bool(get_conversation_memory().build(session)['text'])
+                before = MetricsService.get_cache_stats(CACHE_NAME)
+                start = time.perf_counter()
+                result = process_with_rag(patient, question, session)
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                after = MetricsService.get_cache_stats(CACHE_NAME)
+                answer = result.get('answer', '') if isinstance(result, dict) else str(result)
+                ConversationLog.objects.create(session=session, user_message=question, ai_response=answer,
+                                               response_time_ms=int(elapsed_ms), message_length=len(question),
+                                               response_length=len(answer))
+                turns.append({
+                    'day': day,
+                    'question': question,
+                    'follow_up': is_follow_up(question),
+                    'with_history': with_history,
+                    'hit': after['hits'] > before['hits'],
+                    'latency_ms': round(elapsed_ms, 1),
+                    'saved_ms': after['latency_saved_ms'] - before['latency_saved_ms'],
+                })
+    finally:
+        session.delete()
+
+    standalone = [t for t in turns if not t['follow_up']]
+    hits = [t for t in turns if t['hit']]
+    misses = [t for t in turns if not t['hit']]
+    results = {
+        'turns': len(turns),
+        'turns_with_history': sum(t['with_history'] for t in turns),
+        'standalone': len(standalone),
+        'follow_ups': len(turns) - len(standalone),
+        'hits': len(hits),
+        'hit_rate': round(len(hits) / len(turns), 4) if turns else 0.0,
+        'standalone_hit_rate': round(sum(t['hit'] for t in standalone) / len(standalone), 4) if standalone else 0.0,
+        'hit_latency_median_ms': median_ms([t['latency_ms'] for t in hits]),
+        'miss_latency_median_ms': median_ms([t['latency_ms'] for t in misses]),
+        'latency_saved_ms': sum(t['saved_ms'] for t in turns),
+    }
+
+    print(f"📊 Cache de réponses, patient {patient.id} : {args.days} jour(s), {len(turns)} tours "
+          f"({results['turns_with_history']} avec historique)")
+    print(f"   questions autonomes / de suivi : {results['standalone']} / {results['follow_ups']}")
+    print(f"   hits : {results['hits']} ({results['hit_rate']:.0%} des tours, "
+          f"{results['standalone_hit_rate']:.0%} des questions autonomes)")
+    print(f"   latence médiane hit / miss : {results['hit_latency_median_ms']:.0f}ms / "
+          f"{results['miss_latency_median_ms']:.0f}ms")
+    print(f"   ⏱️ génération épargnée : {results['latency_saved_ms']:.0f}ms")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'results': results, 'turns': turns}, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
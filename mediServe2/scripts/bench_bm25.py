@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark BM25 : Whoosh (HybridRetriever historique) vs index compact (rag.sparse_bm25).
+
+Usage:
+    python scripts/bench_bm25.py --docs 500 5000 50000
+    python scripts/bench_bm25.py --docs 5000 --queries 2000 --json bench_bm25.json
+
+Mesure pour chaque taille de corpus : temps de construction, taille sur
+disque, temps d'ouverture et latence par requête (p50 / p95). Côté Whoosh,
+chaque requête parse la question et ouvre un searcher, comme
+HybridRetriever.retrieve.
+"""
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import tempfile
+import statistics
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, script_dir)
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+from whoosh import index as whoosh_index  # noqa: E402
+from whoosh.fields import Schema, TEXT, ID  # noqa: E402
+from whoosh.qparser import QueryParser  # noqa: E402
+
+from rag.sparse_bm25 import SparseBM25Index  # noqa: E402
+from test_bm25_parity import FR_ANALYZER, random_text, random_query, whoosh_search  # noqa: E402
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return statistics.median(samples), samples[max(int(len(samples) * 0.95) - 1, 0)]
+
+
+def bench(n_docs, n_queries, limit, seed):
+    rng = random.Random(seed)
+    docs = [(f"doc_c{i}", random_text(rng, 20, 250)) for i in range(n_docs)]
+    queries = [random_query(rng) for _ in range(n_queries)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        w_dir = os.path.join(tmp, 'whoosh')
+        os.makedirs(w_dir)
+        sparse_path = os.path.join(tmp, 'patient.sbm25')
+
+        start = time.perf_counter()
+        schema = Schema(id=ID(stored=True, unique=True), content=TEXT(analyzer=FR_ANALYZER))
+        w_idx = whoosh_index.create_in(w_dir, schema)
+        writer = w_idx.writer()
+        for doc_id, text in docs:
+            writer.update_document(id=doc_id, content=text)
+        writer.commit()
+        w_build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        SparseBM25Index.build(docs).save(sparse_path)
+        s_build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        w_idx = whoosh_index.open_dir(w_dir)
+        qp = QueryParser("content", schema=w_idx.schema)
+        w_open = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sparse = SparseBM25Index.open(sparse_path)
+        sparse.vocab, sparse.ids  # noqa: B018 (décodage paresseux inclus dans l'ouverture)
+        s_open = time.perf_counter() - start
+
+        w_lat, s_lat = [], []
+        for q in queries:
+            start = time.perf_counter()
+            whoosh_search(w_idx, qp, q, limit)
+            w_lat.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            sparse.search(q, limit=limit)
+            s_lat.append((time.perf_counter() - start) * 1000)
+
+        w_p50, w_p95 = percentiles(w_lat)
+        s_p50, s_p95 = percentiles(s_lat)
+        return {
+            'docs': n_docs,
+            'whoosh': {'build_s': w_build, 'open_ms': w_open * 1000, 'bytes': dir_size(w_dir),
+                       'p50_ms': w_p50, 'p95_ms': w_p95},
+            'sparse': {'build_s': s_build, 'open_ms': s_open * 1000, 'bytes': os.path.getsize(sparse_path),
+                       'p50_ms': s_p50, 'p95_ms': s_p95},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark BM25 Whoosh vs index compact")
+    parser.add_argument('--docs', type=int, nargs='+', default=[500, 5000, 50000])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help="Écrire les résultats dans ce fichier JSON")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'docs':>7} {'moteur':>7} {'build':>8} {'open':>9} {'taille':>9} {'p50':>9} {'p95':>9}")
+    for n_docs in args.docs:
+        r = bench(n_docs, args.queries, args.limit, args.seed)
+        results.append(r)
+        for engine in ('whoosh', 'sparse'):
+            e = r[engine]
+            print(f"{n_docs:>7} {engine:>7} {e['build_s']:>7.2f}s {e['open_ms']:>7.1f}ms "
+                  f"{e['bytes'] / 1024:>7.0f}Ko {e['p50_ms']:>7.3f}ms {e['p95_ms']:>7.3f}ms")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
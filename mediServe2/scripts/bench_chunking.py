@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Benchmark du chunking (rag.chunking) sur un long document multi-pages.
+
+Usage:
+    python scripts/bench_chunking.py --pdf dossier_patient.pdf --model all-mpnet-base-v2
+    python scripts/bench_chunking.py --synthetic --pages 300          # texte et encodeur simulés
+    python scripts/bench_chunking.py --synthetic --pages 20 --sentences-per-page 600   # longs passages
+    python scripts/bench_chunking.py --synthetic --pages 300 --json bench_chunking.json
+
+Compare sur le même flux de pages :
+  - 'legacy'   : ancien chunking sémantique de generate_embeddings.py
+                 (un encode par page, np.mean de tout le passage à chaque phrase) ;
+  - 'semantic' : rag.chunking.semantic_chunks sans limite de taille (mêmes passages
+                 attendus que 'legacy', vérifié), puis avec CHUNK_SIZE tokens ;
+  - 'sentence' et 'lexical' : stratégies sans encodage.
+
+Le temps d'encodage des phrases est mesuré à part du temps de segmentation :
+c'est la segmentation que le centroïde courant rend linéaire.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+from rag.chunking import (DEFAULT_MAX_TOKENS, DEFAULT_OVERLAP, DEFAULT_THRESHOLD,  # noqa: E402
+                          approx_token_count, lexical_chunks, semantic_chunks, sentence_chunks,
+                          split_sentences, tokenizer_token_counter)
+
+TOPICS = ['antécédents cardiaques', 'bilan sanguin', 'ordonnance', 'imagerie thoracique',
+          'allergies', 'suivi diabétologique', 'compte rendu opératoire', 'vaccinations']
+
+
+class SyntheticEncoder:
+    """Vecteur du thème de la phrase + bruit propre à la phrase ; coût simulé par phrase"""
+
+    def __init__(self, dim=384, item_ms=0.0, noise=0.5):
+        self.dim = dim
+        self.item_ms = item_ms
+        self.noise = noise
+        rng = np.random.default_rng(0)
+        self.topics = {t: rng.standard_normal(dim) for t in TOPICS}
+        self.calls = 0
+
+    def encode(self, sentences, convert_to_numpy=True):
+        self.calls += 1
+        if self.item_ms:
+            time.sleep(self.item_ms * len(sentences) / 1000)
+        out = np.empty((len(sentences), self.dim), dtype='float32')
+        for i, sentence in enumerate(sentences):
+            base = next((v for t, v in self.topics.items() if t in sentence), self.topics[TOPICS[0]])
+            noise = np.random.default_rng(abs(hash(sentence)) % 2 ** 32).standard_normal(self.dim)
+            out[i] = base / np.linalg.norm(base) + self.noise * noise / np.linalg.norm(noise)
+        return out
+
+
+def synthetic_pages(pages, sentences_per_page=40, run=60, seed=0):
+    """Pages de texte dont les thèmes changent toutes les `run` phrases en moyenne"""
+    rng = np.random.default_rng(seed)
+    topic, left = 0, run
+    for page in range(1, pages + 1):
+        sentences = []
+        for s in range(sentences_per_page):
+            if left == 0:
+                topic = (topic + 1 + int(rng.integers(len(TOPICS) - 1))) % len(TOPICS)
+                left = int(rng.integers(run // 2, run * 2))
+            left -= 1
+            words = ' '.join(f"mot{int(w)}" for w in rng.integers(0, 500, int(rng.integers(6, 22))))
+            sentences.append(f"Concernant {TOPICS[topic]}, page {page} phrase {s} : {words}.")
+        yield {'source': 'pdf_page', 'page': page, 'text': ' '.join(sentences)}
+
+
+def pdf_pages(path):
+    import pdfplumber
+    with pdfplumber.open(path) as pdf:
+        for page_idx, page in enumerate(pdf.pages):
+            yield {'source': 'pdf_page', 'page': page_idx + 1, 'text': page.extract_text() or ''}
+
+
+def legacy_semantic_chunks(pages, encode, threshold):
+    """Ancien algorithme (generate_embeddings.extract_text_chunks_semantic), phrases de rag.chunking"""
+    passages = []
+    for page in pages:
+        sentences = split_sentences(page['text'])
+        if not sentences:
+            continue
+        emb = np.asarray(encode(sentences), dtype='float32')
+        emb = emb / np.linalg.norm(emb, axis=1, keepdims=True)
+        chunk_sents, chunk_embs = [], []
+        for sent, vec in zip(sentences, emb):
+            if not chunk_embs:
+                chunk_sents, chunk_embs = [sent], [vec]
+                continue
+            mean_emb = np.mean(chunk_embs, axis=0)
+            mean_emb = mean_emb / np.linalg.norm(mean_emb)
+            if float(np.dot(vec, mean_emb)) >= threshold:
+                chunk_sents.append(sent)
+                chunk_embs.append(vec)
+            else:
+                passages.append({**page, 'text': ' '.join(chunk_sents)})
+                chunk_sents, chunk_embs = [sent], [vec]
+        if chunk_sents:
+            passages.append({**page, 'text': ' '.join(chunk_sents)})
+    return passages
+
+
+class TimedEncoder:
+    """Compte les appels et isole le temps d'encodage"""
+
+    def __init__(self, encode):
+        self._encode = encode
+        self.calls = 0
+        self.sentences = 0
+        self.seconds = 0.0
+
+    def __call__(self, sentences):
+        start = time.perf_counter()
+        out = self._encode(sentences)
+        self.seconds += time.perf_counter() - start
+        self.calls += 1
+        self.sentences += len(sentences)
+        return out
+
+
+def measure(name, run, encode=None):
+    timed = TimedEncoder(encode) if encode is not None else None
+    start = time.perf_counter()
+    chunks = run(timed)
+    total = time.perf_counter() - start
+    encode_s = timed.seconds if timed else 0.0
+    return chunks, {
+        'strategy': name,
+        'chunks': len(chunks),
+        'total_ms': round(total * 1000, 1),
+        'encode_ms': round(encode_s * 1000, 1),
+        'segment_ms': round((total - encode_s) * 1000, 1),
+        'encode_calls': timed.calls if timed else 0,
+        'avg_chunk_tokens': round(float(np.mean([approx_token_count(c['text']) for c in chunks])), 1)
+        if chunks else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunking d'un long document multi-pages")
+    parser.add_argument('--pdf', help="PDF à découper (pdfplumber requis)")
+    parser.add_argument('--synthetic', action='store_true', help="Texte et encodeur simulés")
+    parser.add_argument('--pages', type=int, default=200, help="Pages du document simulé")
+    parser.add_argument('--sentences-per-page', type=int, default=40, help="Phrases par page simulée")
+    parser.add_argument('--model', default='all-mpnet-base-v2')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--max-tokens', type=int, default=DEFAULT_MAX_TOKENS)
+    parser.add_argument('--json', help="Écrire les résultats dans ce fichier JSON")
+    args = parser.parse_args()
+
+    if args.synthetic or not args.pdf:
+        encoder, count_tokens = SyntheticEncoder(), approx_token_count
+        pages = list(synthetic_pages(args.pages, args.sentences_per_page))
+        label = f"document simulé de {len(pages)} pages"
+    else:
+        from sentence_transformers import SentenceTransformer
+        encoder = SentenceTransformer(args.model)
+        count_tokens = tokenizer_token_counter(encoder.tokenizer)
+        pages = list(pdf_pages(args.pdf))
+        label = f"{os.path.basename(args.pdf)} ({len(pages)} pages, {args.model})"
+
+    def encode(sentences):
+        return encoder.encode(sentences, convert_to_numpy=True)
+
+    sentences = sum(len(split_sentences(p['text'])) for p in pages)
+    print(f"📊 Chunking de {label}, {sentences} phrases, seuil {args.threshold}")
+
+    legacy, legacy_row = measure('legacy', lambda enc: legacy_semantic_chunks(pages, enc, args.threshold), encode)
+    unbounded, unbounded_row = measure('semantic (sans limite)', lambda enc: list(semantic_chunks(
+        pages, enc, threshold=args.threshold, max_tokens=float('inf'), count_tokens=count_tokens)), encode)
+    rows = [legacy_row, unbounded_row]
+    rows.append(measure(f'semantic ({args.max_tokens} tok)', lambda enc: list(semantic_chunks(
+        pages, enc, threshold=args.threshold, max_tokens=args.max_tokens, count_tokens=count_tokens)), encode)[1])
+    rows.append(measure(f'sentence ({args.max_tokens} tok)', lambda enc: list(sentence_chunks(
+        pages, max_tokens=args.max_tokens, count_tokens=count_tokens)))[1])
+    rows.append(measure(f'lexical ({args.max_tokens} tok)', lambda enc: list(lexical_chunks(
+        pages, max_tokens=args.max_tokens, overlap=DEFAULT_OVERLAP, count_tokens=count_tokens)))[1])
+
+    same = [c['text'] for c in legacy] == [c['text'] for c in unbounded]
+    print(f"   {'stratégie':<24} {'passages':>9} {'encodage':>10} {'segmentation':>13} {'appels':>7} {'tokens moy.':>12}")
+    for row in rows:
+        print(f"   {row['strategy']:<24} {row['chunks']:>9} {row['encode_ms']:>8.0f}ms {row['segment_ms']:>11.1f}ms "
+              f"{row['encode_calls']:>7} {row['avg_chunk_tokens']:>12}")
+    print(f"   Passages identiques legacy / semantic sans limite: {'✅' if same else '❌'}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'document': label, 'sentences': sentences, 'identical': same, 'results': rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Benchmark des uploads concurrents : plusieurs processus indexent en même
+temps des documents des mêmes patients (rag.commit_queue).
+
+Usage:
+    python scripts/bench_concurrent_indexing.py --workers 8 --docs 80 --patients 1
+    python scripts/bench_concurrent_indexing.py --workers 8 --docs 80 --patients 4 --windows 0 50 200 --json bench.json
+
+Chaque worker simule un process_document_async : il attend un temps
+d'extraction / embedding aléatoire (--work-ms), puis dépose les chunks de
+son document et demande un commit. Pour chaque fenêtre de regroupement
+(INDEX_COMMIT_WINDOW_MS), le rapport donne le nombre de commits, les
+documents par commit, les commits par seconde et vérifie que le store final
+contient exactement toutes les lignes déposées (aucune perdue ni doublée).
+
+Les stores sont écrits dans un répertoire temporaire (voir
+bench_incremental_indexing.configure), jamais dans media/.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+from bench_incremental_indexing import FORMATS, configure, document  # noqa: E402
+
+
+def worker(jobs, results, workdir, args, window_ms):
+    configure(workdir, args.format, args.dim)
+    from rag.commit_queue import PatientCommitQueue
+
+    rng = np.random.default_rng(os.getpid())
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        patient_id, doc_id = job
+        time.sleep(rng.uniform(0, args.work_ms) / 1000)
+        vectors, metadata = document(doc_id, args.chunks, args.dim, rng)
+        start = time.perf_counter()
+        result = PatientCommitQueue(patient_id, args.dim, window_ms=window_ms).submit_and_commit(
+            vectors, metadata, document_id=doc_id)
+        results.put({'patient_id': patient_id, 'latency_ms': (time.perf_counter() - start) * 1000,
+                     'documents': result.get('documents')})
+
+
+def run(window_ms, args, workdir):
+    jobs, results = multiprocessing.Queue(), multiprocessing.Queue()
+    for doc_id in range(args.docs):
+        jobs.put((1 + doc_id % args.patients, doc_id))
+    for _ in range(args.workers):
+        jobs.put(None)
+
+    start = time.perf_counter()
+    procs = [multiprocessing.Process(target=worker, args=(jobs, results, workdir, args, window_ms))
+             for _ in range(args.workers)]
+    for p in procs:
+        p.start()
+    samples = [results.get() for _ in range(args.docs)]
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - start
+
+    configure(workdir, args.format, args.dim)
+    from rag.storage import StoreVersion
+    from rag.vector_format import open_patient_store
+    rows = {pid: len(open_patient_store(pid).meta) for pid in range(1, args.patients + 1)}
+    expected = {pid: args.chunks * len(range(pid - 1, args.docs, args.patients)) for pid in rows}
+    commits = sum(StoreVersion.read_manifest(pid).get('commits', 0) for pid in rows)
+
+    latencies = sorted(s['latency_ms'] for s in samples)
+    return {
+        'window_ms': window_ms,
+        'commits': commits,
+        'documents_per_commit': round(args.docs / commits, 2) if commits else 0.0,
+        'commits_per_sec': round(commits / elapsed, 2),
+        'documents_per_sec': round(args.docs / elapsed, 2),
+        'p50_commit_latency_ms': round(latencies[len(latencies) // 2], 1),
+        'p95_commit_latency_ms': round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], 1),
+        'elapsed_s': round(elapsed, 2),
+        'consistent': rows == expected,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Uploads concurrents : commits regroupés par patient")
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--docs', type=int, default=80)
+    parser.add_argument('--patients', type=int, default=1)
+    parser.add_argument('--chunks', type=int, default=40, help="Passages par document")
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--work-ms', type=float, default=300, help="Extraction + embedding simulés (max, ms)")
+    parser.add_argument('--windows', type=float, nargs='+', default=[0, 200],
+                        help="Fenêtres de regroupement à comparer (ms)")
+    parser.add_argument('--format', default='mmap', choices=FORMATS)
+    parser.add_argument('--json', help="Écrire les résultats dans ce fichier JSON")
+    args = parser.parse_args()
+
+    print(f"📊 {args.docs} documents × {args.chunks} passages, {args.workers} workers, "
+          f"{args.patients} patient(s), store {args.format}")
+    print(f"   {'fenêtre':>8} {'commits':>8} {'docs/commit':>12} {'commits/s':>10} {'docs/s':>8} "
+          f"{'p50':>9} {'p95':>9}  cohérent")
+    report = []
+    for window_ms in args.windows:
+        with tempfile.TemporaryDirectory(prefix='bench_concurrent_') as workdir:
+            point = run(window_ms, args, workdir)
+        report.append(point)
+        print(f"   {window_ms:>6.0f}ms {point['commits']:>8} {point['documents_per_commit']:>12} "
+              f"{point['commits_per_sec']:>10} {point['documents_per_sec']:>8} "
+              f"{point['p50_commit_latency_ms']:>7}ms {point['p95_commit_latency_ms']:>7}ms  "
+              f"{'✅' if point['consistent'] else '❌'}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
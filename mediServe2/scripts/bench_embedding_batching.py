@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Test de charge du micro-batching des embeddings (rag.batching / rag.embedding_service).
+
+Usage:
+    python scripts/bench_embedding_batching.py --model all-mpnet-base-v2
+    python scripts/bench_embedding_batching.py --model all-mpnet-base-v2 --modes direct thread service
+    python scripts/bench_embedding_batching.py --synthetic   # coût simulé, sans modèle
+
+Pour 1, 8 et 32 appelants concurrents, chaque appelant encode des questions
+une par une pendant --duration secondes. Modes comparés :
+  direct  : model.encode(texte) par appel (comportement historique)
+  thread  : MicroBatcher dans le processus
+  service : EmbeddingServer dans un processus séparé, clients par socket Unix
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+import threading
+import statistics
+import multiprocessing
+
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+from rag.batching import MicroBatcher  # noqa: E402
+
+QUESTIONS = [
+    "Quels sont mes prochains rendez-vous ?",
+    "Donne moi des conseils santé au vu de mes antécédents médicaux ?",
+    "Quels médicaments dois-je prendre aujourd'hui ?",
+    "Quel est mon taux de cholestérol ?",
+    "Que dit le compte rendu de ma dernière échographie ?",
+    "Ai-je des allergies connues ?",
+    "Quelle est la posologie du paracétamol prescrit ?",
+    "Quand ai-je été hospitalisé pour la dernière fois ?",
+]
+
+
+class SyntheticEmbedder:
+    """Coût simulé d'un encodeur : surcoût fixe par appel + coût par phrase, calcul sérialisé"""
+
+    def __init__(self, dim=768, call_ms=12.0, item_ms=1.5):
+        self.model_name = 'synthetic'
+        self.dim = dim
+        self.call_ms = call_ms
+        self.item_ms = item_ms
+        self._compute = threading.Lock()
+
+    def encode_batch(self, texts):
+        with self._compute:
+            time.sleep((self.call_ms + self.item_ms * len(texts)) / 1000)
+        return np.random.rand(len(texts), self.dim).astype('float32')
+
+    def encode_one(self, text):
+        return self.encode_batch([text])[0]
+
+
+class ModelEmbedder:
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def encode_batch(self, texts):
+        return self.model.encode(list(texts), batch_size=max(len(texts), 1), convert_to_numpy=True)
+
+    def encode_one(self, text):
+        return self.model.encode(text, convert_to_numpy=True)
+
+
+def make_embedder(args):
+    if args.synthetic:
+        return SyntheticEmbedder()
+    return ModelEmbedder(args.model)
+
+
+def run_service(address, args, ready):
+    from rag.embedding_service import EmbeddingServer
+    server = EmbeddingServer(make_embedder(args), address=address,
+                             max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    ready.set()
+    server.serve_forever()
+
+
+def load_test(encode_factory, concurrency, duration):
+    latencies = []
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def caller(n):
+        encode = encode_factory()
+        local = []
+        i = n
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            encode(QUESTIONS[i % len(QUESTIONS)])
+            local.append((time.perf_counter() - start) * 1000)
+            i += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=caller, args=(n,)) for n in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'concurrency': concurrency,
+        'embeddings_per_s': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies),
+        'p95_ms': latencies[max(int(len(latencies) * 0.95) - 1, 0)],
+        'requests': len(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge du micro-batching des embeddings")
+    parser.add_argument('--model', default='all-mpnet-base-v2')
+    parser.add_argument('--synthetic', action='store_true', help="Encodeur simulé (pas de modèle)")
+    parser.add_argument('--modes', nargs='+', default=['direct', 'thread', 'service'],
+                        choices=['direct', 'thread', 'service'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    parser.add_argument('--json', help="Écrire les résultats dans ce fichier JSON")
+    args = parser.parse_args()
+
+    results = []
+    embedder = make_embedder(args) if {'direct', 'thread'} & set(args.modes) else None
+
+    for mode in args.modes:
+        service = None
+        if mode == 'direct':
+            factory = lambda: embedder.encode_one  # noqa: E731
+        elif mode == 'thread':
+            batcher = MicroBatcher(embedder.encode_batch, args.max_batch_size, args.max_wait_ms)
+            factory = lambda: batcher  # noqa: E731
+        else:
+            from rag.embedding_service import RemoteEmbeddingGenerator
+            address = os.path.join(tempfile.mkdtemp(), 'embeddings.sock')
+            ready = multiprocessing.Event()
+            service = multiprocessing.Process(target=run_service, args=(address, args, ready), daemon=True)
+            service.start()
+            ready.wait(300)
+            time.sleep(0.5)
+            model_name = 'synthetic' if args.synthetic else args.model
+            client = RemoteEmbeddingGenerator(model_name, address=address)
+            factory = lambda: client.embed_text  # noqa: E731
+
+        # Échauffement (chargement paresseux, threads)
+        load_test(factory, 1, 0.5)
+        for concurrency in args.concurrency:
+            r = load_test(factory, concurrency, args.duration)
+            r['mode'] = mode
+            results.append(r)
+            print(f"{mode:>8} x{concurrency:<3} {r['embeddings_per_s']:>8.1f} emb/s   "
+                  f"p50 {r['p50_ms']:>7.1f}ms   p95 {r['p95_ms']:>7.1f}ms")
+
+        if service is not None:
+            service.terminate()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
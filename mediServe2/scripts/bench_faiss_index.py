@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Benchmark du compromis rappel / latence des types d'index FAISS (rag.index_factory).
+
+Usage:
+    python scripts/bench_faiss_index.py --rows 20000 100000 --dim 768
+    python scripts/bench_faiss_index.py --rows 50000 --types ivf_flat hnsw --json bench_faiss.json
+    python scripts/bench_faiss_index.py --rows 200000 --memory-target-mb 128   # force IVF-PQ en 'auto'
+
+Les vecteurs sont synthétiques mais groupés (mélange de gaussiennes sur la
+sphère), plus proches d'embeddings réels qu'un tirage uniforme. Les requêtes
+sont des points bruités hors corpus. Le rappel@k est mesuré contre un index
+Flat (recherche exacte) ; la latence est celle d'une requête isolée, comme
+dans HybridRetriever.retrieve, pour chaque valeur de nprobe / efSearch.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+import numpy as np
+import faiss
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+from rag.index_factory import INDEX_TYPES, build_index, choose_index_spec, search_index  # noqa: E402
+from rag.vector_format import normalize_rows  # noqa: E402
+
+NPROBE_SWEEP = (1, 4, 8, 16, 32, 64)
+EF_SEARCH_SWEEP = (16, 32, 64, 128, 256)
+
+
+def clustered_vectors(n, dim, n_clusters, rng, spread=0.35):
+    centers = normalize_rows(rng.standard_normal((n_clusters, dim)))
+    labels = rng.integers(0, n_clusters, n)
+    noise = rng.standard_normal((n, dim)).astype('float32') * spread / np.sqrt(dim)
+    return normalize_rows(centers[labels] + noise)
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * q), len(samples) - 1)] if samples else 0.0
+
+
+def recall_at_k(found, truth):
+    hits = sum(len(set(f[f >= 0]) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def measure(index, queries, k, truth, **search_params):
+    latencies, found = [], []
+    for q in queries:
+        start = time.perf_counter()
+        _, ids = search_index(index, q.reshape(1, -1), k, **search_params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(ids[0])
+    return {
+        'recall': round(recall_at_k(np.array(found), truth), 4),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'mean_ms': round(statistics.mean(latencies), 3),
+    }
+
+
+def bench_rows(n, args, rng):
+    vectors = clustered_vectors(n, args.dim, max(16, n // 500), rng)
+    queries = normalize_rows(vectors[rng.choice(n, args.queries, replace=False)]
+                             + rng.standard_normal((args.queries, args.dim)).astype('float32') * 0.02)
+
+    exact = faiss.IndexFlatIP(args.dim)
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+
+    auto = choose_index_spec(n, args.dim, memory_target_mb=args.memory_target_mb)
+    results = {'rows': n, 'auto': auto['factory'], 'types': {}}
+    print(f"\n📊 {n} vecteurs (dim {args.dim}) — choix 'auto' : {auto['factory']}")
+
+    for index_type in args.types:
+        spec = choose_index_spec(n, args.dim, type=index_type, memory_target_mb=args.memory_target_mb)
+        if spec['type'] != index_type:
+            print(f"   {index_type}: pas assez de vecteurs, remplacé par {spec['type']} — ignoré")
+            continue
+        index = build_index(vectors, spec)
+        size_mb = len(faiss.serialize_index(index)) / 1024 / 1024
+        entry = {'factory': spec['factory'], 'build_s': spec['build_seconds'], 'train_s': spec['train_seconds'],
+                 'size_mb': round(size_mb, 1), 'sweep': []}
+        print(f"   {spec['factory']}: construit en {spec['build_seconds']}s "
+              f"(entraînement {spec['train_seconds']}s), {size_mb:.1f} MB")
+
+        if index_type.startswith('ivf'):
+            sweep = [('nprobe', v) for v in NPROBE_SWEEP if v <= spec['nlist']]
+        elif index_type == 'hnsw':
+            sweep = [('ef_search', v) for v in EF_SEARCH_SWEEP]
+        else:
+            sweep = [(None, None)]
+        for param, value in sweep:
+            point = measure(index, queries, args.k, truth, **({param: value} if param else {}))
+            if param:
+                point[param] = value
+            entry['sweep'].append(point)
+            label = f"{param}={value}" if param else 'exact'
+            print(f"      {label:<14} rappel@{args.k} {point['recall']:.3f}   "
+                  f"p50 {point['p50_ms']:.3f}ms   p95 {point['p95_ms']:.3f}ms")
+        results['types'][index_type] = entry
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rappel / latence des index FAISS par type")
+    parser.add_argument('--rows', type=int, nargs='+', default=[20000, 100000])
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--types', nargs='+', default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    parser.add_argument('--memory-target-mb', type=float, default=None,
+                        help="Budget mémoire du choix 'auto' (défaut : FAISS_MEMORY_TARGET_MB)")
+    parser.add_argument('--threads', type=int, default=1, help="Threads OpenMP de FAISS (1 = comme un worker)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help="Écrire les résultats dans ce fichier JSON")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    rng = np.random.default_rng(args.seed)
+    report = [bench_rows(n, args, rng) for n in args.rows]
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
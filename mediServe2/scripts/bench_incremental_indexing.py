@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Benchmark de l'indexation incrémentale : temps par document pour un patient
+qui reçoit des documents un par un.
+
+Usage:
+    python scripts/bench_incremental_indexing.py --docs 200 --chunks 40
+    python scripts/bench_incremental_indexing.py --formats mmap hdf5 shared --json bench_incremental.json
+    python scripts/bench_incremental_indexing.py --docs 200 --plot bench_incremental.png   # matplotlib requis
+
+Deux stratégies sont mesurées pour chaque format de store :
+  - 'append'  : PatientIndexWriter.append (lignes du document seulement, index.add) ;
+  - 'rewrite' : comportement historique de DocumentVectorizer, qui relisait
+                tout le store puis réécrivait vecteurs, métadonnées et index FAISS.
+
+Le temps d'un document couvre l'écriture du store, de l'index FAISS et la
+publication du manifeste, pas l'extraction ni l'embedding (identiques dans
+les deux cas). Avec 'rewrite' il croît avec la taille du store ; avec
+'append' il doit rester à peu près constant.
+
+Les stores sont écrits dans un répertoire temporaire (VECTOR_STORE_DIR et
+SHARED_INDEX_DIR sont redirigés), jamais dans media/.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+FORMATS = ('mmap', 'hdf5', 'shared')
+STRATEGIES = ('append', 'rewrite')
+SPARK = ' ▁▂▃▄▅▆▇█'
+
+
+def configure(workdir, store_format, dim):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mediServe.settings')
+    import django
+    from django.conf import settings
+    django.setup()
+    from rag import shared_index
+
+    rag_settings = settings.RAG_SETTINGS
+    rag_settings['VECTOR_STORE_DIR'] = os.path.join(workdir, store_format, 'vectors')
+    rag_settings['SHARED_INDEX_DIR'] = os.path.join(workdir, store_format, 'shared')
+    rag_settings['SHARED_INDEX_SHARDS'] = 1
+    rag_settings['EMBEDDING_DIM'] = dim
+    rag_settings['VECTOR_STORAGE_MODE'] = 'shared' if store_format == 'shared' else 'per_patient'
+    rag_settings['VECTOR_STORE_FORMAT'] = 'hdf5' if store_format == 'hdf5' else 'mmap'
+    shared_index._shared_index = None
+
+
+def document(doc_id, chunks, dim, rng):
+    vectors = rng.standard_normal((chunks, dim)).astype('float32')
+    metadata = [{'id': f'doc{doc_id}_c{i}', 'document_id': str(doc_id), 'page': i // 4 + 1,
+                 'text': f"Passage {i} du document {doc_id} " * 20} for i in range(chunks)]
+    return vectors, metadata
+
+
+def run(store_format, strategy, args, workdir):
+    from rag.index_writer import PatientIndexWriter
+
+    configure(os.path.join(workdir, strategy), store_format, args.dim)
+    writer = PatientIndexWriter(patient_id=1, dim=args.dim)
+    rng = np.random.default_rng(args.seed)
+    timings = []
+    for doc_id in range(args.docs):
+        vectors, metadata = document(doc_id, args.chunks, args.dim, rng)
+        start = time.perf_counter()
+        if strategy == 'append':
+            total = writer.append(vectors, metadata)['n_vectors']
+        else:
+            layout = writer.layout()
+            old_vectors, old_metadata = writer.read_all(layout) if layout else (np.zeros((0, args.dim)), [])
+            total = writer.rewrite(np.vstack([old_vectors, vectors]), old_metadata + metadata)
+        writer.publish(total)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def sparkline(values, width):
+    buckets = np.array_split(np.asarray(values), min(width, len(values)))
+    means = [float(b.mean()) for b in buckets]
+    top = max(means) or 1.0
+    return ''.join(SPARK[min(len(SPARK) - 1, int(m / top * (len(SPARK) - 1) + 0.5))] for m in means)
+
+
+def summarize(timings):
+    tenth = max(1, len(timings) // 10)
+    return {
+        'first_10pct_ms': round(float(np.mean(timings[:tenth])), 2),
+        'last_10pct_ms': round(float(np.mean(timings[-tenth:])), 2),
+        'total_s': round(sum(timings) / 1000, 2),
+    }
+
+
+def plot(report, path):
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("⚠️ matplotlib non installé : pas de graphique")
+        return
+    fig, ax = plt.subplots(figsize=(9, 5))
+    for entry in report['results']:
+        ax.plot(range(1, len(entry['timings_ms']) + 1), entry['timings_ms'],
+                label=f"{entry['format']} / {entry['strategy']}")
+    ax.set_xlabel('Document n°')
+    ax.set_ylabel('Temps d\'indexation (ms)')
+    ax.set_yscale('log')
+    ax.legend()
+    ax.set_title(f"{report['docs']} documents × {report['chunks']} passages (dim {report['dim']})")
+    fig.savefig(path, dpi=120, bbox_inches='tight')
+    print(f"📈 Graphique écrit: {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Temps d'indexation par document : ajout vs réécriture")
+    parser.add_argument('--docs', type=int, default=200)
+    parser.add_argument('--chunks', type=int, default=40, help="Passages par document")
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--formats', nargs='+', default=['mmap'], choices=FORMATS)
+    parser.add_argument('--strategies', nargs='+', default=list(STRATEGIES), choices=STRATEGIES)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--plot', help="Écrire un graphique PNG (matplotlib)")
+    parser.add_argument('--json', help="Écrire les résultats dans ce fichier JSON")
+    args = parser.parse_args()
+
+    report = {'docs': args.docs, 'chunks': args.chunks, 'dim': args.dim, 'results': []}
+    print(f"📊 {args.docs} documents × {args.chunks} passages (dim {args.dim}) pour un patient")
+    print(f"   {'format':<8} {'stratégie':<9} {'début':>10} {'fin':>10} {'total':>9}   temps par document")
+    with tempfile.TemporaryDirectory(prefix='bench_incremental_') as workdir:
+        for store_format in args.formats:
+            for strategy in args.strategies:
+                timings = run(store_format, strategy, args, workdir)
+                summary = summarize(timings)
+                report['results'].append({'format': store_format, 'strategy': strategy,
+                                          **summary, 'timings_ms': [round(t, 3) for t in timings]})
+                print(f"   {store_format:<8} {strategy:<9} {summary['first_10pct_ms']:>8.1f}ms "
+                      f"{summary['last_10pct_ms']:>8.1f}ms {summary['total_s']:>8.1f}s   {sparkline(timings, 50)}")
+
+    if args.plot:
+        plot(report, args.plot)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
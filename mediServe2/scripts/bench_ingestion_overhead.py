@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Benchmark du coût fixe par document de l'ingestion : sous-processus par
+document (ancien vectorize_document.sh) contre worker en processus
+(rag.vectorizer.get_document_vectorizer).
+
+Usage:
+    python scripts/bench_ingestion_overhead.py --runs 5
+    python scripts/bench_ingestion_overhead.py --runs 3 --document-id 42 --json bench_ingestion.json
+
+Variantes mesurées :
+  - 'sous-processus' : bash + nouvel interpréteur + django.setup() + nltk.download
+                       + chargement de SentenceTransformer, à chaque document
+                       (ce que payait l'ancien saut par script, hors traitement) ;
+  - 'en processus'   : premier appel (chargement, payé une fois par worker) puis
+                       appels suivants (get_document_vectorizer + warm_up), à chaque document.
+Avec --document-id, le document est aussi vectorisé de bout en bout des deux
+façons (scripts/vectorize_single_document.py en sous-processus, puis en processus).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(script_dir, '..'))
+sys.path.insert(0, project_root)
+
+# Ce que chaque document payait avant tout traitement dans l'ancien sous-processus
+LEGACY_BOOTSTRAP = """
+import os, django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mediServe.settings')
+django.setup()
+import nltk
+nltk.download('punkt', quiet=True)
+nltk.download('punkt_tab', quiet=True)
+from sentence_transformers import SentenceTransformer
+SentenceTransformer({model!r})
+"""
+
+
+def run_subprocess(command):
+    env = dict(os.environ, PYTHONPATH=project_root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    start = time.perf_counter()
+    completed = subprocess.run(command, cwd=project_root, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start, completed.returncode
+
+
+def summary(samples):
+    return {'runs': len(samples), 'median_ms': round(statistics.median(samples) * 1000, 1),
+            'min_ms': round(min(samples) * 1000, 1), 'max_ms': round(max(samples) * 1000, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coût fixe par document : sous-processus contre worker en processus")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--document-id', type=int, help="Vectoriser aussi ce document de bout en bout")
+    parser.add_argument('--json', help="Écrire les résultats dans ce fichier JSON")
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mediServe.settings')
+    import django
+    django.setup()
+    from django.conf import settings
+    from rag.vectorizer import get_document_vectorizer
+    model = settings.RAG_SETTINGS.get('EMBEDDING_MODEL', 'all-mpnet-base-v2')
+
+    results = {}
+    legacy = [run_subprocess(['bash', '-c', 'set -x; exec "$0" -c "$1"', sys.executable,
+                              LEGACY_BOOTSTRAP.format(model=model)])[0] for _ in range(args.runs)]
+    results['sous-processus'] = summary(legacy)
+
+    start = time.perf_counter()
+    get_document_vectorizer().warm_up()
+    results['en processus (1er document)'] = summary([time.perf_counter() - start])
+    warm = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        get_document_vectorizer().warm_up()
+        warm.append(time.perf_counter() - start)
+    results['en processus'] = summary(warm)
+
+    if args.document_id:
+        cli = os.path.join(script_dir, 'vectorize_single_document.py')
+        elapsed, code = run_subprocess([sys.executable, cli, str(args.document_id)])
+        results['document, sous-processus'] = {**summary([elapsed]), 'success': code == 0}
+        start = time.perf_counter()
+        success = get_document_vectorizer().process_document(args.document_id)
+        results['document, en processus'] = {**summary([time.perf_counter() - start]), 'success': success,
+                                             'report': get_document_vectorizer().last_report}
+
+    print(f"📊 Coût fixe par document ({model})")
+    print(f"   {'variante':<30} {'médiane':>10} {'min':>10} {'max':>10}")
+    for name, row in results.items():
+        print(f"   {name:<30} {row['median_ms']:>8.0f}ms {row['min_ms']:>8.0f}ms {row['max_ms']:>8.0f}ms")
+    saved = results['sous-processus']['median_ms'] - results['en processus']['median_ms']
+    print(f"   ⏱️ {saved:.0f} ms économisées par document")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'model': model, 'results': results}, f, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    main()
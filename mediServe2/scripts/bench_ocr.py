@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Benchmark de l'OCR (rag.ocr) : appel direct de Tesseract contre l'OcrEngine.
+
+Usage:
+    python scripts/bench_ocr.py ordonnance_photo.jpg scan_p1.png scan_p2.png
+    python scripts/bench_ocr.py images/*.jpg --workers 1 4 --json bench_ocr.json
+
+Trois variantes sont mesurées sur les mêmes images :
+  - 'direct'     : pytesseract.image_to_string(Image.open(f), lang='fra') en
+                   séquence, pleine résolution (comportement historique) ;
+  - 'moteur'     : OcrEngine à froid (prétraitement, pool de N tesseract) ;
+  - 'moteur (cache)' : second passage, textes relus du cache par contenu.
+Pour chaque variante : temps total, ms par image et nombre de caractères
+reconnus (contrôle grossier que le prétraitement ne dégrade pas la lecture).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+from rag.ocr import OcrEngine, OcrResultCache  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR direct contre OcrEngine (prétraitement, pool, cache)")
+    parser.add_argument('images', nargs='+')
+    parser.add_argument('--workers', type=int, nargs='+', default=[os.cpu_count() or 1])
+    parser.add_argument('--lang', default='fra')
+    parser.add_argument('--json', help="Écrire les résultats dans ce fichier JSON")
+    args = parser.parse_args()
+
+    import pytesseract
+    from PIL import Image
+
+    runs = []
+    start = time.perf_counter()
+    texts = [pytesseract.image_to_string(Image.open(path), lang=args.lang).strip() for path in args.images]
+    runs.append(('direct', 1, time.perf_counter() - start, texts))
+
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory(prefix='bench_ocr_') as cache_dir:
+            engine = OcrEngine(workers=workers, lang=args.lang, cache=OcrResultCache(cache_dir))
+            for name in ('moteur', 'moteur (cache)'):
+                start = time.perf_counter()
+                texts = engine.ocr_many(args.images, record=False)
+                runs.append((name, workers, time.perf_counter() - start, texts))
+
+    print(f"📊 {len(args.images)} image(s)")
+    print(f"   {'variante':<16} {'workers':>7} {'total':>9} {'ms/image':>9} {'caractères':>11}")
+    report = []
+    for name, workers, elapsed, texts in runs:
+        row = {'variant': name, 'workers': workers, 'elapsed_s': round(elapsed, 3),
+               'ms_per_image': round(elapsed * 1000 / len(args.images), 1),
+               'chars': sum(len(text) for text in texts)}
+        report.append(row)
+        print(f"   {name:<16} {workers:>7} {elapsed:>8.2f}s {row['ms_per_image']:>9} {row['chars']:>11}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark du cache disque des embeddings de passages (rag.passage_embedding_cache).
+
+Usage:
+    python scripts/bench_passage_embedding_cache.py --synthetic
+    python scripts/bench_passage_embedding_cache.py --model all-mpnet-base-v2 --docs 20 --chunks 40
+    python scripts/bench_passage_embedding_cache.py --synthetic --max-entries 500 --json bench_cache.json
+
+Simule la réindexation d'un patient (scripts/reindex_documents.py) :
+  1. indexation initiale (cache vide) ;
+  2. réindexation sans changement : tous les passages doivent être relus du cache ;
+  3. réindexation après modification d'une partie des passages (--changed) ;
+et rapporte pour chaque passe le temps d'embedding, le nombre de passages
+encodés et le taux de hit. Avec --max-entries plus petit que le corpus,
+l'éviction LRU et la compaction sont exercées.
+
+Le cache est écrit dans un répertoire temporaire, jamais dans media/.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+
+class SyntheticEncoder:
+    """Coût simulé de SentenceTransformer.encode : surcoût par appel + coût par passage"""
+
+    def __init__(self, dim=768, call_ms=15.0, item_ms=4.0):
+        self.dim = dim
+        self.call_ms = call_ms
+        self.item_ms = item_ms
+
+    def encode(self, texts, convert_to_numpy=True):
+        time.sleep((self.call_ms + self.item_ms * len(texts)) / 1000)
+        return np.stack([np.random.default_rng(abs(hash(t)) % 2 ** 32).standard_normal(self.dim)
+                         for t in texts]).astype('float32')
+
+
+def corpus(docs, chunks, changed=0.0, seed=0):
+    rng = np.random.default_rng(seed)
+    documents = []
+    for d in range(docs):
+        passages = []
+        for c in range(chunks):
+            version = 1 if rng.random() < changed else 0
+            passages.append(f"Document {d}, passage {c} (v{version}) : compte rendu de consultation " * 8)
+        documents.append(passages)
+    return documents
+
+
+def reindex(cache, encoder, documents):
+    encoded = 0
+    start = time.perf_counter()
+    for passages in documents:
+        def encode(batch):
+            nonlocal encoded
+            encoded += len(batch)
+            return encoder.encode(batch, convert_to_numpy=True)
+        cache.encode_many(passages, encode)
+    return (time.perf_counter() - start) * 1000, encoded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Réindexation avec cache disque des embeddings de passages")
+    parser.add_argument('--model', default='all-mpnet-base-v2')
+    parser.add_argument('--synthetic', action='store_true', help="Encodeur au coût simulé, sans modèle")
+    parser.add_argument('--docs', type=int, default=20)
+    parser.add_argument('--chunks', type=int, default=40, help="Passages par document")
+    parser.add_argument('--changed', type=float, default=0.1, help="Part des passages modifiés (passe 3)")
+    parser.add_argument('--max-entries', type=int, default=200_000)
+    parser.add_argument('--json', help="Écrire les résultats dans ce fichier JSON")
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mediServe.settings')
+    import django
+    django.setup()
+    from rag.passage_embedding_cache import PassageEmbeddingCache
+
+    if args.synthetic:
+        encoder, model_name = SyntheticEncoder(), 'synthetic'
+    else:
+        from sentence_transformers import SentenceTransformer
+        encoder, model_name = SentenceTransformer(args.model), args.model
+
+    passes = [
+        ('initiale', corpus(args.docs, args.chunks)),
+        ('inchangée', corpus(args.docs, args.chunks)),
+        (f"{args.changed:.0%} modifiés", corpus(args.docs, args.chunks, changed=args.changed, seed=1)),
+    ]
+    total = args.docs * args.chunks
+    print(f"📊 {args.docs} documents × {args.chunks} passages, modèle {model_name}, "
+          f"max {args.max_entries} entrées")
+    print(f"   {'passe':<14} {'temps':>10} {'encodés':>9} {'hit rate':>9}")
+    report = []
+    with tempfile.TemporaryDirectory(prefix='bench_passage_cache_') as workdir:
+        cache = PassageEmbeddingCache(model_name, workdir, max_entries=args.max_entries,
+                                      metrics_name='bench_passage_embedding')
+        for name, documents in passes:
+            elapsed_ms, encoded = reindex(cache, encoder, documents)
+            point = {'pass': name, 'embedding_ms': round(elapsed_ms, 1), 'encoded': encoded,
+                     'hit_rate': round(1 - encoded / total, 4)}
+            report.append(point)
+            print(f"   {name:<14} {elapsed_ms:>8.0f}ms {encoded:>9} {point['hit_rate']:>9.1%}")
+        stats = cache.stats()
+    print(f"   cache: {stats['entries']} entrées, {stats['size_bytes'] / 1e6:.1f} Mo")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'passes': report, 'cache': stats}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
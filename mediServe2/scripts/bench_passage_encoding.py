@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Benchmark de l'étape d'embedding de l'ingestion : passages/s avant et après
+l'encodage par lots (DocumentVectorizer.encode_passages, rag.batching).
+
+Usage:
+    python scripts/bench_passage_encoding.py --pdf dossier_100_pages.pdf --model all-mpnet-base-v2
+    python scripts/bench_passage_encoding.py --synthetic --pages 100
+    python scripts/bench_passage_encoding.py --synthetic --pages 100 --batch-sizes 16 32 64 128 --json bench.json
+
+Les pages sont découpées avec rag.chunking (stratégie 'sentence', CHUNK_SIZE
+tokens), puis trois variantes sont mesurées :
+  - 'par passage' : un encode par passage, reshape + normalisation par vecteur et
+                    un resize HDF5 par ligne (comportement historique) ;
+  - 'lots'        : lots de taille fixe dans l'ordre du document ;
+  - 'lots triés'  : lots de passages de longueurs voisines (encode_length_sorted),
+                    normalisation en un appel, une seule écriture HDF5.
+Les vecteurs obtenus sont comparés à ceux de la variante historique.
+
+Sans modèle (--synthetic), l'encodeur simule le coût d'un transformer :
+surcoût fixe par appel + coût proportionnel à (taille du lot × plus long
+passage du lot), c'est-à-dire padding compris.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+from rag.batching import encode_length_sorted  # noqa: E402
+from rag.chunking import DEFAULT_MAX_TOKENS, approx_token_count, sentence_chunks  # noqa: E402
+from bench_chunking import pdf_pages, synthetic_pages  # noqa: E402
+
+
+class SyntheticEncoder:
+    """Coût simulé : call_ms par appel + token_us par token, lot complété au plus long passage"""
+
+    def __init__(self, dim=768, call_ms=8.0, token_us=12.0):
+        self.dim = dim
+        self.call_ms = call_ms
+        self.token_us = token_us
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        padded = len(texts) * max(approx_token_count(t) for t in texts)
+        time.sleep(self.call_ms / 1000 + padded * self.token_us / 1e6)
+        out = np.stack([np.random.default_rng(abs(hash(t)) % 2 ** 32).standard_normal(self.dim)
+                        for t in texts]).astype('float32')
+        return out[0] if single else out
+
+
+def legacy(encoder, texts, h5_path):
+    """Un encode par passage, un resize HDF5 par ligne"""
+    import h5py
+    timings = {}
+    start = time.perf_counter()
+    vectors = []
+    for text in texts:
+        vec = encoder.encode(text, convert_to_numpy=True)
+        vec = vec.reshape(1, -1)
+        vec = vec / np.linalg.norm(vec, axis=1, keepdims=True)
+        vectors.append(vec[0])
+    timings['encode_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with h5py.File(h5_path, 'w') as hf:
+        dset = hf.create_dataset('vectors', shape=(0, vectors[0].shape[0]),
+                                 maxshape=(None, vectors[0].shape[0]), dtype='float32')
+        for i, vec in enumerate(vectors):
+            dset.resize((i + 1, vec.shape[0]))
+            dset[i] = vec
+    timings['write_s'] = time.perf_counter() - start
+    return np.stack(vectors), timings
+
+
+def batched(encoder, texts, h5_path, batch_size, sort):
+    """Lots de batch_size passages (triés par longueur ou non), normalisation et écriture en bloc"""
+    import h5py
+
+    def encode_batch(batch):
+        return encoder.encode(batch, batch_size=len(batch), convert_to_numpy=True)
+
+    timings = {}
+    start = time.perf_counter()
+    if sort:
+        vectors = encode_length_sorted(encode_batch, texts, batch_size)
+    else:
+        vectors = np.vstack([encode_batch(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)])
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    timings['encode_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with h5py.File(h5_path, 'w') as hf:
+        hf.create_dataset('vectors', data=vectors, maxshape=(None, vectors.shape[1]))
+    timings['write_s'] = time.perf_counter() - start
+    return vectors, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Passages/s de l'étape d'embedding, avant / après les lots")
+    parser.add_argument('--pdf', help="PDF à indexer (pdfplumber requis)")
+    parser.add_argument('--synthetic', action='store_true', help="Texte et encodeur simulés")
+    parser.add_argument('--pages', type=int, default=100, help="Pages du document simulé")
+    parser.add_argument('--model', default='all-mpnet-base-v2')
+    parser.add_argument('--max-tokens', type=int, default=DEFAULT_MAX_TOKENS)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[64])
+    parser.add_argument('--json', help="Écrire les résultats dans ce fichier JSON")
+    args = parser.parse_args()
+
+    if args.synthetic or not args.pdf:
+        encoder = SyntheticEncoder()
+        pages = synthetic_pages(args.pages)
+        label = f"document simulé de {args.pages} pages"
+    else:
+        from sentence_transformers import SentenceTransformer
+        encoder = SentenceTransformer(args.model)
+        pages = pdf_pages(args.pdf)
+        label = f"{os.path.basename(args.pdf)} ({args.model})"
+
+    texts = [chunk['text'] for chunk in sentence_chunks(pages, max_tokens=args.max_tokens)]
+    lengths = [approx_token_count(t) for t in texts]
+    print(f"📊 {label}: {len(texts)} passages, {np.mean(lengths):.0f} tokens en moyenne "
+          f"(min {min(lengths):.0f}, max {max(lengths):.0f})")
+    print(f"   {'variante':<18} {'lot':>5} {'encodage':>10} {'écriture':>10} {'passages/s':>11}  vecteurs")
+
+    report = []
+    with tempfile.TemporaryDirectory(prefix='bench_encoding_') as workdir:
+        reference, timings = legacy(encoder, texts, os.path.join(workdir, 'legacy.h5'))
+        runs = [('par passage', 1, reference, timings)]
+        for batch_size in args.batch_sizes:
+            for name, sort in (('lots', False), ('lots triés', True)):
+                vectors, timings = batched(encoder, texts, os.path.join(workdir, f'{name}.h5'), batch_size, sort)
+                runs.append((name, batch_size, vectors, timings))
+
+        for name, batch_size, vectors, timings in runs:
+            total = timings['encode_s'] + timings['write_s']
+            close = bool(np.allclose(vectors, reference, atol=1e-4))
+            row = {'variant': name, 'batch_size': batch_size, 'passages': len(texts),
+                   'encode_ms': round(timings['encode_s'] * 1000, 1),
+                   'write_ms': round(timings['write_s'] * 1000, 1),
+                   'passages_per_sec': round(len(texts) / total, 1), 'same_vectors': close}
+            report.append(row)
+            print(f"   {name:<18} {batch_size:>5} {row['encode_ms']:>8.0f}ms {row['write_ms']:>8.1f}ms "
+                  f"{row['passages_per_sec']:>11}  {'✅' if close else '❌'}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'document': label, 'results': report}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
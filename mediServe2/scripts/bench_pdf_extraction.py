@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Benchmark de l'extraction des PDF (rag.pdf_extraction) selon le nombre de processus.
+
+Usage:
+    python scripts/bench_pdf_extraction.py --pdf compte_rendu_hospitalisation.pdf
+    python scripts/bench_pdf_extraction.py --pdf dossier.pdf --workers 1 2 4 8 --no-tables --json bench_pdf.json
+    python scripts/bench_pdf_extraction.py --pdf dossier.pdf --workers 1 4 --celery
+
+Pour chaque nombre de workers : temps total, pages/s, délai avant le premier
+passage (les passages sortent au fil de l'eau, dans l'ordre des pages) et
+pic de mémoire des processus d'extraction. Avec 1 worker, l'extraction est
+séquentielle dans le processus. La colonne 'pool' indique le pool utilisé
+(multiprocessing, billiard ou séquentiel).
+Avec --celery, chaque mesure est exécutée dans un processus enfant d'un
+worker Celery prefork lancé par le script (broker de CELERY_BROKER_URL),
+comme process_document_async en production.
+Avec --compare-triage, chaque configuration est mesurée avec et sans tri
+des pages (rag.page_triage) ; la colonne 'voies' donne la répartition
+texte / tableau / ocr / vide.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.abspath(os.path.join(script_dir, '..'))
+sys.path.insert(0, project_root)
+
+CELERY_QUEUE = 'bench_pdf_extraction'
+
+
+def measure(pdf, workers, triage, tables, page_timeout):
+    """Une extraction complète du PDF ; ligne du rapport"""
+    import multiprocessing
+    from rag.pdf_extraction import PdfExtractor
+
+    extractor = PdfExtractor(workers=workers, page_timeout=page_timeout, triage=triage)
+    start = time.perf_counter()
+    first, passages = None, 0
+    for _ in extractor.iter_passages(pdf, tables=tables):
+        if first is None:
+            first = time.perf_counter() - start
+        passages += 1
+    elapsed = time.perf_counter() - start
+    stats = extractor.stats
+    usage = resource.RUSAGE_SELF if stats['workers'] == 1 else resource.RUSAGE_CHILDREN
+    return {
+        'workers': workers, 'triage': triage, 'pages': stats['pages'], 'passages': passages,
+        'routes': stats['routes'] if triage else None, 'pool': stats['pool'],
+        'daemon': multiprocessing.current_process().daemon,
+        'elapsed_s': round(elapsed, 2), 'pages_per_sec': round(stats['pages'] / elapsed, 1),
+        'first_passage_ms': round((first or 0) * 1000, 1),
+        'skipped_pages': len(stats['timeouts']) + len(stats['errors']),
+        'max_rss_mb': round(resource.getrusage(usage).ru_maxrss / 1024, 1),
+    }
+
+
+try:
+    from celery import shared_task
+    # Importé par le worker lancé avec --celery (option --include)
+    measure_in_worker = shared_task(name=f'{CELERY_QUEUE}.measure')(measure)
+except ImportError:
+    measure_in_worker = None
+
+
+def start_celery_worker():
+    """Worker prefork à un processus enfant, dédié à la file du benchmark"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        p for p in (project_root, script_dir, os.environ.get('PYTHONPATH')) if p))
+    return subprocess.Popen(
+        [sys.executable, '-m', 'celery', '-A', 'mediServe', 'worker', '--pool', 'prefork', '--concurrency', '1',
+         '-Q', CELERY_QUEUE, '--include', 'bench_pdf_extraction', '--loglevel', 'warning'],
+        cwd=project_root, env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extraction parallèle des pages d'un PDF")
+    parser.add_argument('--pdf', required=True)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--no-tables', action='store_true', help="Sans extraction camelot")
+    parser.add_argument('--page-timeout', type=float, default=60)
+    parser.add_argument('--compare-triage', action='store_true', help="Mesurer aussi sans tri des pages")
+    parser.add_argument('--celery', action='store_true', help="Mesurer dans un worker Celery prefork")
+    parser.add_argument('--json', help="Écrire les résultats dans ce fichier JSON")
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mediServe.settings')
+    import django
+    django.setup()
+
+    worker = None
+    if args.celery:
+        if measure_in_worker is None:
+            print("❌ Celery n'est pas installé")
+            sys.exit(1)
+        from mediServe.celery import app  # noqa: F401 (application courante des tâches partagées)
+        worker = start_celery_worker()
+    pdf = os.path.abspath(args.pdf)
+
+    print(f"📊 {os.path.basename(args.pdf)}, tableaux {'non' if args.no_tables else 'oui'}"
+          f"{', dans un worker Celery prefork' if args.celery else ''}")
+    print(f"   {'workers':>7} {'total':>9} {'pages/s':>8} {'1er passage':>12} {'passages':>9} {'ignorées':>9} "
+          f"{'RSS max':>9} {'tri':>4} {'pool':>16}  voies")
+    report = []
+    runs = [(workers, triage) for workers in args.workers
+            for triage in ((False, True) if args.compare_triage else (True,))]
+    try:
+        for workers, triage in runs:
+            measure_args = (pdf, workers, triage, not args.no_tables, args.page_timeout)
+            if worker is not None:
+                row = measure_in_worker.apply_async(measure_args, queue=CELERY_QUEUE).get(timeout=3600)
+            else:
+                row = measure(*measure_args)
+            report.append(row)
+            pool = f"{row['pool']}{' (démon)' if row['daemon'] else ''}"
+            print(f"   {workers:>7} {row['elapsed_s']:>8.1f}s {row['pages_per_sec']:>8} "
+                  f"{row['first_passage_ms']:>10.0f}ms {row['passages']:>9} {row['skipped_pages']:>9} "
+                  f"{row['max_rss_mb']:>7.0f}Mo {'oui' if triage else 'non':>4} {pool:>16}  "
+                  f"{' '.join(f'{k}:{v}' for k, v in row['routes'].items() if v) if triage else '-'}")
+    finally:
+        if worker is not None:
+            worker.terminate()
+            worker.wait(timeout=30)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Benchmark hors ligne de la recherche RAG : qualité (recall@k, MRR) et
+latence par étape (embed, faiss, bm25, fusion, rerank) sur un corpus fixe.
+
+Usage:
+    python scripts/bench_retrieval.py
+    python scripts/bench_retrieval.py --json bench_retrieval.json
+    python scripts/bench_retrieval.py --baseline bench_retrieval.json --fail-on-regression
+    python scripts/bench_retrieval.py --embedder hashing --no-rerank
+    python scripts/bench_retrieval.py --alphas 0.3 0.5 0.7 --dense-k 20 --bm25-k 20
+
+Configurations évaluées : Retriever (dense seul), HybridRetriever avec
+l'index BM25 compact pour chaque alpha, avec Whoosh, BM25 seul (alpha=0)
+et, si un cross-encoder local est disponible, hybride + reranking.
+
+Aucun accès réseau : les modèles sont chargés depuis le cache local
+(HF_HUB_OFFLINE). Sans modèle d'embedding en cache, un embedder par
+hachage (n-grammes de caractères) est utilisé : les latences restent
+comparables d'un run à l'autre, pas la qualité sémantique.
+"""
+import os
+
+# Hors ligne : jamais de téléchargement de modèle pendant le benchmark
+os.environ.setdefault('HF_HUB_OFFLINE', '1')
+os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+
+import re  # noqa: E402
+import sys  # noqa: E402
+import json  # noqa: E402
+import logging  # noqa: E402
+import time  # noqa: E402
+import zlib  # noqa: E402
+import argparse  # noqa: E402
+import platform  # noqa: E402
+import tempfile  # noqa: E402
+
+import numpy as np  # noqa: E402
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+from whoosh import index as whoosh_index  # noqa: E402
+from whoosh.fields import Schema, TEXT, ID  # noqa: E402
+
+from rag.your_rag_module import FR_ANALYZER, EmbeddingGenerator, HybridRetriever, Retriever  # noqa: E402
+from rag.vector_format import MmapVectorStore, write_store  # noqa: E402
+from rag.sparse_bm25 import SparseBM25Index  # noqa: E402
+
+DEFAULT_FIXTURE = os.path.join(script_dir, 'fixtures', 'retrieval_eval_fr.json')
+STAGES = ('embed', 'faiss', 'bm25', 'fusion', 'rerank')
+
+
+class HashingEmbedder:
+    """Embedder déterministe sans modèle : mots + trigrammes de caractères hachés"""
+
+    def __init__(self, dim: int = 384):
+        self.model_name = f'hashing-{dim}'
+        self.dim = dim
+
+    def _vector(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype='float32')
+        words = re.findall(r"[0-9a-zà-öø-ÿ]+", text.lower())
+        features = words + [w[i:i + 3] for w in words for i in range(max(len(w) - 2, 1))]
+        for feat in features:
+            h = zlib.crc32(feat.encode('utf-8'))
+            vec[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def encode_batch(self, texts):
+        return np.stack([self._vector(t) for t in texts])
+
+    def embed_text(self, text: str) -> np.ndarray:
+        return self._vector(text)
+
+
+def load_embedder(kind: str, model_name: str):
+    if kind != 'hashing':
+        try:
+            return EmbeddingGenerator(model_name)
+        except Exception as e:
+            if kind == 'model':
+                raise
+            print(f"⚠️ Modèle '{model_name}' indisponible hors ligne ({e.__class__.__name__}), embedder par hachage")
+    return HashingEmbedder()
+
+
+def load_cross_encoder(model_name: str):
+    try:
+        from sentence_transformers import CrossEncoder
+        return CrossEncoder(model_name)
+    except Exception as e:
+        print(f"⚠️ Cross-encoder '{model_name}' indisponible hors ligne ({e.__class__.__name__}), reranking ignoré")
+        return None
+
+
+def build_indexes(corpus, embedder, workdir):
+    """Store mmap + index BM25 compact + index Whoosh, comme DocumentVectorizer"""
+    vectors = np.asarray(embedder.encode_batch([c['text'] for c in corpus]), dtype='float32')
+    vector_dir = os.path.join(workdir, 'vectors')
+    write_store(vector_dir, vectors, corpus)
+    store = MmapVectorStore(vector_dir)
+    store.load_store()
+
+    sparse = SparseBM25Index.build([(c['id'], c['text']) for c in corpus])
+
+    whoosh_dir = os.path.join(workdir, 'bm25')
+    os.makedirs(whoosh_dir)
+    w_idx = whoosh_index.create_in(whoosh_dir, Schema(id=ID(stored=True, unique=True), content=TEXT(analyzer=FR_ANALYZER)))
+    writer = w_idx.writer()
+    for c in corpus:
+        writer.update_document(id=c['id'], content=c['text'])
+    writer.commit()
+    return store, sparse, w_idx
+
+
+def build_configs(args, store, embedder, sparse, w_idx, cross_encoder):
+    """[(nom, retriever, kwargs de retrieve)]"""
+    knobs = {'dense_k': args.dense_k, 'bm25_k': args.bm25_k}
+    configs = [('dense', Retriever(store, embedder), {})]
+    for alpha in args.alphas:
+        configs.append((f'hybrid_a{alpha:g}', HybridRetriever(store, embedder, bm25_index=sparse),
+                        {'alpha': alpha, **knobs}))
+    configs.append(('hybrid_whoosh_a0.5', HybridRetriever(store, embedder, bm25_index=w_idx),
+                    {'alpha': 0.5, **knobs}))
+    configs.append(('bm25_only', HybridRetriever(store, embedder, bm25_index=sparse), {'alpha': 0.0, **knobs}))
+    if cross_encoder is not None:
+        reranked = HybridRetriever(store, embedder, bm25_index=sparse)
+        reranked.enable_reranking(args.reranker, cross_encoder=cross_encoder)
+        configs.append(('hybrid_a0.5_rerank', reranked, {'alpha': 0.5, **knobs}))
+    return configs
+
+
+def percentiles(samples):
+    if not samples:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0}
+    p50, p95, p99 = np.percentile(np.asarray(samples), [50, 95, 99])
+    return {'p50': round(float(p50), 3), 'p95': round(float(p95), 3), 'p99': round(float(p99), 3)}
+
+
+def evaluate(retriever, kwargs, queries, ks, repeat):
+    top_k = max(ks)
+    recall = {k: 0.0 for k in ks}
+    mrr = 0.0
+    # Passe de qualité (et de chauffe : premiers appels modèle, caches)
+    for q in queries:
+        ids = [r.get('id') for r in retriever.retrieve(q['question'], top_k, **kwargs)]
+        relevant = set(q['relevant'])
+        for k in ks:
+            recall[k] += len(relevant & set(ids[:k])) / len(relevant)
+        rank = next((i + 1 for i, doc_id in enumerate(ids) if doc_id in relevant), None)
+        mrr += 1.0 / rank if rank else 0.0
+
+    stage_samples = {stage: [] for stage in STAGES}
+    totals = []
+    for _ in range(repeat):
+        for q in queries:
+            start = time.perf_counter()
+            retriever.retrieve(q['question'], top_k, **kwargs)
+            totals.append((time.perf_counter() - start) * 1000)
+            for stage in STAGES:
+                value = retriever.last_timings.get(f'{stage}_ms')
+                if value is not None:
+                    stage_samples[stage].append(value)
+
+    n = len(queries)
+    return {
+        **{f'recall@{k}': round(recall[k] / n, 4) for k in ks},
+        'mrr': round(mrr / n, 4),
+        'latency_ms': {
+            'total': percentiles(totals),
+            **{stage: percentiles(s) for stage, s in stage_samples.items() if s},
+        },
+    }
+
+
+def compare(results, baseline, ks, max_drop):
+    """Affiche les écarts avec un run précédent ; retourne le nombre de régressions de qualité"""
+    regressions = 0
+    print("\nComparaison avec la référence :")
+    for name, current in results['configs'].items():
+        previous = baseline.get('configs', {}).get(name)
+        if previous is None:
+            print(f"  {name}: absente de la référence")
+            continue
+        deltas = []
+        for metric in [f'recall@{k}' for k in ks] + ['mrr']:
+            if metric not in previous:
+                continue
+            delta = current[metric] - previous[metric]
+            if delta < -max_drop:
+                regressions += 1
+                deltas.append(f"❌ {metric} {delta:+.3f}")
+            elif abs(delta) > 1e-9:
+                deltas.append(f"{metric} {delta:+.3f}")
+        p95, prev_p95 = current['latency_ms']['total']['p95'], previous['latency_ms']['total']['p95']
+        deltas.append(f"p95 {p95 - prev_p95:+.2f}ms ({(p95 / prev_p95 - 1) * 100 if prev_p95 else 0:+.0f}%)")
+        print(f"  {name}: {', '.join(deltas)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hors ligne recall/MRR/latence des retrievers RAG")
+    parser.add_argument('--fixture', default=DEFAULT_FIXTURE, help="JSON {corpus: [...], queries: [...]}")
+    parser.add_argument('--embedder', choices=['auto', 'model', 'hashing'], default='auto')
+    parser.add_argument('--model', default='sentence-transformers/all-MiniLM-L6-v2')
+    parser.add_argument('--reranker', default='cross-encoder/ms-marco-MiniLM-L-6-v2')
+    parser.add_argument('--no-rerank', action='store_true')
+    parser.add_argument('--alphas', type=float, nargs='+', default=[0.3, 0.5, 0.7])
+    parser.add_argument('--dense-k', type=int, default=10)
+    parser.add_argument('--bm25-k', type=int, default=10)
+    parser.add_argument('--k', type=int, nargs='+', default=[1, 3, 5, 10])
+    parser.add_argument('--repeat', type=int, default=5, help="Passes de mesure de latence")
+    parser.add_argument('--json', help="Écrire les résultats dans ce fichier JSON")
+    parser.add_argument('--baseline', help="Résultats JSON d'un run précédent à comparer")
+    parser.add_argument('--max-drop', type=float, default=0.02, help="Baisse tolérée de recall/MRR")
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+    # Les avertissements par requête (scores BM25 nuls...) noieraient le rapport
+    logging.basicConfig(level=logging.ERROR)
+
+    with open(args.fixture, encoding='utf-8') as f:
+        fixture = json.load(f)
+    corpus, queries = fixture['corpus'], fixture['queries']
+    ks = sorted(set(args.k))
+
+    embedder = load_embedder(args.embedder, args.model)
+    cross_encoder = None if args.no_rerank else load_cross_encoder(args.reranker)
+
+    results = {
+        'meta': {
+            'fixture': os.path.basename(args.fixture),
+            'corpus_size': len(corpus),
+            'queries': len(queries),
+            'embedder': embedder.model_name,
+            'reranker': args.reranker if cross_encoder is not None else None,
+            'dense_k': args.dense_k,
+            'bm25_k': args.bm25_k,
+            'repeat': args.repeat,
+            'python': platform.python_version(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'configs': {},
+    }
+
+    with tempfile.TemporaryDirectory() as workdir:
+        store, sparse, w_idx = build_indexes(corpus, embedder, workdir)
+        configs = build_configs(args, store, embedder, sparse, w_idx, cross_encoder)
+
+        header = ' '.join(f"{'R@' + str(k):>6}" for k in ks)
+        print(f"{len(corpus)} extraits, {len(queries)} questions, embedder {embedder.model_name}\n")
+        print(f"{'configuration':<22} {header} {'MRR':>6} {'p50':>8} {'p95':>8} {'p99':>8}")
+        for name, retriever, kwargs in configs:
+            r = evaluate(retriever, kwargs, queries, ks, args.repeat)
+            results['configs'][name] = r
+            total = r['latency_ms']['total']
+            recalls = ' '.join(f"{r[f'recall@{k}']:>6.3f}" for k in ks)
+            print(f"{name:<22} {recalls} {r['mrr']:>6.3f} {total['p50']:>6.2f}ms "
+                  f"{total['p95']:>6.2f}ms {total['p99']:>6.2f}ms")
+
+        print("\nLatence p95 par étape (ms) :")
+        for name, r in results['configs'].items():
+            stages = ', '.join(f"{s} {r['latency_ms'][s]['p95']:.3f}" for s in STAGES if s in r['latency_ms'])
+            print(f"  {name:<22} {stages}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('meta', {}).get('embedder') != results['meta']['embedder']:
+            print(f"⚠️ Embedder différent de la référence ({baseline.get('meta', {}).get('embedder')})")
+        regressions = compare(results, baseline, ks, args.max_drop)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
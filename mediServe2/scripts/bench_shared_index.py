@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Benchmark : un index FAISS par patient vs index partagé shardé (rag.shared_index).
+
+Usage:
+    python scripts/bench_shared_index.py --patients 1000 10000 100000
+    python scripts/bench_shared_index.py --patients 10000 --chunks 20 --dim 768 --shards 16
+
+Pour chaque taille, les deux dispositions sont construites sur disque avec
+les mêmes vecteurs synthétiques, puis mesurées dans un sous-processus dédié
+(RSS propre) :
+  - per_patient : latence avec tous les index en mémoire, latence "miss"
+    (lecture du fichier du patient + recherche), RSS avec tous les index chargés
+  - shared      : latence avec filtre IDSelectorRange, RSS avec les shards ouverts
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+import numpy as np
+import faiss
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+from rag.shared_index import SharedFaissIndex, encode_ids  # noqa: E402
+from rag.vector_format import normalize_rows  # noqa: E402
+
+
+def rss_bytes():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def patient_vectors(patient_id, chunks, dim):
+    rng = np.random.default_rng(patient_id)
+    return normalize_rows(rng.standard_normal((chunks, dim), dtype=np.float32))
+
+
+def build(root, n_patients, chunks, dim, shards):
+    per_patient_dir = os.path.join(root, 'per_patient')
+    shared_dir = os.path.join(root, 'shared')
+    os.makedirs(per_patient_dir)
+
+    shard_indexes = [faiss.IndexIDMap2(faiss.IndexFlatIP(dim)) for _ in range(shards)]
+    for pid in range(1, n_patients + 1):
+        vecs = patient_vectors(pid, chunks, dim)
+        index = faiss.IndexFlatIP(dim)
+        index.add(vecs)
+        faiss.write_index(index, os.path.join(per_patient_dir, f'patient_{pid}.faiss'))
+        shard_indexes[pid % shards].add_with_ids(vecs, encode_ids(pid, np.arange(chunks)))
+
+    # Écriture directe des shards (même nommage que SharedFaissIndex)
+    shared = SharedFaissIndex(shared_dir, dim, n_shards=shards)
+    for shard, index in enumerate(shard_indexes):
+        faiss.write_index(index, shared.shard_path(shard))
+
+
+def measure(root, layout, n_patients, chunks, dim, shards, queries, top_k):
+    """Exécuté dans un sous-processus : retourne les mesures en JSON"""
+    rng = np.random.default_rng(12345)
+    targets = rng.integers(1, n_patients + 1, size=queries)
+    qvecs = [patient_vectors(int(pid), chunks, dim)[0] + 0.05 for pid in targets]
+    rss_start = rss_bytes()
+    result = {'layout': layout, 'patients': n_patients}
+
+    if layout == 'per_patient':
+        directory = os.path.join(root, 'per_patient')
+        miss = []
+        for pid, q in zip(targets[:min(queries, 200)], qvecs):
+            start = time.perf_counter()
+            index = faiss.read_index(os.path.join(directory, f'patient_{pid}.faiss'))
+            index.search(q.reshape(1, -1), top_k)
+            miss.append((time.perf_counter() - start) * 1000)
+
+        indexes = {}
+        start = time.perf_counter()
+        for pid in range(1, n_patients + 1):
+            indexes[pid] = faiss.read_index(os.path.join(directory, f'patient_{pid}.faiss'))
+        result['load_all_s'] = time.perf_counter() - start
+
+        hot = []
+        for pid, q in zip(targets, qvecs):
+            start = time.perf_counter()
+            indexes[int(pid)].search(q.reshape(1, -1), top_k)
+            hot.append((time.perf_counter() - start) * 1000)
+        result['miss_p50_ms'] = statistics.median(miss)
+    else:
+        shared = SharedFaissIndex(os.path.join(root, 'shared'), dim, n_shards=shards)
+        start = time.perf_counter()
+        for shard in range(shards):
+            shared._shard(shard)
+        result['load_all_s'] = time.perf_counter() - start
+
+        hot = []
+        for pid, q in zip(targets, qvecs):
+            start = time.perf_counter()
+            shared.search(int(pid), q, top_k)
+            hot.append((time.perf_counter() - start) * 1000)
+
+    hot.sort()
+    result['p50_ms'] = statistics.median(hot)
+    result['p95_ms'] = hot[int(len(hot) * 0.95) - 1]
+    result['rss_mb'] = (rss_bytes() - rss_start) / 1024 / 1024
+    result['files'] = len(os.listdir(os.path.join(root, layout)))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark index par patient vs index partagé")
+    parser.add_argument('--patients', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--chunks', type=int, default=8, help="Chunks par patient")
+    parser.add_argument('--dim', type=int, default=128)
+    parser.add_argument('--shards', type=int, default=16)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--json', help="Écrire les résultats dans ce fichier JSON")
+    parser.add_argument('--worker', nargs=3, metavar=('ROOT', 'LAYOUT', 'PATIENTS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        root, layout, n_patients = args.worker
+        print(json.dumps(measure(root, layout, int(n_patients), args.chunks, args.dim,
+                                 args.shards, args.queries, args.top_k)))
+        return
+
+    results = []
+    print(f"{'patients':>9} {'layout':>12} {'files':>7} {'p50':>9} {'p95':>9} {'miss p50':>9} {'RSS':>9}")
+    for n_patients in args.patients:
+        root = tempfile.mkdtemp(prefix='bench_shared_')
+        try:
+            build(root, n_patients, args.chunks, args.dim, args.shards)
+            for layout in ('per_patient', 'shared'):
+                out = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--worker', root, layout, str(n_patients),
+                     '--chunks', str(args.chunks), '--dim', str(args.dim), '--shards', str(args.shards),
+                     '--queries', str(args.queries), '--top-k', str(args.top_k)],
+                    check=True, capture_output=True, text=True,
+                ).stdout
+                r = json.loads(out.strip().splitlines()[-1])
+                results.append(r)
+                miss = f"{r['miss_p50_ms']:.3f}ms" if 'miss_p50_ms' in r else '-'
+                print(f"{n_patients:>9} {layout:>12} {r['files']:>7} {r['p50_ms']:>7.3f}ms "
+                      f"{r['p95_ms']:>7.3f}ms {miss:>9} {r['rss_mb']:>7.1f}Mo")
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la compression des vecteurs (float16, SQ8, PQ) avec re-scoring exact.
+
+Usage:
+    python scripts/bench_vector_compression.py --rows 20000 --dim 768
+    python scripts/bench_vector_compression.py --rows 50000 --codecs sq8 pq --rescore-factors 1 4 8 --json bench.json
+
+Référence : index Flat float32 (recherche exacte), tel que construit par
+DocumentVectorizer avant compression. Pour chaque codec, l'index est
+construit par rag.index_factory puis interrogé via MmapVectorStore : la
+recherche porte sur les codes, puis les RESCORE_FACTOR × k meilleurs
+candidats sont re-scorés sur vectors.mvec (float32, mappé). Un facteur 1
+mesure les codes seuls, sans re-scoring.
+
+"Mémoire" est la taille de l'index résident. Le store mmap est lu à la
+demande via le page cache et n'est pas compté. Le store HDF5 historique
+garde en plus les vecteurs float32 en mémoire (≈ 2× la référence).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import faiss
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+from bench_faiss_index import clustered_vectors, percentile, recall_at_k  # noqa: E402
+from rag.index_factory import build_index, choose_index_spec, write_index_params  # noqa: E402
+from rag.vector_format import MmapVectorStore, normalize_rows, write_store  # noqa: E402
+
+CODECS = ('fp16', 'sq8', 'pq')
+
+
+def measure(search, queries, k, truth):
+    latencies, found = [], []
+    for q in queries:
+        start = time.perf_counter()
+        hits = search(q)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(([i for i, _ in hits] + [-1] * k)[:k])
+    return {
+        'recall': round(recall_at_k(np.array(found), truth), 4),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+    }
+
+
+def bench_rows(n, args, rng, workdir):
+    vectors = clustered_vectors(n, args.dim, max(16, n // 500), rng)
+    queries = normalize_rows(vectors[rng.choice(n, args.queries, replace=False)]
+                             + rng.standard_normal((args.queries, args.dim)).astype('float32') * 0.02)
+    directory = os.path.join(workdir, f'store_{n}')
+    write_store(directory, vectors, [{'id': str(i), 'text': ''} for i in range(n)])
+
+    exact = faiss.IndexFlatIP(args.dim)
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+    reference_bytes = len(faiss.serialize_index(exact))
+
+    def flat_search(q):
+        scores, ids = exact.search(q.reshape(1, -1), args.k)
+        return list(zip(ids[0], scores[0]))
+
+    reference = measure(flat_search, queries, args.k, truth)
+    rows = [{'codec': 'float32 (référence)', 'factory': 'Flat', 'rescore_factor': None,
+             'memory_mb': round(reference_bytes / 1024 / 1024, 2), 'memory_ratio': 1.0, **reference}]
+
+    for codec in args.codecs:
+        spec = choose_index_spec(n, args.dim, type='flat', compression=codec)
+        if spec['codec'] != codec:
+            print(f"   {codec}: pas assez de vecteurs pour l'apprentissage, remplacé par {spec['codec']} — ignoré")
+            continue
+        index = build_index(vectors, spec)
+        faiss.write_index(index, os.path.join(directory, 'vector_store.faiss'))
+        write_index_params(directory, spec)
+        index_bytes = len(faiss.serialize_index(index))
+
+        store = MmapVectorStore(directory)
+        store.load_store()
+        for factor in args.rescore_factors:
+            store.index_params['rescore'] = factor > 1
+            store.index_params['rescore_factor'] = factor
+            point = measure(lambda q: store.search(q, args.k), queries, args.k, truth)
+            rows.append({'codec': codec, 'factory': spec['factory'], 'rescore_factor': factor,
+                         'memory_mb': round(index_bytes / 1024 / 1024, 2),
+                         'memory_ratio': round(index_bytes / reference_bytes, 3), **point})
+
+    print(f"\n📊 {n} vecteurs (dim {args.dim}), rappel@{args.k} contre Flat float32")
+    print(f"   {'codec':<20} {'re-score':>8} {'mémoire':>10} {'ratio':>6} {'rappel':>7} {'Δ':>7} "
+          f"{'p50':>8} {'p95':>8}")
+    for row in rows:
+        factor = f"x{row['rescore_factor']}" if row['rescore_factor'] and row['rescore_factor'] > 1 else '-'
+        delta = row['recall'] - reference['recall']
+        print(f"   {row['codec']:<20} {factor:>8} {row['memory_mb']:>8.2f}MB {row['memory_ratio']:>6.3f} "
+              f"{row['recall']:>7.3f} {delta:>+7.3f} {row['p50_ms']:>6.3f}ms {row['p95_ms']:>6.3f}ms")
+    return {'rows': n, 'dim': args.dim, 'results': rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mémoire et rappel des index compressés avec re-scoring")
+    parser.add_argument('--rows', type=int, nargs='+', default=[20000])
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--codecs', nargs='+', default=list(CODECS), choices=CODECS)
+    parser.add_argument('--rescore-factors', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--threads', type=int, default=0, help="Threads OpenMP de FAISS (0 = défaut)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help="Écrire les résultats dans ce fichier JSON")
+    args = parser.parse_args()
+
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory(prefix='bench_compression_') as workdir:
+        report = [bench_rows(n, args, rng, workdir) for n in args.rows]
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
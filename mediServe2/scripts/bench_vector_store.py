@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Benchmark des temps de chargement du vector store : HDF5 (historique) vs mmap.
+
+Usage:
+    python scripts/bench_vector_store.py --rows 2000 20000 --dim 768
+    python scripts/bench_vector_store.py --rows 10000 --dtype float16 --json bench.json
+
+"Cold" : les pages des fichiers sont évincées du page cache (posix_fadvise)
+avant chaque chargement. "Warm" : les fichiers sont déjà en cache.
+Le chargement inclut l'ouverture du store et une première recherche top-5.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+
+import numpy as np
+import h5py
+import faiss
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+from rag.vector_format import MmapVectorStore, write_store, normalize_rows  # noqa: E402
+
+
+def drop_page_cache(paths):
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def write_hdf5_store(directory, vectors, metadata):
+    """Même disposition que le store HDF5 historique (vector_store.h5 + index Flat)"""
+    h5_path = os.path.join(directory, 'vector_store.h5')
+    with h5py.File(h5_path, 'w') as hf:
+        hf.create_dataset('vectors', data=vectors)
+        dt = h5py.special_dtype(vlen=bytes)
+        meta_ds = hf.create_dataset('metadata', (len(metadata),), dtype=dt)
+        for i, meta in enumerate(metadata):
+            meta_ds[i] = json.dumps(meta).encode('utf-8')
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    faiss.write_index(index, os.path.join(directory, 'vector_store.faiss'))
+    return [h5_path, os.path.join(directory, 'vector_store.faiss')]
+
+
+def load_hdf5_and_search(directory, query):
+    """Reproduit VectorStoreHDF5.load_store + search"""
+    with h5py.File(os.path.join(directory, 'vector_store.h5'), 'r') as hf:
+        vectors = hf['vectors'][:]
+        meta = [json.loads(r.decode('utf-8')) for r in hf['metadata'][:]]
+    id_map = {m['id']: m for m in meta}
+    index = faiss.read_index(os.path.join(directory, 'vector_store.faiss'))
+    q = query.reshape(1, -1).copy()
+    faiss.normalize_L2(q)
+    _, ids = index.search(q, 5)
+    return [meta[i] for i in ids[0] if i >= 0], vectors, id_map
+
+
+def load_mmap_and_search(directory, query):
+    store = MmapVectorStore(directory)
+    store.load_store()
+    hits = store.search(query, 5)
+    return store.get_metadata([i for i, _ in hits])
+
+
+def timed(fn, repeats, before=None):
+    samples = []
+    for _ in range(repeats):
+        if before:
+            before()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def synthetic_store(rows, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = normalize_rows(rng.standard_normal((rows, dim), dtype=np.float32))
+    metadata = [
+        {'id': f'doc1_patient1_pdf_page_p{i // 4}_c{i}', 'page': i // 4, 'type': 'pdf_page',
+         'text': ' '.join(['compte rendu médical'] * 60)}
+        for i in range(rows)
+    ]
+    return vectors, metadata
+
+
+def bench_one(rows, dim, dtype, repeats):
+    vectors, metadata = synthetic_store(rows, dim)
+    query = vectors[rows // 2].copy()
+
+    with tempfile.TemporaryDirectory() as h5_dir, tempfile.TemporaryDirectory() as mm_dir:
+        h5_files = write_hdf5_store(h5_dir, vectors, metadata)
+        write_store(mm_dir, vectors, metadata, dtype=dtype)
+        mm_files = [os.path.join(mm_dir, f) for f in os.listdir(mm_dir)]
+
+        return {
+            'rows': rows,
+            'dim': dim,
+            'mmap_dtype': dtype,
+            'hdf5_bytes': sum(os.path.getsize(p) for p in h5_files),
+            'mmap_bytes': sum(os.path.getsize(p) for p in mm_files),
+            'hdf5_cold_ms': timed(lambda: load_hdf5_and_search(h5_dir, query), repeats,
+                                  before=lambda: drop_page_cache(h5_files)),
+            'mmap_cold_ms': timed(lambda: load_mmap_and_search(mm_dir, query), repeats,
+                                  before=lambda: drop_page_cache(mm_files)),
+            'hdf5_warm_ms': timed(lambda: load_hdf5_and_search(h5_dir, query), repeats),
+            'mmap_warm_ms': timed(lambda: load_mmap_and_search(mm_dir, query), repeats),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HDF5 vs mmap pour le vector store")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--json', help="Écrire les résultats dans ce fichier JSON")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'rows':>8} {'HDF5 cold':>11} {'mmap cold':>11} {'HDF5 warm':>11} {'mmap warm':>11}")
+    for rows in args.rows:
+        r = bench_one(rows, args.dim, args.dtype, args.repeats)
+        results.append(r)
+        print(f"{rows:>8} {r['hdf5_cold_ms']:>9.1f}ms {r['mmap_cold_ms']:>9.1f}ms "
+              f"{r['hdf5_warm_ms']:>9.1f}ms {r['mmap_warm_ms']:>9.1f}ms")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
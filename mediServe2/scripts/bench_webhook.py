@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Benchmark de bout en bout du webhook WhatsApp RAG avec Gemini et Twilio simulés.
+
+Usage:
+    # En processus (substituts 'fake', client de test Django)
+    python scripts/bench_webhook.py --phone +221770000000 --requests 50
+    python scripts/bench_webhook.py --phone +221770000000 --no-sleep --json bench_webhook.json
+
+    # Contre un serveur lancé avec GEMINI_BACKEND=http TWILIO_BACKEND=http
+    python scripts/stand_in_server.py &
+    python scripts/bench_webhook.py --url http://127.0.0.1:8000/api/webhook/twilio/ --phone +221770000000
+
+Le patient (--phone) doit exister et être actif (scripts/create_test_patient.py) :
+chaque requête crée un ConversationLog dans la base configurée.
+
+Le rapport sépare la latence totale du webhook (p50/p95/p99) de la latence
+injectée par les substituts : la différence est le temps passé dans notre
+code (recherche, prompt, base de données, attentes internes). Avec
+--no-sleep, les substituts répondent immédiatement et seule cette part reste.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+QUESTIONS = [
+    "Quels sont mes derniers résultats ?",
+    "Quelle est ma posologie actuelle ?",
+    "Est-ce que mon cholestérol est trop élevé ?",
+    "Quand est mon prochain rendez-vous ?",
+    "Résume mon dernier rapport médical",
+]
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * q), len(samples) - 1)] if samples else 0.0
+
+
+def twilio_payload(phone, body):
+    sid = f"SM{uuid.uuid4().hex}"
+    return {'MessageSid': sid, 'SmsSid': sid, 'AccountSid': 'ACstandin', 'NumMedia': '0',
+            'From': f'whatsapp:{phone}', 'To': 'whatsapp:+14155238886', 'Body': body}
+
+
+def in_process_sender(args):
+    os.environ['GEMINI_BACKEND'] = 'fake'
+    os.environ['TWILIO_BACKEND'] = 'fake'
+    os.environ['STAND_IN_SEED'] = str(args.seed)
+    os.environ['STAND_IN_SLEEP'] = 'False' if args.no_sleep else 'True'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mediServe.settings')
+    import django
+    django.setup()
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    setup_test_environment()  # ALLOWED_HOSTS += testserver
+
+    def send(payload):
+        response = Client().post('/api/webhook/twilio/', payload)
+        return response.status_code
+
+    def stats():
+        from core.stand_ins import get_stand_in_stats
+        return get_stand_in_stats().snapshot()
+
+    return send, stats
+
+
+def http_sender(args):
+    import requests
+    stand_in_url = os.getenv('STAND_IN_URL', 'http://127.0.0.1:8765').rstrip('/')
+    requests.post(f"{stand_in_url}/reset", timeout=5)
+
+    def send(payload):
+        return requests.post(args.url, data=payload, timeout=120).status_code
+
+    def stats():
+        return requests.get(f"{stand_in_url}/stats", timeout=5).json()
+
+    return send, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark du webhook WhatsApp RAG avec substituts")
+    parser.add_argument('--phone', required=True, help="Numéro d'un patient actif")
+    parser.add_argument('--requests', type=int, default=30)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--url', help="Webhook HTTP (sinon client de test Django en processus)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-sleep', action='store_true', help="Substituts sans latence (en processus)")
+    parser.add_argument('--json', help="Écrire les résultats dans ce fichier JSON")
+    args = parser.parse_args()
+
+    send, stats = http_sender(args) if args.url else in_process_sender(args)
+    payloads = [twilio_payload(args.phone, QUESTIONS[i % len(QUESTIONS)]) for i in range(args.requests)]
+
+    def timed(payload):
+        start = time.perf_counter()
+        status = send(payload)
+        return status, (time.perf_counter() - start) * 1000
+
+    before = stats()
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(timed, payloads))
+    wall_s = time.perf_counter() - wall_start
+    after = stats()
+
+    latencies = [ms for _, ms in results]
+    failures = sum(1 for status, _ in results if status >= 400)
+    services = {}
+    for name, values in after.items():
+        prev = before.get(name, {})
+        services[name] = {k: values[k] - prev.get(k, 0) for k in values}
+    injected_ms = sum(s['injected_ms'] for s in services.values())
+    own_ms = (sum(latencies) - injected_ms) / len(latencies) if latencies else 0.0
+
+    report = {
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'mode': 'http' if args.url else 'in-process',
+        'seed': args.seed,
+        'failures': failures,
+        'throughput_rps': round(args.requests / wall_s, 2),
+        'latency_ms': {
+            'mean': round(statistics.mean(latencies), 1),
+            'p50': round(percentile(latencies, 0.50), 1),
+            'p95': round(percentile(latencies, 0.95), 1),
+            'p99': round(percentile(latencies, 0.99), 1),
+        },
+        'injected_ms_per_request': round(injected_ms / args.requests, 1),
+        'own_overhead_ms_per_request': round(own_ms, 1),
+        'services': services,
+    }
+
+    lat = report['latency_ms']
+    print(f"📊 {args.requests} requêtes ({report['mode']}, concurrence {args.concurrency}), {failures} échec(s)")
+    print(f"   latence : moyenne {lat['mean']}ms, p50 {lat['p50']}ms, p95 {lat['p95']}ms, p99 {lat['p99']}ms")
+    print(f"   débit : {report['throughput_rps']} req/s")
+    print(f"   latence injectée (Gemini/Twilio simulés) : {report['injected_ms_per_request']}ms/requête")
+    if args.concurrency == 1:
+        print(f"   notre code : {report['own_overhead_ms_per_request']}ms/requête")
+    for name, s in services.items():
+        print(f"   {name}: {s['calls']} appels, {s['errors']} erreurs, {s['rate_limited']} réponses 429")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -144,7 +144,8 @@ def check_patient_rag_setup(patient_id=None, phone=None):
         try:
             # Importer et tester
             sys.path.append(os.path.join(settings.BASE_DIR, 'scripts'))
-            from rag.your_rag_module import VectorStoreHDF5, EmbeddingGenerator
+            from rag.your_rag_module import VectorStoreHDF5
+            from rag.model_registry import ModelRegistry
             
             # Charger le store
             store = VectorStoreHDF5(hdf5_path)
@@ -153,7 +154,7 @@ def check_patient_rag_setup(patient_id=None, phone=None):
             print(f"  - Nombre de documents: {len(store.meta)}")
             
             # Tester l'embedder
-            embedder = EmbeddingGenerator()
+            embedder = ModelRegistry.get_embedder()
             test_vec = embedder.embed_text("test")
             print(f"  ✅ Embedder fonctionne")
             print(f"  - Dimension des vecteurs: {len(test_vec)}")
@@ -5,10 +5,12 @@ index dense (FAISS + HDF5) et index sparse BM25 (Whoosh),
 et tests de retrieval intégrés (FAISS & BM25).
 """
 import os
+import sys
 import json
+import time
 import argparse
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 
 import collections, collections.abc
@@ -21,17 +23,21 @@ import h5py
 import faiss
 import pdfplumber
 import camelot
-from PIL import Image
-import pytesseract
 from sentence_transformers import SentenceTransformer
 
-# Pour chunking sémantique
+# Pour chunking sémantique (découpage en phrases de rag.chunking)
 import nltk
-from nltk.tokenize import sent_tokenize
 # Télécharger les modèles Punkt pour le français
 nltk.download('punkt', quiet=True)
 nltk.download('punkt_tab', quiet=True)
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')))
+from rag.batching import encode_length_sorted  # noqa: E402
+from rag.chunking import (DEFAULT_MAX_TOKENS, lexical_chunks, semantic_chunks,  # noqa: E402
+                          tokenizer_token_counter)
+from rag.ocr import OcrEngine, OcrResultCache  # noqa: E402
+from rag.page_triage import triage_pdf  # noqa: E402
+
 from whoosh import index as whoosh_index
 from whoosh.fields import Schema, TEXT, ID
 from whoosh.analysis import RegexTokenizer, LowercaseFilter
@@ -49,81 +55,67 @@ DEFAULT_QUERIES = [
 ]
 
 
-def extract_text_chunks_lexical(pdf_path: str, chunk_size: int, overlap: int) -> List[Dict]:
-    passages = []
+def iter_pdf_pages(pdf_path: str):
+    """Pages du PDF une par une (page 0-indexée)"""
     with pdfplumber.open(pdf_path) as pdf:
         for page_idx, page in enumerate(pdf.pages):
-            text = page.extract_text() or ""
-            words = text.split()
-            start = 0
-            while start < len(words):
-                chunk = words[start:start+chunk_size]
-                passages.append({"source": "text", "page": page_idx, "text": " ".join(chunk)})
-                start += chunk_size - overlap
-    return passages
+            yield {"source": "text", "page": page_idx, "text": page.extract_text() or ""}
 
 
-def extract_text_chunks_semantic(pdf_path: str, embedder: SentenceTransformer, threshold: float) -> List[Dict]:
-    passages = []
-    with pdfplumber.open(pdf_path) as pdf:
-        for page_idx, page in enumerate(pdf.pages):
-            text = page.extract_text() or ""
-            # Tokenisation en phrases en français
-            sentences = sent_tokenize(text, language='french')
-            if not sentences:
-                continue
-            # Encoder et normaliser chaque phrase
-            emb = embedder.encode(sentences, convert_to_numpy=True)
-            faiss.normalize_L2(emb)
-            # Segmenter par similarité
-            chunk_sents: List[str] = []
-            chunk_embs: List[np.ndarray] = []
-            for sent, vec in zip(sentences, emb):
-                if not chunk_embs:
-                    chunk_sents = [sent]
-                    chunk_embs = [vec]
-                else:
-                    mean_emb = np.mean(chunk_embs, axis=0)
-                    faiss.normalize_L2(mean_emb.reshape(1, -1))
-                    sim = float(np.dot(vec, mean_emb))
-                    if sim >= threshold:
-                        chunk_sents.append(sent)
-                        chunk_embs.append(vec)
-                    else:
-                        passages.append({
-                            "source": "text", "page": page_idx,
-                            "text": " ".join(chunk_sents)
-                        })
-                        chunk_sents = [sent]
-                        chunk_embs = [vec]
-            # Ajouter le dernier chunk s'il existe
-            if chunk_sents:
-                passages.append({"source": "text", "page": page_idx, "text": " ".join(chunk_sents)})
-    return passages
+def extract_text_chunks_lexical(pdf_path: str, chunk_size: int, overlap: int) -> List[Dict]:
+    return list(lexical_chunks(iter_pdf_pages(pdf_path), max_tokens=chunk_size, overlap=overlap))
+
+
+def extract_text_chunks_semantic(pdf_path: str, embedder: SentenceTransformer, threshold: float,
+                                 max_tokens: int = DEFAULT_MAX_TOKENS) -> List[Dict]:
+    def encode(sentences):
+        return embedder.encode(sentences, convert_to_numpy=True)
+    return list(semantic_chunks(iter_pdf_pages(pdf_path), encode, threshold=threshold, max_tokens=max_tokens,
+                                count_tokens=tokenizer_token_counter(embedder.tokenizer)))
 
 
-def extract_tables(pdf_path: str) -> List[Dict]:
+def extract_tables(pdf_path: str, pages: Optional[List[int]] = None) -> List[Dict]:
+    """Tableaux camelot de toutes les pages, ou des seules `pages` (0-indexées)"""
     passages = []
-    tables = camelot.read_pdf(pdf_path, pages="all")
+    if pages is not None and not pages:
+        return passages
+    selection = "all" if pages is None else ",".join(str(p + 1) for p in pages)
+    tables = camelot.read_pdf(pdf_path, pages=selection)
     for tbl in tables:
         html = tbl.df.to_html(index=False)
         passages.append({"source": "table", "page": int(tbl.page) - 1, "text": html})
     return passages
 
 
-def extract_images_ocr(pdf_path: str) -> List[Dict]:
+def extract_images_ocr(pdf_path: str, pages: Optional[List[int]] = None,
+                       engine: Optional[OcrEngine] = None) -> List[Dict]:
+    """
+    OCR des images de toutes les pages, ou des seules `pages` (0-indexées).
+    Les images d'une page sont reconnues en parallèle ; les images répétées
+    (logos, en-têtes) ne sont lues qu'une fois grâce au cache de l'OcrEngine.
+    """
     passages = []
+    if pages is not None and not pages:
+        return passages
+    engine = engine or OcrEngine()
+    wanted = None if pages is None else set(pages)
     with pdfplumber.open(pdf_path) as pdf:
         for page_idx, page in enumerate(pdf.pages):
+            if wanted is not None and page_idx not in wanted:
+                continue
+            images = []
             for img_idx, img in enumerate(page.images):
                 bbox = (img["x0"], img["top"], img["x1"], img["bottom"])
                 try:
-                    cropped = page.crop(bbox).to_image(resolution=300)
-                    img_arr = cropped.original
-                    ocr_text = pytesseract.image_to_string(Image.fromarray(img_arr), lang='fra')
-                    passages.append({"source": "image", "page": page_idx, "text": ocr_text})
+                    images.append(page.crop(bbox).to_image(resolution=300).original)
                 except Exception as e:
-                    logging.warning(f"OCR failed for image {img_idx} on page {page_idx}: {e}")
+                    logging.warning(f"Rendering failed for image {img_idx} on page {page_idx}: {e}")
+            try:
+                texts = engine.ocr_many(images, record=False)
+            except Exception as e:
+                logging.warning(f"OCR failed on page {page_idx}: {e}")
+                continue
+            passages.extend({"source": "image", "page": page_idx, "text": text} for text in texts if text.strip())
     return passages
 
 
@@ -153,12 +145,17 @@ def main():
     parser.add_argument("--bm25_index", default="bm25_index", help="Répertoire pour l'index BM25.")
     parser.add_argument("--with_bm25", action="store_true", help="Construire l'index sparse BM25.")
     parser.add_argument("--embedder", type=str, default="all-mpnet-base-v2", help="Modèle SentenceTransformer.")
-    parser.add_argument("--chunk_size", type=int, default=1000, help="Nombre de mots par chunk lexical.")
-    parser.add_argument("--overlap", type=int, default=200, help="Chevauchement lexical.")
+    parser.add_argument("--chunk_size", type=int, default=256, help="Nombre de tokens maximal par chunk.")
+    parser.add_argument("--overlap", type=int, default=32, help="Chevauchement lexical (tokens).")
     parser.add_argument("--semantic_chunking", action="store_true",
-                        help="Activer le chunking sémantique (ignore chunk_size/overlap).")
+                        help="Activer le chunking sémantique (ignore overlap).")
     parser.add_argument("--semantic_threshold", type=float, default=0.8,
                         help="Seuil de similarité pour chunking sémantique.")
+    parser.add_argument("--batch_size", type=int, default=64, help="Passages encodés par lot (triés par longueur).")
+    parser.add_argument("--ocr_cache", default="", help="Répertoire du cache OCR (vide : sans cache).")
+    parser.add_argument("--ocr_workers", type=int, default=0, help="Processus tesseract en parallèle (0 : un par cœur).")
+    parser.add_argument("--no_triage", action="store_true",
+                        help="Camelot et OCR sur toutes les pages (sans tri des pages).")
     parser.add_argument("--test_retrieval", action="store_true", help="Tester la retrieval après indexation.")
     parser.add_argument("--use_default_queries", action="store_true", help="Utiliser les DEFAULT_QUERIES.")
     parser.add_argument("--test_query", type=str, default="", help="Requête unique pour test retrieval.")
@@ -183,32 +180,52 @@ def main():
         bm25_idx = init_bm25_index(args.bm25_index)
         bm25_writer = bm25_idx.writer()
 
+    ocr_engine = OcrEngine(workers=args.ocr_workers or None,
+                           cache=OcrResultCache(args.ocr_cache) if args.ocr_cache else None)
+
     count = 0
     for fname in os.listdir(args.input_dir):
         if not fname.lower().endswith(".pdf"): continue
         path = os.path.join(args.input_dir, fname)
-        passages = (extract_text_chunks_semantic(path, embedder, args.semantic_threshold)
+        passages = (extract_text_chunks_semantic(path, embedder, args.semantic_threshold, args.chunk_size)
                     if args.semantic_chunking else
                     extract_text_chunks_lexical(path, args.chunk_size, args.overlap))
-        passages.extend(extract_tables(path))
-        passages.extend(extract_images_ocr(path))
-        for p_i, passage in enumerate(passages):
-            pid = f"{os.path.splitext(fname)[0]}_{passage['source']}_p{passage['page']}_c{p_i}"
-            vec = embedder.encode(passage['text'], convert_to_numpy=True)
-            faiss.normalize_L2(vec.reshape(1, -1))
-            vectors.resize((count+1, dim))
-            vectors[count] = vec
-            metas.resize((count+1,))
-            metas[count] = json.dumps({
-               "id": pid,
-               "source": passage['source'],
-               "type": passage['source'],
-               "page": passage['page'],
-               "embedder": args.embedder
-            }).encode()
-            if args.with_bm25:
+        table_pages = ocr_pages = None
+        if not args.no_triage:
+            # Camelot sur les pages à tableaux, OCR sur les pages scannées seulement
+            start = time.perf_counter()
+            decisions = triage_pdf(path)
+            table_pages = [d['page'] - 1 for d in decisions if d['route'] == 'table']
+            ocr_pages = [d['page'] - 1 for d in decisions if d['route'] == 'ocr']
+            logger.info(f"{fname}: {len(decisions)} pages triées en {(time.perf_counter() - start) * 1000:.0f} ms, "
+                        f"camelot sur {len(table_pages)}, OCR sur {len(ocr_pages)}")
+        start = time.perf_counter()
+        passages.extend(extract_tables(path, table_pages))
+        passages.extend(extract_images_ocr(path, ocr_pages, ocr_engine))
+        logger.info(f"{fname}: tableaux et OCR en {(time.perf_counter() - start) * 1000:.0f} ms")
+        if not passages:
+            continue
+        # Encodage par lots triés par longueur, normalisation en un appel, une écriture HDF5 par PDF
+        embs = encode_length_sorted(
+            lambda batch: embedder.encode(batch, batch_size=len(batch), convert_to_numpy=True),
+            [passage['text'] for passage in passages], args.batch_size)
+        faiss.normalize_L2(embs)
+        pids = [f"{os.path.splitext(fname)[0]}_{passage['source']}_p{passage['page']}_c{p_i}"
+                for p_i, passage in enumerate(passages)]
+        vectors.resize((count + len(passages), dim))
+        vectors[count:count + len(passages)] = embs
+        metas.resize((count + len(passages),))
+        metas[count:count + len(passages)] = [json.dumps({
+            "id": pid,
+            "source": passage['source'],
+            "type": passage['source'],
+            "page": passage['page'],
+            "embedder": args.embedder
+        }).encode() for pid, passage in zip(pids, passages)]
+        if args.with_bm25:
+            for pid, passage in zip(pids, passages):
                 bm25_writer.add_document(id=pid, content=passage['text'])
-            count += 1
+        count += len(passages)
 
     hf.close()
     logger.info(f"Saved {count} vectors to '{args.output_hdf5}'")
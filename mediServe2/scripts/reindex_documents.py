@@ -39,6 +39,8 @@ def reindex_patient_documents(patient):
     if os.path.exists(bm25_dir):
         print(f"🗑️ Suppression de l'ancien index BM25...")
         shutil.rmtree(bm25_dir)
+    if os.path.exists(f"{bm25_dir}.sbm25"):
+        os.remove(f"{bm25_dir}.sbm25")
     
     # 2. Récupérer tous les documents
     documents = DocumentUpload.objects.filter(patient=patient)
@@ -38,7 +38,7 @@ fi
 
 # Télécharger les modèles NLTK
 echo "📚 Téléchargement des modèles NLTK..."
-python3 -c "import nltk; nltk.download('punkt'); nltk.download('punkt_tab')" 2>/dev/null
+(cd "$PROJECT_ROOT" && python3 manage.py download_nltk_data) 2>/dev/null
 
 # Installer Tesseract si nécessaire (pour OCR)
 if ! command -v tesseract &> /dev/null; then
@@ -66,7 +66,7 @@ pip install -r requirements.txt
 
 # 5. Télécharger les modèles NLTK
 log_info "Téléchargement des modèles NLTK..."
-python -c "import nltk; nltk.download('punkt'); nltk.download('punkt_tab')"
+python manage.py download_nltk_data
 
 # 6. Créer les répertoires nécessaires
 log_info "Création des répertoires..."
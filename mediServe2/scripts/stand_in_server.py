@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Serveur local imitant les API Gemini et Twilio, pour les tests de charge.
+
+Usage:
+    python scripts/stand_in_server.py --port 8765
+    python scripts/stand_in_server.py --gemini-latency lognormal:900:2500 --gemini-rpm 15 \\
+        --twilio-latency const:200 --error-rate 0.02 --rate-limit-rate 0.05 --seed 7
+
+Puis lancer Django avec GEMINI_BACKEND=http TWILIO_BACKEND=http
+(STAND_IN_URL=http://127.0.0.1:8765 par défaut).
+
+Routes :
+    POST /v1beta/models/{modèle}:generateContent       (Gemini)
+    POST /v1beta/models/{modèle}:embedContent          (Gemini)
+    POST /2010-04-01/Accounts/{sid}/Messages.json      (Twilio, formulaire)
+    GET  /2010-04-01/Accounts/{sid}/Messages/{sid}.json
+    GET  /stats    compteurs par service (appels, erreurs, 429, latence injectée)
+    POST /reset    remise à zéro des compteurs
+
+Les erreurs simulées renvoient les corps d'erreur des API réelles (503,
+429 RESOURCE_EXHAUSTED / code Twilio 20429).
+"""
+import os
+import re
+import sys
+import json
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+from core.stand_ins import (  # noqa: E402
+    configure_behaviour, fake_embedding, gemini_generate_payload, get_behaviour,
+    get_stand_in_stats, twilio_message_payload,
+)
+
+GEMINI_ROUTE = re.compile(r'^/v1beta/models/(?P<model>[^/:]+):(?P<method>generateContent|embedContent)$')
+TWILIO_CREATE = re.compile(r'^/2010-04-01/Accounts/(?P<account>[^/]+)/Messages\.json$')
+TWILIO_FETCH = re.compile(r'^/2010-04-01/Accounts/(?P<account>[^/]+)/Messages/(?P<sid>[^/]+)\.json$')
+
+GEMINI_STATUS = {429: 'RESOURCE_EXHAUSTED', 503: 'UNAVAILABLE'}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    sent = {}
+
+    def log_message(self, fmt, *args):  # silencieux : des milliers de requêtes par run
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _gemini(self, match):
+        payload = json.loads(self._body() or b'{}')
+        method = match.group('method')
+        status = get_behaviour('gemini' if method == 'generateContent' else 'gemini_embed').call()
+        if status:
+            return self._send_json(status, {'error': {
+                'code': status, 'status': GEMINI_STATUS.get(status, 'INTERNAL'),
+                'message': 'Resource has been exhausted (e.g. check quota).' if status == 429 else 'Service unavailable',
+            }})
+        parts = (payload.get('contents') or [{}])[-1].get('parts') if method == 'generateContent' \
+            else (payload.get('content') or {}).get('parts')
+        text = ''.join(p.get('text', '') for p in parts or [])
+        if method == 'generateContent':
+            return self._send_json(200, gemini_generate_payload(text))
+        return self._send_json(200, {'embedding': {'values': fake_embedding(text)}})
+
+    def _twilio_error(self, status):
+        code = 20429 if status == 429 else 20500
+        return self._send_json(status, {'code': code, 'status': status,
+                                        'message': 'Too Many Requests' if status == 429 else 'Service unavailable',
+                                        'more_info': f'https://www.twilio.com/docs/errors/{code}'})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path == '/reset':
+            get_stand_in_stats().reset()
+            return self._send_json(200, {'reset': True})
+        match = GEMINI_ROUTE.match(path)
+        if match:
+            return self._gemini(match)
+        match = TWILIO_CREATE.match(path)
+        if match:
+            params = dict(parse_qsl(self._body().decode('utf-8')))
+            status = get_behaviour('twilio').call()
+            if status:
+                return self._twilio_error(status)
+            payload = twilio_message_payload(match.group('account'), params)
+            self.sent[payload['sid']] = payload
+            return self._send_json(201, payload)
+        return self._send_json(404, {'error': f'Route inconnue: {path}'})
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/stats':
+            return self._send_json(200, get_stand_in_stats().snapshot())
+        match = TWILIO_FETCH.match(path)
+        if match:
+            status = get_behaviour('twilio').call()
+            if status:
+                return self._twilio_error(status)
+            payload = self.sent.get(match.group('sid')) or twilio_message_payload(
+                match.group('account'), {}, match.group('sid'))
+            return self._send_json(200, {**payload, 'status': 'delivered'})
+        return self._send_json(404, {'error': f'Route inconnue: {path}'})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Substituts HTTP locaux de Gemini et Twilio")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--gemini-latency', default='lognormal:900:2500')
+    parser.add_argument('--embed-latency', default='lognormal:80:200')
+    parser.add_argument('--twilio-latency', default='lognormal:250:600')
+    parser.add_argument('--gemini-rpm', type=int, default=0, help="Quota simulé (429 au-delà), 0 = aucun")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Part de réponses 503")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Part de réponses 429 aléatoires")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    faults = {'error_rate': args.error_rate, 'rate_limit_rate': args.rate_limit_rate}
+    configure_behaviour('gemini', {'latency': args.gemini_latency, 'rpm': args.gemini_rpm, **faults}, seed=args.seed)
+    configure_behaviour('gemini_embed', {'latency': args.embed_latency, **faults}, seed=args.seed)
+    configure_behaviour('twilio', {'latency': args.twilio_latency, **faults}, seed=args.seed)
+
+    server = ThreadingHTTPServer((args.host, args.port), StandInHandler)
+    server.daemon_threads = True
+    print(f"🧪 Substituts Gemini/Twilio sur http://{args.host}:{args.port} "
+          f"(gemini {args.gemini_latency}, twilio {args.twilio_latency}, seed {args.seed})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Test de parité : index BM25 compact (rag.sparse_bm25) vs Whoosh.
+
+Usage:
+    python scripts/test_bm25_parity.py
+    python scripts/test_bm25_parity.py --docs 2000 --queries 500 --seed 7
+
+Construit les deux index sur le même corpus (schéma et analyseur identiques
+à DocumentVectorizer.update_bm25_index) en plusieurs ajouts incrémentaux,
+puis compare pour chaque requête les (id, score) retournés par
+HybridRetriever (QueryParser + BM25F) et par SparseBM25Index.
+Sort avec le code 1 en cas d'écart.
+
+Les remplacements d'ids ne sont pas comparés : Whoosh garde les documents
+supprimés dans ses statistiques (N, df) jusqu'à la fusion des segments.
+"""
+import os
+import sys
+import random
+import argparse
+import tempfile
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+from whoosh import index as whoosh_index, scoring  # noqa: E402
+from whoosh.analysis import RegexTokenizer, LowercaseFilter  # noqa: E402
+from whoosh.fields import Schema, TEXT, ID  # noqa: E402
+from whoosh.qparser import QueryParser  # noqa: E402
+
+from rag.sparse_bm25 import SparseBM25Index  # noqa: E402
+
+# Copie de rag.your_rag_module.FR_ANALYZER (évite d'importer les modèles)
+FR_ANALYZER = RegexTokenizer(r"[0-9A-Za-zÀ-ÖØ-öø-ÿ]+") | LowercaseFilter()
+
+VOCAB = (
+    "patient patiente hypertension artérielle diabète type insuline metformine posologie "
+    "comprimé matin soir cholestérol LDL HDL échographie abdominale foie rein créatinine "
+    "glycémie jeun hémoglobine glyquée HbA1c allergie pénicilline amoxicilline paracétamol "
+    "1000 mg 500 3 fois par jour rendez-vous cardiologue consultation Dr Diop Dakar "
+    "radiographie thorax normal anomalie suivi traitement antécédents familiaux asthme "
+    "Ventoline inhalateur crise tension 14/9 pouls fréquence cardiaque bilan sanguin NFS "
+    "plaquettes leucocytes fièvre toux ordonnance renouvellement pharmacie à de la le les"
+).split()
+
+
+def random_text(rng, min_words=5, max_words=120):
+    return ' '.join(rng.choice(VOCAB) for _ in range(rng.randint(min_words, max_words)))
+
+
+def random_query(rng):
+    words = [rng.choice(VOCAB) for _ in range(rng.randint(1, 4))]
+    r = rng.random()
+    if r < 0.1:
+        words.append('inexistant')          # terme absent : aucun résultat
+    elif r < 0.2:
+        words.append(words[0].upper())      # doublon, casse différente
+    elif r < 0.25:
+        words = ['?!']                      # aucun token
+    return ' '.join(words)
+
+
+def whoosh_search(idx, qp, question, limit):
+    """Reproduit HybridRetriever.retrieve (partie BM25)"""
+    toks = [t.text for t in FR_ANALYZER(question)]
+    if not toks:
+        return []
+    query = qp.parse(" ".join(toks))
+    with idx.searcher(weighting=scoring.BM25F()) as searcher:
+        return [(hit["id"], hit.score) for hit in searcher.search(query, limit=limit)]
+
+
+def same_results(expected, actual, tol=1e-6):
+    if len(expected) != len(actual):
+        return False
+    # Les ex aequo peuvent être ordonnés différemment : comparer par score
+    for (eid, escore), (aid, ascore) in zip(expected, actual):
+        if abs(escore - ascore) > tol * max(1.0, abs(escore)):
+            return False
+    # Un id différent n'est accepté qu'à égalité avec le dernier score retenu (coupure à `limit`)
+    exp_scores = {i: s for i, s in expected}
+    last = expected[-1][1] if expected else 0.0
+    return all(
+        (i in exp_scores and abs(exp_scores[i] - s) <= tol * max(1.0, abs(s)))
+        or abs(s - last) <= tol * max(1.0, abs(last))
+        for i, s in actual
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parité BM25 compact / Whoosh")
+    parser.add_argument('--docs', type=int, default=600)
+    parser.add_argument('--batches', type=int, default=3, help="Nombre d'ajouts incrémentaux")
+    parser.add_argument('--queries', type=int, default=300)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        schema = Schema(id=ID(stored=True, unique=True), content=TEXT(analyzer=FR_ANALYZER))
+        w_idx = whoosh_index.create_in(os.path.join(tmp), schema)
+        sparse_path = os.path.join(tmp, 'patient_bm25.sbm25')
+
+        per_batch = max(args.docs // args.batches, 1)
+        for b in range(args.batches):
+            docs = [(f"doc{b}_c{i}", random_text(rng)) for i in range(per_batch)]
+            writer = w_idx.writer()
+            for doc_id, text in docs:
+                writer.update_document(id=doc_id, content=text)
+            # commit() simple, comme DocumentVectorizer.update_bm25_index
+            writer.commit()
+            SparseBM25Index.append_to_file(sparse_path, docs)
+
+        sparse = SparseBM25Index.open(sparse_path)
+        qp = QueryParser("content", schema=w_idx.schema)
+        print(f"Index : {sparse.n_docs} documents, {sparse.n_terms} termes")
+
+        failures = 0
+        non_empty = 0
+        for _ in range(args.queries):
+            question = random_query(rng)
+            expected = whoosh_search(w_idx, qp, question, args.limit)
+            actual = sparse.search(question, limit=args.limit)
+            non_empty += bool(expected)
+            if not same_results(expected, actual):
+                failures += 1
+                print(f"❌ '{question}'\n   whoosh: {expected[:3]}\n   sparse: {actual[:3]}")
+                if failures >= 5:
+                    break
+
+    if failures:
+        print(f"❌ {failures} écart(s)")
+        sys.exit(1)
+    print(f"✅ {args.queries} requêtes identiques ({non_empty} avec résultats)")
+
+
+if __name__ == '__main__':
+    main()
@@ -21,10 +21,8 @@ sys.path.append(os.path.join(settings.BASE_DIR, 'scripts'))
 
 from patients.models import Patient
 from documents.models import DocumentUpload
-from rag.your_rag_module import (
-    VectorStoreHDF5, EmbeddingGenerator, 
-    HybridRetriever, GeminiLLM, RAG
-)
+from rag.your_rag_module import VectorStoreHDF5, RAG
+from rag.model_registry import ModelRegistry, build_hybrid_retriever
 
 def test_rag_for_all_patients():
     """Test le RAG pour tous les patients actifs"""
@@ -92,22 +90,15 @@ def test_rag_for_all_patients():
             vector_store.load_store()
             print(f"   ✅ Vector store chargé ({len(vector_store.meta)} chunks)")
             
-            # 2. Embedder
-            embedder = EmbeddingGenerator()
-            print(f"   ✅ Embedder initialisé")
-            
-            # 3. Retriever
-            if os.path.exists(bm25_dir):
-                retriever = HybridRetriever(vector_store, embedder, bm25_dir)
-                if settings.RAG_SETTINGS.get('USE_RERANKING', True):
-                    retriever.enable_reranking('cross-encoder/ms-marco-MiniLM-L-6-v2')
-                print(f"   ✅ Retriever hybride avec reranking")
+            # 2-3. Retriever (embedder et reranker partagés par le registre)
+            retriever = build_hybrid_retriever(vector_store, bm25_dir)
+            if retriever.bm25_idx:
+                print(f"   ✅ Retriever hybride{' avec reranking' if retriever.cross_encoder else ''}")
             else:
-                retriever = HybridRetriever(vector_store, embedder)
                 print(f"   ✅ Retriever dense uniquement")
             
             # 4. LLM
-            llm = GeminiLLM()
+            llm = ModelRegistry.get_llm()
             print(f"   ✅ LLM Gemini initialisé")
             
             # 5. RAG
@@ -166,14 +157,8 @@ def test_specific_patient(patient_id, question=None):
         vector_store = VectorStoreHDF5(hdf5_path)
         vector_store.load_store()
         
-        embedder = EmbeddingGenerator()
-        
-        if os.path.exists(bm25_dir):
-            retriever = HybridRetriever(vector_store, embedder, bm25_dir)
-        else:
-            retriever = HybridRetriever(vector_store, embedder)
-        
-        llm = GeminiLLM()
+        retriever = build_hybrid_retriever(vector_store, bm25_dir)
+        llm = ModelRegistry.get_llm()
         rag = RAG(retriever, llm)
         
         # Poser la question
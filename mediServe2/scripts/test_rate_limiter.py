@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Vérifications du limiteur de débit LLM (rag.rate_limiter).
+
+Usage:
+    python scripts/test_rate_limiter.py
+
+Utilise une horloge simulée (FakeClock) et un substitut local de Redis qui
+rejoue en Python les scripts Lua (même stockage en hash de chaînes), pour
+couvrir sans serveur : absence d'attente sous le quota, attente exacte
+quand un seau est vide, partage entre processus, priorité des réponses
+patients sur les tâches de fond, correction par la consommation réelle et
+repli en mémoire si Redis tombe. Sort avec le code 1 en cas d'échec.
+"""
+import os
+import sys
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+from rag.rate_limiter import (  # noqa: E402
+    ADJUST_LUA, TOKEN_BUCKET_LUA, BACKGROUND, FakeClock, LocalBucketBackend,
+    RateLimiter, RateLimitExceeded, RedisBucketBackend,
+)
+
+MODEL = 'gemini-1.5-flash-latest'
+
+
+class LocalRedisStandIn:
+    """Substitut de redis.Redis limité à register_script() pour les deux scripts du limiteur"""
+
+    def __init__(self):
+        self.hashes = {}
+        self.down = False
+
+    def register_script(self, source):
+        handlers = {TOKEN_BUCKET_LUA: self._token_bucket, ADJUST_LUA: self._adjust}
+
+        def call(keys, args):
+            if self.down:
+                raise ConnectionError("redis indisponible")
+            return handlers[source](keys, [float(a) for a in args])
+        return call
+
+    def _hmget(self, key, field):
+        value = self.hashes.get(key, {}).get(field)
+        return float(value) if value is not None else None
+
+    def _token_bucket(self, keys, argv):
+        now, reserve = argv[0], argv[7]
+        wait, levels, amounts = 0.0, [], []
+        for i in (1, 2):
+            capacity, rate = argv[2 * i - 1], argv[2 * i]
+            amount = min(argv[4 + i], capacity * (1 - reserve))
+            level = self._hmget(keys[i - 1], 'level')
+            level = capacity if level is None else level
+            last = self._hmget(keys[i - 1], 'ts')
+            last = now if last is None else last
+            level = min(capacity, level + max(0.0, now - last) * rate)
+            missing = amount + reserve * capacity - level
+            if missing > 0:
+                wait = max(wait, missing / rate) if rate > 0 else float('inf')
+            levels.append(level)
+            amounts.append(amount)
+        for i in (0, 1):
+            level = levels[i] - amounts[i] if wait == 0 else levels[i]
+            self.hashes.setdefault(keys[i], {}).update(level=str(level), ts=str(now))
+        return str(wait)
+
+    def _adjust(self, keys, argv):
+        capacity, delta = argv[0], argv[1]
+        level = self._hmget(keys[0], 'level')
+        level = min(capacity, (capacity if level is None else level) - delta)
+        self.hashes.setdefault(keys[0], {})['level'] = str(level)
+        return str(level)
+
+
+def make(limits, clock, backend=None, reserve=0.2, max_wait=60.0):
+    return RateLimiter({MODEL: limits}, backend=backend, clock=clock,
+                       background_reserve=reserve, max_wait=max_wait)
+
+
+def check(name, condition, detail=''):
+    print(f"{'✅' if condition else '❌'} {name}{f' ({detail})' if detail else ''}")
+    return bool(condition)
+
+
+def main():
+    ok = True
+
+    for label, backend_factory in (('mémoire', LocalBucketBackend),
+                                   ('redis', lambda: RedisBucketBackend(LocalRedisStandIn()))):
+        clock = FakeClock()
+        limiter = make({'rpm': 15, 'tpm': 1_000_000}, clock, backend_factory())
+        for _ in range(15):
+            limiter.acquire(MODEL, 1000)
+        ok &= check(f"[{label}] 15 appels sous le quota sans attente", clock.slept == 0, f"{clock.slept}s")
+        waited = limiter.acquire(MODEL, 1000)
+        ok &= check(f"[{label}] 16e appel : attente d'une recharge (4s)", abs(waited - 4.0) < 1e-6, f"{waited}s")
+
+        clock = FakeClock()
+        limiter = make({'rpm': 1000, 'tpm': 6000}, clock, backend_factory())
+        limiter.acquire(MODEL, 6000)
+        waited = limiter.acquire(MODEL, 3000)
+        ok &= check(f"[{label}] seau tokens vide : attente proportionnelle", abs(waited - 30.0) < 1e-6, f"{waited}s")
+        waited = limiter.acquire(MODEL, 50_000, max_wait=120)
+        ok &= check(f"[{label}] demande > capacité bornée à la capacité", abs(waited - 60.0) < 1e-6, f"{waited}s")
+
+    # Deux processus partageant le même Redis
+    redis = LocalRedisStandIn()
+    clock = FakeClock()
+    a = make({'rpm': 10, 'tpm': 0}, clock, RedisBucketBackend(redis))
+    b = make({'rpm': 10, 'tpm': 0}, clock, RedisBucketBackend(redis))
+    for i in range(10):
+        (a if i % 2 else b).acquire(MODEL)
+    ok &= check("quota partagé entre processus", b.acquire(MODEL) > 0)
+
+    # Priorités : les tâches de fond laissent 20% de la capacité aux patients
+    clock = FakeClock()
+    limiter = make({'rpm': 10, 'tpm': 0}, clock, reserve=0.2)
+    for _ in range(8):
+        limiter.acquire(MODEL, priority=BACKGROUND)
+    ok &= check("8 appels de fond sans attente", clock.slept == 0)
+    try:
+        limiter.acquire(MODEL, priority=BACKGROUND, max_wait=1)
+        ok &= check("9e appel de fond retenu par la réserve", False)
+    except RateLimitExceeded:
+        ok &= check("9e appel de fond retenu par la réserve", True)
+    limiter.acquire(MODEL)
+    limiter.acquire(MODEL)
+    ok &= check("réponses patients servies sur la réserve sans attente", clock.slept == 0)
+
+    # Correction par la consommation réelle (usage_metadata)
+    clock = FakeClock()
+    limiter = make({'rpm': 1000, 'tpm': 6000}, clock, RedisBucketBackend(LocalRedisStandIn()))
+    limiter.acquire(MODEL, 6000)
+    limiter.settle(MODEL, 6000, 1000)
+    waited = limiter.acquire(MODEL, 5000)
+    ok &= check("tokens non consommés rendus au seau", waited == 0, f"{waited}s")
+
+    # Redis indisponible : repli en mémoire, sans erreur pour l'appelant
+    redis = LocalRedisStandIn()
+    clock = FakeClock()
+    limiter = make({'rpm': 2, 'tpm': 0}, clock, RedisBucketBackend(redis))
+    limiter.acquire(MODEL)
+    redis.down = True
+    limiter.acquire(MODEL)
+    limiter.acquire(MODEL)
+    ok &= check("repli en mémoire si Redis tombe", clock.slept == 0)
+
+    # Modèle sans limite configurée
+    limiter = make({'rpm': 1, 'tpm': 1}, FakeClock())
+    ok &= check("modèle non configuré : aucune limitation",
+                all(limiter.acquire('autre-modele', 10 ** 6) == 0 for _ in range(100)))
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
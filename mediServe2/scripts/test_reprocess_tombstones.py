@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Test du retraitement d'un document : tombstones, recherche BM25 et compaction.
+
+Usage:
+    python scripts/test_reprocess_tombstones.py
+    python scripts/test_reprocess_tombstones.py --formats mmap hdf5 shared --engines sparse whoosh
+
+Pour chaque format de store et moteur BM25 :
+  1. indexe deux documents d'un patient (PatientCommitQueue) ;
+  2. retraite le premier (replace=True) avec un texte corrigé ;
+  3. vérifie que HybridRetriever retrouve par BM25 les chunks corrigés et
+     jamais l'ancienne version ;
+  4. compacte le store et vérifie de nouveau la recherche, ainsi que le
+     nombre d'entrées des index BM25 (égal aux lignes vivantes).
+
+Deux schémas d'identifiants sont testés : celui de rag.vectorizer (suffixe
+propre à chaque indexation) et l'ancien (mêmes identifiants d'une version à
+l'autre), encore présent dans les stores indexés avant ce suffixe.
+Sort avec le code 1 en cas d'échec.
+
+Les stores sont écrits dans un répertoire temporaire (VECTOR_STORE_DIR,
+BM25_INDEX_DIR et SHARED_INDEX_DIR sont redirigés), jamais dans media/.
+"""
+import os
+import sys
+import uuid
+import argparse
+import tempfile
+
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(script_dir, '..')))
+
+FORMATS = ('mmap', 'hdf5', 'shared')
+ENGINES = ('sparse', 'whoosh')
+ID_SCHEMES = ('per_pass', 'legacy')
+PATIENT_ID = 1
+DIM = 32
+
+OLD_TEXTS = [
+    "Ancienne ordonnance : metformine 500 mg matin et soir",
+    "Ancienne ordonnance : glycémie à jeun à contrôler",
+    "Ancienne ordonnance : rendez-vous cardiologue annulé",
+    "Ancienne ordonnance : paracétamol si fièvre",
+]
+NEW_TEXTS = [
+    "Ordonnance corrigée : metformine 1000 mg matin et soir",
+    "Ordonnance corrigée : glycémie à jeun et HbA1c à contrôler",
+    "Ordonnance corrigée : rendez-vous cardiologue maintenu",
+]
+OTHER_TEXTS = [
+    "Radiographie du thorax normale",
+    "Bilan sanguin : NFS et plaquettes normales",
+]
+
+
+def configure(workdir, store_format, engine):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mediServe.settings')
+    import django
+    from django.conf import settings
+    django.setup()
+    from rag import shared_index
+
+    rag_settings = settings.RAG_SETTINGS
+    rag_settings['VECTOR_STORE_DIR'] = os.path.join(workdir, 'vectors')
+    rag_settings['BM25_INDEX_DIR'] = os.path.join(workdir, 'bm25')
+    rag_settings['SHARED_INDEX_DIR'] = os.path.join(workdir, 'shared')
+    rag_settings['SHARED_INDEX_SHARDS'] = 1
+    rag_settings['EMBEDDING_DIM'] = DIM
+    rag_settings['VECTOR_STORAGE_MODE'] = 'shared' if store_format == 'shared' else 'per_patient'
+    rag_settings['VECTOR_STORE_FORMAT'] = 'hdf5' if store_format == 'hdf5' else 'mmap'
+    rag_settings['BM25_ENGINE'] = engine
+    rag_settings['USE_BM25'] = True
+    shared_index._shared_index = None
+
+
+def document(document_id, texts, id_scheme, rng):
+    """Chunks d'un document, identifiants au format de rag.vectorizer"""
+    index_pass = uuid.uuid4().hex[:8]
+    metadata = []
+    for i, text in enumerate(texts):
+        mid = f"doc{document_id}_patient{PATIENT_ID}_pdf_page_p1_c{i}"
+        if id_scheme == 'per_pass':
+            mid = f"{mid}_{index_pass}"
+        metadata.append({'id': mid, 'patient_id': str(PATIENT_ID), 'document_id': str(document_id),
+                         'source': 'pdf_page', 'type': 'pdf_page', 'page': 1, 'text': text})
+    return rng.standard_normal((len(texts), DIM)).astype('float32'), metadata
+
+
+def update_bm25(writer, new_metadata, n_vectors):
+    """Même mise à jour que DocumentVectorizer.update_bm25_index (sans charger de modèle)"""
+    from rag.sparse_bm25 import SparseBM25Index, sparse_engine_enabled
+    paths = writer.paths
+    os.makedirs(paths['bm25'], exist_ok=True)
+    if sparse_engine_enabled():
+        SparseBM25Index.append_to_file(paths['bm25_sparse'], [(m['id'], m['text']) for m in new_metadata])
+        return
+    from whoosh import index as whoosh_index
+    from whoosh.fields import Schema, TEXT, ID
+    from rag.your_rag_module import FR_ANALYZER
+    if whoosh_index.exists_in(paths['bm25']):
+        idx = whoosh_index.open_dir(paths['bm25'])
+    else:
+        idx = whoosh_index.create_in(paths['bm25'], Schema(id=ID(stored=True, unique=True),
+                                                            content=TEXT(analyzer=FR_ANALYZER)))
+    writer_bm25 = idx.writer()
+    for meta in new_metadata:
+        writer_bm25.update_document(id=meta['id'], content=meta['text'])
+    writer_bm25.commit()
+
+
+class FixedEmbedder:
+    """Vecteur de requête fixe : seul le BM25 est vérifié ici"""
+
+    def __init__(self, rng):
+        self.vector = rng.standard_normal(DIM).astype('float32')
+
+    def embed_text(self, text):
+        return self.vector
+
+
+def bm25_index(engine, paths):
+    if engine == 'sparse':
+        from rag.sparse_bm25 import open_sparse_bm25
+        return open_sparse_bm25(paths['bm25_sparse'])
+    from whoosh import index as whoosh_index
+    return whoosh_index.open_dir(paths['bm25'])
+
+
+def bm25_entries(engine, index) -> int:
+    return index.n_docs if engine == 'sparse' else index.doc_count()
+
+
+def check_retrieval(engine, paths, rng, stage) -> list:
+    from rag.vector_format import open_patient_store
+    from rag.your_rag_module import HybridRetriever
+
+    store = open_patient_store(PATIENT_ID)
+    retriever = HybridRetriever(store, FixedEmbedder(rng), bm25_index=bm25_index(engine, paths))
+    errors = []
+    for question, expected in (("metformine 1000", NEW_TEXTS[0]), ("glycémie HbA1c", NEW_TEXTS[1])):
+        # alpha=0 : score issu du seul BM25
+        results = retriever.retrieve(question, top_k=10, alpha=0.0, dense_k=2, bm25_k=5)
+        bm25_texts = [m['text'] for m in results if m['score'] > 0]
+        if expected not in bm25_texts:
+            errors.append(f"{stage}: '{question}' ne retrouve pas le chunk corrigé par BM25 ({bm25_texts})")
+        stale = [m['text'] for m in results if m['text'] in OLD_TEXTS]
+        if stale:
+            errors.append(f"{stage}: '{question}' retourne l'ancienne version {stale}")
+    return errors
+
+
+def run(store_format, engine, id_scheme, seed) -> list:
+    from rag.commit_queue import PatientCommitQueue
+    from rag.index_writer import PatientIndexWriter
+
+    rng = np.random.default_rng(seed)
+    queue = PatientCommitQueue(PATIENT_ID, DIM, window_ms=0)
+    paths = queue.writer.paths
+    errors = []
+
+    for document_id, texts in ((1, OLD_TEXTS), (2, OTHER_TEXTS)):
+        vectors, metadata = document(document_id, texts, id_scheme, rng)
+        queue.submit_and_commit(vectors, metadata, document_id=document_id, update_bm25=update_bm25)
+
+    vectors, metadata = document(1, NEW_TEXTS, id_scheme, rng)
+    result = queue.submit_and_commit(vectors, metadata, document_id=1, replace=True, update_bm25=update_bm25)
+    if result['replaced_rows'] != len(OLD_TEXTS):
+        errors.append(f"replaced_rows={result['replaced_rows']} (attendu {len(OLD_TEXTS)})")
+    errors += check_retrieval(engine, paths, rng, 'avant compaction')
+
+    compacted = PatientIndexWriter(PATIENT_ID, DIM).compact()
+    live = len(NEW_TEXTS) + len(OTHER_TEXTS)
+    if compacted['n_vectors'] != live or compacted['removed_rows'] != len(OLD_TEXTS):
+        errors.append(f"compaction: {compacted} (attendu {live} vecteurs, {len(OLD_TEXTS)} lignes retirées)")
+    entries = bm25_entries(engine, bm25_index(engine, paths))
+    if entries != live:
+        errors.append(f"compaction: {entries} entrées BM25 (attendu {live})")
+    errors += check_retrieval(engine, paths, rng, 'après compaction')
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retraitement d'un document : BM25 et compaction")
+    parser.add_argument('--formats', nargs='+', default=['mmap'], choices=FORMATS)
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=ENGINES)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    failures = 0
+    for store_format in args.formats:
+        for engine in args.engines:
+            for id_scheme in ID_SCHEMES:
+                with tempfile.TemporaryDirectory(prefix='test_reprocess_') as workdir:
+                    configure(workdir, store_format, engine)
+                    errors = run(store_format, engine, id_scheme, args.seed)
+                label = f"{store_format:<6} {engine:<6} {id_scheme:<8}"
+                if errors:
+                    failures += 1
+                    print(f"❌ {label}")
+                    for error in errors:
+                        print(f"   - {error}")
+                else:
+                    print(f"✅ {label} retraitement, recherche BM25 et compaction cohérents")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -50,3 +50,36 @@ def archive_old_conversations():
     except Exception as e:
         logger.error(f"Erreur archivage conversations: {e}")
         return {"error": str(e)}
+
+@shared_task(bind=True, max_retries=2, default_retry_delay=30)
+def update_conversation_summary(self, session_id):
+    """Intègre au résumé de la session les échanges sortis de la fenêtre récente"""
+    from django.core.cache import cache
+    from rag.conversation_memory import get_conversation_memory
+    from rag.rate_limiter import RateLimitExceeded
+
+    # Le verrou de déduplication (ConversationMemory.schedule_update) n'est libéré
+    # qu'à la fin définitive de la tâche : pendant un retry, la mise à jour est
+    # toujours en file et aucune autre ne doit être planifiée
+    terminal = True
+    try:
+        session = WhatsAppSession.objects.get(id=session_id)
+        state = get_conversation_memory().summarize(session)
+        return {"session_id": session_id, "updated": state is not None}
+    except WhatsAppSession.DoesNotExist:
+        return {"session_id": session_id, "updated": False}
+    except RateLimitExceeded as e:
+        # Quota réservé aux réponses patients : réessayer plus tard
+        # (au-delà de max_retries, self.retry lève l'erreur : fin définitive)
+        terminal = self.request.retries >= self.max_retries
+        raise self.retry(exc=e)
+    except Exception as e:
+        logger.error(f"Erreur résumé de conversation {session_id}: {e}")
+        return {"error": str(e)}
+    finally:
+        if terminal:
+            try:
+                cache.delete(f"rag:memory:summarizing:{session_id}")
+            except Exception as e:
+                # Cache indisponible : le verrou expire de lui-même (timeout de schedule_update)
+                logger.warning(f"⚠️ Verrou de résumé {session_id} non libéré: {e}")